@@ -3,12 +3,64 @@
 # Nginx全量备份与还原脚本
 # 备份内容：配置、证书、静态文件
 # 适用目录：/usr/local/nginx/conf /usr/local/nginx/html /usr/local/nginx/ssl /etc/nginx/ssl
+# 有python3时使用内容寻址快照存储（未变化的文件不重复占用空间），否则整目录复制
 # 用法：
 #   ./backup-nginx.sh backup   # 备份
 #   ./backup-nginx.sh restore  # 还原
+#   ./backup-nginx.sh gc       # 按保留策略清理旧快照
 
 BACKUP_DIR="$(pwd)/nginx-backup-$(date +%Y%m%d%H%M%S)"
 RESTORE_SRC=""
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+SNAPSHOT_TOOL="$SCRIPT_DIR/manage/snapshot_store.py"
+RELOAD_TOOL="$SCRIPT_DIR/manage/reload_coordinator.py"
+
+function use_snapshot_store() {
+  command -v python3 >/dev/null 2>&1 && [ -f "$SNAPSHOT_TOOL" ]
+}
+
+function reload_after_restore() {
+  echo "[完成] 还原完毕，正在重载nginx..."
+  # 通过重载协调器验证并合并重载，验证失败时保留当前运行的配置
+  if command -v python3 >/dev/null 2>&1 && [ -f "$RELOAD_TOOL" ]; then
+    python3 "$RELOAD_TOOL" notify backup-restore --now
+    return $?
+  fi
+  if command -v nginx >/dev/null 2>&1; then
+    if ! nginx -t; then
+      echo "nginx配置验证失败，未重载"
+      return 1
+    fi
+    nginx -s reload || systemctl reload nginx
+    echo "nginx已重载"
+  fi
+}
+
+function has_snapshots() {
+  use_snapshot_store && [ -n "$(python3 "$SNAPSHOT_TOOL" list | grep -v '暂无快照')" ]
+}
+
+function has_dir_backups() {
+  local backup
+  for backup in nginx-backup-*; do
+    [ -d "$backup" ] && return 0
+  done
+  return 1
+}
+
+function snapshot_restore() {
+  local snapshot_id restore_target
+  read -r -p "请输入要还原的快照ID（可只输入前缀）: " snapshot_id
+  [ -z "$snapshot_id" ] && echo "未输入快照ID" && return 1
+  read -r -p "只还原单个站点/路径请输入域名或绝对路径，直接回车还原全部: " restore_target
+  local restore_args=("$snapshot_id")
+  [ -n "$restore_target" ] && restore_args+=("$restore_target")
+  if python3 "$SNAPSHOT_TOOL" restore "${restore_args[@]}"; then
+    reload_after_restore
+  else
+    return 1
+  fi
+}
 
 function list_backups() {
   echo "========= 现有备份 ========="
@@ -34,6 +86,10 @@ function list_backups() {
 }
 
 function do_backup() {
+  if use_snapshot_store; then
+    python3 "$SNAPSHOT_TOOL" create backup
+    return $?
+  fi
   echo "[备份] 目标目录: $BACKUP_DIR"
   mkdir -p "$BACKUP_DIR"
   # 配置
@@ -58,12 +114,7 @@ function do_backup() {
   echo "[完成] 备份已保存到: $BACKUP_DIR"
 }
 
-function do_restore() {
-  # 显示备份列表
-  if ! list_backups; then
-    return 1
-  fi
-  
+function dir_restore() {
   # 获取备份列表
   local backups=()
   for backup in nginx-backup-*; do
@@ -73,7 +124,7 @@ function do_restore() {
   done
   
   read -p "请选择要还原的备份序号: " choice
-  if [ "$choice" -ge 1 ] && [ "$choice" -le ${#backups[@]} ]; then
+  if [[ "$choice" =~ ^[0-9]+$ ]] && [ "$choice" -ge 1 ] && [ "$choice" -le ${#backups[@]} ]; then
     local selected_backup="${backups[$((choice-1))]}"
     echo "已选择备份: $selected_backup"
     
@@ -98,17 +149,41 @@ function do_restore() {
         echo "已还原: /etc/nginx/ssl"
       fi
     fi
-    echo "[完成] 还原完毕，正在重载nginx..."
-    if command -v nginx >/dev/null 2>&1; then
-      nginx -s reload || nginx -t && systemctl reload nginx
-      echo "nginx已重载"
-    fi
+    reload_after_restore
   else
     echo "无效的备份序号"
     return 1
   fi
 }
 
+function do_restore() {
+  # 启用快照存储之前的目录备份（nginx-backup-*）与快照一起列出
+  local snapshots=0 dirs=0 kind
+  has_snapshots && snapshots=1
+  has_dir_backups && dirs=1
+  if [ $snapshots -eq 1 ] && [ $dirs -eq 1 ]; then
+    echo "========= 快照 ========="
+    python3 "$SNAPSHOT_TOOL" list
+    list_backups
+    read -r -p "还原快照请输入 s，还原目录备份请输入 d: " kind
+  elif [ $snapshots -eq 1 ]; then
+    python3 "$SNAPSHOT_TOOL" list
+    kind="s"
+  elif [ $dirs -eq 1 ]; then
+    list_backups
+    kind="d"
+  else
+    echo "当前无备份文件。"
+    return 1
+  fi
+  
+  case "$kind" in
+    s) snapshot_restore ;;
+    d) dir_restore ;;
+    *) echo "无效的选择"; return 1 ;;
+  esac
+}
+
 case "$1" in
   backup)
     do_backup
@@ -116,7 +191,14 @@ case "$1" in
   restore)
     do_restore
     ;;
+  gc)
+    if use_snapshot_store; then
+      python3 "$SNAPSHOT_TOOL" gc "${@:2}"
+    else
+      echo "清理快照需要python3"
+    fi
+    ;;
   *)
-    echo "用法: $0 backup|restore"
+    echo "用法: $0 backup|restore|gc"
     ;;
 esac 
\ No newline at end of file
@@ -17,6 +17,12 @@ stop_nginx_safe() {
 
 reload_nginx_safe() {
   if pgrep -x nginx >/dev/null 2>&1; then
+    # 优先通过重载协调器合并重载（验证失败时不会重载）
+    local coordinator="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)/manage/reload_coordinator.py"
+    if command -v python3 >/dev/null 2>&1 && [ -f "$coordinator" ]; then
+      python3 "$coordinator" notify "${1:-lib}"
+      return $?
+    fi
     if command -v systemctl >/dev/null 2>&1; then
       systemctl reload nginx 2>/dev/null || /usr/local/nginx/sbin/nginx -s reload || nginx -s reload
     else
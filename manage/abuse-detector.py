@@ -0,0 +1,600 @@
+#!/usr/bin/env python3
+"""
+滥用IP检测与自动封禁
+流式读取各站点日志新增的部分，为每个IP维护滑动窗口（请求数、4xx/404比例、攻击特征命中次数），
+超过阈值的IP写入 geo $blocked 封禁列表（只精确合并相邻地址，按网段聚合需用 --aggregate 显式开启；
+nginx以基数树查找，不随条目数线性变慢），封禁的网段有变化时才通过重载协调器验证并重载。
+自称搜索引擎的IP需通过反向DNS+正向确认后才免于按频率封禁。窗口和封禁都有过期时间，内存占用有上限
+"""
+
+import sys
+import os
+import re
+import json
+import time
+import fcntl
+import socket
+import ipaddress
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from log_engine import classify_user_agent, iter_new_lines, parse_line, record_timestamp, site_access_logs
+from nginx_conf import ConfigParseError, iter_servers, parse_lines, vhost_files
+from reload_coordinator import ReloadCoordinator
+from snapshot_store import snapshot_files
+
+NGINX_CONF = "/usr/local/nginx/conf/nginx.conf"
+BLOCKLIST_FILE = "/usr/local/nginx/conf/abuse-blocklist.conf"
+ALLOWLIST_FILE = "/usr/local/nginx/conf/abuse-allowlist.txt"
+STATE_FILE = "/usr/local/nginx/logs/.abuse-detector-state.json"
+CRON_FILE = "/etc/cron.d/nginx-abuse-detector"
+BLOCK_MARKER = "# 自动封禁"
+BLOCK_END_MARKER = "# 自动封禁结束"
+
+# 滑动窗口：总长度和分桶粒度（秒）
+WINDOW_SECONDS = 300
+BUCKET_SECONDS = 30
+# 同时跟踪的IP数上限，超出时淘汰最久未出现的IP
+MAX_TRACKED = 50000
+# 默认阈值（窗口内）
+RATE_LIMIT = 1500
+MIN_REQUESTS_FOR_RATIO = 60
+ERROR_RATIO = 0.8
+NOT_FOUND_LIMIT = 100
+SIGNATURE_LIMIT = 5
+# 封禁时长，重复违规时翻倍，最长MAX_BAN_SECONDS
+BAN_SECONDS = 3600
+MAX_BAN_SECONDS = 86400 * 7
+# 开启 --aggregate 时，同一网段（IPv4 /24、IPv6 /64）内封禁的IP达到这个数量才合并为整个网段
+AGGREGATE_MIN = 4
+# 经过验证的搜索引擎爬虫只按攻击特征封禁，不按请求频率封禁；监控探测请加入白名单文件
+CRAWLER_FAMILY = "search_bot"
+# 搜索引擎公布的爬虫反向DNS域名，反查到这些域名且正向解析回同一IP才算真实爬虫
+CRAWLER_DOMAINS = (
+    ".googlebot.com", ".google.com", ".search.msn.com", ".baidu.com", ".baidu.jp", ".yandex.ru", ".yandex.net",
+    ".yandex.com", ".crawl.yahoo.net", ".applebot.apple.com", ".petalsearch.com", ".sogou.com", ".sm.cn",
+    ".seznam.cz", ".naver.com",
+)
+DNS_TIMEOUT = 3
+# 爬虫验证结果的缓存时间
+VERIFY_TTL = 86400
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+DEFAULT_ALLOWLIST = ["127.0.0.0/8", "10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16", "::1/128", "fc00::/7"]
+
+# 与security-scan.sh相同的攻击特征，另加常见的敏感路径扫描
+SIGNATURE_PATTERN = re.compile(
+    r"select.+from|union.+select|'--|\"--|<script|javascript:|onerror=|onload=|\.\./|/etc/passwd|/bin/sh|"
+    r"/\.env|/\.git/|wp-login\.php|xmlrpc\.php|phpmyadmin|/cgi-bin/|\.(?:bak|sql|swp)$",
+    re.IGNORECASE,
+)
+
+class IpWindow:
+    """单个IP的滑动窗口，按BUCKET_SECONDS分桶：[桶起始时间, 请求数, 4xx数, 404数, 特征命中数]"""
+    
+    __slots__ = ('buckets', 'last_seen', 'crawler_claim')
+    
+    def __init__(self):
+        self.buckets: List[List[int]] = []
+        self.last_seen = 0
+        # UA自称搜索引擎爬虫（UA可以伪造，超过频率阈值时再验证IP）
+        self.crawler_claim = False
+    
+    def add(self, ts: int, status: int, signature: bool) -> None:
+        start = ts - ts % BUCKET_SECONDS
+        if not self.buckets or self.buckets[-1][0] < start:
+            self.buckets.append([start, 0, 0, 0, 0])
+        bucket = self.buckets[-1]
+        bucket[1] += 1
+        if 400 <= status < 500:
+            bucket[2] += 1
+        if status == 404:
+            bucket[3] += 1
+        if signature:
+            bucket[4] += 1
+        self.last_seen = max(self.last_seen, ts)
+        self.expire(ts)
+    
+    def expire(self, now: int) -> None:
+        """丢弃窗口之外的桶"""
+        while self.buckets and self.buckets[0][0] <= now - WINDOW_SECONDS:
+            self.buckets.pop(0)
+    
+    def totals(self) -> Tuple[int, int, int, int]:
+        """窗口内的(请求数, 4xx数, 404数, 特征命中数)"""
+        return tuple(sum(bucket[i] for bucket in self.buckets) for i in range(1, 5))
+
+class AbuseDetector:
+    def __init__(self, state_file: str = STATE_FILE, blocklist_file: str = BLOCKLIST_FILE,
+                 thresholds: Optional[Dict[str, float]] = None, aggregate: int = 0):
+        self.state_file = state_file
+        self.blocklist_file = blocklist_file
+        # 网段聚合的最少IP数，0表示不聚合
+        self.aggregate = aggregate
+        self.thresholds = {
+            'rate': RATE_LIMIT,
+            'error_ratio': ERROR_RATIO,
+            'not_found': NOT_FOUND_LIMIT,
+            'signatures': SIGNATURE_LIMIT,
+        }
+        self.thresholds.update(thresholds or {})
+        # 按最后出现时间排序（最久未出现的在前），便于TTL淘汰和容量淘汰
+        self.windows: 'OrderedDict[str, IpWindow]' = OrderedDict()
+        self.offsets: Dict[str, Dict[str, int]] = {}
+        # 已处理日志中的最新时间，窗口按日志时间滑动
+        self.clock = 0
+        # 封禁记录：IP -> {until, reason, strikes}
+        self.blocked: Dict[str, Dict[str, object]] = {}
+        # 爬虫验证缓存：IP -> [是否真实爬虫, 验证时间]
+        self.verified: Dict[str, List] = {}
+        self.allowlist = self.load_allowlist()
+        self.load_state()
+    
+    def load_allowlist(self) -> List[Network]:
+        """内网地址和白名单文件中的地址永不封禁"""
+        entries = list(DEFAULT_ALLOWLIST)
+        try:
+            with open(ALLOWLIST_FILE, 'r', encoding='utf-8') as f:
+                entries.extend(line.split('#', 1)[0].strip() for line in f)
+        except OSError:
+            pass
+        networks = []
+        for entry in entries:
+            try:
+                if entry:
+                    networks.append(ipaddress.ip_network(entry, strict=False))
+            except ValueError:
+                print(f"忽略无效的白名单条目: {entry}", file=sys.stderr)
+        return networks
+    
+    def allowed(self, ip: str) -> bool:
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return True
+        return any(address in network for network in self.allowlist)
+    
+    def load_state(self) -> None:
+        """读取状态文件，内存中的状态整体替换（在锁内重新读取时丢弃本进程过时的状态）"""
+        self.windows = OrderedDict()
+        self.offsets = {}
+        self.clock = 0
+        self.blocked = {}
+        self.verified = {}
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.offsets = state.get('offsets', {})
+        self.clock = state.get('clock', 0)
+        self.blocked = state.get('blocked', {})
+        self.verified = state.get('verified', {})
+        for ip, data in state.get('windows', {}).items():
+            window = IpWindow()
+            window.buckets = data.get('buckets', [])
+            window.last_seen = data.get('last_seen', 0)
+            window.crawler_claim = data.get('crawler_claim', False)
+            self.windows[ip] = window
+    
+    def save_state(self) -> None:
+        state = {
+            'offsets': self.offsets,
+            'clock': self.clock,
+            'blocked': self.blocked,
+            'verified': {ip: result for ip, result in self.verified.items() if result[1] > time.time() - VERIFY_TTL},
+            'windows': {ip: {'buckets': window.buckets, 'last_seen': window.last_seen,
+                             'crawler_claim': window.crawler_claim}
+                        for ip, window in self.windows.items()},
+        }
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        tmp_file = f"{self.state_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(tmp_file, self.state_file)
+    
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """
+        cron的run、watch和手动unblock同时执行时串行处理：持锁后重新读取状态，
+        避免用本进程过时的状态覆盖对方的修改（例如刚解封的IP被重新写回）
+        """
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        with open(f"{self.state_file}.lock", 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.load_state()
+            yield
+    
+    def evict(self, now: int) -> None:
+        """淘汰窗口已过期的IP，以及超出容量上限的最久未出现的IP"""
+        while self.windows:
+            ip, window = next(iter(self.windows.items()))
+            if window.last_seen > now - WINDOW_SECONDS and len(self.windows) <= MAX_TRACKED:
+                break
+            self.windows.popitem(last=False)
+    
+    def verified_crawler(self, ip: str) -> bool:
+        """反向DNS+正向确认：IP反查到搜索引擎公布的域名，且该域名解析回同一IP（结果缓存VERIFY_TTL）"""
+        cached = self.verified.get(ip)
+        if cached and cached[1] > time.time() - VERIFY_TTL:
+            return cached[0]
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            verified = executor.submit(forward_confirmed_crawler, ip).result(timeout=DNS_TIMEOUT)
+        except FutureTimeoutError:
+            verified = False
+        finally:
+            executor.shutdown(wait=False)
+        self.verified[ip] = [verified, int(time.time())]
+        return verified
+    
+    def check(self, ip: str, window: IpWindow) -> Optional[str]:
+        """判断IP是否超过阈值，返回封禁原因"""
+        requests, client_errors, not_found, signatures = window.totals()
+        if signatures >= self.thresholds['signatures']:
+            return f"攻击特征 {signatures} 次"
+        if requests >= self.thresholds['rate'] and not (window.crawler_claim and self.verified_crawler(ip)):
+            return f"{WINDOW_SECONDS // 60}分钟内 {requests} 次请求"
+        if requests >= MIN_REQUESTS_FOR_RATIO:
+            if not_found >= self.thresholds['not_found'] and not_found >= requests * 0.5:
+                return f"404扫描 {not_found}/{requests}"
+            if client_errors >= requests * self.thresholds['error_ratio']:
+                return f"4xx比例 {client_errors}/{requests}"
+        return None
+    
+    def block(self, ip: str, reason: str, now: float) -> None:
+        """封禁IP，重复违规时延长封禁时间"""
+        previous = self.blocked.get(ip, {})
+        if previous.get('until', 0) > now:
+            return
+        strikes = int(previous.get('strikes', 0)) + 1
+        duration = min(BAN_SECONDS * 2 ** (strikes - 1), MAX_BAN_SECONDS)
+        self.blocked[ip] = {'until': int(now + duration), 'reason': reason, 'strikes': strikes}
+        print(f"封禁 {ip}（{reason}，{duration // 60} 分钟）")
+    
+    def process_line(self, line: str) -> None:
+        record = parse_line(line)
+        if record is None:
+            return
+        ts = record_timestamp(record.time_local)
+        if ts is None or self.allowed(record.remote_addr):
+            return
+        ip = record.remote_addr
+        window = self.windows.pop(ip, None) or IpWindow()
+        self.windows[ip] = window
+        if classify_user_agent(record.user_agent) == CRAWLER_FAMILY:
+            window.crawler_claim = True
+        window.add(ts, record.status, bool(SIGNATURE_PATTERN.search(record.path)))
+        self.clock = max(self.clock, ts)
+        reason = self.check(ip, window)
+        if reason:
+            self.block(ip, reason, time.time())
+        if len(self.windows) > MAX_TRACKED:
+            self.evict(self.clock)
+    
+    def process_logs(self, from_start: bool = False) -> int:
+        """处理所有站点日志新增的部分，返回处理的行数"""
+        lines = 0
+        active = set()
+        for _, log_path in site_access_logs():
+            active.add(log_path)
+            position = self.offsets.get(log_path)
+            if position is None:
+                # 首次发现的日志从末尾开始，不回溯历史
+                position = {}
+                if not from_start:
+                    try:
+                        stat = os.stat(log_path)
+                        position = {'inode': stat.st_ino, 'offset': stat.st_size}
+                    except OSError:
+                        continue
+                self.offsets[log_path] = position
+            for line in iter_new_lines(log_path, position):
+                lines += 1
+                self.process_line(line)
+        for log_path in [path for path in self.offsets if path not in active]:
+            del self.offsets[log_path]
+        self.evict(self.clock)
+        return lines
+    
+    def active_networks(self, now: float) -> List[str]:
+        """未过期的封禁，合并相邻地址（开启聚合时按网段聚合）后返回网段列表"""
+        # 过期的封禁记录再保留MAX_BAN_SECONDS，期间再次违规时延长封禁时间
+        self.blocked = {ip: data for ip, data in self.blocked.items()
+                        if data.get('until', 0) > now - MAX_BAN_SECONDS}
+        addresses = []
+        for ip, data in self.blocked.items():
+            if data.get('until', 0) <= now or self.allowed(ip):
+                continue
+            try:
+                addresses.append(ipaddress.ip_address(ip))
+            except ValueError:
+                continue
+        
+        networks: List[Network] = [ipaddress.ip_network(address) for address in addresses]
+        if self.aggregate:
+            groups: Dict[Network, List[Network]] = {}
+            for network in networks:
+                prefix = 24 if network.version == 4 else 64
+                groups.setdefault(network.supernet(new_prefix=prefix), []).append(network)
+            networks = []
+            for supernet, members in groups.items():
+                if len(members) >= self.aggregate and not any(supernet.overlaps(allowed) for allowed in self.allowlist):
+                    networks.append(supernet)
+                else:
+                    networks.extend(members)
+        
+        result = []
+        for version in (4, 6):
+            # collapse_addresses只合并相邻、可精确表示为一个网段的地址，不会扩大封禁范围
+            for network in ipaddress.collapse_addresses(n for n in networks if n.version == version):
+                result.append(str(network.network_address) if network.prefixlen == network.max_prefixlen else str(network))
+        return result
+    
+    def render(self, networks: List[str]) -> str:
+        """封禁列表只包含网段，封禁原因保存在状态文件中（用 list 查看），避免原因变化导致无谓的重载"""
+        lines = [
+            "# 自动封禁列表",
+            "# 由 abuse-detector.py 生成，请勿手动修改（解封请使用 abuse-detector.py unblock）",
+            "geo $blocked {",
+            "    default 0;",
+        ]
+        lines.extend(f"    {network} 1;" for network in networks)
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+    
+    def write_blocklist(self, content: str) -> Optional[bool]:
+        """封禁的网段有变化时写入并重载；无变化返回None，重载失败时恢复原文件并返回False"""
+        try:
+            with open(self.blocklist_file, 'r', encoding='utf-8') as f:
+                previous = f.read()
+        except OSError:
+            previous = None
+        if previous is not None and blocklist_networks(previous) == blocklist_networks(content):
+            return None
+        
+        tmp_file = f"{self.blocklist_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_file, self.blocklist_file)
+        if not blocklist_included():
+            return True
+        if ReloadCoordinator(debounce=0).notify("abuse-detector"):
+            return True
+        if previous is not None:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(previous)
+            os.replace(tmp_file, self.blocklist_file)
+        return False
+    
+    def run(self, from_start: bool = False) -> Tuple[int, int, Optional[bool]]:
+        """处理一次新增日志并更新封禁列表，返回(处理行数, 封禁网段数, 是否重载)"""
+        with self.locked():
+            lines = self.process_logs(from_start)
+            networks = self.active_networks(time.time())
+            reloaded = self.write_blocklist(self.render(networks))
+            self.save_state()
+        return lines, len(networks), reloaded
+    
+    def unblock(self, target: str) -> bool:
+        """解除对IP或网段内所有IP的封禁，有解封的IP时更新封禁列表并保存状态"""
+        try:
+            network = ipaddress.ip_network(target, strict=False)
+        except ValueError:
+            print(f"无效的IP或网段: {target}")
+            return False
+        with self.locked():
+            removed = [ip for ip in self.blocked if ipaddress.ip_address(ip) in network]
+            for ip in removed:
+                del self.blocked[ip]
+            if removed:
+                self.write_blocklist(self.render(self.active_networks(time.time())))
+                self.save_state()
+        print(f"已解封 {len(removed)} 个IP")
+        return bool(removed)
+    
+    def print_list(self) -> None:
+        now = time.time()
+        active = sorted(((ip, data) for ip, data in self.blocked.items() if data.get('until', 0) > now),
+                        key=lambda item: item[1]['until'])
+        print(f"跟踪中的IP: {len(self.windows)}，封禁中的IP: {len(active)}")
+        if not active:
+            return
+        print(f"{'IP':<40} {'剩余(分钟)':>10} {'次数':>4}  原因")
+        for ip, data in active:
+            print(f"{ip:<40} {int((data['until'] - now) // 60):>10} {data.get('strikes', 1):>4}  {data.get('reason', '')}")
+
+def forward_confirmed_crawler(ip: str) -> bool:
+    """IP反查的主机名属于CRAWLER_DOMAINS，且主机名正向解析的地址包含该IP"""
+    try:
+        host = socket.gethostbyaddr(ip)[0].lower().rstrip('.')
+        if not host.endswith(CRAWLER_DOMAINS):
+            return False
+        address = ipaddress.ip_address(ip)
+        return any(ipaddress.ip_address(info[4][0].split('%', 1)[0]) == address
+                   for info in socket.getaddrinfo(host, None))
+    except (OSError, ValueError):
+        return False
+
+def blocklist_networks(content: str) -> List[str]:
+    """封禁列表中的网段（忽略注释和空白），用于判断是否需要重载"""
+    networks = []
+    for line in content.splitlines():
+        fields = line.split('#', 1)[0].split()
+        if len(fields) == 2 and fields[1] == "1;":
+            networks.append(fields[0])
+    return networks
+
+def blocklist_included(nginx_conf: str = NGINX_CONF) -> bool:
+    try:
+        with open(nginx_conf, 'r', encoding='utf-8') as f:
+            return any(BLOCKLIST_FILE in line for line in f)
+    except OSError:
+        return False
+
+def install(nginx_conf: str = NGINX_CONF) -> bool:
+    """在http块引入封禁列表，并在所有站点的server块中拒绝被封禁的IP"""
+    if not os.path.exists(BLOCKLIST_FILE):
+        with open(BLOCKLIST_FILE, 'w', encoding='utf-8') as f:
+            f.write(AbuseDetector().render([]))
+    try:
+        with open(nginx_conf, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+    except OSError as e:
+        print(f"读取nginx主配置文件失败: {e}")
+        return False
+    if not any(BLOCKLIST_FILE in line for line in lines):
+        http_start = next((i for i, line in enumerate(lines) if re.match(r'\s*http\s*{', line)), None)
+        if http_start is None:
+            print("未找到http块，无法引入封禁列表")
+            return False
+        snapshot_files([nginx_conf], "abuse-detector")
+        lines[http_start + 1:http_start + 1] = [f"    {BLOCK_MARKER}\n", f"    include {BLOCKLIST_FILE};\n"]
+        with open(nginx_conf, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+    
+    for conf_file in vhost_files():
+        with open(conf_file, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        if any(line.strip() == BLOCK_MARKER for line in lines):
+            continue
+        try:
+            servers = list(iter_servers(parse_lines(lines)))
+        except ConfigParseError as e:
+            print(f"跳过无法解析的配置 {conf_file}: {e}")
+            continue
+        inserted: Dict[int, List[str]] = {}
+        for server in servers:
+            anchor = server.first('server_name')
+            line = lines[anchor.start] if anchor else "    "
+            indent = line[:len(line) - len(line.lstrip())] or "    "
+            inserted[anchor.end if anchor else server.start] = [
+                f"{indent}{BLOCK_MARKER}\n",
+                f"{indent}if ($blocked) {{ return 403; }}\n",
+                f"{indent}{BLOCK_END_MARKER}\n",
+            ]
+        if not inserted:
+            continue
+        snapshot_files([conf_file], "abuse-detector")
+        new_lines = []
+        for i, line in enumerate(lines):
+            new_lines.append(line)
+            new_lines.extend(inserted.get(i, []))
+        with open(conf_file, 'w', encoding='utf-8') as f:
+            f.writelines(new_lines)
+        print(f"已启用自动封禁: {conf_file}")
+    return True
+
+def uninstall(nginx_conf: str = NGINX_CONF) -> None:
+    """从站点配置和主配置中移除自动封禁"""
+    for conf_file in vhost_files() + [nginx_conf]:
+        try:
+            with open(conf_file, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except OSError:
+            continue
+        new_lines = []
+        in_block = False
+        for line in lines:
+            stripped = line.strip()
+            if stripped == BLOCK_MARKER:
+                in_block = conf_file != nginx_conf
+                continue
+            if in_block:
+                in_block = stripped != BLOCK_END_MARKER
+                continue
+            if BLOCKLIST_FILE in line:
+                continue
+            new_lines.append(line)
+        if new_lines != lines:
+            snapshot_files([conf_file], "abuse-detector")
+            with open(conf_file, 'w', encoding='utf-8') as f:
+                f.writelines(new_lines)
+            print(f"已移除自动封禁: {conf_file}")
+
+def install_cron(interval: int, aggregate: int = 0) -> bool:
+    """安装cron定时检测任务"""
+    script = os.path.abspath(__file__)
+    options = f" --aggregate={aggregate}" if aggregate else ""
+    try:
+        with open(CRON_FILE, 'w', encoding='utf-8') as f:
+            f.write(f"*/{interval} * * * * root /usr/bin/env python3 {script} run{options} >/dev/null 2>&1\n")
+        os.chmod(CRON_FILE, 0o644)
+    except OSError as e:
+        print(f"写入定时任务失败: {e}")
+        return False
+    print(f"已安装定时任务: {CRON_FILE}（每 {interval} 分钟检测一次）")
+    return True
+
+def main():
+    if len(sys.argv) < 2:
+        print("用法: abuse-detector.py <run|watch|list|unblock|install|uninstall|install-cron|remove-cron> [选项]")
+        print("  run [--from-start] [--rate=N] [--signatures=N]  - 处理日志新增部分并更新封禁列表")
+        print(f"      [--aggregate[=N]]                          - 同一/24或/64内封禁N个（默认{AGGREGATE_MIN}）以上IP时封禁整个网段")
+        print("  watch [--interval=5]                           - 持续跟踪日志（Ctrl+C退出）")
+        print("  list                                           - 查看封禁中的IP")
+        print("  unblock <IP或网段> [--aggregate[=N]]            - 解除封禁（聚合选项与定时任务保持一致）")
+        print("  install / uninstall                            - 在nginx配置中启用/移除自动封禁")
+        print("  install-cron [--interval=1] [--aggregate[=N]] / remove-cron - 安装/删除定时检测")
+        sys.exit(1)
+    
+    action = sys.argv[1]
+    args = [arg for arg in sys.argv[2:] if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[2:] if arg.startswith("--") and "=" in arg)
+    thresholds = {key: float(options[key]) for key in ('rate', 'signatures', 'not_found', 'error_ratio')
+                  if key in options}
+    aggregate = int(options.get("aggregate", AGGREGATE_MIN)) if "--aggregate" in sys.argv or "aggregate" in options else 0
+    
+    if action == "run":
+        detector = AbuseDetector(thresholds=thresholds, aggregate=aggregate)
+        lines, networks, reloaded = detector.run(from_start="--from-start" in sys.argv)
+        state = {None: "封禁列表无变化", True: "封禁列表已更新", False: "封禁列表更新后重载失败，已恢复"}[reloaded]
+        print(f"本次处理 {lines} 行，封禁 {networks} 个网段/IP，{state}")
+        sys.exit(1 if reloaded is False else 0)
+    elif action == "watch":
+        interval = float(options.get("interval", "5"))
+        detector = AbuseDetector(thresholds=thresholds, aggregate=aggregate)
+        print(f"持续检测中（每 {interval:g} 秒读取一次新增日志，Ctrl+C退出）...")
+        try:
+            while True:
+                _, _, reloaded = detector.run()
+                if reloaded:
+                    print(f"{time.strftime('%H:%M:%S')} 封禁列表已更新并重载")
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            # 每轮结束时已在锁内保存状态，中断的这一轮偏移未保存，下次从原位置重新读取
+            pass
+        sys.exit(0)
+    elif action == "list":
+        AbuseDetector().print_list()
+        sys.exit(0)
+    elif action == "unblock" and args:
+        AbuseDetector(aggregate=aggregate).unblock(args[0])
+        sys.exit(0)
+    elif action == "install":
+        if not install():
+            sys.exit(1)
+        sys.exit(0 if ReloadCoordinator().notify("abuse-detector", wait=False) else 1)
+    elif action == "uninstall":
+        uninstall()
+        sys.exit(0 if ReloadCoordinator().notify("abuse-detector", wait=False) else 1)
+    elif action == "install-cron":
+        interval = options.get("interval", "1")
+        if not interval.isdigit() or not 1 <= int(interval) <= 59:
+            print("间隔应为1-59分钟")
+            sys.exit(1)
+        sys.exit(0 if install_cron(int(interval), aggregate) else 1)
+    elif action == "remove-cron":
+        if os.path.exists(CRON_FILE):
+            os.remove(CRON_FILE)
+            print("已删除定时任务")
+        else:
+            print("未安装定时任务")
+        sys.exit(0)
+    else:
+        print(f"未知操作或缺少参数: {action}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+"""
+站点访问日志管理器
+为每个站点设置独立的带缓冲access_log（buffer/flush，可选gzip压缩），使用带计时字段的日志格式，
+并提供日志轮转：重命名日志文件后向master发送USR1重新打开，不重载配置
+"""
+
+import sys
+import re
+import os
+import gzip
+import shutil
+import signal
+import subprocess
+from typing import Dict, List, Optional
+
+from log_engine import rotated_name
+from nginx_conf import ConfigParseError, iter_servers, parse_lines, server_names, vhost_files
+from profiling import enable_profiling, timed
+from reload_coordinator import master_pid, nginx_binary
+from snapshot_store import snapshot_files
+
+LOG_DIR = "/usr/local/nginx/logs"
+# combined + 请求总耗时和上游耗时，与log_engine.request_times的解析格式一致
+LOG_FORMAT_NAME = "site_timed"
+LOG_FORMAT = (
+    f"    log_format {LOG_FORMAT_NAME} '$remote_addr - $remote_user [$time_local] \"$request\" '\n"
+    f"                      '$status $body_bytes_sent \"$http_referer\" '\n"
+    f"                      '\"$http_user_agent\" rt=$request_time urt=\"$upstream_response_time\"';\n"
+)
+DEFAULT_KEEP = 7
+
+def rotate_file(path: str, keep: int = DEFAULT_KEEP) -> bool:
+    """轮转一个日志文件，文件不存在或为空时跳过"""
+    try:
+        if os.path.getsize(path) == 0:
+            return False
+    except OSError:
+        return False
+    
+    for number in range(keep, 0, -1):
+        src = rotated_name(path, number)
+        if not os.path.exists(src):
+            continue
+        if number == keep:
+            os.remove(src)
+            continue
+        dst = rotated_name(path, number + 1)
+        if number == 1 and not path.endswith('.gz'):
+            # 上一次轮转出的.1在上次USR1之后已不再被写入，可以安全压缩
+            with open(src, 'rb') as f_in, gzip.open(dst, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+            os.remove(src)
+        else:
+            os.rename(src, dst)
+    os.rename(path, rotated_name(path, 1))
+    return True
+
+def reopen_logs() -> bool:
+    """通知nginx重新打开日志文件（USR1，不重载配置）"""
+    master = master_pid()
+    if master is not None:
+        try:
+            os.kill(master, signal.SIGUSR1)
+            return True
+        except OSError:
+            pass
+    nginx_bin = nginx_binary()
+    if not nginx_bin:
+        return False
+    result = subprocess.run([nginx_bin, '-s', 'reopen'], capture_output=True, text=True)
+    return result.returncode == 0
+
+class AccessLogManager:
+    def __init__(self, conf_file: str):
+        self.conf_file = conf_file
+        self.backup_file = f"{conf_file}.accesslog.bak"
+        self.nginx_main_conf = "/usr/local/nginx/conf/nginx.conf"
+        self.main_backup_file = f"{self.nginx_main_conf}.accesslog.bak"
+        self.main_conf_changed = False
+        self.log_marker = "# 站点访问日志配置"
+        self.log_end_marker = "# 站点访问日志配置结束"
+        self.replaced_marker = "# 站点访问日志已替换:"
+    
+    @timed("backup")
+    def backup_config(self) -> bool:
+        """备份配置文件"""
+        try:
+            if os.path.exists(self.conf_file):
+                with open(self.conf_file, 'r', encoding='utf-8') as src:
+                    with open(self.backup_file, 'w', encoding='utf-8') as dst:
+                        dst.write(src.read())
+                snapshot_files([self.conf_file], "access-log")
+                return True
+        except Exception as e:
+            print(f"备份配置文件失败: {e}", file=sys.stderr)
+        return False
+    
+    def backup_main_config(self) -> bool:
+        """备份nginx主配置文件"""
+        try:
+            shutil.copyfile(self.nginx_main_conf, self.main_backup_file)
+            snapshot_files([self.nginx_main_conf], "access-log")
+            return True
+        except OSError as e:
+            print(f"备份nginx主配置文件失败: {e}", file=sys.stderr)
+            return False
+    
+    def restore_main_config(self) -> bool:
+        """恢复本次修改前的nginx主配置文件"""
+        try:
+            shutil.copyfile(self.main_backup_file, self.nginx_main_conf)
+            return True
+        except OSError as e:
+            print(f"恢复nginx主配置文件失败: {e}", file=sys.stderr)
+            return False
+    
+    def restore_config(self) -> bool:
+        """恢复配置文件"""
+        try:
+            if os.path.exists(self.backup_file):
+                with open(self.backup_file, 'r', encoding='utf-8') as src:
+                    with open(self.conf_file, 'w', encoding='utf-8') as dst:
+                        dst.write(src.read())
+                return True
+        except Exception as e:
+            print(f"恢复配置文件失败: {e}", file=sys.stderr)
+        return False
+    
+    @timed("read", lines="read")
+    def read_config(self) -> List[str]:
+        """读取配置文件"""
+        try:
+            with open(self.conf_file, 'r', encoding='utf-8') as f:
+                return f.readlines()
+        except Exception as e:
+            print(f"读取配置文件失败: {e}", file=sys.stderr)
+            return []
+    
+    @timed("write", lines="write")
+    def write_config(self, lines: List[str]) -> bool:
+        """写入配置文件"""
+        try:
+            with open(self.conf_file, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+            return True
+        except Exception as e:
+            print(f"写入配置文件失败: {e}", file=sys.stderr)
+            return False
+    
+    @timed("read", lines="read")
+    def read_main_config(self) -> List[str]:
+        """读取nginx主配置文件"""
+        try:
+            with open(self.nginx_main_conf, 'r', encoding='utf-8') as f:
+                return f.readlines()
+        except Exception as e:
+            print(f"读取nginx主配置文件失败: {e}", file=sys.stderr)
+            return []
+    
+    @timed("write", lines="write")
+    def write_main_config(self, lines: List[str]) -> bool:
+        """写入nginx主配置文件"""
+        try:
+            with open(self.nginx_main_conf, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+            return True
+        except Exception as e:
+            print(f"写入nginx主配置文件失败: {e}", file=sys.stderr)
+            return False
+    
+    def get_site_name(self, lines: List[str]) -> str:
+        """获取站点的第一个server_name"""
+        for line in lines:
+            name_match = re.search(r'^\s*server_name\s+([^;\s]+)', line)
+            if name_match:
+                return name_match.group(1)
+        return os.path.basename(self.conf_file).rsplit('.conf', 1)[0]
+    
+    def add_log_format(self) -> bool:
+        """在主配置文件的http块中添加带计时字段的日志格式（已存在时跳过）"""
+        lines = self.read_main_config()
+        if not lines:
+            return False
+        if any(re.match(rf'\s*log_format\s+{LOG_FORMAT_NAME}\s', line) for line in lines):
+            return True
+        for i, line in enumerate(lines):
+            if re.match(r'\s*http\s*{', line):
+                insert = [f"    # 站点访问日志格式（combined + 请求耗时/上游耗时）\n", LOG_FORMAT]
+                if not self.backup_main_config():
+                    return False
+                self.main_conf_changed = self.write_main_config(lines[:i + 1] + insert + lines[i + 1:])
+                return self.main_conf_changed
+        print("未找到http块，无法添加日志格式", file=sys.stderr)
+        return False
+    
+    def generate_log_directive(self, log_path: str, buffer: str, flush: str, gzip_level: Optional[int]) -> str:
+        """生成access_log指令"""
+        options = [f"buffer={buffer}", f"flush={flush}"]
+        if gzip_level:
+            options.append(f"gzip={gzip_level}")
+        return f"access_log {log_path} {LOG_FORMAT_NAME} {' '.join(options)};"
+    
+    def comment_line(self, line: str) -> str:
+        """注释掉被替换的指令，删除配置时原样恢复"""
+        indent = line[:len(line) - len(line.lstrip())]
+        return f"{indent}{self.replaced_marker} {line.strip()}\n"
+    
+    def remove_log_internal(self, lines: List[str]) -> List[str]:
+        """内部方法：从lines中删除站点日志配置并恢复被替换的access_log"""
+        new_lines = []
+        in_config = False
+        for line in lines:
+            stripped = line.strip()
+            if stripped == self.log_marker:
+                in_config = True
+                continue
+            if in_config:
+                if stripped == self.log_end_marker:
+                    in_config = False
+                continue
+            if stripped.startswith(self.replaced_marker):
+                indent = line[:len(line) - len(line.lstrip())]
+                new_lines.append(f"{indent}{stripped[len(self.replaced_marker):].strip()}\n")
+                continue
+            new_lines.append(line)
+        return new_lines
+    
+    @timed("parse")
+    def managed_log_paths(self, lines: List[str]) -> List[str]:
+        """本工具配置的日志文件路径"""
+        paths = []
+        in_config = False
+        for line in lines:
+            stripped = line.strip()
+            if stripped == self.log_marker:
+                in_config = True
+            elif stripped == self.log_end_marker:
+                in_config = False
+            elif in_config:
+                log_match = re.match(r'access_log\s+(\S+)', stripped)
+                if log_match and log_match.group(1) not in paths:
+                    paths.append(log_match.group(1))
+        return paths
+    
+    def add_access_log(self, buffer: str = "64k", flush: str = "5s", gzip_level: Optional[int] = None) -> bool:
+        """为配置文件中的所有server块设置站点独立的带缓冲访问日志"""
+        # 备份配置文件
+        if not self.backup_config():
+            return False
+        
+        lines = self.read_config()
+        if not lines:
+            return False
+        
+        if any(line.strip() == self.log_marker for line in lines):
+            print("检测到已存在的站点日志配置，将先删除再添加")
+            lines = self.remove_log_internal(lines)
+        
+        try:
+            servers = list(iter_servers(parse_lines(lines)))
+        except ConfigParseError as e:
+            print(f"解析配置文件失败: {e}", file=sys.stderr)
+            return False
+        if not servers:
+            print(f"未找到server块: {self.conf_file}")
+            return False
+        
+        site = self.get_site_name(lines)
+        log_path = f"{LOG_DIR}/access_{site}.log" + (".gz" if gzip_level else "")
+        directive = self.generate_log_directive(log_path, buffer, flush, gzip_level)
+        
+        replaced: Dict[int, List[str]] = {}
+        inserted: Dict[int, List[str]] = {}
+        for server in servers:
+            indent = "    "
+            for child in server.block:
+                if child.start != server.start:
+                    indent = lines[child.start][:len(lines[child.start]) - len(lines[child.start].lstrip())]
+                    break
+            
+            # server级别原有的access_log（包括access_log off）由新配置替换；location内的保持不变
+            for child in server.children('access_log'):
+                for i in range(child.start, child.end + 1):
+                    replaced[i] = [self.comment_line(lines[i])]
+            
+            anchor = server.first('server_name')
+            inserted[anchor.end if anchor else server.start] = [
+                f"{indent}{self.log_marker}\n",
+                f"{indent}{directive}\n",
+                f"{indent}{self.log_end_marker}\n",
+            ]
+        
+        new_lines = []
+        for i, line in enumerate(lines):
+            new_lines.extend(replaced.get(i, [line]))
+            new_lines.extend(inserted.get(i, []))
+        
+        # 写入配置文件
+        if self.write_config(new_lines):
+            print(f"站点访问日志已设置（{len(servers)} 个server块）: {log_path}")
+            print(f"  {directive}")
+            if gzip_level:
+                print("⚠️  gzip压缩的日志不能用tail -f等直接查看；stat-report、latency-report、geo-report、"
+                      "prom-exporter、abuse-detector 在每个压缩块写完（缓冲区满或flush到期）后读取")
+            return True
+        else:
+            print("站点访问日志设置失败，正在恢复备份...")
+            self.restore_config()
+            return False
+    
+    def remove_access_log(self) -> bool:
+        """删除站点访问日志配置（恢复原有的access_log）"""
+        # 备份配置文件
+        if not self.backup_config():
+            return False
+        
+        lines = self.read_config()
+        if not lines:
+            return False
+        
+        if not any(line.strip() == self.log_marker for line in lines):
+            print(f"未找到站点日志配置: {self.conf_file}")
+            return True
+        
+        if self.write_config(self.remove_log_internal(lines)):
+            print(f"站点访问日志配置已删除: {self.conf_file}")
+            return True
+        else:
+            print("站点访问日志配置删除失败，正在恢复备份...")
+            self.restore_config()
+            return False
+    
+    def check_status(self) -> bool:
+        """显示每个server块实际使用的access_log"""
+        lines = self.read_config()
+        if not lines:
+            return False
+        try:
+            servers = list(iter_servers(parse_lines(lines)))
+        except ConfigParseError as e:
+            print(f"解析配置文件失败: {e}", file=sys.stderr)
+            return False
+        
+        enabled = any(line.strip() == self.log_marker for line in lines)
+        print(f"{self.conf_file}: 站点独立日志{'已启用' if enabled else '未启用'}")
+        for server in servers:
+            logs = [' '.join(d.args) for d in server.children('access_log')]
+            print(f"  第{server.start + 1}行 {' '.join(server_names(server))}")
+            if not logs:
+                print(f"    access_log: 继承http块（通常为共享的 {LOG_DIR}/access.log），每个请求写一次")
+            for log in logs:
+                buffered = "buffer=" in log or "gzip" in log
+                print(f"    access_log {log}{'' if buffered else '（无缓冲）'}")
+        for path in self.managed_log_paths(lines):
+            if os.path.exists(path):
+                print(f"  {path}: {os.path.getsize(path) / 1024 / 1024:.2f} MB")
+        return enabled
+    
+    @timed("nginx_test")
+    def validate_config(self) -> bool:
+        """验证nginx配置语法"""
+        try:
+            result = subprocess.run(['nginx', '-t'],
+                                  capture_output=True,
+                                  text=True,
+                                  timeout=10)
+            if result.returncode == 0:
+                print("nginx配置语法验证通过")
+                return True
+            else:
+                print("nginx配置语法错误:")
+                print(result.stderr)
+                return False
+        except Exception as e:
+            print(f"无法验证nginx配置: {e}")
+            return False
+
+def main():
+    enable_profiling("access-log-manager", action_index=2)
+    if len(sys.argv) < 3:
+        print("用法: access-log-manager.py <conf_file|all> <action> [参数]")
+        print("actions:")
+        print("  add [buffer] [flush] [gzip级别]  - 设置站点独立的带缓冲日志（默认 64k 5s，不压缩）")
+        print("  remove                          - 删除站点日志配置，恢复原有access_log")
+        print("  status                          - 查看access_log设置")
+        print(f"  rotate [保留份数]               - 轮转站点日志并通知nginx重新打开（USR1，默认保留{DEFAULT_KEEP}份）")
+        print("  validate                        - 验证nginx配置")
+        sys.exit(1)
+    
+    target = sys.argv[1]
+    action = sys.argv[2]
+    
+    if target == "all":
+        conf_files = vhost_files()
+    elif os.path.exists(target):
+        conf_files = [target]
+    else:
+        print(f"配置文件不存在: {target}", file=sys.stderr)
+        sys.exit(1)
+    
+    if action == "add":
+        buffer = sys.argv[3] if len(sys.argv) > 3 else "64k"
+        flush = sys.argv[4] if len(sys.argv) > 4 else "5s"
+        gzip_level = int(sys.argv[5]) if len(sys.argv) > 5 and sys.argv[5].isdigit() else None
+        if not re.match(r'^\d+[kKmM]?$', buffer) or not re.match(r'^\d+(ms|s|m|h)?$', flush):
+            print(f"无效的buffer或flush参数: {buffer} {flush}", file=sys.stderr)
+            sys.exit(1)
+        if gzip_level is not None and not 1 <= gzip_level <= 9:
+            print("gzip级别应为1-9", file=sys.stderr)
+            sys.exit(1)
+        if not conf_files:
+            sys.exit(1)
+        format_manager = AccessLogManager(conf_files[0])
+        if not format_manager.add_log_format():
+            sys.exit(1)
+        
+        applied = [manager for manager in map(AccessLogManager, conf_files)
+                   if manager.add_access_log(buffer, flush, gzip_level)]
+        if applied and format_manager.validate_config():
+            sys.exit(0)
+        if applied:
+            print("配置验证失败，正在恢复修改前的配置...")
+        for manager in applied:
+            manager.restore_config()
+        if format_manager.main_conf_changed:
+            format_manager.restore_main_config()
+        sys.exit(1)
+    
+    elif action == "remove":
+        applied = [manager for manager in map(AccessLogManager, conf_files) if manager.remove_access_log()]
+        if not applied or applied[0].validate_config():
+            sys.exit(0)
+        print("配置验证失败，正在恢复修改前的配置...")
+        for manager in applied:
+            manager.restore_config()
+        sys.exit(1)
+    
+    elif action == "status":
+        for conf_file in conf_files:
+            AccessLogManager(conf_file).check_status()
+        sys.exit(0)
+    
+    elif action == "rotate":
+        keep = int(sys.argv[3]) if len(sys.argv) > 3 and sys.argv[3].isdigit() else DEFAULT_KEEP
+        paths: List[str] = []
+        for conf_file in conf_files:
+            manager = AccessLogManager(conf_file)
+            for path in manager.managed_log_paths(manager.read_config()):
+                if path not in paths:
+                    paths.append(path)
+        
+        rotated = []
+        for path in paths:
+            try:
+                if rotate_file(path, max(keep, 1)):
+                    rotated.append(path)
+            except OSError as e:
+                print(f"轮转 {path} 失败: {e}", file=sys.stderr)
+        if not rotated:
+            print("没有需要轮转的站点日志")
+            sys.exit(0)
+        for path in rotated:
+            print(f"已轮转: {path} -> {rotated_name(path, 1)}")
+        if reopen_logs():
+            print("已通知nginx重新打开日志文件（USR1，未重载配置）")
+            sys.exit(0)
+        print("⚠️  通知nginx重新打开日志失败，nginx会继续写入轮转后的文件", file=sys.stderr)
+        sys.exit(1)
+    
+    elif action == "validate":
+        success = AccessLogManager(conf_files[0] if conf_files else target).validate_config()
+        sys.exit(0 if success else 1)
+    
+    else:
+        print(f"未知操作: {action}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
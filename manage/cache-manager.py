@@ -0,0 +1,545 @@
+#!/usr/bin/env python3
+"""
+反向代理缓存配置管理器
+为反代站点添加proxy_cache_path缓存区域和缓存策略，并根据日志统计缓存命中率
+"""
+
+import sys
+import re
+import os
+import math
+import subprocess
+from typing import Dict, List, Tuple, Optional
+
+from log_engine import find_site_log, iter_records
+from nginx_conf import ConfigParseError, Directive, iter_servers, parse_lines, walk
+from profiling import enable_profiling, timed
+from snapshot_store import snapshot_files
+
+# 缓存策略: (状态码, 缓存时间)列表；不使用any，避免缓存后端的错误页和个性化响应
+CACHE_POLICIES = {
+    "conservative": [("200", "1m"), ("404", "10s")],
+    "default": [("200 301 302", "10m"), ("404", "1m")],
+    "aggressive": [("200 301 302", "1h"), ("404", "5m")],
+}
+# cache_combined是这些格式的超集（site_timed为access-log-manager.py的站点格式），替换后日志解析结果不变
+CACHE_LOG_BASE_FORMATS = ("combined", "site_timed")
+
+# 带认证头或会话Cookie的请求不读也不写缓存，防止登录用户的响应被缓存后返回给其他用户
+SESSION_COOKIE_PATTERN = (r"(^|;\s*)(session|sess|sid|phpsessid|jsessionid|connect\.sid|laravel_session"
+                          r"|wordpress_logged_in_[^=]*|wp-postpass_[^=]*|token|auth[^=]*)=")
+
+# 每MB共享内存大约可以保存8000个缓存键
+KEYS_PER_MB = 8000
+
+class CacheManager:
+    def __init__(self, conf_file: str):
+        self.conf_file = conf_file
+        self.backup_file = f"{conf_file}.cache.bak"
+        self.cache_marker = "# 反向代理缓存配置"
+        self.cache_end_marker = "# 反向代理缓存配置结束"
+        self.nginx_main_conf = "/usr/local/nginx/conf/nginx.conf"
+        self.cache_root = "/usr/local/nginx/cache"
+        self.log_format_name = "cache_combined"
+        self.private_marker = "# 反向代理缓存：带认证信息或会话Cookie的请求不使用缓存"
+        self.skip_vars = "$cache_skip_auth $cache_skip_cookie"
+    
+    @timed("backup")
+    def backup_config(self) -> bool:
+        """备份配置文件"""
+        try:
+            if os.path.exists(self.conf_file):
+                with open(self.conf_file, 'r', encoding='utf-8') as src:
+                    with open(self.backup_file, 'w', encoding='utf-8') as dst:
+                        dst.write(src.read())
+                snapshot_files([self.conf_file], "cache")
+                return True
+        except Exception as e:
+            print(f"备份配置文件失败: {e}", file=sys.stderr)
+        return False
+    
+    def restore_config(self) -> bool:
+        """恢复配置文件"""
+        try:
+            if os.path.exists(self.backup_file):
+                with open(self.backup_file, 'r', encoding='utf-8') as src:
+                    with open(self.conf_file, 'w', encoding='utf-8') as dst:
+                        dst.write(src.read())
+                return True
+        except Exception as e:
+            print(f"恢复配置文件失败: {e}", file=sys.stderr)
+        return False
+    
+    @timed("read", lines="read")
+    def read_config(self) -> List[str]:
+        """读取配置文件"""
+        try:
+            with open(self.conf_file, 'r', encoding='utf-8') as f:
+                return f.readlines()
+        except Exception as e:
+            print(f"读取配置文件失败: {e}", file=sys.stderr)
+            return []
+    
+    @timed("write", lines="write")
+    def write_config(self, lines: List[str]) -> bool:
+        """写入配置文件"""
+        try:
+            with open(self.conf_file, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+            return True
+        except Exception as e:
+            print(f"写入配置文件失败: {e}", file=sys.stderr)
+            return False
+    
+    @timed("read", lines="read")
+    def read_main_config(self) -> List[str]:
+        """读取nginx主配置文件"""
+        try:
+            with open(self.nginx_main_conf, 'r', encoding='utf-8') as f:
+                return f.readlines()
+        except Exception as e:
+            print(f"读取nginx主配置文件失败: {e}", file=sys.stderr)
+            return []
+    
+    @timed("write", lines="write")
+    def write_main_config(self, lines: List[str]) -> bool:
+        """写入nginx主配置文件"""
+        try:
+            snapshot_files([self.nginx_main_conf], "cache")
+            with open(self.nginx_main_conf, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+            return True
+        except Exception as e:
+            print(f"写入nginx主配置文件失败: {e}", file=sys.stderr)
+            return False
+    
+    def get_site_name(self, lines: List[str]) -> str:
+        """获取站点的第一个server_name"""
+        for line in lines:
+            name_match = re.search(r'^\s*server_name\s+([^;\s]+)', line)
+            if name_match:
+                return name_match.group(1)
+        return os.path.basename(self.conf_file).rsplit('.conf', 1)[0]
+    
+    def get_zone_name(self, site: str) -> str:
+        """根据站点名生成缓存区域名称"""
+        return "cache_" + re.sub(r'[^A-Za-z0-9_]', '_', site)
+    
+    def parse_size(self, size: str) -> int:
+        """将1g/512m/64k格式的大小转换为字节数"""
+        size_match = re.match(r'^(\d+)([kKmMgG]?)$', size.strip())
+        if not size_match:
+            raise ValueError(f"无效的大小: {size}")
+        units = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+        return int(size_match.group(1)) * units[size_match.group(2).lower()]
+    
+    def calculate_zone_size(self, max_size: str, avg_object: str) -> int:
+        """根据磁盘缓存上限和平均对象大小计算keys_zone大小（MB）"""
+        max_objects = self.parse_size(max_size) // max(self.parse_size(avg_object), 1)
+        # 预留25%余量，最少1MB
+        return max(1, math.ceil(max_objects * 1.25 / KEYS_PER_MB))
+    
+    def find_http_block(self, lines: List[str]) -> Optional[int]:
+        """查找http块起始行"""
+        for i, line in enumerate(lines):
+            if re.match(r'\s*http\s*{', line):
+                return i
+        return None
+    
+    def add_zone_to_main_config(self, zone: str, max_size: str, avg_object: str, inactive: str) -> bool:
+        """在主配置文件中添加或调整proxy_cache_path缓存区域"""
+        lines = self.read_main_config()
+        if not lines:
+            return False
+        
+        http_start = self.find_http_block(lines)
+        if http_start is None:
+            print("未找到http块，无法添加缓存区域", file=sys.stderr)
+            return False
+        
+        zone_mb = self.calculate_zone_size(max_size, avg_object)
+        zone_line = (
+            f"    proxy_cache_path {self.cache_root}/{zone} levels=1:2 keys_zone={zone}:{zone_mb}m "
+            f"max_size={max_size} inactive={inactive} use_temp_path=off;\n"
+        )
+        
+        # 已存在同名区域时直接替换该行（调整大小）
+        new_lines = [line for line in lines if f"keys_zone={zone}:" not in line]
+        insert_config = [zone_line]
+        
+        if not any(line.strip() == self.private_marker for line in new_lines):
+            insert_config.insert(0, (
+                f"    {self.private_marker}\n"
+                "    map $http_authorization $cache_skip_auth {\n"
+                "        default 1;\n"
+                '        "" 0;\n'
+                "    }\n"
+                "    map $http_cookie $cache_skip_cookie {\n"
+                "        default 0;\n"
+                f'        "~*{SESSION_COOKIE_PATTERN}" 1;\n'
+                "    }\n"
+            ))
+        
+        # 旧版本的日志格式没有计时字段，替换为新格式
+        new_lines = self.remove_log_format(new_lines)
+        if not any(re.match(rf'\s*log_format\s+{self.log_format_name}\s', line) for line in new_lines):
+            insert_config.insert(0, (
+                f"    # 反向代理缓存日志格式（与站点日志相同的计时字段 + 缓存状态）\n"
+                f"    log_format {self.log_format_name} '$remote_addr - $remote_user [$time_local] \"$request\" '\n"
+                f"                      '$status $body_bytes_sent \"$http_referer\" '\n"
+                f"                      '\"$http_user_agent\" rt=$request_time urt=\"$upstream_response_time\" '\n"
+                f"                      'cs=$upstream_cache_status';\n"
+            ))
+        
+        http_start = self.find_http_block(new_lines)
+        new_lines = new_lines[:http_start + 1] + insert_config + new_lines[http_start + 1:]
+        
+        try:
+            os.makedirs(self.cache_root, exist_ok=True)
+        except Exception as e:
+            print(f"创建缓存目录失败: {e}", file=sys.stderr)
+        
+        print(f"缓存区域 {zone}: keys_zone={zone_mb}m, max_size={max_size}, inactive={inactive}")
+        return self.write_main_config(new_lines)
+    
+    def remove_log_format(self, lines: List[str]) -> List[str]:
+        """删除不带计时字段的旧版缓存日志格式"""
+        try:
+            tree = parse_lines(lines)
+        except ConfigParseError:
+            return lines
+        for directive in walk(tree):
+            if directive.name == 'log_format' and directive.args and directive.args[0] == self.log_format_name:
+                if any('rt=' in arg for arg in directive.args):
+                    return lines
+                start = directive.start
+                if start > 0 and lines[start - 1].strip().startswith("# 反向代理缓存日志格式"):
+                    start -= 1
+                return lines[:start] + lines[directive.end + 1:]
+        return lines
+    
+    def remove_zone_from_main_config(self, zone: str) -> bool:
+        """从主配置文件中删除站点的缓存区域"""
+        lines = self.read_main_config()
+        if not lines:
+            return False
+        new_lines = [line for line in lines if f"keys_zone={zone}:" not in line]
+        if new_lines == lines:
+            return True
+        return self.write_main_config(new_lines)
+    
+    def generate_cache_config(self, indent: str, zone: str, policy: str, log_args: List[List[str]]) -> str:
+        """生成location内的缓存策略配置
+        
+        不使用add_header（location中的add_header会屏蔽server级别的所有add_header），
+        缓存状态写入访问日志，由stats统计命中率。
+        """
+        config_lines = [
+            f"{indent}{self.cache_marker}",
+            f"{indent}proxy_cache {zone};",
+        ]
+        for codes, valid in CACHE_POLICIES[policy]:
+            config_lines.append(f"{indent}proxy_cache_valid {codes} {valid};")
+        config_lines.extend([
+            f"{indent}proxy_cache_bypass {self.skip_vars};",
+            f"{indent}proxy_no_cache {self.skip_vars};",
+            f"{indent}proxy_cache_lock on;",
+            f"{indent}proxy_cache_lock_timeout 5s;",
+            f"{indent}proxy_cache_use_stale error timeout updating http_500 http_502 http_503 http_504;",
+            f"{indent}proxy_cache_background_update on;",
+        ])
+        config_lines.extend(f"{indent}access_log {' '.join(args)};" for args in log_args)
+        config_lines.append(f"{indent}{self.cache_end_marker}")
+        return "\n".join(config_lines) + "\n"
+    
+    def cache_log_args(self, server: Optional[Directive], line: int, default_path: str) -> List[List[str]]:
+        """location的access_log参数：逐条沿用站点的access_log（路径、缓冲、if=等参数不变）
+        
+        只有站点使用combined或site_timed格式时才换成带缓存状态的cache_combined（两者的超集，
+        解析结果不变）；其它自定义格式保持原样，不记录缓存状态。站点关闭日志时location同样关闭，
+        location自己已有access_log时不再添加。
+        """
+        if server is None:
+            return [[default_path, self.log_format_name]]
+        for location in walk(server.children('location')):
+            if location.name == 'location' and location.start <= line <= location.end and location.children('access_log'):
+                return []
+        directives = [directive for directive in server.children('access_log') if directive.args]
+        if not directives:
+            return [[default_path, self.log_format_name]]
+        log_args = []
+        for directive in directives:
+            args = directive.args
+            if args[0] == "off":
+                log_args.append(["off"])
+                continue
+            has_format = len(args) > 1 and '=' not in args[1] and args[1] != "gzip"
+            log_format = args[1] if has_format else "combined"
+            params = args[2:] if has_format else args[1:]
+            if log_format in CACHE_LOG_BASE_FORMATS or log_format == self.log_format_name:
+                log_args.append([args[0], self.log_format_name] + params)
+            else:
+                print(f"站点日志使用自定义格式 {log_format}，缓存location沿用该格式，日志中不记录缓存状态")
+                log_args.append(list(args))
+        return log_args
+    
+    @timed("parse")
+    def find_cache_config(self, lines: List[str]) -> List[Tuple[int, int]]:
+        """查找所有缓存策略配置块"""
+        blocks = []
+        start_line = None
+        for i, line in enumerate(lines):
+            if line.strip() == self.cache_marker:
+                start_line = i
+            elif line.strip() == self.cache_end_marker and start_line is not None:
+                blocks.append((start_line, i))
+                start_line = None
+        return blocks
+    
+    def remove_cache_internal(self, lines: List[str]) -> List[str]:
+        """内部方法：从lines中删除缓存策略配置"""
+        removed = set()
+        for start_line, end_line in self.find_cache_config(lines):
+            removed.update(range(start_line, end_line + 1))
+        return [line for i, line in enumerate(lines) if i not in removed]
+    
+    def add_cache(self, policy: str = "default", max_size: str = "1g", avg_object: str = "64k",
+                  inactive: str = "60m") -> bool:
+        """添加反向代理缓存配置"""
+        print("正在添加反向代理缓存配置...")
+        
+        if policy not in CACHE_POLICIES:
+            print(f"未知缓存策略: {policy}（可选: {', '.join(CACHE_POLICIES)}）", file=sys.stderr)
+            return False
+        
+        # 备份配置文件
+        if not self.backup_config():
+            return False
+        
+        lines = self.read_config()
+        if not lines:
+            return False
+        
+        # 检查是否已存在缓存配置
+        if self.find_cache_config(lines):
+            print("检测到已存在的缓存配置，将先删除再添加")
+            lines = self.remove_cache_internal(lines)
+        
+        site = self.get_site_name(lines)
+        zone = self.get_zone_name(site)
+        
+        log_path = find_site_log(site) or f"/usr/local/nginx/logs/access_{site}.log"
+        if os.path.basename(log_path) == "access.log":
+            log_path = f"/usr/local/nginx/logs/access_{site}.log"
+        try:
+            servers = list(iter_servers(parse_lines(lines)))
+        except ConfigParseError as e:
+            print(f"解析配置文件失败: {e}", file=sys.stderr)
+            return False
+        
+        new_lines = []
+        applied = 0
+        for i, line in enumerate(lines):
+            new_lines.append(line)
+            proxy_match = re.match(r'^(\s*)proxy_pass\s', line)
+            if proxy_match:
+                server = next((server for server in servers if server.start <= i <= server.end), None)
+                new_lines.append(self.generate_cache_config(proxy_match.group(1), zone, policy,
+                                                            self.cache_log_args(server, i, log_path)))
+                applied += 1
+        
+        # 先确认有可用的location再添加缓存区域，避免主配置中留下无用的keys_zone
+        if applied == 0:
+            print("未找到proxy_pass，缓存只适用于反向代理站点", file=sys.stderr)
+            return False
+        
+        try:
+            if not self.add_zone_to_main_config(zone, max_size, avg_object, inactive):
+                print("添加缓存区域失败", file=sys.stderr)
+                return False
+        except ValueError as e:
+            print(str(e), file=sys.stderr)
+            return False
+        
+        # 写入配置文件
+        if self.write_config(new_lines):
+            print(f"反向代理缓存配置添加成功（策略: {policy}，{applied} 个location）")
+            return True
+        else:
+            print("反向代理缓存配置添加失败，正在恢复备份...")
+            self.restore_config()
+            return False
+    
+    def remove_cache(self) -> bool:
+        """删除反向代理缓存配置"""
+        print("正在删除反向代理缓存配置...")
+        
+        # 备份配置文件
+        if not self.backup_config():
+            return False
+        
+        lines = self.read_config()
+        if not lines:
+            return False
+        
+        if not self.find_cache_config(lines):
+            print("未找到反向代理缓存配置")
+            return True
+        
+        new_lines = self.remove_cache_internal(lines)
+        
+        # 写入配置文件
+        if self.write_config(new_lines):
+            self.remove_zone_from_main_config(self.get_zone_name(self.get_site_name(lines)))
+            print("反向代理缓存配置删除成功")
+            return True
+        else:
+            print("反向代理缓存配置删除失败，正在恢复备份...")
+            self.restore_config()
+            return False
+    
+    def check_cache_status(self) -> bool:
+        """检查反向代理缓存配置状态"""
+        lines = self.read_config()
+        if not lines:
+            return False
+        
+        blocks = self.find_cache_config(lines)
+        if blocks:
+            start_line, end_line = blocks[0]
+            print(f"反向代理缓存已启用（{len(blocks)} 个location，第{start_line + 1}行起）")
+            
+            # 显示配置详情
+            for i in range(start_line, end_line + 1):
+                line = lines[i].rstrip()
+                if line.strip():
+                    print(f"  {line}")
+            
+            zone = self.get_zone_name(self.get_site_name(lines))
+            zone_lines = [line.strip() for line in self.read_main_config() if f"keys_zone={zone}:" in line]
+            if zone_lines:
+                print(f"✅ 主配置文件中已定义缓存区域: {zone_lines[0]}")
+            else:
+                print("⚠️  主配置文件中未找到缓存区域定义")
+            return True
+        else:
+            print("反向代理缓存未启用")
+            return False
+    
+    def cache_hit_stats(self) -> Dict[str, int]:
+        """根据日志中的$upstream_cache_status统计缓存状态"""
+        lines = self.read_config()
+        site = self.get_site_name(lines)
+        log_path = None
+        for line in lines:
+            log_match = re.match(rf'\s*access_log\s+(\S+)\s+{self.log_format_name}', line)
+            if log_match:
+                log_path = log_match.group(1)
+                break
+        if not log_path:
+            log_path = find_site_log(site)
+        
+        stats: Dict[str, int] = {}
+        if not log_path or not os.path.exists(log_path):
+            return stats
+        for record in iter_records(log_path):
+            # 新格式为cs=状态，旧格式的缓存状态是最后一个字段；站点日志中的记录没有缓存状态
+            cache_match = re.search(r'\bcs=(\S+)', record.extra)
+            if cache_match:
+                status = cache_match.group(1)
+            elif record.extra and 'rt=' not in record.extra:
+                status = record.extra.split()[-1]
+            else:
+                status = "-"
+            stats[status] = stats.get(status, 0) + 1
+        return stats
+    
+    def print_hit_stats(self) -> bool:
+        """输出缓存命中率"""
+        stats = self.cache_hit_stats()
+        total = sum(count for status, count in stats.items() if status != "-")
+        if total == 0:
+            print("日志中没有缓存状态记录（需先启用缓存并产生访问）")
+            return False
+        
+        hits = sum(stats.get(status, 0) for status in ("HIT", "STALE", "UPDATING", "REVALIDATED"))
+        print("========= 缓存命中统计 =========")
+        for status, count in sorted(stats.items(), key=lambda item: item[1], reverse=True):
+            if status != "-":
+                print(f"{status:<12} {count:>10} {count * 100 / total:>6.1f}%")
+        print("--------------------------------")
+        print(f"命中率: {hits * 100 / total:.1f}%（{hits}/{total}）")
+        print("================================")
+        return True
+    
+    @timed("nginx_test")
+    def validate_config(self) -> bool:
+        """验证nginx配置语法"""
+        try:
+            result = subprocess.run(['nginx', '-t'],
+                                  capture_output=True,
+                                  text=True,
+                                  timeout=10)
+            if result.returncode == 0:
+                print("nginx配置语法验证通过")
+                return True
+            else:
+                print("nginx配置语法错误:")
+                print(result.stderr)
+                return False
+        except Exception as e:
+            print(f"无法验证nginx配置: {e}")
+            return False
+
+def main():
+    enable_profiling("cache-manager", action_index=2)
+    if len(sys.argv) < 3:
+        print("用法: cache-manager.py <conf_file> <action> [policy] [max_size] [avg_object] [inactive]")
+        print("actions: add, remove, status, stats, validate")
+        print(f"policies: {', '.join(CACHE_POLICIES)}")
+        sys.exit(1)
+    
+    conf_file = sys.argv[1]
+    action = sys.argv[2]
+    
+    if not os.path.exists(conf_file):
+        print(f"配置文件不存在: {conf_file}", file=sys.stderr)
+        sys.exit(1)
+    
+    manager = CacheManager(conf_file)
+    
+    if action == "add":
+        policy = sys.argv[3] if len(sys.argv) > 3 else "default"
+        max_size = sys.argv[4] if len(sys.argv) > 4 else "1g"
+        avg_object = sys.argv[5] if len(sys.argv) > 5 else "64k"
+        inactive = sys.argv[6] if len(sys.argv) > 6 else "60m"
+        
+        success = manager.add_cache(policy, max_size, avg_object, inactive)
+        if success:
+            manager.validate_config()
+        sys.exit(0 if success else 1)
+    
+    elif action == "remove":
+        success = manager.remove_cache()
+        if success:
+            manager.validate_config()
+        sys.exit(0 if success else 1)
+    
+    elif action == "status":
+        manager.check_cache_status()
+        sys.exit(0)
+    
+    elif action == "stats":
+        manager.print_hit_stats()
+        sys.exit(0)
+    
+    elif action == "validate":
+        success = manager.validate_config()
+        sys.exit(0 if success else 1)
+    
+    else:
+        print(f"未知操作: {action}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+"""
+证书批量续签调度器
+按到期时间排序续签所有站点证书，acme.sh/certbot并发执行（按CA限制并发和速率），
+全部完成后只做一次验证+重载
+"""
+
+import sys
+import re
+import os
+import json
+import time
+import base64
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from cert_info import CertificateCache, decode_certificate, key_type, pem_der
+from nginx_conf import ConfigParseError, Directive, find_ssl_servers, iter_servers, parse_lines, server_names, vhost_files
+from reload_coordinator import ReloadCoordinator
+
+ACME_HOME = os.path.expanduser("~/.acme.sh")
+# 可用环境变量指向测试目录（配合 --server 指向pebble做端到端测试）
+LETSENCRYPT_DIR = os.environ.get("CERTBOT_CONFIG_DIR", "/etc/letsencrypt")
+ACME_WEBROOT = "/usr/local/nginx/html/acme-challenge"
+STATE_FILE = os.environ.get("CERT_RENEWAL_STATE", os.path.expanduser("~/.cache/nginx-cert-renewal.json"))
+
+# 各CA的并发和速率限制（取官方限制的保守值）
+# orders: 每个窗口内的新订单数；per_domain: 每周同一注册域名的证书数
+CA_LIMITS = {
+    "letsencrypt": {"concurrency": 4, "orders": 250, "window": 3 * 3600, "per_domain": 45},
+    "zerossl": {"concurrency": 2, "orders": 60, "window": 3600, "per_domain": 0},
+    "buypass": {"concurrency": 2, "orders": 20, "window": 3600, "per_domain": 15},
+    "google": {"concurrency": 2, "orders": 60, "window": 3600, "per_domain": 0},
+    "default": {"concurrency": 2, "orders": 30, "window": 3600, "per_domain": 0},
+}
+
+# acme.sh保存的重载命令：设置了NGINX_RELOAD_DEFER时只标记，由调度器统一重载
+DEFERRED_RELOAD_CMD = ('[ -n "$NGINX_RELOAD_DEFER" ] && touch "$NGINX_RELOAD_DEFER" '
+                       '|| (systemctl reload nginx || nginx -s reload)')
+
+RATE_LIMIT_PATTERN = re.compile(r'rateLimited|too many (certificates|new orders|failed)', re.IGNORECASE)
+
+def read_acme_conf(path: str) -> Dict[str, str]:
+    """读取acme.sh的域名配置（Le_xxx='value'）"""
+    values = {}
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                conf_match = re.match(r"^(\w+)='(.*)'\s*$", line.strip())
+                if not conf_match:
+                    continue
+                value = conf_match.group(2)
+                b64_match = re.match(r'^__ACME_BASE64__START_(.*)__ACME_BASE64__END_$', value)
+                if b64_match:
+                    value = base64.b64decode(b64_match.group(1)).decode('utf-8', errors='replace')
+                values[conf_match.group(1)] = value
+    except (OSError, ValueError):
+        pass
+    return values
+
+def read_certbot_renewal(lineage: str) -> Dict[str, str]:
+    """读取certbot的续签配置"""
+    values = {}
+    try:
+        with open(os.path.join(LETSENCRYPT_DIR, "renewal", f"{lineage}.conf"), 'r', encoding='utf-8') as f:
+            for line in f:
+                if '=' in line and not line.lstrip().startswith('#'):
+                    key, value = line.split('=', 1)
+                    values[key.strip()] = value.strip()
+    except OSError:
+        pass
+    return values
+
+def ca_name(server_url: str, issuer: str) -> str:
+    """根据ACME服务器地址或颁发者识别CA"""
+    text = f"{server_url} {issuer}".lower()
+    if "letsencrypt" in text or "let's encrypt" in text:
+        return "letsencrypt"
+    if "zerossl" in text:
+        return "zerossl"
+    if "buypass" in text:
+        return "buypass"
+    if "pki.goog" in text or "google trust" in text:
+        return "google"
+    return server_url or issuer or "default"
+
+def registered_domain(domain: str) -> str:
+    """粗略取注册域名（最后两级），用于每域名证书数限制"""
+    parts = domain.lstrip('*.').split('.')
+    return '.'.join(parts[-2:])
+
+class RateLimiter:
+    """按CA记录订单时间，跨多次运行持久化，超过限制的证书留待下次续签"""
+    
+    def __init__(self, state_file: str = STATE_FILE):
+        self.state_file = state_file
+        self.lock = threading.Lock()
+        self.exhausted: Dict[str, bool] = {}
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {}
+        self.state.setdefault('orders', {})
+        self.state.setdefault('domains', {})
+    
+    def limits(self, ca: str) -> Dict[str, int]:
+        return CA_LIMITS.get(ca, CA_LIMITS["default"])
+    
+    def acquire(self, ca: str, domain: str) -> Optional[str]:
+        """尝试为一次订单占用额度，超限时返回原因"""
+        now = time.time()
+        limits = self.limits(ca)
+        with self.lock:
+            if self.exhausted.get(ca):
+                return "CA已返回速率限制"
+            orders = [ts for ts in self.state['orders'].get(ca, []) if ts > now - limits['window']]
+            if len(orders) >= limits['orders']:
+                return f"{limits['window'] // 3600}小时内订单数已达{limits['orders']}"
+            key = f"{ca}|{registered_domain(domain)}"
+            issued = [ts for ts in self.state['domains'].get(key, []) if ts > now - 7 * 86400]
+            if limits['per_domain'] and len(issued) >= limits['per_domain']:
+                return f"{registered_domain(domain)} 本周证书数已达{limits['per_domain']}"
+            orders.append(now)
+            issued.append(now)
+            self.state['orders'][ca] = orders
+            self.state['domains'][key] = issued
+        return None
+    
+    def mark_exhausted(self, ca: str) -> None:
+        with self.lock:
+            self.exhausted[ca] = True
+    
+    def save(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+            tmp_file = f"{self.state_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.state, f)
+            os.replace(tmp_file, self.state_file)
+        except OSError:
+            pass
+
+class CertRenewalScheduler:
+    def __init__(self, days: int = 30, concurrency: int = 8, server: Optional[str] = None,
+                 insecure: bool = False, webroot: str = ACME_WEBROOT,
+                 vhost_dir: str = "/usr/local/nginx/conf/vhost"):
+        self.days = days
+        self.concurrency = concurrency
+        self.server = server
+        self.insecure = insecure
+        self.webroot = webroot
+        self.vhost_dir = vhost_dir
+        # 站点已有ACME验证location时使用其目录：{配置文件: webroot}
+        self.conf_webroots: Dict[str, str] = {}
+        self.challenge_marker = "# ACME验证"
+        self.reload_flag = "/usr/local/nginx/logs/.cert-reload-pending"
+        self.limiter = RateLimiter()
+        self.semaphores: Dict[str, threading.Semaphore] = {}
+        self.semaphore_lock = threading.Lock()
+    
+    def collect_certificates(self) -> List[Dict[str, object]]:
+        """从所有vhost的TLS server块收集证书，按到期时间排序"""
+        cache = CertificateCache()
+        certs: Dict[str, Dict[str, object]] = {}
+        for conf_file in vhost_files(self.vhost_dir):
+            try:
+                with open(conf_file, 'r', encoding='utf-8') as f:
+                    servers = find_ssl_servers(parse_lines(f.readlines()))
+            except (OSError, ConfigParseError) as e:
+                print(f"跳过无法解析的配置 {conf_file}: {e}", file=sys.stderr)
+                continue
+            for server in servers:
+                cert_keys = zip([d.args[0] for d in server.children('ssl_certificate') if d.args],
+                                [d.args[0] for d in server.children('ssl_certificate_key') if d.args])
+                for cert_path, key_path in cert_keys:
+                    if cert_path in certs or not os.path.isfile(cert_path):
+                        continue
+                    info = cache.get(cert_path)
+                    if not info or info.get('not_after') is None:
+                        continue
+                    cert = {
+                        'cert': cert_path,
+                        'key': key_path,
+                        'conf': conf_file,
+                        'domains': info.get('dns_names') or ([info['subject_cn']] if info['subject_cn'] else server_names(server)),
+                        'not_after': info['not_after'],
+                        'issuer': info['issuer'],
+                    }
+                    cert.update(self.detect_source(cert_path, key_path, cert['domains']))
+                    certs[cert_path] = cert
+        cache.save()
+        return sorted(certs.values(), key=lambda cert: cert['not_after'])
+    
+    def detect_source(self, cert_path: str, key_path: str, domains: List[str]) -> Dict[str, object]:
+        """判断证书由acme.sh还是certbot管理"""
+        if cert_path.startswith(f"{LETSENCRYPT_DIR}/live/"):
+            lineage = cert_path[len(f"{LETSENCRYPT_DIR}/live/"):].split('/', 1)[0]
+            renewal = read_certbot_renewal(lineage)
+            return {'tool': 'certbot', 'lineage': lineage, 'ca_server': renewal.get('server', "")}
+        
+        for domain in domains:
+            for suffix in ("_ecc", ""):
+                domain_dir = os.path.join(ACME_HOME, f"{domain}{suffix}")
+                conf = read_acme_conf(os.path.join(domain_dir, f"{domain}.conf"))
+                if not conf:
+                    continue
+                managed_paths = (conf.get('Le_RealFullChainPath'), conf.get('Le_RealCertPath'))
+                if cert_path.startswith(domain_dir + "/") or cert_path in managed_paths:
+                    return {'tool': 'acme.sh', 'acme_domain': domain, 'ecc': suffix == "_ecc",
+                            'acme_conf': conf, 'ca_server': conf.get('Le_API', "")}
+        return {'tool': 'manual', 'ca_server': ""}
+    
+    def ca_semaphore(self, ca: str) -> threading.Semaphore:
+        with self.semaphore_lock:
+            if ca not in self.semaphores:
+                self.semaphores[ca] = threading.Semaphore(self.limiter.limits(ca)['concurrency'])
+            return self.semaphores[ca]
+    
+    def challenge_location(self, indent: str) -> str:
+        """HTTP-01验证用的location，续签时nginx不需要停机"""
+        config_lines = [
+            f"{indent}{self.challenge_marker}",
+            f"{indent}location ^~ /.well-known/acme-challenge/ {{",
+            f"{indent}    root {self.webroot};",
+            f"{indent}    default_type text/plain;",
+            f"{indent}}}",
+        ]
+        return "\n".join(config_lines) + "\n"
+    
+    def existing_challenge_webroot(self, server: Directive) -> Optional[str]:
+        """server块中已有的ACME验证location（手写、lib/ssl.sh或本工具添加），返回其webroot
+        
+        没有这样的location时返回None；有但无法确定目录时返回空字符串。
+        """
+        for location in server.children('location'):
+            path = location.args[-1] if location.args else ""
+            if 'acme-challenge' not in path and path.rstrip('/') != '/.well-known':
+                continue
+            root = location.first('root') or server.first('root')
+            if root and root.args:
+                return root.args[0]
+            alias = location.first('alias')
+            suffix = "/.well-known/acme-challenge"
+            if alias and alias.args and alias.args[0].rstrip('/').endswith(suffix):
+                return alias.args[0].rstrip('/')[:-len(suffix)] or "/"
+            return ""
+        return None
+    
+    def ensure_challenge_locations(self, conf_files: List[str]) -> List[str]:
+        """为站点中还没有ACME验证location的server块加入该location，返回被修改的文件"""
+        changed = []
+        for conf_file in sorted(set(conf_files)):
+            with open(conf_file, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+            try:
+                servers = list(iter_servers(parse_lines(lines)))
+            except ConfigParseError:
+                continue
+            inserts = {}
+            for server in servers:
+                webroot = self.existing_challenge_webroot(server)
+                if webroot is not None:
+                    # 已有的location继续使用原来的目录，重复添加会导致nginx -t失败
+                    if webroot and webroot != self.webroot:
+                        if self.conf_webroots.get(conf_file, webroot) != webroot:
+                            print(f"{conf_file} 中的server块使用了不同的ACME验证目录，使用 {self.conf_webroots[conf_file]}",
+                                  file=sys.stderr)
+                        self.conf_webroots.setdefault(conf_file, webroot)
+                    elif not webroot:
+                        print(f"无法确定 {conf_file} 中ACME验证location的目录，使用 {self.webroot}", file=sys.stderr)
+                    continue
+                anchor = max([d.end for d in server.children() if d.name in ('listen', 'server_name')] or [server.start])
+                child = server.block[0] if server.block else None
+                indent = "    "
+                if child is not None and child.start != server.start:
+                    indent = lines[child.start][:len(lines[child.start]) - len(lines[child.start].lstrip())]
+                inserts[anchor] = self.challenge_location(indent)
+            if not inserts:
+                continue
+            with open(f"{conf_file}.acme.bak", 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+            new_lines = []
+            for i, line in enumerate(lines):
+                new_lines.append(line)
+                if i in inserts:
+                    new_lines.append(inserts[i])
+            with open(conf_file, 'w', encoding='utf-8') as f:
+                f.writelines(new_lines)
+            changed.append(conf_file)
+        return changed
+    
+    def build_command(self, cert: Dict[str, object]) -> Optional[List[str]]:
+        """生成签发命令（webroot方式，nginx保持运行）"""
+        domains = [d for d in cert['domains'] if d]
+        webroot = self.conf_webroots.get(cert['conf'], self.webroot)
+        if cert['tool'] == 'acme.sh':
+            acme_conf = cert['acme_conf']
+            command = ['acme.sh', '--issue', '--webroot', webroot, '--force']
+            for domain in [cert['acme_domain']] + [d for d in domains if d != cert['acme_domain']]:
+                command.extend(['-d', domain])
+            command.extend(['--keylength', acme_conf.get('Le_Keylength') or ('ec-256' if cert['ecc'] else '2048')])
+            if self.server or acme_conf.get('Le_API'):
+                command.extend(['--server', self.server or acme_conf['Le_API']])
+            if self.insecure:
+                command.append('--insecure')
+            return command
+        if cert['tool'] == 'certbot':
+            command = ['certbot', 'certonly', '--webroot', '-w', webroot,
+                       '--cert-name', cert['lineage'], '--force-renewal', '--non-interactive',
+                       '--agree-tos', '--no-random-sleep-on-renew']
+            if LETSENCRYPT_DIR != "/etc/letsencrypt":
+                command.extend(['--config-dir', LETSENCRYPT_DIR, '--work-dir', os.path.join(LETSENCRYPT_DIR, "work"),
+                                '--logs-dir', os.path.join(LETSENCRYPT_DIR, "logs")])
+            for domain in domains:
+                command.extend(['-d', domain])
+            kind = key_type(cert['key'])
+            if kind:
+                command.extend(['--key-type', kind])
+            if self.server or cert['ca_server']:
+                command.extend(['--server', self.server or cert['ca_server']])
+            if self.insecure:
+                command.append('--no-verify-ssl')
+            return command
+        return None
+    
+    def install_acme_cert(self, cert: Dict[str, object], env: Dict[str, str]) -> bool:
+        """将acme.sh证书安装到nginx引用的路径，重载命令改为可延迟的形式"""
+        acme_conf = cert['acme_conf']
+        fullchain = acme_conf.get('Le_RealFullChainPath')
+        key_file = acme_conf.get('Le_RealKeyPath')
+        if not fullchain and not cert['cert'].startswith(ACME_HOME):
+            fullchain, key_file = cert['cert'], cert['key']
+        if not fullchain:
+            return True
+        command = ['acme.sh', '--install-cert', '-d', cert['acme_domain'],
+                   '--fullchain-file', fullchain, '--key-file', key_file,
+                   '--reloadcmd', DEFERRED_RELOAD_CMD]
+        if cert['ecc']:
+            command.append('--ecc')
+        result = subprocess.run(command, capture_output=True, text=True, timeout=120, env=env)
+        return result.returncode == 0
+    
+    def renew_one(self, cert: Dict[str, object]) -> Dict[str, object]:
+        """续签单个证书（在线程池中执行）"""
+        domain = cert['domains'][0] if cert['domains'] else cert['cert']
+        ca = ca_name(self.server or cert['ca_server'], cert['issuer'])
+        result = {'domain': domain, 'ca': ca, 'status': "", 'detail': ""}
+        
+        command = self.build_command(cert)
+        if command is None:
+            result['status'] = "跳过"
+            result['detail'] = "非acme.sh/certbot管理的证书"
+            return result
+        
+        with self.ca_semaphore(ca):
+            reason = self.limiter.acquire(ca, domain)
+            if reason:
+                result['status'] = "延后"
+                result['detail'] = reason
+                return result
+            
+            env = dict(os.environ, NGINX_RELOAD_DEFER=self.reload_flag)
+            started = time.time()
+            try:
+                process = subprocess.run(command, capture_output=True, text=True, timeout=600, env=env)
+            except (OSError, subprocess.TimeoutExpired) as e:
+                result['status'] = "失败"
+                result['detail'] = str(e)
+                return result
+            
+            output = process.stdout + process.stderr
+            if process.returncode != 0:
+                if RATE_LIMIT_PATTERN.search(output):
+                    self.limiter.mark_exhausted(ca)
+                    result['status'] = "限流"
+                    result['detail'] = "CA返回速率限制，本次不再向该CA提交"
+                else:
+                    result['status'] = "失败"
+                    result['detail'] = output.strip().splitlines()[-1] if output.strip() else f"退出码{process.returncode}"
+                return result
+            
+            if cert['tool'] == 'acme.sh' and not self.install_acme_cert(cert, env):
+                result['status'] = "失败"
+                result['detail'] = "证书已签发但安装失败"
+                return result
+        
+        der = pem_der(cert['cert'], "CERTIFICATE")
+        info = decode_certificate(der) if der else None
+        if not info or not info['not_after'] or info['not_after'] <= cert['not_after']:
+            result['status'] = "失败"
+            result['detail'] = "签发完成但证书文件未更新"
+            return result
+        result['status'] = "成功"
+        result['detail'] = f"新到期时间 {time.strftime('%Y-%m-%d', time.localtime(info['not_after']))}，用时{time.time() - started:.0f}秒"
+        return result
+    
+    def validate_and_reload(self) -> bool:
+        """验证配置后平滑重载一次（经由重载协调器，与同时进行的其他修改合并）"""
+        try:
+            return ReloadCoordinator(debounce=0).notify("cert-renewal")
+        except Exception as e:
+            print(f"无法重载nginx: {e}")
+            return False
+    
+    def run(self, dry_run: bool = False) -> bool:
+        """执行一次批量续签"""
+        certs = self.collect_certificates()
+        deadline = time.time() + self.days * 86400
+        due = [cert for cert in certs if cert['not_after'] <= deadline]
+        
+        print(f"共 {len(certs)} 张证书，{self.days} 天内到期 {len(due)} 张")
+        for cert in due:
+            remaining = (cert['not_after'] - time.time()) / 86400
+            print(f"  {cert['domains'][0] if cert['domains'] else cert['cert']:<40} "
+                  f"{'已过期' if remaining < 0 else f'{remaining:.0f}天':<8} {cert['tool']}")
+        if dry_run or not due:
+            return True
+        
+        changed = self.ensure_challenge_locations([cert['conf'] for cert in due if cert['tool'] != 'manual'])
+        for webroot in {self.webroot, *self.conf_webroots.values()}:
+            os.makedirs(webroot, exist_ok=True)
+        if changed:
+            print(f"已为 {len(changed)} 个站点加入ACME验证location，先重载nginx使其生效")
+            if not self.validate_and_reload():
+                for conf_file in changed:
+                    os.replace(f"{conf_file}.acme.bak", conf_file)
+                print("已恢复配置，续签中止")
+                return False
+        
+        # 上次运行重载失败时留下的标记不清除，本次结束时一并重载
+        results = []
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for result in executor.map(self.renew_one, due):
+                results.append(result)
+                print(f"[{result['status']}] {result['domain']} ({result['ca']}) {result['detail']}")
+        self.limiter.save()
+        
+        succeeded = sum(1 for result in results if result['status'] == "成功")
+        print("")
+        for status in ("成功", "失败", "延后", "限流", "跳过"):
+            count = sum(1 for result in results if result['status'] == status)
+            if count:
+                print(f"{status}: {count}")
+        
+        # 所有成功安装的证书只重载一次；重载失败时保留标记，下次运行再重载
+        reloaded = True
+        if succeeded or os.path.exists(self.reload_flag):
+            reloaded = self.validate_and_reload()
+            if not reloaded:
+                print("⚠️  证书已更新但nginx验证或重载失败，新证书尚未生效")
+            elif os.path.exists(self.reload_flag):
+                os.remove(self.reload_flag)
+        return reloaded and all(result['status'] in ("成功", "延后", "跳过") for result in results)
+
+def main():
+    options = {}
+    for arg in sys.argv[1:]:
+        option_match = re.match(r'^--([a-z-]+)(?:=(.*))?$', arg)
+        if not option_match:
+            print("用法: cert-renewal.py [--days=30] [--concurrency=8] [--server=ACME目录地址] [--insecure] [--dry-run]"
+                  " [--webroot=目录] [--vhost-dir=目录]")
+            print("--server 可指向本地测试CA（如pebble: https://localhost:14000/dir），配合--insecure使用")
+            sys.exit(1)
+        options[option_match.group(1)] = option_match.group(2)
+    
+    for name in ('days', 'concurrency'):
+        if options.get(name) is not None and (not options[name].isdigit() or int(options[name]) == 0):
+            print(f"--{name} 应为正整数: {options[name]}")
+            sys.exit(1)
+    scheduler = CertRenewalScheduler(
+        days=int(options.get('days') or 30),
+        concurrency=int(options.get('concurrency') or 8),
+        server=options.get('server'),
+        insecure='insecure' in options,
+        webroot=options.get('webroot') or ACME_WEBROOT,
+        vhost_dir=options.get('vhost-dir') or "/usr/local/nginx/conf/vhost",
+    )
+    success = scheduler.run(dry_run='dry-run' in options)
+    sys.exit(0 if success else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+证书信息读取
+在进程内解码PEM/DER证书的颁发者、主题和有效期（不调用openssl），并按路径+mtime缓存结果
+"""
+
+import os
+import re
+import json
+import base64
+import binascii
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+CACHE_FILE = os.path.expanduser("~/.cache/nginx-cert-cache.json")
+
+# id-ad-ocsp (1.3.6.1.5.5.7.48.1) 的DER编码，证书中存在即表示带有OCSP地址
+OCSP_OID = bytes.fromhex("2b06010505073001")
+RSA_OID = bytes.fromhex("2a864886f70d010101")
+EC_OID = bytes.fromhex("2a8648ce3d0201")
+SAN_OID = bytes.fromhex("551d11")
+
+# 名称属性OID（2.5.4.x）
+NAME_ATTRIBUTES = {
+    bytes.fromhex("550406"): "C",
+    bytes.fromhex("55040a"): "O",
+    bytes.fromhex("55040b"): "OU",
+    bytes.fromhex("550403"): "CN",
+}
+
+def pem_der(path: str, label: str) -> Optional[bytes]:
+    """读取PEM文件中第一个指定类型块的DER内容"""
+    try:
+        with open(path, 'r', encoding='ascii', errors='replace') as f:
+            content = f.read()
+    except OSError:
+        return None
+    block_match = re.search(r'-----BEGIN ' + label + r'-----(.*?)-----END ' + label + r'-----', content, re.S)
+    if not block_match:
+        return None
+    try:
+        return base64.b64decode(''.join(block_match.group(1).split()))
+    except (binascii.Error, ValueError):
+        return None
+
+def key_type(key_path: str) -> Optional[str]:
+    """识别私钥类型，返回 "ecdsa"、"rsa" 或 None"""
+    try:
+        with open(key_path, 'r', encoding='ascii', errors='replace') as f:
+            header = f.read(4096)
+    except OSError:
+        return None
+    if "BEGIN EC PRIVATE KEY" in header:
+        return "ecdsa"
+    if "BEGIN RSA PRIVATE KEY" in header:
+        return "rsa"
+    # PKCS#8格式按算法OID区分
+    der = pem_der(key_path, "PRIVATE KEY")
+    if der:
+        head = der[:64]
+        if EC_OID in head:
+            return "ecdsa"
+        if RSA_OID in head:
+            return "rsa"
+    return None
+
+def has_ocsp_url(cert_path: str) -> bool:
+    """证书的AIA扩展中是否带有OCSP地址（没有时开启stapling只会产生告警）"""
+    der = pem_der(cert_path, "CERTIFICATE")
+    return bool(der and OCSP_OID in der)
+
+def read_tlv(der: bytes, pos: int) -> Tuple[int, int, int]:
+    """读取一个DER元素，返回(tag, 值起始位置, 值结束位置)"""
+    tag = der[pos]
+    length = der[pos + 1]
+    pos += 2
+    if length & 0x80:
+        size = length & 0x7f
+        length = int.from_bytes(der[pos:pos + size], 'big')
+        pos += size
+    return tag, pos, pos + length
+
+def children(der: bytes, start: int, end: int) -> List[Tuple[int, int, int]]:
+    """返回构造类型元素的所有子元素"""
+    items = []
+    pos = start
+    while pos < end:
+        tag, value_start, value_end = read_tlv(der, pos)
+        items.append((tag, value_start, value_end))
+        pos = value_end
+    return items
+
+def decode_name(der: bytes, start: int, end: int) -> Dict[str, str]:
+    """解码X.509 Name中常用的属性"""
+    name: Dict[str, str] = {}
+    for _, set_start, set_end in children(der, start, end):
+        for _, seq_start, seq_end in children(der, set_start, set_end):
+            parts = children(der, seq_start, seq_end)
+            if len(parts) < 2:
+                continue
+            oid = der[parts[0][1]:parts[0][2]]
+            key = NAME_ATTRIBUTES.get(oid)
+            if key and key not in name:
+                tag, value_start, value_end = parts[1]
+                encoding = 'utf-16-be' if tag == 0x1e else 'utf-8'
+                name[key] = der[value_start:value_end].decode(encoding, errors='replace')
+    return name
+
+def decode_time(der: bytes, tag: int, start: int, end: int) -> Optional[float]:
+    """解码UTCTime/GeneralizedTime为时间戳"""
+    text = der[start:end].decode('ascii', errors='replace').rstrip('Z')
+    try:
+        if tag == 0x17:
+            moment = datetime.strptime(text[:12], "%y%m%d%H%M%S")
+        else:
+            moment = datetime.strptime(text[:14], "%Y%m%d%H%M%S")
+    except ValueError:
+        return None
+    return moment.replace(tzinfo=timezone.utc).timestamp()
+
+def decode_dns_names(der: bytes, start: int, end: int) -> List[str]:
+    """从扩展列表中取出subjectAltName的DNS名称"""
+    names = []
+    _, ext_start, ext_end = read_tlv(der, start)
+    for _, seq_start, seq_end in children(der, ext_start, ext_end):
+        parts = children(der, seq_start, seq_end)
+        if not parts or der[parts[0][1]:parts[0][2]] != SAN_OID:
+            continue
+        # 扩展值为OCTET STRING包裹的GeneralNames，dNSName的tag为[2]
+        _, value_start, value_end = parts[-1]
+        _, names_start, names_end = read_tlv(der, value_start)
+        for tag, name_start, name_end in children(der, names_start, names_end):
+            if tag == 0x82:
+                names.append(der[name_start:name_end].decode('ascii', errors='replace'))
+    return names
+
+def format_name(name: Dict[str, str]) -> str:
+    """按openssl的顺序拼接名称"""
+    return ", ".join(f"{key}={name[key]}" for key in ("C", "O", "OU", "CN") if key in name)
+
+def decode_certificate(der: bytes) -> Optional[Dict[str, object]]:
+    """从证书DER中取出颁发者、主题和有效期"""
+    try:
+        _, cert_start, cert_end = read_tlv(der, 0)
+        _, tbs_start, tbs_end = children(der, cert_start, cert_end)[0]
+        fields = children(der, tbs_start, tbs_end)
+        # 跳过可选的[0]版本号
+        if fields and fields[0][0] == 0xa0:
+            fields = fields[1:]
+        issuer = decode_name(der, fields[2][1], fields[2][2])
+        validity = children(der, fields[3][1], fields[3][2])
+        subject = decode_name(der, fields[4][1], fields[4][2])
+        # 扩展位于[3]标签中
+        extensions = [field for field in fields[5:] if field[0] == 0xa3]
+        dns_names = decode_dns_names(der, extensions[0][1], extensions[0][2]) if extensions else []
+    except (IndexError, ValueError):
+        return None
+    return {
+        'issuer': format_name(issuer),
+        'issuer_cn': issuer.get('CN') or issuer.get('O') or format_name(issuer),
+        'subject_cn': subject.get('CN', ""),
+        'dns_names': dns_names,
+        'not_before': decode_time(der, *validity[0]),
+        'not_after': decode_time(der, *validity[1]),
+    }
+
+class CertificateCache:
+    """按证书路径+mtime缓存解码结果，证书未变化时不重复读取"""
+    
+    def __init__(self, cache_file: str = CACHE_FILE):
+        self.cache_file = cache_file
+        self.entries: Dict[str, Dict[str, object]] = {}
+        self.dirty = False
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+    
+    def get(self, cert_path: str) -> Optional[Dict[str, object]]:
+        """返回证书信息，文件不存在或无法解析时返回None"""
+        try:
+            stat = os.stat(cert_path)
+        except OSError:
+            return None
+        entry = self.entries.get(cert_path)
+        if entry and entry.get('mtime_ns') == stat.st_mtime_ns and entry.get('size') == stat.st_size:
+            return entry.get('info')
+        
+        der = pem_der(cert_path, "CERTIFICATE")
+        info = decode_certificate(der) if der else None
+        self.entries[cert_path] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'info': info}
+        self.dirty = True
+        return info
+    
+    def save(self) -> None:
+        """保存缓存（只在有变化时写入）"""
+        if not self.dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            tmp_file = f"{self.cache_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_file, self.cache_file)
+            self.dirty = False
+        except OSError:
+            pass
@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 """
 nginx配置修复工具
-提供通用的配置修复功能，包括重复server块清理等
+提供通用的配置修复功能，包括重复server块清理等。
+fix只处理单个文件内部的重复server块；跨文件的重复server_name会修改其他站点的配置，
+需要显式执行 fix-conflicts（先列出改动，验证失败时整体还原）
 """
 
 import os
 import re
 from typing import List, Dict, Tuple
 
+from server_index import ServerIndex
+from snapshot_store import SnapshotStore
+
 class ConfigFixUtils:
     """nginx配置修复工具类"""
     
@@ -43,6 +48,37 @@ class ConfigFixUtils:
         
         return results
     
+    @staticmethod
+    def fix_conflicts(vhost_dir: str = "/usr/local/nginx/conf/vhost", dry_run: bool = False) -> bool:
+        """
+        处理跨文件重复的server_name（保留nginx实际生效的第一个定义），
+        逐条列出改动，修改后nginx -t验证失败时从修改前的快照还原
+        
+        Args:
+            vhost_dir: 虚拟主机配置目录
+            dry_run: 只列出将要进行的修改
+            
+        Returns:
+            bool: 是否处理成功
+        """
+        index = ServerIndex(vhost_dir=vhost_dir)
+        index.refresh()
+        if not index.conflicts():
+            print("未发现跨文件重复的server_name")
+            return True
+        
+        changed = index.resolve_conflicts(dry_run=dry_run)
+        if dry_run or not changed:
+            return True
+        print(f"已修改 {len(changed)} 个配置文件: {', '.join(changed)}")
+        if ConfigFixUtils.check_nginx_config():
+            return True
+        if index.last_snapshot and SnapshotStore().restore(index.last_snapshot):
+            print("修改后配置验证失败，已还原上述文件")
+        else:
+            print("修改后配置验证失败，且无法自动还原，请检查上述文件")
+        return False
+    
     @staticmethod
     def _fix_duplicate_servers_in_file(config_file: str) -> bool:
         """
@@ -86,7 +122,7 @@ class ConfigFixUtils:
                                 server_name = name_match.group(1).strip()
                         elif 'listen' in lines[j] and not server_port:
                             # 提取端口信息
-                            port_match = re.search(r'listen\s+(\d+)(?:\s+ssl)?;', lines[j])
+                            port_match = re.search(r'listen\s+(?:\S*:)?(\d+)[^;]*;', lines[j])
                             if port_match:
                                 server_port = port_match.group(1)
                         elif '{' in lines[j]:
@@ -204,13 +240,18 @@ def main():
             # 验证配置
             ConfigFixUtils.check_nginx_config()
         sys.exit(0)
+    elif len(sys.argv) > 1 and sys.argv[1] == "fix-conflicts":
+        # 跨文件的重复server_name
+        success = ConfigFixUtils.fix_conflicts(dry_run="--dry-run" in sys.argv)
+        sys.exit(0 if success else 1)
     elif len(sys.argv) > 1 and sys.argv[1] == "check":
         # 检查配置
         success = ConfigFixUtils.check_nginx_config()
         sys.exit(0 if success else 1)
     else:
-        print("用法: config-fix-utils.py [fix|check]")
-        print("  fix  - 修复重复的server配置")
+        print("用法: config-fix-utils.py [fix|fix-conflicts|check]")
+        print("  fix  - 修复同一文件内重复的server配置")
+        print("  fix-conflicts [--dry-run] - 处理跨文件重复的server_name（列出改动，验证失败时还原）")
         print("  check - 检查nginx配置语法")
         sys.exit(1)
 
@@ -7,6 +7,12 @@ fi
 if [ -z "$site" ]; then
   echo "未指定站点名"; exit 1
 fi
+# 有python3时按时间范围流式导出（只读取范围内的日志行），其余参数原样传给report-export.py
+script_dir="$(dirname "$0")"
+if command -v python3 >/dev/null 2>&1 && [ -f "$script_dir/report-export.py" ]; then
+  shift
+  exec python3 "$script_dir/report-export.py" "$site" "$@"
+fi
 log_files=("$log_dir/access_$site.log" "$log_dir/access-$site.log" "$log_dir/access.log")
 found_log=""
 for f in "${log_files[@]}"; do
@@ -36,7 +36,7 @@ if grep -q "# 流量限制配置" "$CONF_FILE"; then
     echo "  请求大小: ${BODY_SIZE:-256}KB"
     
     # 为HTTPS server块添加流量限制配置
-    sed -i '/listen 443 ssl;/a\
+    sed -i '/listen[[:space:]]\+443[[:space:]]\+ssl[^;]*;/a\
     # 流量限制配置\
     client_max_body_size '"${BODY_SIZE:-256}"'k;\
     limit_req zone=req_limit_per_ip burst=3 nodelay;\
@@ -49,7 +49,7 @@ else
     echo "未找到现有流量限制配置，使用默认严格限制..."
     
     # 使用默认的严格限制配置
-    sed -i '/listen 443 ssl;/a\
+    sed -i '/listen[[:space:]]\+443[[:space:]]\+ssl[^;]*;/a\
     # 流量限制配置\
     client_max_body_size 256k;\
     limit_req zone=req_limit_per_ip burst=3 nodelay;\
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+按国家/ASN统计访问量和流量
+用本地MaxMind格式数据库（.mmdb，mmap读取）解析访问IP，按国家和ASN汇总请求数、流量和IP数，
+分布式攻击时可以看出应当限流或封禁的网络。top单次遍历日志（多个日志文件并行处理），
+ingest增量读取各站点日志新增部分并按天汇总（与latency-report.py相同的汇总存储），query查询汇总结果
+"""
+
+import sys
+import os
+import json
+import time
+import fcntl
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from log_engine import LOG_DIR, find_site_log, iter_new_lines, iter_records, parse_line, record_day, record_timestamp, rotated_logs, site_access_logs
+from mmdb import GeoResolver, InvalidDatabaseError
+from rollup_store import RollupStore
+
+KIND = "geo"
+CRON_FILE = "/etc/cron.d/nginx-geo-rollup"
+UNKNOWN = "-"
+# 每站点每天最多保存的ASN数（按请求数保留，其余计入 "-"）
+MAX_ASNS = 500
+
+def new_groups() -> Dict[str, Dict[str, List]]:
+    """{'country': {代码: [请求数, 流量, IP集合]}, 'asn': {ASN: [请求数, 流量, IP集合]}}，names保存ASN组织名"""
+    return {'country': {}, 'asn': {}, 'names': {}}
+
+def add_record(groups: Dict[str, Dict], resolver: GeoResolver, ip: str, body_bytes: int) -> None:
+    country, asn, org = resolver.resolve(ip)
+    asn_key = str(asn) if asn is not None else UNKNOWN
+    for kind, key in (('country', country or UNKNOWN), ('asn', asn_key)):
+        counter = groups[kind].get(key)
+        if counter is None:
+            counter = groups[kind][key] = [0, 0, set()]
+        counter[0] += 1
+        counter[1] += body_bytes
+        counter[2].add(ip)
+    if org and asn_key not in groups['names']:
+        groups['names'][asn_key] = org
+
+def merge_groups(target: Dict[str, Dict], other: Dict[str, Dict]) -> None:
+    for kind in ('country', 'asn'):
+        for key, (requests, sent, ips) in other[kind].items():
+            counter = target[kind].setdefault(key, [0, 0, set()])
+            counter[0] += requests
+            counter[1] += sent
+            counter[2] |= set(ips)
+    for key, name in other['names'].items():
+        target['names'].setdefault(key, name)
+
+def aggregate_file(path: str, country_db: Optional[str], asn_db: Optional[str], since: float) -> Dict[str, Dict]:
+    """统计一个日志文件（在工作进程中执行，各进程共享数据库文件的页缓存）"""
+    resolver = GeoResolver(country_db, asn_db)
+    groups = new_groups()
+    try:
+        for record in iter_records(path):
+            if since:
+                ts = record_timestamp(record.time_local)
+                if ts is None or ts < since:
+                    continue
+            add_record(groups, resolver, record.remote_addr, record.body_bytes)
+    finally:
+        resolver.close()
+    return groups
+
+def ingest_log(site: str, log_path: str, position: Dict[str, int], country_db: Optional[str],
+               asn_db: Optional[str]) -> Tuple[str, str, Dict[str, int], Dict[str, Dict], int]:
+    """读取一个站点日志新增的行，按天汇总（在工作进程中执行）"""
+    resolver = GeoResolver(country_db, asn_db)
+    pending: Dict[str, Dict[str, Dict]] = {}
+    lines = 0
+    try:
+        for line in iter_new_lines(log_path, position):
+            lines += 1
+            record = parse_line(line)
+            if record is None:
+                continue
+            day = record_day(record.time_local)
+            if day is None:
+                continue
+            add_record(pending.setdefault(day.isoformat(), new_groups()), resolver, record.remote_addr,
+                       record.body_bytes)
+    finally:
+        resolver.close()
+    return site, log_path, position, pending, lines
+
+def dump_groups(groups: Dict[str, Dict]) -> Dict[str, object]:
+    """汇总只保存IP数，不保存IP集合"""
+    return {
+        'country': {key: [requests, sent, len(ips)] for key, (requests, sent, ips) in groups['country'].items()},
+        'asn': {key: [requests, sent, len(ips)] for key, (requests, sent, ips) in groups['asn'].items()},
+        'names': groups['names'],
+    }
+
+class GeoReport:
+    def __init__(self, country_db: Optional[str] = None, asn_db: Optional[str] = None,
+                 store: Optional[RollupStore] = None, workers: Optional[int] = None):
+        resolver = GeoResolver(country_db, asn_db)
+        self.country_db = resolver.country_db
+        self.asn_db = resolver.asn_db
+        self.available = resolver.available
+        resolver.close()
+        self.store = store or RollupStore(KIND)
+        self.workers = workers
+    
+    def run_parallel(self, function, jobs: List[Tuple]) -> List:
+        """多个任务时用进程池并行处理，单个任务直接执行"""
+        if len(jobs) <= 1 or self.workers == 1:
+            return [function(*job) for job in jobs]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(function, *zip(*jobs)))
+    
+    def top(self, log_files: List[str], days: int = 0) -> Dict[str, Dict]:
+        """单次遍历日志文件（并行）统计各国家/ASN"""
+        since = time.time() - days * 86400 if days else 0
+        groups = new_groups()
+        for result in self.run_parallel(aggregate_file, [(path, self.country_db, self.asn_db, since)
+                                                         for path in log_files]):
+            merge_groups(groups, result)
+        return groups
+    
+    def ingest(self) -> Tuple[int, int]:
+        """并行处理各站点日志的新增部分并按天汇总，返回(处理行数, 站点数)"""
+        os.makedirs(self.store.root, exist_ok=True)
+        with open(os.path.join(self.store.root, ".lock"), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            offsets = self.store.load_offsets()
+            jobs = [(site, log_path, offsets.get(log_path, {}), self.country_db, self.asn_db)
+                    for site, log_path in site_access_logs()]
+            lines = 0
+            for site, log_path, position, pending, count in self.run_parallel(ingest_log, jobs):
+                lines += count
+                offsets[log_path] = position
+                if not count:
+                    continue
+                merged = {}
+                for day_text, groups in pending.items():
+                    day = date.fromisoformat(day_text)
+                    if self.store.in_retention(day):
+                        merged[day] = self.merge_day(site, day, dump_groups(groups))
+                # 每个日志的汇总和偏移一起提交，中途崩溃时不会重复累加已处理的部分
+                self.store.commit(site, merged, offsets)
+            active = {job[1] for job in jobs}
+            for log_path in [path for path in offsets if path not in active]:
+                del offsets[log_path]
+            self.store.save_offsets(offsets)
+            self.store.prune()
+        return lines, len(jobs)
+    
+    def merge_day(self, site: str, day: date, data: Dict[str, object]) -> Dict[str, object]:
+        """与已保存的当天汇总合并并返回；IP数按批次相加，是去重IP数的上界"""
+        stored = self.store.load_day(site, day)
+        for kind in ('country', 'asn'):
+            counters = stored.setdefault(kind, {})
+            for key, values in data[kind].items():
+                counter = counters.setdefault(key, [0, 0, 0])
+                for i in range(3):
+                    counter[i] += values[i]
+        stored.setdefault('names', {}).update(data['names'])
+        if len(stored['asn']) > MAX_ASNS:
+            ordered = sorted(stored['asn'].items(), key=lambda item: -item[1][0])
+            stored['asn'] = dict(ordered[:MAX_ASNS - 1])
+            other = stored['asn'].setdefault(UNKNOWN, [0, 0, 0])
+            for _, values in ordered[MAX_ASNS - 1:]:
+                for i in range(3):
+                    other[i] += values[i]
+            stored['names'] = {key: name for key, name in stored['names'].items() if key in stored['asn']}
+        return stored
+    
+    def query(self, sites: List[str], days: int) -> Dict[str, Dict]:
+        """合并多个站点最近days天的汇总"""
+        result: Dict[str, Dict] = {'country': {}, 'asn': {}, 'names': {}}
+        for site in sites:
+            for _, data in self.store.iter_days(site, days):
+                for kind in ('country', 'asn'):
+                    for key, values in data.get(kind, {}).items():
+                        counter = result[kind].setdefault(key, [0, 0, 0])
+                        for i in range(3):
+                            counter[i] += values[i]
+                result['names'].update(data.get('names', {}))
+        return result
+    
+    def print_groups(self, groups: Dict[str, Dict], by: str, top: int, title: str) -> None:
+        counters = {key: (values[0], values[1], len(values[2]) if isinstance(values[2], set) else values[2])
+                    for key, values in groups[by].items()}
+        total_requests = sum(values[0] for values in counters.values()) or 1
+        total_bytes = sum(values[1] for values in counters.values()) or 1
+        label = "国家/地区" if by == "country" else "ASN"
+        print(f"========= {title} 按{label}统计 =========")
+        print(f"{label:<10} {'请求数':>10} {'请求占比':>8} {'流量(MB)':>10} {'流量占比':>8} {'IP数':>8}  {'组织' if by == 'asn' else ''}")
+        for key, (requests, sent, ips) in sorted(counters.items(), key=lambda item: -item[1][0])[:top]:
+            name = groups['names'].get(key, "") if by == "asn" else ""
+            display = f"AS{key}" if by == "asn" and key != UNKNOWN else key
+            print(f"{display:<12} {requests:>10} {requests * 100 / total_requests:>7.1f}% {sent / 1024 / 1024:>10.2f} "
+                  f"{sent * 100 / total_bytes:>7.1f}% {ips:>8}  {name[:30]}")
+        print(f"共 {len(counters)} 个{label}，{total_requests} 次请求")
+
+def install_cron(interval: int) -> bool:
+    """安装cron定时汇总任务"""
+    script = os.path.abspath(__file__)
+    try:
+        with open(CRON_FILE, 'w', encoding='utf-8') as f:
+            f.write(f"*/{interval} * * * * root /usr/bin/env python3 {script} ingest >/dev/null 2>&1\n")
+        os.chmod(CRON_FILE, 0o644)
+    except OSError as e:
+        print(f"写入定时任务失败: {e}")
+        return False
+    print(f"已安装定时任务: {CRON_FILE}（每 {interval} 分钟汇总一次）")
+    return True
+
+def main():
+    if len(sys.argv) < 2:
+        print("用法: geo-report.py <top|ingest|query|install-cron|remove-cron> [选项]")
+        print("  top [站点] [--by=country|asn] [--days=N] [--top=20]   - 单次遍历日志统计（不指定站点时统计access.log）")
+        print("  ingest                                               - 汇总各站点日志新增部分")
+        print("  query [站点] [--by=country|asn] [--days=7] [--top=20] [--json]")
+        print("  install-cron [--interval=5] / remove-cron")
+        print("  数据库: --country-db=路径 --asn-db=路径，默认在 /usr/local/nginx/conf/geoip、/usr/share/GeoIP 等目录查找")
+        sys.exit(1)
+    
+    action = sys.argv[1]
+    args = [arg for arg in sys.argv[2:] if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[2:] if arg.startswith("--") and "=" in arg)
+    by = options.get("by", "country")
+    if by not in ("country", "asn"):
+        print(f"不支持的分组: {by}")
+        sys.exit(1)
+    top = int(options.get("top", "20"))
+    workers = int(options["workers"]) if options.get("workers", "").isdigit() else None
+    
+    if action == "install-cron":
+        interval = options.get("interval", "5")
+        if not interval.isdigit() or not 1 <= int(interval) <= 59:
+            print("间隔应为1-59分钟")
+            sys.exit(1)
+        sys.exit(0 if install_cron(int(interval)) else 1)
+    elif action == "remove-cron":
+        if os.path.exists(CRON_FILE):
+            os.remove(CRON_FILE)
+            print("已删除定时任务")
+        else:
+            print("未安装定时任务")
+        sys.exit(0)
+    
+    try:
+        report = GeoReport(options.get("country-db"), options.get("asn-db"), workers=workers)
+    except (OSError, InvalidDatabaseError) as e:
+        print(f"打开GeoIP数据库失败: {e}")
+        sys.exit(1)
+    if not report.available and action in ("top", "ingest"):
+        print("未找到GeoIP数据库（.mmdb），请将GeoLite2-Country.mmdb/GeoLite2-ASN.mmdb放到 /usr/local/nginx/conf/geoip")
+        sys.exit(1)
+    
+    if action == "top":
+        site = args[0] if args else None
+        log_file = find_site_log(site) if site else os.path.join(LOG_DIR, "access.log")
+        if not log_file or not os.path.exists(log_file):
+            print("未找到该站点日志文件")
+            sys.exit(1)
+        groups = report.top(rotated_logs(log_file), int(options.get("days", "0")))
+        report.print_groups(groups, by, top, site or "access.log")
+        sys.exit(0)
+    elif action == "ingest":
+        lines, sites = report.ingest()
+        print(f"已汇总 {sites} 个站点，本次解析 {lines} 行")
+        sys.exit(0)
+    elif action == "query":
+        days = int(options.get("days", "7"))
+        if not 1 <= days <= report.store.retention_days:
+            print(f"天数应在1-{report.store.retention_days}之间")
+            sys.exit(1)
+        sites = args or report.store.sites()
+        if not sites:
+            print("暂无汇总数据，请先运行 ingest")
+            sys.exit(1)
+        result = report.query(sites, days)
+        if "--json" in sys.argv:
+            print(json.dumps(result, ensure_ascii=False, indent=2))
+        else:
+            report.print_groups(result, by, top, f"{args[0] if args else '全部站点'} 近{days}天")
+        sys.exit(0)
+    else:
+        print(f"未知操作: {action}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
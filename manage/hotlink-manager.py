@@ -7,16 +7,28 @@
 import sys
 import re
 import os
-import json
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
+
+from hotlink_rules import HOTLINK_MARKER, map_location, referer_location, static_tuning_config
+from nginx_conf import ConfigParseError, Directive, find_ssl_servers, iter_servers, parse_lines
+from profiling import enable_profiling, timed
+from snapshot_store import snapshot_files
 
 class HotlinkManager:
     def __init__(self, conf_file: str):
         self.conf_file = conf_file
         self.backup_file = f"{conf_file}.hotlink.bak"
-        self.hotlink_marker = "# 防盗链配置"
+        self.hotlink_marker = HOTLINK_MARKER
         self.hotlink_end_marker = "    }"
+        self.nginx_main_conf = "/usr/local/nginx/conf/nginx.conf"
+        self.vhost_dir = "/usr/local/nginx/conf/vhost"
+        # 共享map模式：所有站点共用一个http级别的map文件，每个站点一个独立的map变量，
+        # 各站点的白名单（包括server_names）只对本站点生效
+        self.referer_map_file = "/usr/local/nginx/conf/hotlink-referers.conf"
+        self.referer_map_marker = "# 防盗链来源白名单（共享map）"
+        self.referer_map_var = "$hotlink_referer_ok"
         
+    @timed("backup")
     def backup_config(self) -> bool:
         """备份配置文件"""
         try:
@@ -24,6 +36,7 @@ class HotlinkManager:
                 with open(self.conf_file, 'r', encoding='utf-8') as src:
                     with open(self.backup_file, 'w', encoding='utf-8') as dst:
                         dst.write(src.read())
+                snapshot_files([self.conf_file], "hotlink")
                 return True
         except Exception as e:
             print(f"备份配置文件失败: {e}", file=sys.stderr)
@@ -41,6 +54,7 @@ class HotlinkManager:
             print(f"恢复配置文件失败: {e}", file=sys.stderr)
         return False
     
+    @timed("read", lines="read")
     def read_config(self) -> List[str]:
         """读取配置文件"""
         try:
@@ -50,6 +64,7 @@ class HotlinkManager:
             print(f"读取配置文件失败: {e}", file=sys.stderr)
             return []
     
+    @timed("write", lines="write")
     def write_config(self, lines: List[str]) -> bool:
         """写入配置文件"""
         try:
@@ -60,32 +75,16 @@ class HotlinkManager:
             print(f"写入配置文件失败: {e}", file=sys.stderr)
             return False
     
-    def find_server_blocks(self, lines: List[str]) -> List[Tuple[int, int]]:
-        """查找所有server块的位置"""
-        server_blocks = []
-        brace_stack = []
-        
-        for i, line in enumerate(lines):
-            if re.match(r'\s*server\s*{', line):
-                brace_stack.append(i)
-            elif '{' in line and not re.match(r'\s*server\s*{', line):
-                brace_stack.append(None)
-            elif '}' in line:
-                if brace_stack:
-                    start = brace_stack.pop()
-                    if start is not None:
-                        server_blocks.append((start, i))
-        
-        return server_blocks
-    
-    def find_ssl_server_block(self, lines: List[str], server_blocks: List[Tuple[int, int]]) -> Optional[Tuple[int, int]]:
-        """查找SSL server块"""
-        for start, end in server_blocks:
-            for i in range(start, end + 1):
-                if re.search(r'listen\s+443\s+ssl;', lines[i]):
-                    return (start, end)
-        return None
+    def find_ssl_server_block(self, lines: List[str]) -> Optional[Directive]:
+        """查找第一个SSL server块（按解析后的配置树判断，不限定listen和大括号的写法）"""
+        try:
+            ssl_servers = find_ssl_servers(parse_lines(lines))
+        except ConfigParseError as e:
+            print(f"解析配置文件失败: {e}", file=sys.stderr)
+            return None
+        return ssl_servers[0] if ssl_servers else None
     
+    @timed("parse")
     def find_hotlink_config(self, lines: List[str]) -> Optional[Tuple[int, int]]:
         """查找现有的防盗链配置"""
         start_line = None
@@ -108,19 +107,223 @@ class HotlinkManager:
         
         return (start_line, end_line) if start_line is not None and end_line is not None else None
     
-    def generate_hotlink_config(self, referers: str) -> str:
+    def generate_hotlink_config(self, referers: str, static_tuning: str = "") -> str:
         """生成防盗链配置"""
-        return (
-            f"    {self.hotlink_marker}\n"
-            "    location ~* \\.(gif|jpg|jpeg|png|bmp|swf|flv|mp4|ico|webp)$ {\n"
-            f"        valid_referers {referers};\n"
-            "        if ($invalid_referer) {\n"
-            "            return 403;\n"
-            "        }\n"
-            "    }\n"
+        return referer_location(referers, static_tuning)
+    
+    def generate_hotlink_map_config(self, map_var: str, static_tuning: str = "") -> str:
+        """生成共享map模式的防盗链配置（location中只检查本站点的map变量）"""
+        return map_location(map_var, static_tuning)
+    
+    def find_access_log(self, lines: List[str], start: int) -> Optional[List[str]]:
+        """查找server块级别的access_log参数（不含location中的）"""
+        try:
+            tree = parse_lines(lines)
+        except ConfigParseError:
+            return None
+        for server in iter_servers(tree):
+            if server.start == start:
+                directive = server.first('access_log')
+                return directive.args if directive else None
+        return None
+    
+    def generate_static_tuning(self, log_off: bool = False, expires: str = "30d") -> str:
+        """生成静态资源性能优化配置"""
+        return static_tuning_config(log_off, expires)
+    
+    def get_server_names(self, lines: List[str]) -> List[str]:
+        """提取配置文件中的所有server_name"""
+        names = []
+        for line in lines:
+            name_match = re.search(r'^\s*server_name\s+([^;]+);', line)
+            if name_match:
+                for name in name_match.group(1).split():
+                    if name not in names:
+                        names.append(name)
+        return names
+    
+    def referers_to_map_keys(self, referers: str, server_names: List[str]) -> List[str]:
+        """将valid_referers格式的参数转换为map的键"""
+        keys = []
+        for token in referers.split():
+            if token == "none":
+                token_keys = ["__none__"]
+            elif token == "blocked":
+                token_keys = ["__blocked__"]
+            elif token == "server_names":
+                token_keys = server_names
+            else:
+                # valid_referers允许带路径，map只按主机名匹配
+                token_keys = [token.split('/')[0].lower()]
+            for key in token_keys:
+                if key and key not in keys:
+                    keys.append(key)
+        return keys
+    
+    def site_map_var(self, site: str) -> str:
+        """站点对应的map变量名"""
+        return f"{self.referer_map_var}_{re.sub(r'[^A-Za-z0-9_]', '_', site)}"
+    
+    def read_referer_map(self) -> Dict[str, Tuple[str, List[str]]]:
+        """读取共享map文件，返回 {map变量: (站点, 来源白名单)}"""
+        maps: Dict[str, Tuple[str, List[str]]] = {}
+        if not os.path.exists(self.referer_map_file):
+            return maps
+        try:
+            with open(self.referer_map_file, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except Exception as e:
+            print(f"读取防盗链来源白名单失败: {e}", file=sys.stderr)
+            return maps
+        
+        current = None
+        site = ""
+        for line in lines:
+            stripped = line.strip()
+            site_match = re.match(r'^# 站点: (\S+)$', stripped)
+            map_match = re.match(r'^map \$hotlink_referer_host (\$\w+) \{$', stripped)
+            if site_match:
+                site = site_match.group(1)
+            elif map_match:
+                current = map_match.group(1)
+                maps[current] = (site, [])
+                site = ""
+            elif current and stripped == '}':
+                current = None
+            elif current:
+                key_match = re.match(r'^(\S+)\s+1;$', stripped)
+                if key_match:
+                    maps[current][1].append(key_match.group(1).strip('"'))
+        return maps
+    
+    def generate_referer_map(self, maps: Dict[str, Tuple[str, List[str]]]) -> str:
+        """生成http级别的共享map配置
+        
+        第一个map从$http_referer中取出主机名，之后每个站点一个map，使用hostnames做
+        哈希精确匹配和前后缀匹配，每个请求只需一次哈希查找。
+        """
+        config_lines = [
+            self.referer_map_marker,
+            "# 由 hotlink-manager.py 生成，请勿手动修改",
+            "map $http_referer $hotlink_referer_host {",
+            "    default __blocked__;",
+            '    "" __none__;',
+            '    "~*^https?://([^/:?#]+)" $1;',
+            "}",
+        ]
+        for map_var, (site, keys) in sorted(maps.items()):
+            config_lines.append("")
+            if site:
+                config_lines.append(f"# 站点: {site}")
+            config_lines.extend([
+                f"map $hotlink_referer_host {map_var} {{",
+                "    hostnames;",
+                "    default 0;",
+            ])
+            for key in keys:
+                if key.startswith('~'):
+                    config_lines.append(f'    "{key}" 1;')
+                else:
+                    config_lines.append(f"    {key} 1;")
+            config_lines.append("}")
+        return "\n".join(config_lines) + "\n"
+    
+    def write_referer_map(self, maps: Dict[str, Tuple[str, List[str]]]) -> bool:
+        """写入共享map配置文件"""
+        try:
+            if os.path.exists(self.referer_map_file):
+                snapshot_files([self.referer_map_file], "hotlink")
+            tmp_file = f"{self.referer_map_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(self.generate_referer_map(maps))
+            os.replace(tmp_file, self.referer_map_file)
+            return True
+        except Exception as e:
+            print(f"写入防盗链来源白名单失败: {e}", file=sys.stderr)
+            return False
+    
+    def ensure_referer_map_include(self) -> bool:
+        """确保nginx主配置文件的http块中引入了共享map"""
+        try:
+            with open(self.nginx_main_conf, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except Exception as e:
+            print(f"读取nginx主配置文件失败: {e}", file=sys.stderr)
+            return False
+        
+        if any(self.referer_map_file in line for line in lines):
+            return True
+        
+        http_start = None
+        for i, line in enumerate(lines):
+            if re.match(r'\s*http\s*{', line):
+                http_start = i
+                break
+        
+        if http_start is None:
+            print("未找到http块，无法引入防盗链来源白名单", file=sys.stderr)
+            return False
+        
+        include_config = (
+            f"    {self.referer_map_marker}\n"
+            f"    include {self.referer_map_file};\n"
         )
+        new_lines = lines[:http_start + 1] + [include_config] + lines[http_start + 1:]
+        
+        try:
+            snapshot_files([self.nginx_main_conf], "hotlink")
+            with open(self.nginx_main_conf, 'w', encoding='utf-8') as f:
+                f.writelines(new_lines)
+            return True
+        except Exception as e:
+            print(f"写入nginx主配置文件失败: {e}", file=sys.stderr)
+            return False
     
-    def add_hotlink(self, referers: str) -> bool:
+    def find_map_mode_sites(self) -> Dict[str, Tuple[str, List[str]]]:
+        """查找所有使用共享map模式的站点，返回 {map变量: (站点, server_name列表)}"""
+        sites: Dict[str, Tuple[str, List[str]]] = {}
+        if not os.path.isdir(self.vhost_dir):
+            return sites
+        var_pattern = re.compile(r'if\s*\(\s*(' + re.escape(self.referer_map_var) + r'\w*)\s*=\s*0\s*\)')
+        for filename in sorted(os.listdir(self.vhost_dir)):
+            if not filename.endswith('.conf'):
+                continue
+            try:
+                with open(os.path.join(self.vhost_dir, filename), 'r', encoding='utf-8') as f:
+                    lines = f.readlines()
+            except Exception:
+                continue
+            names = self.get_server_names(lines)
+            for line in lines:
+                var_match = var_pattern.search(line)
+                if not var_match:
+                    continue
+                site, site_names = sites.get(var_match.group(1), (names[0] if names else filename[:-5], []))
+                sites[var_match.group(1)] = (site, site_names + [name for name in names if name not in site_names])
+        return sites
+    
+    def update_referer_map(self, referers: str) -> bool:
+        """替换所有共享map模式站点的来源白名单（一次更新，全部站点生效，server_names只对各自站点生效）"""
+        print("正在更新共享防盗链来源白名单...")
+        if "server_names" not in referers.split():
+            referers = f"{referers} server_names"
+        maps = {}
+        for map_var, (site, server_names) in self.find_map_mode_sites().items():
+            if map_var == self.referer_map_var:
+                print(f"站点 {site} 仍使用旧的全站共享白名单，请重新添加防盗链以按站点隔离", file=sys.stderr)
+            maps[map_var] = (site, self.referers_to_map_keys(referers, server_names))
+        if not maps:
+            print("没有使用共享白名单的站点")
+            return True
+        if not self.write_referer_map(maps):
+            return False
+        if not self.ensure_referer_map_include():
+            return False
+        print(f"共享防盗链来源白名单已更新，共 {len(maps)} 个站点")
+        return True
+    
+    def add_hotlink(self, referers: str, use_map: bool = False, static_tuning: bool = False,
+                    static_log: str = "on", expires: str = "30d") -> bool:
         """添加防盗链配置"""
         print("正在添加防盗链配置...")
         
@@ -132,42 +335,77 @@ class HotlinkManager:
         if not lines:
             return False
         
+        # 检查是否已存在防盗链配置（先删除再定位server块，保证重复添加结果一致）
+        existing_hotlink = self.find_hotlink_config(lines)
+        old_map_var = None
+        if existing_hotlink:
+            print("检测到已存在的防盗链配置，将先删除再添加")
+            old_map_var = self.hotlink_map_var(lines[existing_hotlink[0]:existing_hotlink[1] + 1])
+            lines = self.remove_hotlink_internal(lines)
+        
         # 查找SSL server块
-        server_blocks = self.find_server_blocks(lines)
-        ssl_server = self.find_ssl_server_block(lines, server_blocks)
+        ssl_server = self.find_ssl_server_block(lines)
         
         if not ssl_server:
             print("未找到SSL server块，无法添加防盗链配置", file=sys.stderr)
             return False
+        if ssl_server.start == ssl_server.end:
+            print("SSL server块写在同一行，无法插入防盗链配置，请先调整格式", file=sys.stderr)
+            return False
         
-        start_line, end_line = ssl_server
+        start_line, end_line = ssl_server.start, ssl_server.end
+        server_names = self.get_server_names(lines[start_line:end_line + 1])
+        site = server_names[0] if server_names else os.path.basename(self.conf_file)[:-5]
         
-        # 检查是否已存在防盗链配置
-        existing_hotlink = self.find_hotlink_config(lines)
-        if existing_hotlink:
-            print("检测到已存在的防盗链配置，将先删除再添加")
-            lines = self.remove_hotlink_internal(lines)
+        map_var = self.site_map_var(site)
         
-        # 查找插入位置（第一个location之前）
-        insert_pos = start_line + 1
-        for i in range(start_line + 1, end_line):
-            if re.match(r'\s*location\s', lines[i]):
-                insert_pos = i
-                break
+        # 查找插入位置（第一个location之前，没有location时放在server块末尾）
+        locations = ssl_server.children('location')
+        insert_pos = locations[0].start if locations else end_line
+        
+        # 生成静态资源优化配置
+        tuning_config = ""
+        if static_tuning:
+            if static_log == "buffer":
+                # 同一个日志文件只能有一种缓冲设置，缓冲在站点级别的access_log上设置
+                site_log = self.find_access_log(lines, start_line)
+                if not site_log or not any(arg.startswith("buffer=") for arg in site_log):
+                    print("站点日志未启用缓冲，静态资源沿用站点日志；"
+                          "如需缓冲写入请在访问日志管理中为站点启用带缓冲的日志")
+            tuning_config = self.generate_static_tuning(static_log == "off", expires)
         
         # 生成防盗链配置
-        hotlink_config = self.generate_hotlink_config(referers)
+        if use_map:
+            hotlink_config = self.generate_hotlink_map_config(map_var, tuning_config)
+        else:
+            hotlink_config = self.generate_hotlink_config(referers, tuning_config)
         
         # 插入配置
         new_lines = lines[:insert_pos] + [hotlink_config] + lines[insert_pos:]
         
-        # 写入配置文件
+        # 更新共享map：本站点的白名单写入独立的map，不影响其它站点；
+        # 从map模式改回普通模式（或站点名变化）时删除原来的map。任何一步失败都恢复map文件、主配置和站点配置
+        saved = self.read_map_files()
+        maps = self.read_referer_map()
+        stale_map = old_map_var in maps and (not use_map or old_map_var != map_var)
+        if stale_map:
+            del maps[old_map_var]
+        if use_map:
+            maps[map_var] = (site, self.referers_to_map_keys(referers, self.get_server_names(lines)))
+        if use_map or stale_map:
+            if not self.write_referer_map(maps) or (use_map and not self.ensure_referer_map_include()):
+                print("共享防盗链来源白名单写入失败", file=sys.stderr)
+                self.restore_map_files(saved)
+                return False
+        
+        # 写入配置文件（放在最后，失败时连同map一起恢复）
         if self.write_config(new_lines):
             print("防盗链配置添加成功")
             return True
         else:
             print("防盗链配置添加失败，正在恢复备份...")
             self.restore_config()
+            self.restore_map_files(saved)
             return False
     
     def remove_hotlink_internal(self, lines: List[str]) -> List[str]:
@@ -201,6 +439,7 @@ class HotlinkManager:
         
         # 写入配置文件
         if self.write_config(new_lines):
+            self.remove_site_map(lines[existing_hotlink[0]:existing_hotlink[1] + 1])
             print("防盗链配置删除成功")
             return True
         else:
@@ -208,6 +447,46 @@ class HotlinkManager:
             self.restore_config()
             return False
     
+    def hotlink_map_var(self, hotlink_lines: List[str]) -> Optional[str]:
+        """防盗链配置使用的站点map变量，普通模式返回None"""
+        for line in hotlink_lines:
+            var_match = re.search(r'(' + re.escape(self.referer_map_var) + r'_\w+)', line)
+            if var_match:
+                return var_match.group(1)
+        return None
+    
+    def remove_site_map(self, hotlink_lines: List[str]) -> None:
+        """删除防盗链时一并删除本站点在共享map文件中的白名单"""
+        maps = self.read_referer_map()
+        map_var = self.hotlink_map_var(hotlink_lines)
+        if map_var in maps:
+            del maps[map_var]
+            self.write_referer_map(maps)
+    
+    def read_map_files(self) -> Dict[str, Optional[str]]:
+        """读取共享map文件和nginx主配置的当前内容（不存在为None），写入失败时用于恢复"""
+        saved: Dict[str, Optional[str]] = {}
+        for path in (self.referer_map_file, self.nginx_main_conf):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    saved[path] = f.read()
+            except OSError:
+                saved[path] = None
+        return saved
+    
+    def restore_map_files(self, saved: Dict[str, Optional[str]]) -> None:
+        """恢复read_map_files读取的内容，原来不存在的文件删除"""
+        for path, content in saved.items():
+            try:
+                if content is None:
+                    if os.path.exists(path):
+                        os.remove(path)
+                    continue
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(content)
+            except OSError as e:
+                print(f"恢复 {path} 失败: {e}", file=sys.stderr)
+    
     def check_hotlink_status(self) -> bool:
         """检查防盗链配置状态"""
         lines = self.read_config()
@@ -225,11 +504,24 @@ class HotlinkManager:
                     line = lines[i].rstrip()
                     if line.strip():
                         print(f"  {line}")
+            
+            if any('open_file_cache' in lines[i] for i in range(start_line, end_line + 1)):
+                print("静态资源优化: 已启用")
+            
+            # 共享map模式下显示本站点白名单规模
+            maps = self.read_referer_map()
+            for i in range(start_line, end_line + 1):
+                var_match = re.search(r'(' + re.escape(self.referer_map_var) + r'\w*)', lines[i])
+                if var_match:
+                    keys = maps.get(var_match.group(1), ("", []))[1]
+                    print(f"模式: 共享map（{self.referer_map_file}，本站点 {len(keys)} 条来源规则）")
+                    break
             return True
         else:
             print("防盗链配置未启用")
             return False
     
+    @timed("fix_duplicates")
     def fix_duplicate_servers(self) -> bool:
         """修复重复的server配置"""
         print("正在检查并修复重复的server配置...")
@@ -318,6 +610,7 @@ class HotlinkManager:
             print(f"修复文件 {config_file} 时出错: {e}")
             return False
     
+    @timed("nginx_test")
     def validate_config(self) -> bool:
         """验证nginx配置语法"""
         try:
@@ -338,9 +631,10 @@ class HotlinkManager:
             return False
 
 def main():
+    enable_profiling("hotlink-manager", action_index=2)
     if len(sys.argv) < 3:
-        print("用法: hotlink-manager.py <conf_file> <action> [referers]")
-        print("actions: add, remove, status, validate")
+        print("用法: hotlink-manager.py <conf_file> <action> [referers] [--static] [--static-log=on|off|buffer] [--expires=30d]")
+        print("actions: add, add-map, map-update, remove, status, validate")
         sys.exit(1)
     
     conf_file = sys.argv[1]
@@ -352,6 +646,18 @@ def main():
     
     manager = HotlinkManager(conf_file)
     
+    # 静态资源优化选项
+    options = [arg for arg in sys.argv[3:] if arg.startswith('--')]
+    static_tuning = '--static' in options
+    static_log = "on"
+    expires = "30d"
+    for option in options:
+        if option.startswith('--static-log='):
+            static_log = option.split('=', 1)[1]
+            static_tuning = True
+        elif option.startswith('--expires='):
+            expires = option.split('=', 1)[1]
+    
     if action == "add":
         if len(sys.argv) < 4:
             print("添加防盗链需要指定referers参数", file=sys.stderr)
@@ -361,7 +667,32 @@ def main():
         # 先修复重复配置
         manager.fix_duplicate_servers()
         
-        success = manager.add_hotlink(referers)
+        success = manager.add_hotlink(referers, static_tuning=static_tuning,
+                                      static_log=static_log, expires=expires)
+        if success:
+            manager.validate_config()
+        sys.exit(0 if success else 1)
+    
+    elif action == "add-map":
+        if len(sys.argv) < 4:
+            print("添加防盗链需要指定referers参数", file=sys.stderr)
+            sys.exit(1)
+        referers = sys.argv[3]
+        
+        # 先修复重复配置
+        manager.fix_duplicate_servers()
+        
+        success = manager.add_hotlink(referers, use_map=True, static_tuning=static_tuning,
+                                      static_log=static_log, expires=expires)
+        if success:
+            manager.validate_config()
+        sys.exit(0 if success else 1)
+    
+    elif action == "map-update":
+        if len(sys.argv) < 4:
+            print("更新共享白名单需要指定referers参数", file=sys.stderr)
+            sys.exit(1)
+        success = manager.update_referer_map(sys.argv[3])
         if success:
             manager.validate_config()
         sys.exit(0 if success else 1)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+防盗链带宽分析报表
+流式读取站点访问日志，按来源主机统计受保护静态资源的请求、流量和403拦截情况
+"""
+
+import sys
+import os
+import re
+from datetime import date, timedelta
+from typing import Dict, List
+
+from log_engine import TopK, find_site_log, iter_records, record_day, referer_host, rotated_logs
+
+# 与hotlink-manager.py生成的location保持一致
+DEFAULT_EXTENSIONS = ["gif", "jpg", "jpeg", "png", "bmp", "swf", "flv", "mp4", "ico", "webp"]
+
+class HotlinkReport:
+    def __init__(self, site: str, days: int = 7, top: int = 20, capacity: int = 1000):
+        self.site = site
+        self.days = days
+        self.top = top
+        self.conf_file = f"/usr/local/nginx/conf/vhost/{site}.conf"
+        self.hotlink_marker = "# 防盗链配置"
+        self.extensions = DEFAULT_EXTENSIONS
+        self.server_names = [site]
+        self.referers = TopK(capacity)
+        self.daily: Dict[date, Dict[str, int]] = {}
+        # 按扩展名统计正常响应的平均大小，用于估算被拦截请求节省的流量
+        self.served_bytes: Dict[str, int] = {}
+        self.served_count: Dict[str, int] = {}
+        self.blocked_by_ext: Dict[date, Dict[str, int]] = {}
+        # 站点没有独立日志时find_site_log会退回共用的access.log，其中混有所有站点的请求
+        self.shared_log = False
+    
+    def load_site_config(self) -> None:
+        """从站点配置中读取受保护的扩展名和本站域名"""
+        if not os.path.exists(self.conf_file):
+            return
+        try:
+            with open(self.conf_file, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except Exception as e:
+            print(f"读取配置文件失败: {e}", file=sys.stderr)
+            return
+        
+        names = []
+        for i, line in enumerate(lines):
+            name_match = re.search(r'^\s*server_name\s+([^;]+);', line)
+            if name_match:
+                for name in name_match.group(1).split():
+                    if name not in names:
+                        names.append(name)
+            if self.hotlink_marker in line and i + 1 < len(lines):
+                ext_match = re.search(r'\\\.\(([^)]+)\)\$', lines[i + 1])
+                if ext_match:
+                    self.extensions = ext_match.group(1).split('|')
+        if names:
+            self.server_names = names
+    
+    def find_log_files(self) -> List[str]:
+        """查找站点日志及其轮转文件"""
+        log_file = find_site_log(self.site)
+        if not log_file:
+            return []
+        self.shared_log = os.path.basename(log_file) == "access.log"
+        # 只取按轮转规则命名的文件（.1、.2.gz……），按数字从旧到新，不混入.bak等其它文件
+        return rotated_logs(log_file)
+    
+    def classify_referer(self, referer: str) -> str:
+        """将Referer归类为来源主机"""
+        host = referer_host(referer)
+        if not host:
+            return "(无来源)"
+        for name in self.server_names:
+            if host == name or host.endswith(f".{name}"):
+                return "(本站)"
+        return host
+    
+    def process(self, log_files: List[str]) -> int:
+        """单次遍历所有日志文件完成统计，返回处理的记录数"""
+        ext_pattern = re.compile(r'\.(' + '|'.join(map(re.escape, self.extensions)) + r')$', re.IGNORECASE)
+        since = date.today() - timedelta(days=self.days - 1)
+        processed = 0
+        
+        for log_file in log_files:
+            for record in iter_records(log_file):
+                day = record_day(record.time_local)
+                if day is None or day < since:
+                    continue
+                path = record.path.split('?', 1)[0]
+                ext_match = ext_pattern.search(path)
+                if not ext_match:
+                    continue
+                processed += 1
+                ext = ext_match.group(1).lower()
+                blocked = 1 if record.status == 403 else 0
+                
+                metrics = self.referers.add(self.classify_referer(record.referer))
+                metrics['bytes'] = metrics.get('bytes', 0) + record.body_bytes
+                metrics['blocked'] = metrics.get('blocked', 0) + blocked
+                
+                daily = self.daily.setdefault(day, {'requests': 0, 'bytes': 0, 'blocked': 0})
+                daily['requests'] += 1
+                daily['bytes'] += record.body_bytes
+                daily['blocked'] += blocked
+                
+                if blocked:
+                    day_blocked = self.blocked_by_ext.setdefault(day, {})
+                    day_blocked[ext] = day_blocked.get(ext, 0) + 1
+                elif 200 <= record.status < 300:
+                    self.served_bytes[ext] = self.served_bytes.get(ext, 0) + record.body_bytes
+                    self.served_count[ext] = self.served_count.get(ext, 0) + 1
+        
+        return processed
+    
+    def estimate_saved(self, day: date) -> int:
+        """估算某一天被403拦截的请求节省的流量（按同扩展名正常响应的平均大小）"""
+        total_served = sum(self.served_bytes.values())
+        total_count = sum(self.served_count.values())
+        overall_avg = total_served // total_count if total_count else 0
+        saved = 0
+        for ext, count in self.blocked_by_ext.get(day, {}).items():
+            if self.served_count.get(ext):
+                avg = self.served_bytes[ext] // self.served_count[ext]
+            else:
+                avg = overall_avg
+            saved += avg * count
+        return saved
+    
+    def print_report(self) -> None:
+        """输出报表"""
+        mb = lambda value: value / 1024 / 1024
+        print(f"========= {self.site} 防盗链带宽分析（近{self.days}天） =========")
+        if self.shared_log:
+            print("注意: 未找到该站点的独立日志，以下统计来自所有站点共用的access.log，包含其它站点的请求")
+        print(f"受保护扩展名: {'|'.join(self.extensions)}")
+        print(f"{'来源主机':<36} {'请求数':>10} {'流量(MB)':>12} {'403次数':>10}")
+        print("-" * 72)
+        for host, count, metrics in self.referers.items(self.top):
+            print(f"{host:<40} {count:>10} {mb(metrics.get('bytes', 0)):>12.2f} {metrics.get('blocked', 0):>10}")
+        if self.referers.evicted:
+            print(f"（长尾来源超过{self.referers.capacity}个，已按Space-Saving合并统计，计数为上界估计）")
+        
+        print("")
+        print(f"{'日期':<10} {'请求数':>10} {'流量(MB)':>12} {'403次数':>10} {'预计节省(MB)':>14}")
+        print("-" * 72)
+        total_saved = 0
+        for day in sorted(self.daily):
+            daily = self.daily[day]
+            saved = self.estimate_saved(day)
+            total_saved += saved
+            print(f"{day.isoformat():<12} {daily['requests']:>10} {mb(daily['bytes']):>12.2f} "
+                  f"{daily['blocked']:>10} {mb(saved):>14.2f}")
+        print("-" * 72)
+        print(f"合计预计节省流量: {mb(total_saved):.2f} MB")
+        print("=" * 72)
+
+def main():
+    if len(sys.argv) < 2:
+        print("用法: hotlink-report.py <site> [days] [top]")
+        sys.exit(1)
+    
+    site = sys.argv[1]
+    for value in sys.argv[2:4]:
+        if not value.isdigit() or int(value) == 0:
+            print(f"天数和条目数应为正整数: {value}", file=sys.stderr)
+            sys.exit(1)
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 7
+    top = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    
+    report = HotlinkReport(site, days, top)
+    report.load_site_config()
+    log_files = report.find_log_files()
+    if not log_files:
+        print("未找到该站点日志文件", file=sys.stderr)
+        sys.exit(1)
+    
+    report.process(log_files)
+    report.print_report()
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -1,68 +1,58 @@
 #!/usr/bin/env python3
 import sys
-import re
 
-if len(sys.argv) != 3:
-    print("用法: insert_hotlink.py conf_file referers")
+from hotlink_rules import HOTLINK_MARKER, referer_location, static_tuning_config
+from nginx_conf import ConfigParseError, find_ssl_servers, parse_lines
+
+if len(sys.argv) not in (3, 4) or (len(sys.argv) == 4 and sys.argv[3] != "static"):
+    print("用法: insert_hotlink.py conf_file referers [static]")
     sys.exit(1)
 
 conf_file = sys.argv[1]
 referers = sys.argv[2]
+static_tuning = len(sys.argv) == 4
 
 with open(conf_file, 'r', encoding='utf-8') as f:
     lines = f.readlines()
 
-# 1. 检查所有 server 块结构是否正常
-brace_stack = []
-server_blocks = []  # [(start_line, end_line)]
+# 0. 删除已存在的防盗链配置，保证重复执行结果一致
 for i, line in enumerate(lines):
-    if re.match(r'\s*server\s*{', line):
-        brace_stack.append(i)
-    if '{' in line and not re.match(r'\s*server\s*{', line):
-        # 其它块
-        brace_stack.append(None)
-    if '}' in line:
-        if not brace_stack:
-            print(f"配置文件第{i+1}行多余的 }}，请手动修复！", file=sys.stderr)
-            sys.exit(1)
-        start = brace_stack.pop()
-        if start is not None:
-            server_blocks.append((start, i))
-if brace_stack:
-    print("配置文件 server 块大括号数量不匹配，请手动修复！", file=sys.stderr)
+    if HOTLINK_MARKER in line:
+        brace_count = 0
+        for j in range(i + 1, len(lines)):
+            if '{' in lines[j]:
+                brace_count += 1
+            elif '}' in lines[j]:
+                brace_count -= 1
+                if brace_count == 0:
+                    lines = lines[:i] + lines[j + 1:]
+                    break
+        break
+
+# 1. 解析配置（大括号不匹配等结构问题由解析器报告）
+try:
+    ssl_servers = find_ssl_servers(parse_lines(lines))
+except ConfigParseError as e:
+    print(f"解析配置文件失败: {e}，请手动修复！", file=sys.stderr)
     sys.exit(1)
 
-# 2. 找到 listen 443 ssl 的 server 块
-server_start = None
-server_end = None
-for start, end in server_blocks:
-    for j in range(start, end+1):
-        if re.search(r'listen\s+443\s+ssl;', lines[j]):
-            server_start = start
-            server_end = end
-            break
-    if server_start is not None:
-        break
-if server_start is None or server_end is None:
-    print("未找到 listen 443 ssl 的 server 块，无法插入防盗链规则。", file=sys.stderr)
+# 2. 找到第一个 TLS server 块（listen 带 ssl 标志即可，如 listen 443 ssl http2）
+if not ssl_servers:
+    print("未找到 listen ... ssl 的 server 块，无法插入防盗链规则。", file=sys.stderr)
+    sys.exit(1)
+server = ssl_servers[0]
+if server.start == server.end:
+    print("TLS server 块写在同一行，无法插入防盗链规则，请先调整格式。", file=sys.stderr)
     sys.exit(1)
+server_end = server.end
 
 # 3. 查找第一个 location 行号
-first_loc = None
-for idx in range(server_start+1, server_end):
-    if re.match(r'\s*location\s', lines[idx]):
-        first_loc = idx
-        break
+locations = server.children('location')
+first_loc = locations[0].start if locations else None
 
-hotlink_rule = (
-    "    # 防盗链配置\n"
-    "    location ~* \\.(gif|jpg|jpeg|png|bmp|swf|flv|mp4|ico|webp)$ {\n"
-    f"        valid_referers {referers};\n"
-    "        if ($invalid_referer) {\n"
-    "            return 403;\n"
-    "        }\n"
-    "    }\n"
-)
+# 静态资源性能优化与hotlink-manager.py共用同一个生成函数
+static_rule = static_tuning_config() if static_tuning else ""
+hotlink_rule = referer_location(referers, static_rule)
 
 # 4. 插入防盗链 location
 if first_loc is not None:
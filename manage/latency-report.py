@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+站点/路由请求耗时分位数
+增量读取各站点日志中的rt=/urt=计时字段（access-log-manager.py的site_timed格式），
+按站点和归一化路由（去掉查询参数、数字ID等动态段替换为:id）分别累加总耗时和上游耗时的直方图，
+每天一份保存在汇总存储中（保留30天），查询时合并每天的直方图得到p50/p90/p99/max，不再重新扫描日志
+"""
+
+import sys
+import os
+import json
+import fcntl
+from datetime import date, timedelta
+from typing import Dict, Optional, Tuple
+
+from log_engine import LatencySketch, iter_new_lines, normalize_route, parse_line, record_day, request_times, site_access_logs
+from rollup_store import RollupStore
+
+KIND = "latency"
+CRON_FILE = "/etc/cron.d/nginx-latency-rollup"
+# 路由保留的路径段数，以及每站点每天最多保存的路由数（超出部分计入 _other）
+ROUTE_DEPTH = 3
+MAX_ROUTES = 200
+QUANTILES = (0.5, 0.9, 0.99)
+
+def new_entry() -> Dict[str, LatencySketch]:
+    return {'total': LatencySketch(), 'upstream': LatencySketch()}
+
+def load_entry(data: Dict[str, Dict]) -> Dict[str, LatencySketch]:
+    return {kind: LatencySketch.from_dict(data.get(kind, {})) for kind in ('total', 'upstream')}
+
+def dump_entry(entry: Dict[str, LatencySketch]) -> Dict[str, Dict]:
+    return {kind: sketch.to_dict() for kind, sketch in entry.items()}
+
+def merge_entry(target: Dict[str, LatencySketch], other: Dict[str, LatencySketch]) -> None:
+    for kind in ('total', 'upstream'):
+        target[kind].merge(other[kind])
+
+def format_seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.3f}"
+
+class LatencyRollup:
+    def __init__(self, store: Optional[RollupStore] = None):
+        self.store = store or RollupStore(KIND)
+    
+    def ingest_log(self, log_path: str, position: Dict[str, int],
+                   pending: Dict[date, Dict[str, object]]) -> int:
+        """读取日志新增的行，按天累加到pending，返回处理的行数"""
+        processed = 0
+        for line in iter_new_lines(log_path, position):
+            processed += 1
+            record = parse_line(line)
+            if record is None:
+                continue
+            request_time, upstream_time = request_times(record.extra)
+            if request_time is None:
+                continue
+            day = record_day(record.time_local)
+            if day is None or not self.store.in_retention(day):
+                continue
+            day_data = pending.setdefault(day, {'site': new_entry(), 'routes': {}})
+            route = normalize_route(record.path, ROUTE_DEPTH)
+            routes = day_data['routes']
+            if route not in routes:
+                routes[route] = new_entry()
+            for entry in (day_data['site'], routes[route]):
+                entry['total'].add(request_time)
+                if upstream_time is not None:
+                    entry['upstream'].add(upstream_time)
+        return processed
+    
+    def merge_pending(self, site: str, pending: Dict[date, Dict[str, object]]) -> Dict[date, Dict[str, object]]:
+        """把本次累加的结果与已保存的每天汇总合并，返回合并后的汇总（由调用方与偏移一起提交）"""
+        merged = {}
+        for day, day_data in pending.items():
+            stored = self.store.load_day(site, day)
+            site_entry = load_entry(stored.get('site', {}))
+            merge_entry(site_entry, day_data['site'])
+            routes = {route: load_entry(data) for route, data in stored.get('routes', {}).items()}
+            # 按请求数从多到少加入新路由，超过上限的计入 _other
+            for route, entry in sorted(day_data['routes'].items(), key=lambda item: -item[1]['total'].count):
+                if route not in routes and len(routes) >= MAX_ROUTES:
+                    route = "_other"
+                merge_entry(routes.setdefault(route, new_entry()), entry)
+            merged[day] = {
+                'site': dump_entry(site_entry),
+                'routes': {route: dump_entry(entry) for route, entry in routes.items()},
+            }
+        return merged
+    
+    def ingest(self) -> Tuple[int, int]:
+        """处理所有站点日志的新增部分，返回(处理行数, 站点数)；首次发现的日志从头读取以回填历史"""
+        os.makedirs(self.store.root, exist_ok=True)
+        with open(os.path.join(self.store.root, ".lock"), 'a') as lock:
+            # cron和手动运行同时执行时串行处理，避免重复累加
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            offsets = self.store.load_offsets()
+            lines = 0
+            active = set()
+            for site, log_path in site_access_logs():
+                position = offsets.setdefault(log_path, {})
+                pending: Dict[date, Dict[str, object]] = {}
+                count = self.ingest_log(log_path, position, pending)
+                if count:
+                    # 每个日志的汇总和偏移一起提交，中途崩溃时不会重复累加已处理的部分
+                    self.store.commit(site, self.merge_pending(site, pending), offsets)
+                lines += count
+                active.add(log_path)
+            for log_path in [path for path in offsets if path not in active]:
+                del offsets[log_path]
+            self.store.save_offsets(offsets)
+            self.store.prune()
+        return lines, len(active)
+    
+    def query(self, site: str, days: int, until: Optional[date] = None) -> Tuple[Dict[str, LatencySketch], Dict[str, Dict[str, LatencySketch]]]:
+        """合并最近days天的汇总，返回(站点整体, 各路由)"""
+        site_entry = new_entry()
+        routes: Dict[str, Dict[str, LatencySketch]] = {}
+        for _, data in self.store.iter_days(site, days, until):
+            merge_entry(site_entry, load_entry(data.get('site', {})))
+            for route, route_data in data.get('routes', {}).items():
+                merge_entry(routes.setdefault(route, new_entry()), load_entry(route_data))
+        return site_entry, routes
+    
+    def describe(self, entry: Dict[str, LatencySketch]) -> Dict[str, object]:
+        """直方图的分位数摘要（秒）"""
+        result: Dict[str, object] = {'requests': entry['total'].count}
+        for kind, sketch in entry.items():
+            summary = {f"p{int(q * 100)}": sketch.quantile(q) for q in QUANTILES}
+            summary['max'] = sketch.max if sketch.count else None
+            summary['count'] = sketch.count
+            result[kind] = summary
+        return result
+    
+    def report(self, site: str, days: int, compare: bool = False) -> Dict[str, object]:
+        """查询结果；compare时同时给出上一个同长度周期的p99用于对比"""
+        site_entry, routes = self.query(site, days)
+        result = {'site': site, 'days': days, 'overall': self.describe(site_entry), 'routes': {}}
+        previous: Dict[str, Dict[str, LatencySketch]] = {}
+        if compare:
+            _, previous = self.query(site, days, date.today() - timedelta(days=days))
+        for route, entry in routes.items():
+            summary = self.describe(entry)
+            if route in previous and previous[route]['total'].count:
+                summary['previous_p99'] = previous[route]['total'].quantile(0.99)
+            result['routes'][route] = summary
+        return result
+    
+    def print_report(self, report: Dict[str, object], top: int, sort: str) -> None:
+        """输出路由耗时表"""
+        overall = report['overall']
+        print(f"========= {report['site']} 近{report['days']}天请求耗时（秒） =========")
+        if not overall['requests']:
+            print("没有耗时数据（日志需包含rt=/urt=字段，可用access-log-manager.py启用site_timed格式）")
+            return
+        total, upstream = overall['total'], overall['upstream']
+        print(f"整体: {overall['requests']} 次请求  总耗时 p50 {format_seconds(total['p50'])} "
+              f"p90 {format_seconds(total['p90'])} p99 {format_seconds(total['p99'])} max {format_seconds(total['max'])}")
+        if upstream['count']:
+            print(f"      上游耗时 p50 {format_seconds(upstream['p50'])} p90 {format_seconds(upstream['p90'])} "
+                  f"p99 {format_seconds(upstream['p99'])} max {format_seconds(upstream['max'])}")
+        
+        if sort == "count":
+            key = lambda item: -item[1]['requests']
+        else:
+            key = lambda item: -(item[1]['total'][sort] or 0)
+        routes = sorted(report['routes'].items(), key=key)[:top]
+        print(f"{'路由':<36} {'请求数':>8} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} {'上游p99':>8} {'上期p99':>8}")
+        print("-" * 110)
+        for route, summary in routes:
+            total, upstream = summary['total'], summary['upstream']
+            print(f"{route[:38]:<38} {summary['requests']:>10} {format_seconds(total['p50']):>8} "
+                  f"{format_seconds(total['p90']):>8} {format_seconds(total['p99']):>8} {format_seconds(total['max']):>8} "
+                  f"{format_seconds(upstream['p99']):>10} {format_seconds(summary.get('previous_p99')):>10}")
+
+def install_cron(interval: int) -> bool:
+    """安装cron定时汇总任务"""
+    script = os.path.abspath(__file__)
+    try:
+        with open(CRON_FILE, 'w', encoding='utf-8') as f:
+            f.write(f"*/{interval} * * * * root /usr/bin/env python3 {script} ingest >/dev/null 2>&1\n")
+        os.chmod(CRON_FILE, 0o644)
+    except OSError as e:
+        print(f"写入定时任务失败: {e}")
+        return False
+    print(f"已安装定时任务: {CRON_FILE}（每 {interval} 分钟汇总一次）")
+    return True
+
+def main():
+    if len(sys.argv) < 2:
+        print("用法: latency-report.py <ingest|query|install-cron|remove-cron> [选项]")
+        print("  ingest                                   - 汇总各站点日志新增部分的耗时")
+        print("  query [站点] [--days=7] [--top=20] [--sort=p99|p90|p50|max|count] [--compare] [--json]")
+        print("                                           - 查询站点各路由的耗时分位数（不指定站点时列出全部站点）")
+        print("  install-cron [--interval=5]              - 安装cron定时汇总")
+        print("  remove-cron                              - 删除定时任务")
+        sys.exit(1)
+    
+    action = sys.argv[1]
+    args = [arg for arg in sys.argv[2:] if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[2:] if arg.startswith("--") and "=" in arg)
+    rollup = LatencyRollup()
+    
+    if action == "ingest":
+        lines, sites = rollup.ingest()
+        print(f"已汇总 {sites} 个站点，本次解析 {lines} 行")
+        sys.exit(0)
+    elif action == "query":
+        days = int(options.get("days", "7"))
+        if not 1 <= days <= rollup.store.retention_days:
+            print(f"天数应在1-{rollup.store.retention_days}之间")
+            sys.exit(1)
+        sort = options.get("sort", "p99")
+        if sort not in ("p50", "p90", "p99", "max", "count"):
+            print(f"不支持的排序: {sort}")
+            sys.exit(1)
+        sites = args or rollup.store.sites()
+        if not sites:
+            print("暂无汇总数据，请先运行 ingest")
+            sys.exit(1)
+        reports = [rollup.report(site, days, compare="--compare" in sys.argv) for site in sites]
+        if "--json" in sys.argv:
+            print(json.dumps(reports if not args else reports[0], ensure_ascii=False, indent=2))
+        elif args:
+            rollup.print_report(reports[0], int(options.get("top", "20")), sort)
+        else:
+            print(f"{'站点':<34} {'请求数':>10} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} {'上游p99':>8}")
+            for report in reports:
+                overall = report['overall']
+                total = overall['total']
+                print(f"{report['site'][:36]:<36} {overall['requests']:>10} {format_seconds(total['p50']):>8} "
+                      f"{format_seconds(total['p90']):>8} {format_seconds(total['p99']):>8} "
+                      f"{format_seconds(total['max']):>8} {format_seconds(overall['upstream']['p99']):>10}")
+        sys.exit(0)
+    elif action == "install-cron":
+        interval = options.get("interval", "5")
+        if not interval.isdigit() or not 1 <= int(interval) <= 59:
+            print("间隔应为1-59分钟")
+            sys.exit(1)
+        sys.exit(0 if install_cron(int(interval)) else 1)
+    elif action == "remove-cron":
+        if os.path.exists(CRON_FILE):
+            os.remove(CRON_FILE)
+            print("已删除定时任务")
+        else:
+            print("未安装定时任务")
+        sys.exit(0)
+    else:
+        print(f"未知操作: {action}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
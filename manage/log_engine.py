@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""
+nginx访问日志解析引擎
+提供站点日志查找、流式逐行解析和有界内存的Top-K统计，供各统计报表复用
+"""
+
+import os
+import re
+import gzip
+import glob
+import math
+import zlib
+import heapq
+import calendar
+import functools
+from datetime import date, datetime
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from nginx_conf import ConfigParseError, iter_servers, parse_file, server_names, vhost_files, walk
+
+LOG_DIR = "/usr/local/nginx/logs"
+VHOST_DIR = "/usr/local/nginx/conf/vhost"
+
+# combined格式: $remote_addr - $remote_user [$time_local] "$request" $status $body_bytes_sent "$http_referer" "$http_user_agent"
+LOG_PATTERN = re.compile(
+    r'^(\S+) \S+ \S+ \[([^\]]+)\] "(?:(\S+) (\S+)(?: [^"]*)?|[^"]*)" (\d{3}) (\d+|-)'
+    r'(?: "((?:[^"\\]|\\.)*)" "((?:[^"\\]|\\.)*)")?(.*)$'
+)
+
+# 日志末尾的计时字段（rt=$request_time urt=$upstream_response_time）
+TIMING_PATTERN = re.compile(r'\b(rt|urt)="?([\d.]+(?:, *[\d.]+)*)"?')
+# 路由归一化：数字、十六进制串、UUID等动态段替换为占位符
+DYNAMIC_SEGMENT = re.compile(r'^(\d+|[0-9a-fA-F]{16,}|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})$')
+
+# User-Agent分类规则，按顺序匹配第一条（AI爬虫的UA中常带bot字样，需排在通用规则之前）
+UA_RULES = [
+    ("ai_crawler", re.compile(
+        r'GPTBot|ChatGPT-User|OAI-SearchBot|ClaudeBot|Claude-Web|anthropic-ai|CCBot|PerplexityBot|'
+        r'Bytespider|Google-Extended|Amazonbot|meta-externalagent|FacebookBot|cohere-ai|Diffbot|YouBot|'
+        r'Applebot-Extended|ImagesiftBot|Timpibot|omgili', re.IGNORECASE)),
+    ("search_bot", re.compile(
+        r'Googlebot|Storebot-Google|bingbot|Baiduspider|YandexBot|DuckDuckBot|Sogou|360Spider|Slurp|'
+        r'Applebot|PetalBot|YisouSpider|SeznamBot|Naver', re.IGNORECASE)),
+    ("monitor", re.compile(
+        r'UptimeRobot|Pingdom|StatusCake|Site24x7|Zabbix|blackbox-exporter|kube-probe|ELB-HealthChecker|'
+        r'Uptime-Kuma|check_http|NewRelicPinger|Datadog', re.IGNORECASE)),
+    ("headless", re.compile(r'HeadlessChrome|PhantomJS|Puppeteer|Playwright|Selenium|Lighthouse', re.IGNORECASE)),
+    ("library", re.compile(
+        r'^(curl|Wget|python-requests|python-urllib|Python/|aiohttp|httpx|Go-http-client|Java/|okhttp|'
+        r'libwww-perl|axios|node-fetch|undici|Scrapy|PostmanRuntime|Apache-HttpClient|Dart/|Ruby|'
+        r'PHP|GuzzleHttp|reqwest|HTTPie)', re.IGNORECASE)),
+    ("other_bot", re.compile(r'bot\b|spider|crawl|scrap|fetch|slurp|archiver|preview|externalhit', re.IGNORECASE)),
+    ("browser", re.compile(r'^Mozilla/5\.0 .*(Chrome|Firefox|Safari|Edg|OPR|MicroMessenger|QQBrowser)/')),
+]
+UA_FAMILY_NAMES = {
+    "ai_crawler": "AI爬虫",
+    "search_bot": "搜索引擎",
+    "monitor": "监控探测",
+    "headless": "无头浏览器",
+    "library": "程序/库",
+    "other_bot": "其它爬虫",
+    "browser": "浏览器",
+    "unknown": "未知/空UA",
+}
+# 真实用户流量的类别；空UA或无法识别的UA单独统计（unknown），其余都视为机器流量
+HUMAN_FAMILIES = ("browser",)
+UNKNOWN_FAMILY = "unknown"
+# 不同UA的数量通常只有几千个，缓存分类结果即可避免逐行跑正则
+UA_CACHE_SIZE = 8192
+# 增量读取gzip=写入的日志时每次读取的字节数
+GZIP_READ_SIZE = 1024 * 1024
+
+MONTHS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12,
+}
+
+class LogRecord(NamedTuple):
+    """单条访问日志记录"""
+    remote_addr: str
+    time_local: str
+    method: str
+    path: str
+    status: int
+    body_bytes: int
+    referer: str
+    user_agent: str
+    extra: str
+
+def find_site_log(site: str, log_dir: str = LOG_DIR) -> Optional[str]:
+    """按与stat-*.sh相同的顺序查找站点日志文件"""
+    candidates = [
+        os.path.join(log_dir, f"access_{site}.log"),
+        os.path.join(log_dir, f"access-{site}.log"),
+        # access-log-manager.py 设置 gzip= 时的日志名
+        os.path.join(log_dir, f"access_{site}.log.gz"),
+    ]
+    for path in candidates:
+        if os.path.isfile(path):
+            return path
+    
+    patterns = [
+        f"access_{site}_*.log",
+        f"access-{site}-*.log",
+        f"access.{site}*.log",
+        f"*{site}*.log",
+    ]
+    for pattern in patterns:
+        matches = sorted(glob.glob(os.path.join(log_dir, pattern)))
+        if matches:
+            return matches[0]
+    
+    fallback = os.path.join(log_dir, "access.log")
+    return fallback if os.path.isfile(fallback) else None
+
+def site_access_logs(vhost_dir: str = VHOST_DIR) -> List[Tuple[str, str]]:
+    """
+    返回各站点的(站点, 日志路径)：优先使用配置中的access_log，否则按find_site_log查找。
+    同一日志文件只归属一个站点，避免重复计数；共享的access.log归为 _default
+    """
+    result = []
+    assigned = set()
+    for conf_file in vhost_files(vhost_dir):
+        try:
+            tree = parse_file(conf_file)
+        except (OSError, ConfigParseError):
+            continue
+        site = next((names[0] for names in map(server_names, iter_servers(tree)) if names), None)
+        if not site:
+            continue
+        log_path = next((d.args[0] for d in walk(tree)
+                         if d.name == 'access_log' and d.args and d.args[0] not in ('off', 'syslog')
+                         and not d.args[0].startswith('syslog:')), None)
+        if not log_path or not os.path.isfile(log_path):
+            log_path = find_site_log(site)
+        if not log_path or log_path in assigned:
+            continue
+        assigned.add(log_path)
+        if os.path.basename(log_path) == "access.log":
+            site = "_default"
+        result.append((site, log_path))
+    return result
+
+def open_log(path: str):
+    """打开日志文件，自动识别gzip压缩的轮转日志"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+def parse_line(line: str) -> Optional[LogRecord]:
+    """解析一行combined格式日志，无法识别时返回None"""
+    match = LOG_PATTERN.match(line)
+    if not match:
+        return None
+    addr, time_local, method, path, status, size, referer, agent, extra = match.groups()
+    return LogRecord(
+        addr,
+        time_local,
+        method or "-",
+        path or "-",
+        int(status),
+        0 if size == '-' else int(size),
+        referer or "-",
+        agent or "-",
+        extra.strip(),
+    )
+
+def iter_records(path: str) -> Iterator[LogRecord]:
+    """流式读取日志文件，逐条产出解析后的记录"""
+    with open_log(path) as f:
+        try:
+            for line in f:
+                record = parse_line(line)
+                if record is not None:
+                    yield record
+        except EOFError:
+            # gzip=写入中的日志最后一个压缩块可能还没写完
+            pass
+
+def iter_new_lines(path: str, position: Dict[str, int]) -> Iterator[str]:
+    """
+    从上次的位置继续读取日志中新增的完整行，position（inode/offset）会被原地更新。
+    日志被轮转（inode变化）时先读完轮转后的旧文件（.1）剩余部分，再从新文件开头读取；
+    被截断时从头读取；不完整的最后一行留到下次读取。
+    以.gz结尾的日志按gzip=写入的格式读取，偏移量记录在压缩块边界上
+    """
+    compressed = path.endswith('.gz')
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return
+    if position.get('inode') != stat.st_ino:
+        if 'inode' in position:
+            rotated = rotated_name(path, 1)
+            try:
+                if os.stat(rotated).st_ino == position['inode']:
+                    yield from _read_from(rotated, dict(position), compressed)
+            except OSError:
+                pass
+        position['inode'] = stat.st_ino
+        position['offset'] = 0
+    elif stat.st_size < position.get('offset', 0):
+        position['offset'] = 0
+    yield from _read_from(path, position, compressed)
+
+def _read_from(path: str, position: Dict[str, int], compressed: bool = False) -> Iterator[str]:
+    """从position['offset']开始按字节读取完整的行"""
+    if compressed:
+        yield from _read_gzip_from(path, position)
+        return
+    with open(path, 'rb') as f:
+        f.seek(position.get('offset', 0))
+        for raw in f:
+            if not raw.endswith(b'\n'):
+                break
+            position['offset'] = position.get('offset', 0) + len(raw)
+            yield raw.decode('utf-8', errors='replace')
+
+def _read_gzip_from(path: str, position: Dict[str, int]) -> Iterator[str]:
+    """
+    nginx的gzip=日志每次刷新缓冲区追加一个完整的gzip成员，成员内都是完整的行。
+    从position['offset']开始逐个解压成员，每解压完一个成员把偏移推进到成员末尾；
+    最后一个尚未写完的成员留到下次读取
+    """
+    offset = position.get('offset', 0)
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        decompressor = zlib.decompressobj(wbits=31)
+        member: List[bytes] = []
+        while True:
+            chunk = f.read(GZIP_READ_SIZE)
+            if not chunk:
+                return
+            while chunk:
+                try:
+                    member.append(decompressor.decompress(chunk))
+                except zlib.error:
+                    return
+                if not decompressor.eof:
+                    offset += len(chunk)
+                    break
+                rest = decompressor.unused_data
+                offset += len(chunk) - len(rest)
+                position['offset'] = offset
+                for raw in b"".join(member).splitlines(keepends=True):
+                    yield raw.decode('utf-8', errors='replace')
+                decompressor = zlib.decompressobj(wbits=31)
+                member = []
+                chunk = rest
+
+def request_times(extra: str) -> Tuple[Optional[float], Optional[float]]:
+    """从日志末尾取出(请求总耗时, 上游耗时)，没有计时字段时为None；多次上游尝试的耗时相加"""
+    if not extra:
+        return None, None
+    times: Dict[str, float] = {}
+    for key, value in TIMING_PATTERN.findall(extra):
+        try:
+            times[key] = sum(float(part) for part in value.split(','))
+        except ValueError:
+            continue
+    return times.get('rt'), times.get('urt')
+
+def normalize_route(path: str, depth: int = 2) -> str:
+    """把请求路径归一化为路由（去掉查询参数，动态段替换为:id，只保留前depth段）"""
+    path = path.split('?', 1)[0].split('#', 1)[0]
+    if not path.startswith('/'):
+        return "-"
+    segments = [segment for segment in path.split('/') if segment][:depth]
+    normalized = [":id" if DYNAMIC_SEGMENT.match(segment) else segment[:48] for segment in segments]
+    return "/" + "/".join(normalized)
+
+@functools.lru_cache(maxsize=UA_CACHE_SIZE)
+def classify_user_agent(user_agent: str) -> str:
+    """按UA_RULES把User-Agent归类，结果按原始UA字符串缓存（有界LRU）"""
+    if not user_agent or user_agent == '-':
+        return UNKNOWN_FAMILY
+    for family, pattern in UA_RULES:
+        if pattern.search(user_agent):
+            return family
+    return UNKNOWN_FAMILY
+
+def is_bot_family(family: str) -> bool:
+    """是否属于可识别的机器流量（unknown既不算机器也不算真实用户）"""
+    return family not in HUMAN_FAMILIES and family != UNKNOWN_FAMILY
+
+def rotated_name(path: str, number: int) -> str:
+    """
+    第number份轮转文件名：普通日志的第1份保持未压缩（便于增量读取刚轮转的日志），更早的为.N.gz；
+    gzip=写入的日志（.gz）轮转为.N.gz
+    """
+    if path.endswith('.gz'):
+        return f"{path[:-3]}.{number}.gz"
+    return f"{path}.1" if number == 1 else f"{path}.{number}.gz"
+
+def rotated_logs(log_file: str) -> List[str]:
+    """日志及其轮转文件（按rotated_name命名，.1、.2.gz……），按从旧到新排序"""
+    base = log_file[:-3] if log_file.endswith('.gz') else log_file
+    rotated = []
+    for path in glob.glob(f"{glob.escape(base)}.*"):
+        number, _, rest = path[len(base) + 1:].partition('.')
+        if number.isdigit() and rest in ("", "gz"):
+            rotated.append((int(number), path))
+    return [path for _, path in sorted(rotated, reverse=True)] + [log_file]
+
+_day_cache: Dict[str, date] = {}
+
+def record_day(time_local: str) -> Optional[date]:
+    """从$time_local中取出日期（按日缓存，避免逐行strptime）"""
+    day_str = time_local[:11]
+    day = _day_cache.get(day_str)
+    if day is None:
+        try:
+            day = date(int(day_str[7:11]), MONTHS[day_str[3:6]], int(day_str[0:2]))
+        except (KeyError, ValueError):
+            return None
+        _day_cache[day_str] = day
+    return day
+
+def record_timestamp(time_local: str) -> Optional[int]:
+    """将$time_local转换为Unix时间戳（不经过strptime，适合逐行调用）"""
+    day = record_day(time_local)
+    if day is None or len(time_local) < 26:
+        return None
+    try:
+        seconds = int(time_local[12:14]) * 3600 + int(time_local[15:17]) * 60 + int(time_local[18:20])
+        sign = -1 if time_local[21] == '-' else 1
+        offset = sign * (int(time_local[22:24]) * 3600 + int(time_local[24:26]) * 60)
+    except ValueError:
+        return None
+    return calendar.timegm(day.timetuple()) + seconds - offset
+
+def line_timestamp(line: str) -> Optional[int]:
+    """只取出日志行中[...]内的时间，不做整行解析"""
+    start = line.find('[')
+    if start < 0:
+        return None
+    return record_timestamp(line[start + 1:start + 27])
+
+def record_datetime(time_local: str) -> Optional[datetime]:
+    """将$time_local解析为带时区的datetime"""
+    try:
+        return datetime.strptime(time_local, "%d/%b/%Y:%H:%M:%S %z")
+    except ValueError:
+        return None
+
+def referer_host(referer: str) -> str:
+    """从Referer中取出主机名，空来源返回空字符串"""
+    if not referer or referer == '-':
+        return ""
+    host_match = re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*://([^/:?#]+)', referer)
+    if not host_match:
+        return referer[:64]
+    return host_match.group(1).lower()
+
+class TopK:
+    """Space-Saving算法的Top-K计数器
+    
+    最多只保留capacity个键，超出时淘汰计数最小的键并由新键继承其计数作为误差上界，
+    长尾数据下内存占用固定。每个键可附带一个指标字典用于累加其它数值。
+    """
+    
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.metrics: Dict[str, Dict[str, int]] = {}
+        self._heap: List[Tuple[int, str]] = []
+        self.evicted = 0
+    
+    def add(self, key: str, weight: int = 1) -> Dict[str, int]:
+        """累加一个键的计数，返回该键的指标字典"""
+        if key in self.counts:
+            self.counts[key] += weight
+            return self.metrics[key]
+        
+        error = 0
+        if len(self.counts) >= self.capacity:
+            error = self._evict_min()
+        self.counts[key] = error + weight
+        self.errors[key] = error
+        self.metrics[key] = {}
+        heapq.heappush(self._heap, (self.counts[key], key))
+        return self.metrics[key]
+    
+    def _evict_min(self) -> int:
+        """淘汰当前计数最小的键（堆中过期的条目惰性更新）"""
+        while self._heap:
+            count, key = heapq.heappop(self._heap)
+            current = self.counts.get(key)
+            if current is None:
+                continue
+            if current != count:
+                heapq.heappush(self._heap, (current, key))
+                continue
+            del self.counts[key]
+            del self.errors[key]
+            del self.metrics[key]
+            self.evicted += 1
+            return count
+        return 0
+    
+    def items(self, limit: Optional[int] = None) -> List[Tuple[str, int, Dict[str, int]]]:
+        """按计数从大到小返回(键, 计数, 指标)"""
+        ordered = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        if limit is not None:
+            ordered = ordered[:limit]
+        return [(key, count, self.metrics[key]) for key, count in ordered]
+
+class LatencySketch:
+    """对数分桶的耗时直方图（HDR风格）
+    
+    按相对精度把毫秒值映射到对数桶，只保存非空桶，内存与请求数无关；
+    同规格的直方图按桶相加即可合并，合并结果与一次性统计完全相同，适合按天保存后再合并查询。
+    """
+    
+    # 相邻桶的比例，分位数的相对误差约为其一半（1%）
+    GAMMA = 1.02
+    _LOG_GAMMA = math.log(GAMMA)
+    
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def add(self, seconds: float) -> None:
+        """记录一个耗时（秒）"""
+        ms = seconds * 1000
+        # 1ms以下（$request_time精度为毫秒）统一计入0号桶
+        index = 0 if ms < 1 else 1 + int(math.log(ms) / self._LOG_GAMMA)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+    
+    def merge(self, other: 'LatencySketch') -> None:
+        """合并另一个直方图"""
+        for index, value in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + value
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+    
+    def quantile(self, ratio: float) -> Optional[float]:
+        """返回分位数（秒，最近秩），没有数据时为None"""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(ratio * self.count))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                if index == 0:
+                    return min(0.0005, self.max)
+                lower = self.GAMMA ** (index - 1)
+                return min((lower + lower * self.GAMMA) / 2 / 1000, self.max)
+        return self.max
+    
+    def to_dict(self) -> Dict[str, object]:
+        return {'b': {str(index): value for index, value in self.buckets.items()},
+                'n': self.count, 's': round(self.total, 6), 'm': self.max}
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, object]) -> 'LatencySketch':
+        sketch = cls()
+        sketch.buckets = {int(index): value for index, value in data.get('b', {}).items()}
+        sketch.count = data.get('n', 0)
+        sketch.total = data.get('s', 0.0)
+        sketch.max = data.get('m', 0.0)
+        return sketch
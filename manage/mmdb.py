@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+MaxMind DB（.mmdb）读取与IP归属地/ASN解析
+用mmap映射数据库文件按需读取（不整体载入内存），纯Python实现，不依赖maxminddb库。
+解析结果按IPv4 /24、IPv6 /48缓存，同一网段的大量IP只查一次数据库
+"""
+
+import os
+import mmap
+import struct
+import ipaddress
+from typing import Dict, List, Optional, Tuple
+
+METADATA_MARKER = b"\xab\xcd\xefMaxMind.com"
+DATA_SECTION_SEPARATOR = 16
+# 按顺序查找数据库文件，可用环境变量指定
+GEOIP_DIRS = [os.environ.get("NGINX_GEOIP_DIR", "/usr/local/nginx/conf/geoip"), "/usr/share/GeoIP",
+              "/var/lib/GeoIP", "/usr/local/share/GeoIP"]
+COUNTRY_DB_NAMES = ["GeoLite2-Country.mmdb", "GeoIP2-Country.mmdb", "GeoLite2-City.mmdb", "GeoIP2-City.mmdb",
+                    "dbip-country-lite.mmdb", "dbip-city-lite.mmdb"]
+ASN_DB_NAMES = ["GeoLite2-ASN.mmdb", "GeoIP2-ISP.mmdb", "dbip-asn-lite.mmdb"]
+# 缓存的网段前缀长度和最多缓存的网段数
+CACHE_PREFIX = {4: 24, 6: 48}
+CACHE_SIZE = 65536
+# 网段被数据库拆得比缓存粒度更细时的标记，此时对每个IP单独查询
+SPLIT = object()
+
+class InvalidDatabaseError(ValueError):
+    pass
+
+class MaxMindReader:
+    """MaxMind DB格式读取器，lookup返回(数据记录, 所在网段前缀长度)"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise InvalidDatabaseError(f"数据库文件为空: {path}")
+        start = self.buffer.rfind(METADATA_MARKER, max(0, len(self.buffer) - 128 * 1024))
+        if start < 0:
+            self.buffer.close()
+            raise InvalidDatabaseError(f"不是有效的MaxMind DB文件: {path}")
+        self.metadata, _ = self._decode(start + len(METADATA_MARKER), start + len(METADATA_MARKER))
+        try:
+            self.node_count = int(self.metadata['node_count'])
+            self.record_size = int(self.metadata['record_size'])
+            self.ip_version = int(self.metadata['ip_version'])
+        except (KeyError, TypeError, ValueError):
+            raise InvalidDatabaseError(f"数据库元数据不完整: {path}")
+        if self.record_size not in (24, 28, 32):
+            raise InvalidDatabaseError(f"不支持的记录长度: {self.record_size}")
+        self.node_bytes = self.record_size * 2 // 8
+        self.search_tree_size = self.node_count * self.node_bytes
+        self.data_start = self.search_tree_size + DATA_SECTION_SEPARATOR
+        # 同一数据记录会被很多网段引用，按偏移量缓存解码结果
+        self.data_cache: Dict[int, object] = {}
+        self.ipv4_start = self._ipv4_start()
+    
+    def close(self) -> None:
+        self.buffer.close()
+    
+    @property
+    def database_type(self) -> str:
+        return str(self.metadata.get('database_type', ''))
+    
+    def _ipv4_start(self) -> int:
+        """IPv6数据库中IPv4地址位于::/96之下，预先走完前96位"""
+        if self.ip_version != 6:
+            return 0
+        node = 0
+        for _ in range(96):
+            if node >= self.node_count:
+                break
+            node = self._read_node(node, 0)
+        return node
+    
+    def _read_node(self, node: int, bit: int) -> int:
+        offset = node * self.node_bytes
+        buffer = self.buffer
+        if self.record_size == 24:
+            offset += bit * 3
+            return int.from_bytes(buffer[offset:offset + 3], 'big')
+        if self.record_size == 28:
+            middle = buffer[offset + 3]
+            if bit:
+                return ((middle & 0x0F) << 24) | int.from_bytes(buffer[offset + 4:offset + 7], 'big')
+            return ((middle & 0xF0) << 20) | int.from_bytes(buffer[offset:offset + 3], 'big')
+        offset += bit * 4
+        return int.from_bytes(buffer[offset:offset + 4], 'big')
+    
+    def lookup(self, ip: str) -> Tuple[Optional[object], int]:
+        """查询IP，返回(数据记录, 网段前缀长度)；没有记录时数据为None"""
+        address = ipaddress.ip_address(ip)
+        if address.version == 6 and self.ip_version == 4:
+            return None, 0
+        packed = address.packed
+        bit_count = len(packed) * 8
+        node = self.ipv4_start if address.version == 4 else 0
+        value = int.from_bytes(packed, 'big')
+        depth = 0
+        while depth < bit_count and node < self.node_count:
+            node = self._read_node(node, (value >> (bit_count - 1 - depth)) & 1)
+            depth += 1
+        if node == self.node_count:
+            return None, depth
+        if node < self.node_count:
+            raise InvalidDatabaseError("搜索树损坏")
+        offset = node - self.node_count - DATA_SECTION_SEPARATOR + self.data_start
+        if offset not in self.data_cache:
+            self.data_cache[offset], _ = self._decode(offset, self.data_start)
+        return self.data_cache[offset], depth
+    
+    def _decode(self, offset: int, base: int) -> Tuple[object, int]:
+        """解码数据区中offset处的一个值，返回(值, 下一个值的偏移量)；base为指针的基准偏移量"""
+        buffer = self.buffer
+        control = buffer[offset]
+        offset += 1
+        data_type = control >> 5
+        if data_type == 1:
+            # 指针：指向的值解码后继续从指针之后读取
+            size = (control >> 3) & 0x3
+            value = control & 0x7
+            if size == 0:
+                pointer = (value << 8) | buffer[offset]
+            elif size == 1:
+                pointer = ((value << 16) | int.from_bytes(buffer[offset:offset + 2], 'big')) + 2048
+            elif size == 2:
+                pointer = ((value << 24) | int.from_bytes(buffer[offset:offset + 3], 'big')) + 526336
+            else:
+                pointer = int.from_bytes(buffer[offset:offset + 4], 'big')
+            result, _ = self._decode(base + pointer, base)
+            return result, offset + size + 1
+        if data_type == 0:
+            data_type = 7 + buffer[offset]
+            offset += 1
+        size = control & 0x1F
+        if size >= 29:
+            extra = size - 28
+            raw = int.from_bytes(buffer[offset:offset + extra], 'big')
+            offset += extra
+            size = (29, 285, 65821)[extra - 1] + raw
+        
+        if data_type == 2:
+            return buffer[offset:offset + size].decode('utf-8', 'replace'), offset + size
+        if data_type == 7:
+            result = {}
+            for _ in range(size):
+                key, offset = self._decode(offset, base)
+                result[key], offset = self._decode(offset, base)
+            return result, offset
+        if data_type == 11:
+            items = []
+            for _ in range(size):
+                item, offset = self._decode(offset, base)
+                items.append(item)
+            return items, offset
+        if data_type in (5, 6, 9, 10):
+            return int.from_bytes(buffer[offset:offset + size], 'big'), offset + size
+        if data_type == 8:
+            return int.from_bytes(buffer[offset:offset + size].rjust(4, b'\0'), 'big', signed=True), offset + size
+        if data_type == 3:
+            return struct.unpack('>d', buffer[offset:offset + 8])[0], offset + 8
+        if data_type == 15:
+            return struct.unpack('>f', buffer[offset:offset + 4])[0], offset + 4
+        if data_type == 4:
+            return bytes(buffer[offset:offset + size]), offset + size
+        if data_type == 14:
+            return bool(size), offset
+        if data_type in (12, 13):
+            return None, offset
+        raise InvalidDatabaseError(f"未知的数据类型: {data_type}")
+
+def find_database(names: List[str], dirs: Optional[List[str]] = None) -> Optional[str]:
+    for directory in dirs or GEOIP_DIRS:
+        for name in names:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                return path
+    return None
+
+def country_code(record: Optional[object]) -> Optional[str]:
+    """City/Country数据库记录中的国家代码，没有国家时使用注册地"""
+    if not isinstance(record, dict):
+        return None
+    for key in ('country', 'registered_country'):
+        value = record.get(key)
+        if isinstance(value, dict) and value.get('iso_code'):
+            return str(value['iso_code'])
+    return None
+
+def asn_info(record: Optional[object]) -> Tuple[Optional[int], str]:
+    """ASN数据库记录中的(ASN, 组织名)"""
+    if not isinstance(record, dict):
+        return None, ""
+    number = record.get('autonomous_system_number')
+    return (int(number) if number is not None else None), str(record.get('autonomous_system_organization') or "")
+
+class GeoResolver:
+    """
+    把IP解析为(国家代码, ASN, 组织名)，国家和ASN可以来自同一个或两个数据库。
+    结果按IPv4 /24、IPv6 /48缓存，数据库在该网段内划分得更细时退回逐个IP查询
+    """
+    
+    def __init__(self, country_db: Optional[str] = None, asn_db: Optional[str] = None, cache_size: int = CACHE_SIZE):
+        self.country_db = country_db or find_database(COUNTRY_DB_NAMES)
+        self.asn_db = asn_db or find_database(ASN_DB_NAMES)
+        self.country_reader = MaxMindReader(self.country_db) if self.country_db else None
+        if self.asn_db and self.asn_db == self.country_db:
+            self.asn_reader = self.country_reader
+        else:
+            self.asn_reader = MaxMindReader(self.asn_db) if self.asn_db else None
+        self.cache_size = cache_size
+        self.cache: Dict[Tuple[int, int], object] = {}
+        self.hits = 0
+        self.lookups = 0
+    
+    @property
+    def available(self) -> bool:
+        return self.country_reader is not None or self.asn_reader is not None
+    
+    def close(self) -> None:
+        for reader in {self.country_reader, self.asn_reader}:
+            if reader is not None:
+                reader.close()
+    
+    def _lookup(self, ip: str) -> Tuple[Tuple[Optional[str], Optional[int], str], int]:
+        """直接查询数据库，返回(结果, 两个数据库中较长的网段前缀长度)"""
+        prefix = 0
+        country = None
+        number, org = None, ""
+        if self.country_reader is not None:
+            record, depth = self.country_reader.lookup(ip)
+            country = country_code(record)
+            prefix = max(prefix, depth)
+        if self.asn_reader is not None:
+            record, depth = self.asn_reader.lookup(ip)
+            number, org = asn_info(record)
+            prefix = max(prefix, depth)
+        return (country, number, org), prefix
+    
+    def resolve(self, ip: str) -> Tuple[Optional[str], Optional[int], str]:
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None, None, ""
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+            ip = str(address)
+        bits = 32 if address.version == 4 else 128
+        cache_prefix = CACHE_PREFIX[address.version]
+        key = (address.version, int(address) >> (bits - cache_prefix))
+        cached = self.cache.get(key)
+        if cached is not None and cached is not SPLIT:
+            self.hits += 1
+            return cached
+        self.lookups += 1
+        result, prefix = self._lookup(ip)
+        if cached is None:
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            # 数据库中的网段比缓存粒度更细时，同网段其它IP的结果可能不同
+            self.cache[key] = result if prefix <= cache_prefix else SPLIT
+        return result
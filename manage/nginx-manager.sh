@@ -17,6 +17,10 @@ function show_sites() {
     echo "当前无已配置站点。"
     return
   fi
+  # 优先使用Python清单（单进程解析配置、缓存证书信息），不可用时回退到逐站点查询
+  if command -v python3 >/dev/null 2>&1 && [ -f "$SCRIPT_DIR/manage/site-inventory.py" ]; then
+    python3 "$SCRIPT_DIR/manage/site-inventory.py" && return
+  fi
   local line_len=90
   local line
   line=$(printf '%.0s=' $(seq 1 $line_len))
@@ -487,6 +491,12 @@ function site_status_menu() {
     echo "5. 热门请求URL/资源统计"
     echo "6. 安全扫描与告警"
     echo "7. 一键下载日志/流量报表"
+    echo "8. 防盗链带宽分析"
+    echo "9. 站点功能总览（防盗链/限流/HTTPS/后端）"
+    echo "10. Prometheus指标导出"
+    echo "11. 请求耗时分位数（按站点/路由）"
+    echo "12. 滥用IP自动封禁"
+    echo "13. 按国家/ASN统计访问"
     echo "0. 返回上一级"
     read -p "请输入选项: " subchoice
     case $subchoice in
@@ -611,7 +621,120 @@ function site_status_menu() {
         if [[ -z "${site_list[$site_idx]}" ]]; then
           echo "无效序号。"; continue
         fi
-        bash "$SCRIPT_DIR/manage/download-report.sh" "${site_list[$site_idx]}"
+        read -p "导出时间范围（30m/12h/7d 或 2024-01-01，默认1d）: " report_since
+        read -p "结束时间（默认现在）: " report_until
+        read -p "压缩格式 gzip/zstd（默认gzip）: " report_compress
+        export_args=("--since=${report_since:-1d}" "--compress=${report_compress:-gzip}")
+        [ -n "$report_until" ] && export_args+=("--until=$report_until")
+        bash "$SCRIPT_DIR/manage/download-report.sh" "${site_list[$site_idx]}" "${export_args[@]}"
+        ;;
+      8)
+        # 防盗链带宽分析
+        NGINX_CONF_DIR="/usr/local/nginx/conf/vhost"
+        idx=1
+        site_list=()
+        echo "========= 站点列表 ========="
+        for conf in $NGINX_CONF_DIR/*.conf; do
+          [ -e "$conf" ] || continue
+          server_name=$(grep -m1 'server_name' "$conf" | awk '{print $2}' | sed 's/;//')
+          printf "%2d. %s\n" "$idx" "$server_name"
+          site_list+=("$server_name")
+          idx=$((idx+1))
+        done
+        read -p "请输入要分析防盗链的站点序号: " site_idx
+        site_idx=$((site_idx-1))
+        if [[ -z "${site_list[$site_idx]}" ]]; then
+          echo "无效序号。"; continue
+        fi
+        read -p "统计天数（默认7）: " report_days
+        python3 "$SCRIPT_DIR/manage/hotlink-report.py" "${site_list[$site_idx]}" "${report_days:-7}"
+        ;;
+      9)
+        python3 "$SCRIPT_DIR/manage/site-inventory.py" status --all
+        ;;
+      10)
+        echo "1. 立即导出一次"
+        echo "2. 安装定时导出（每分钟）"
+        echo "3. 删除定时导出"
+        read -p "请输入选项: " export_op
+        case $export_op in
+          1) python3 "$SCRIPT_DIR/manage/prom-exporter.py" run;;
+          2) python3 "$SCRIPT_DIR/manage/prom-exporter.py" install-cron;;
+          3) python3 "$SCRIPT_DIR/manage/prom-exporter.py" remove-cron;;
+          *) echo "无效选项";;
+        esac
+        ;;
+      11)
+        echo "1. 查看各站点耗时"
+        echo "2. 查看某站点各路由耗时（与上一周期对比）"
+        echo "3. 立即汇总日志"
+        echo "4. 安装定时汇总（每5分钟）"
+        echo "5. 删除定时汇总"
+        read -p "请输入选项: " latency_op
+        case $latency_op in
+          1) python3 "$SCRIPT_DIR/manage/latency-report.py" query;;
+          2)
+            read -p "请输入站点域名: " latency_site
+            read -p "统计天数（默认7，最多30）: " latency_days
+            python3 "$SCRIPT_DIR/manage/latency-report.py" query "$latency_site" "--days=${latency_days:-7}" --compare
+            ;;
+          3) python3 "$SCRIPT_DIR/manage/latency-report.py" ingest;;
+          4) python3 "$SCRIPT_DIR/manage/latency-report.py" install-cron;;
+          5) python3 "$SCRIPT_DIR/manage/latency-report.py" remove-cron;;
+          *) echo "无效选项";;
+        esac
+        ;;
+      12)
+        echo "1. 查看封禁中的IP"
+        echo "2. 立即检测一次"
+        echo "3. 持续检测（Ctrl+C退出）"
+        echo "4. 解除封禁"
+        echo "5. 在所有站点启用自动封禁"
+        echo "6. 移除自动封禁"
+        echo "7. 安装定时检测（每分钟）"
+        echo "8. 删除定时检测"
+        read -p "请输入选项: " abuse_op
+        case $abuse_op in
+          1) python3 "$SCRIPT_DIR/manage/abuse-detector.py" list;;
+          2) python3 "$SCRIPT_DIR/manage/abuse-detector.py" run;;
+          3) python3 "$SCRIPT_DIR/manage/abuse-detector.py" watch;;
+          4)
+            read -p "请输入要解封的IP或网段: " abuse_ip
+            python3 "$SCRIPT_DIR/manage/abuse-detector.py" unblock "$abuse_ip"
+            ;;
+          5) python3 "$SCRIPT_DIR/manage/abuse-detector.py" install;;
+          6) python3 "$SCRIPT_DIR/manage/abuse-detector.py" uninstall;;
+          7) python3 "$SCRIPT_DIR/manage/abuse-detector.py" install-cron;;
+          8) python3 "$SCRIPT_DIR/manage/abuse-detector.py" remove-cron;;
+          *) echo "无效选项";;
+        esac
+        ;;
+      13)
+        echo "1. 按国家统计站点日志"
+        echo "2. 按ASN统计站点日志"
+        echo "3. 查询汇总（近N天，所有站点或指定站点）"
+        echo "4. 立即汇总一次"
+        echo "5. 安装定时汇总（每5分钟）"
+        echo "6. 删除定时汇总"
+        read -p "请输入选项: " geo_op
+        case $geo_op in
+          1|2)
+            read -p "请输入站点域名（留空统计access.log）: " geo_site
+            geo_by=country
+            [ "$geo_op" = "2" ] && geo_by=asn
+            python3 "$SCRIPT_DIR/manage/geo-report.py" top $geo_site "--by=$geo_by"
+            ;;
+          3)
+            read -p "请输入站点域名（留空为所有站点）: " geo_site
+            read -p "统计天数（默认7）: " geo_days
+            read -p "按国家(country)还是ASN(asn)统计（默认country）: " geo_by
+            python3 "$SCRIPT_DIR/manage/geo-report.py" query $geo_site "--by=${geo_by:-country}" "--days=${geo_days:-7}"
+            ;;
+          4) python3 "$SCRIPT_DIR/manage/geo-report.py" ingest;;
+          5) python3 "$SCRIPT_DIR/manage/geo-report.py" install-cron;;
+          6) python3 "$SCRIPT_DIR/manage/geo-report.py" remove-cron;;
+          *) echo "无效选项";;
+        esac
         ;;
       0) break;;
       *) echo "无效选项";;
@@ -619,6 +742,34 @@ function site_status_menu() {
   done
 }
 
+function worker_tuning_menu() {
+  echo "========= Worker/连接数调优 ========="
+  echo "1. 查看硬件检测结果和推荐值"
+  echo "2. 预览改动（diff）"
+  echo "3. 应用推荐值"
+  echo "4. 回滚上一次调优"
+  echo "0. 返回上一级"
+  read -p "请输入选项: " tuning_op
+  case $tuning_op in
+    1) python3 "$SCRIPT_DIR/manage/worker-tuning.py" show;;
+    2) python3 "$SCRIPT_DIR/manage/worker-tuning.py" diff;;
+    3)
+      if python3 "$SCRIPT_DIR/manage/worker-tuning.py" apply; then
+        python3 "$SCRIPT_DIR/manage/reload_coordinator.py" notify worker-tuning --now
+      else
+        echo "❌ 调优未应用"
+      fi
+      ;;
+    4)
+      if python3 "$SCRIPT_DIR/manage/worker-tuning.py" rollback; then
+        python3 "$SCRIPT_DIR/manage/reload_coordinator.py" notify worker-tuning --now
+      fi
+      ;;
+    0) return;;
+    *) echo "无效选项";;
+  esac
+}
+
 function manage_menu() {
   while true; do
     clear
@@ -634,6 +785,8 @@ function manage_menu() {
     echo "7. 管理SSL证书"
     echo "8. 管理Nginx备份"
     echo "9. 查看站点状态"
+    echo "10. Worker/连接数调优"
+    echo "11. 按清单批量添加站点"
     echo "0. 退出"
     read -p "请输入选项: " choice
     case $choice in
@@ -646,6 +799,8 @@ function manage_menu() {
       7) manage_ssl_menu;;
       8) manage_backups;;
       9) site_status_menu;;
+      10) worker_tuning_menu;;
+      11) provision_menu;;
       0) exit 0;;
       *) echo "无效选项"; sleep 1;;
     esac
@@ -654,6 +809,19 @@ function manage_menu() {
   done
 }
 
+function provision_menu() {
+  read -p "请输入站点清单路径（.yaml/.csv/.json）: " manifest
+  if [ ! -f "$manifest" ]; then
+    echo "清单文件不存在。"
+    return
+  fi
+  python3 "$SCRIPT_DIR/manage/site-provision.py" plan "$manifest" || return
+  read -p "确认按清单写入配置并重载? (y/N): " confirm
+  if [[ $confirm == "y" || $confirm == "Y" ]]; then
+    python3 "$SCRIPT_DIR/manage/site-provision.py" apply "$manifest"
+  fi
+}
+
 function manual_edit_proxy() {
   NGINX_CONF_DIR="/usr/local/nginx/conf/vhost"
   idx=1
@@ -716,12 +884,15 @@ function manual_edit_proxy() {
   if bash "$SCRIPT_DIR/manage/proxy-config.sh" auto_fix_nginx; then
     echo "已自动修复nginx配置。"
   fi
-  if command -v systemctl >/dev/null 2>&1; then
+  if command -v python3 >/dev/null 2>&1 && [ -f "$SCRIPT_DIR/manage/reload_coordinator.py" ]; then
+    python3 "$SCRIPT_DIR/manage/reload_coordinator.py" notify edit-config --now
+  elif command -v systemctl >/dev/null 2>&1; then
     systemctl reload nginx 2>/dev/null || /usr/local/nginx/sbin/nginx -s reload || nginx -s reload
+    echo "已重载nginx。"
   else
     /usr/local/nginx/sbin/nginx -s reload || nginx -s reload
+    echo "已重载nginx。"
   fi
-  echo "已重载nginx。"
 }
 
 # 启动管理菜单
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+nginx配置解析器
+将配置文件解析为指令树（保留行号），供各管理脚本按结构查找server块、listen和证书等信息
+"""
+
+import os
+from typing import Iterator, List, Optional, Tuple
+
+class ConfigParseError(ValueError):
+    """配置文件无法解析（如大括号不匹配）"""
+    
+    def __init__(self, message: str, line: int):
+        super().__init__(f"第{line + 1}行: {message}")
+        self.line = line
+
+class Directive:
+    """一条配置指令；带块的指令（server、location等）的子指令保存在block中
+    
+    start/end为指令在文件中起止行的下标（从0开始，与readlines()的下标一致），
+    带块指令的end为对应右大括号所在行。
+    """
+    
+    __slots__ = ('name', 'args', 'start', 'end', 'block')
+    
+    def __init__(self, name: str, args: List[str], start: int, end: int,
+                 block: Optional[List['Directive']] = None):
+        self.name = name
+        self.args = args
+        self.start = start
+        self.end = end
+        self.block = block
+    
+    def children(self, name: Optional[str] = None) -> List['Directive']:
+        """返回直接子指令，可按名称过滤"""
+        if self.block is None:
+            return []
+        if name is None:
+            return list(self.block)
+        return [child for child in self.block if child.name == name]
+    
+    def first(self, name: str) -> Optional['Directive']:
+        """返回第一个同名直接子指令"""
+        for child in self.block or []:
+            if child.name == name:
+                return child
+        return None
+    
+    def __repr__(self) -> str:
+        return f"Directive({self.name!r}, {self.args!r}, {self.start}, {self.end})"
+
+def tokenize(text: str) -> Iterator[Tuple[str, int, bool]]:
+    """将配置文本切分为(词, 行下标, 是否带引号)，跳过注释"""
+    line = 0
+    i = 0
+    length = len(text)
+    while i < length:
+        char = text[i]
+        if char == '\n':
+            line += 1
+            i += 1
+        elif char.isspace():
+            i += 1
+        elif char == '#':
+            while i < length and text[i] != '\n':
+                i += 1
+        elif char in '{};':
+            yield char, line, False
+            i += 1
+        elif char in '"\'':
+            start_line = line
+            quote = char
+            i += 1
+            value = []
+            while i < length and text[i] != quote:
+                if text[i] == '\\' and i + 1 < length:
+                    value.append(text[i:i + 2])
+                    i += 2
+                    continue
+                if text[i] == '\n':
+                    line += 1
+                value.append(text[i])
+                i += 1
+            i += 1
+            yield ''.join(value), start_line, True
+        else:
+            start = i
+            while i < length and not text[i].isspace() and text[i] not in ';{}':
+                # ${var}形式的变量中的大括号不是块
+                if text[i] == '$' and i + 1 < length and text[i + 1] == '{':
+                    close = text.find('}', i)
+                    i = close + 1 if close != -1 else length
+                    continue
+                i += 1
+            yield text[start:i], line, False
+
+def parse(text: str) -> List[Directive]:
+    """解析配置文本，返回顶层指令列表"""
+    root: List[Directive] = []
+    stack: List[Tuple[Directive, List[Directive]]] = []
+    current = root
+    words: List[str] = []
+    words_line = 0
+    
+    for token, line, quoted in tokenize(text):
+        if not quoted and token == ';':
+            if not words:
+                continue
+            current.append(Directive(words[0], words[1:], words_line, line))
+            words = []
+        elif not quoted and token == '{':
+            if not words:
+                raise ConfigParseError("缺少指令名的 {", line)
+            directive = Directive(words[0], words[1:], words_line, line, [])
+            current.append(directive)
+            stack.append((directive, current))
+            current = directive.block
+            words = []
+        elif not quoted and token == '}':
+            if words:
+                raise ConfigParseError(f"指令 {words[0]} 缺少分号", line)
+            if not stack:
+                raise ConfigParseError("多余的 }", line)
+            directive, current = stack.pop()
+            directive.end = line
+        else:
+            if not words:
+                words_line = line
+            words.append(token)
+    
+    if words:
+        raise ConfigParseError(f"指令 {words[0]} 缺少分号", words_line)
+    if stack:
+        raise ConfigParseError(f"{stack[-1][0].name} 块缺少 }}", stack[-1][0].start)
+    return root
+
+def parse_lines(lines: List[str]) -> List[Directive]:
+    """解析readlines()得到的行列表"""
+    return parse(''.join(lines))
+
+def parse_file(path: str) -> List[Directive]:
+    """解析配置文件"""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        return parse(f.read())
+
+def walk(tree: List[Directive]) -> Iterator[Directive]:
+    """深度优先遍历所有指令"""
+    for directive in tree:
+        yield directive
+        if directive.block:
+            yield from walk(directive.block)
+
+def iter_servers(tree: List[Directive]) -> Iterator[Directive]:
+    """遍历所有server块（vhost文件中在顶层，nginx.conf中在http块内）"""
+    for directive in tree:
+        if directive.name == 'server' and directive.block is not None:
+            yield directive
+        elif directive.name == 'http' and directive.block is not None:
+            yield from iter_servers(directive.block)
+
+def parse_listen(args: List[str]) -> Tuple[str, int, List[str]]:
+    """解析listen参数，返回(地址, 端口, 其余标志)"""
+    if not args:
+        return "*", 80, []
+    address = args[0]
+    flags = args[1:]
+    if address.startswith('unix:'):
+        return address, 0, flags
+    host = "*"
+    port_str = address
+    if address.startswith('['):
+        host, _, rest = address[1:].partition(']')
+        host = f"[{host}]"
+        port_str = rest[1:] if rest.startswith(':') else "80"
+    elif ':' in address:
+        host, port_str = address.rsplit(':', 1)
+    elif not address.isdigit():
+        host, port_str = address, "80"
+    try:
+        port = int(port_str)
+    except ValueError:
+        port = 80
+    return host, port, flags
+
+def listens(server: Directive) -> List[Tuple[str, int, List[str]]]:
+    """返回server块所有listen的(地址, 端口, 标志)"""
+    return [parse_listen(listen.args) for listen in server.children('listen')]
+
+def is_ssl_server(server: Directive) -> bool:
+    """判断server块是否为TLS server（任意listen带ssl标志，或旧式ssl on）"""
+    for _, _, flags in listens(server):
+        if 'ssl' in flags:
+            return True
+    ssl = server.first('ssl')
+    return bool(ssl and ssl.args and ssl.args[0] == 'on')
+
+def find_ssl_servers(tree: List[Directive]) -> List[Directive]:
+    """返回所有TLS server块"""
+    return [server for server in iter_servers(tree) if is_ssl_server(server)]
+
+def server_names(server: Directive) -> List[str]:
+    """返回server块的全部server_name"""
+    names = []
+    for directive in server.children('server_name'):
+        for name in directive.args:
+            if name not in names:
+                names.append(name)
+    return names
+
+def vhost_files(vhost_dir: str = "/usr/local/nginx/conf/vhost") -> List[str]:
+    """列出vhost目录下的配置文件"""
+    if not os.path.isdir(vhost_dir):
+        return []
+    return sorted(os.path.join(vhost_dir, name) for name in os.listdir(vhost_dir) if name.endswith('.conf'))
@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+"""
+静态资源预压缩工具
+并行、增量地为静态站点生成.gz/.br文件，并为站点开启gzip_static（nginx带brotli模块时同时开启brotli_static）
+"""
+
+import sys
+import os
+import re
+import json
+import gzip
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple, Optional
+
+from nginx_conf import ConfigParseError, Directive, iter_servers, parse_lines, walk
+from profiling import enable_profiling, timed
+from reload_coordinator import nginx_binary
+from snapshot_store import snapshot_files
+
+# 可压缩的文本类资源（图片、视频、字体等本身已压缩，不处理）
+COMPRESSIBLE_EXTENSIONS = (
+    ".html", ".htm", ".css", ".js", ".mjs", ".json", ".xml", ".svg",
+    ".txt", ".map", ".wasm", ".ico", ".md", ".csv", ".webmanifest",
+)
+
+GZIP_TYPES = (
+    "text/plain text/css text/xml application/javascript application/json "
+    "application/xml application/wasm image/svg+xml image/x-icon application/manifest+json"
+)
+
+MIN_SIZE = 1024
+NGINX_CONF = "/usr/local/nginx/conf/nginx.conf"
+
+def brotli_module_available(nginx_conf: str = NGINX_CONF) -> bool:
+    """nginx静态编译了ngx_brotli，或在nginx.conf中加载了brotli_static动态模块"""
+    nginx_bin = nginx_binary()
+    if nginx_bin:
+        try:
+            result = subprocess.run([nginx_bin, '-V'], capture_output=True, text=True, timeout=10)
+            if re.search(r'--add-module=\S*brotli', result.stderr):
+                return True
+        except (OSError, subprocess.SubprocessError):
+            pass
+    try:
+        with open(nginx_conf, 'r', encoding='utf-8') as f:
+            return re.search(r'^\s*load_module\s+\S*brotli_static\S*\s*;', f.read(), re.M) is not None
+    except OSError:
+        return False
+
+def compress_file(path: str, use_brotli: bool) -> Tuple[str, int, int, bool]:
+    """压缩单个文件（在子进程中执行），返回(路径, 原始大小, 压缩后大小, 是否保留了压缩文件)"""
+    stat = os.stat(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    
+    compressed_size = 0
+    gz_path = f"{path}.gz"
+    tmp_path = f"{gz_path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=9, mtime=int(stat.st_mtime)) as gz:
+            gz.write(data)
+    compressed_size = os.path.getsize(tmp_path)
+    
+    # 压缩收益不足5%时不保留压缩文件
+    if compressed_size >= stat.st_size * 0.95:
+        os.remove(tmp_path)
+        for old in (gz_path, f"{path}.br"):
+            if os.path.exists(old):
+                os.remove(old)
+        return path, stat.st_size, stat.st_size, False
+    
+    os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(tmp_path, gz_path)
+    
+    br_path = f"{path}.br"
+    if use_brotli:
+        result = subprocess.run(['brotli', '-f', '-q', '11', '-o', br_path, path],
+                                capture_output=True, timeout=300)
+        if result.returncode == 0:
+            os.utime(br_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    elif os.path.exists(br_path):
+        # nginx不会提供.br文件时不再保留（也避免以后开启brotli_static时提供过期内容）
+        os.remove(br_path)
+    
+    return path, stat.st_size, compressed_size, True
+
+def is_up_to_date(root: str, relpath: str, entry: Optional[List[int]], signature: List[int],
+                  use_brotli: bool = False) -> bool:
+    """文件自上次运行以来未变化：压缩收益不足而跳过的文件不要求存在.gz/.br（旧版状态没有第3项）"""
+    if not entry or entry[:2] != signature:
+        return False
+    if len(entry) > 2 and not entry[2]:
+        return True
+    suffixes = (".gz", ".br") if use_brotli else (".gz",)
+    return all(os.path.exists(os.path.join(root, f"{relpath}{suffix}")) for suffix in suffixes)
+
+class StaticPrecompressor:
+    def __init__(self, conf_file: str):
+        self.conf_file = conf_file
+        self.backup_file = f"{conf_file}.gzip.bak"
+        # 状态文件放在配置目录而不是站点目录，避免被当作静态文件对外提供
+        self.state_file = f"{conf_file}.precompress.json"
+        self.gzip_marker = "# 静态预压缩配置"
+        self.gzip_end_marker = "# 静态预压缩配置结束"
+        self.has_brotli_encoder = shutil.which('brotli') is not None
+        # 只有nginx能通过brotli_static提供.br文件时才生成
+        self.use_brotli = self.has_brotli_encoder and brotli_module_available()
+    
+    @timed("backup")
+    def backup_config(self) -> bool:
+        """备份配置文件"""
+        try:
+            if os.path.exists(self.conf_file):
+                with open(self.conf_file, 'r', encoding='utf-8') as src:
+                    with open(self.backup_file, 'w', encoding='utf-8') as dst:
+                        dst.write(src.read())
+                snapshot_files([self.conf_file], "precompress")
+                return True
+        except Exception as e:
+            print(f"备份配置文件失败: {e}", file=sys.stderr)
+        return False
+    
+    def restore_config(self) -> bool:
+        """恢复配置文件"""
+        try:
+            if os.path.exists(self.backup_file):
+                with open(self.backup_file, 'r', encoding='utf-8') as src:
+                    with open(self.conf_file, 'w', encoding='utf-8') as dst:
+                        dst.write(src.read())
+                return True
+        except Exception as e:
+            print(f"恢复配置文件失败: {e}", file=sys.stderr)
+        return False
+    
+    @timed("read", lines="read")
+    def read_config(self) -> List[str]:
+        """读取配置文件"""
+        try:
+            with open(self.conf_file, 'r', encoding='utf-8') as f:
+                return f.readlines()
+        except Exception as e:
+            print(f"读取配置文件失败: {e}", file=sys.stderr)
+            return []
+    
+    @timed("write", lines="write")
+    def write_config(self, lines: List[str]) -> bool:
+        """写入配置文件"""
+        try:
+            with open(self.conf_file, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+            return True
+        except Exception as e:
+            print(f"写入配置文件失败: {e}", file=sys.stderr)
+            return False
+    
+    def server_root(self, server: Directive) -> Optional[Directive]:
+        """server块的root指令，server级别没有时取location中的第一个"""
+        directive = server.first('root')
+        if directive is None:
+            directive = next((child for child in walk(server.block or []) if child.name == 'root'), None)
+        return directive if directive and directive.args else None
+    
+    def find_site_roots(self, lines: List[str]) -> List[str]:
+        """按解析后的配置树查找各server块的root目录"""
+        try:
+            tree = parse_lines(lines)
+        except ConfigParseError as e:
+            print(f"解析配置文件失败: {e}", file=sys.stderr)
+            return []
+        roots = []
+        for server in iter_servers(tree):
+            directive = self.server_root(server)
+            if directive and directive.args[0] not in roots:
+                roots.append(directive.args[0])
+        return roots
+    
+    def load_state(self) -> Dict[str, Dict[str, List[int]]]:
+        """读取上次运行记录的{root: {相对路径: [mtime_ns, 大小, 是否保留.gz]}}"""
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if 'roots' in state:
+            return state['roots']
+        if state.get('root'):
+            return {state['root']: state.get('files', {})}
+        return {}
+    
+    def save_state(self, state: Dict[str, Dict[str, List[int]]]) -> None:
+        """保存压缩状态"""
+        tmp_path = f"{self.state_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'roots': state}, f)
+        os.replace(tmp_path, self.state_file)
+    
+    def scan_files(self, root: str) -> Dict[str, List[int]]:
+        """遍历站点目录，返回可压缩文件的{相对路径: [mtime_ns, size]}"""
+        files = {}
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                if not filename.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if stat.st_size < MIN_SIZE:
+                    continue
+                files[os.path.relpath(path, root)] = [stat.st_mtime_ns, stat.st_size]
+        return files
+    
+    def precompress(self, workers: Optional[int] = None) -> bool:
+        """并行预压缩站点静态资源，跳过自上次运行以来未变化的文件"""
+        lines = self.read_config()
+        if not lines:
+            return False
+        
+        roots = [root for root in self.find_site_roots(lines) if os.path.isdir(root)]
+        if not roots:
+            print("未找到站点root目录，预压缩只适用于静态站点", file=sys.stderr)
+            return False
+        
+        previous = self.load_state()
+        state: Dict[str, Dict[str, List[int]]] = {}
+        pending: List[Tuple[str, str]] = []
+        total = 0
+        removed = 0
+        for root in roots:
+            print(f"正在扫描静态资源目录: {root}")
+            root_state = previous.get(root, {})
+            current = self.scan_files(root)
+            total += len(current)
+            state[root] = {}
+            for relpath, signature in current.items():
+                if is_up_to_date(root, relpath, root_state.get(relpath), signature, self.use_brotli):
+                    state[root][relpath] = root_state[relpath]
+                else:
+                    pending.append((root, relpath))
+                    state[root][relpath] = signature
+            
+            # 源文件已删除时清理遗留的压缩文件
+            for relpath in set(root_state) - set(current):
+                for suffix in (".gz", ".br"):
+                    stale = os.path.join(root, relpath + suffix)
+                    if os.path.exists(stale):
+                        os.remove(stale)
+                        removed += 1
+        
+        print(f"共 {total} 个可压缩文件，需要压缩 {len(pending)} 个，"
+              f"跳过未变化 {total - len(pending)} 个")
+        if self.use_brotli:
+            print("检测到brotli编码器和nginx brotli模块，将同时生成.br文件")
+        elif self.has_brotli_encoder:
+            print("nginx未加载brotli模块，不生成.br文件")
+        
+        original_total = 0
+        compressed_total = 0
+        failed = 0
+        if pending:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(compress_file, os.path.join(root, relpath), self.use_brotli)
+                           for root, relpath in pending]
+                for (root, relpath), future in zip(pending, futures):
+                    try:
+                        _, original, compressed, kept = future.result()
+                        original_total += original
+                        compressed_total += compressed
+                        # 收益不足未生成.gz的文件也记录下来，下次不再重复压缩
+                        state[root][relpath] = state[root][relpath][:2] + [1 if kept else 0]
+                    except Exception as e:
+                        print(f"压缩失败 {relpath}: {e}", file=sys.stderr)
+                        state[root].pop(relpath, None)
+                        failed += 1
+        
+        self.save_state(state)
+        if original_total:
+            print(f"本次压缩 {original_total / 1024:.1f} KB -> {compressed_total / 1024:.1f} KB"
+                  f"（{compressed_total * 100 / original_total:.1f}%）")
+        if removed:
+            print(f"已清理 {removed} 个过期的压缩文件")
+        print("预压缩完成" if not failed else f"预压缩完成，{failed} 个文件失败")
+        return failed == 0
+    
+    def generate_gzip_config(self, indent: str, server: Directive) -> str:
+        """生成gzip_static配置，server块中已设置的gzip相关指令不再重复添加"""
+        directives = [
+            ("gzip_static", "on"),
+            ("gzip", "on"),
+            ("gzip_vary", "on"),
+            ("gzip_comp_level", "5"),
+            ("gzip_min_length", str(MIN_SIZE)),
+            ("gzip_types", GZIP_TYPES),
+        ]
+        if self.use_brotli:
+            directives.insert(1, ("brotli_static", "on"))
+        config_lines = [f"{indent}{self.gzip_marker}"]
+        for name, value in directives:
+            if server.first(name) is None:
+                config_lines.append(f"{indent}{name} {value};")
+        config_lines.append(f"{indent}{self.gzip_end_marker}")
+        return "\n".join(config_lines) + "\n"
+    
+    def remove_gzip_internal(self, lines: List[str]) -> List[str]:
+        """内部方法：从lines中删除gzip_static配置"""
+        new_lines = []
+        in_config = False
+        for line in lines:
+            if line.strip() == self.gzip_marker:
+                in_config = True
+                continue
+            if in_config:
+                if line.strip() == self.gzip_end_marker:
+                    in_config = False
+                continue
+            new_lines.append(line)
+        return new_lines
+    
+    def enable_gzip_static(self) -> bool:
+        """为站点中所有带root的server块开启gzip_static（每个server块一份，放在server级别）"""
+        print("正在开启gzip_static...")
+        
+        # 备份配置文件
+        if not self.backup_config():
+            return False
+        
+        lines = self.read_config()
+        if not lines:
+            return False
+        
+        if any(line.strip() == self.gzip_marker for line in lines):
+            print("检测到已存在的gzip_static配置，将先删除再添加")
+            lines = self.remove_gzip_internal(lines)
+        
+        try:
+            servers = list(iter_servers(parse_lines(lines)))
+        except ConfigParseError as e:
+            print(f"解析配置文件失败: {e}", file=sys.stderr)
+            return False
+        
+        # server级别的root之后插入；root只在location中时插入到server_name之后
+        inserts: Dict[int, str] = {}
+        for server in servers:
+            if self.server_root(server) is None:
+                continue
+            anchor = server.first('root') or server.first('server_name')
+            if anchor is None:
+                anchor = server
+            if anchor.end >= server.end:
+                print(f"第{server.start + 1}行的server块写在同一行，请手动添加gzip_static", file=sys.stderr)
+                continue
+            if anchor is server:
+                inserts[server.start] = self.generate_gzip_config("    ", server)
+                continue
+            line = lines[anchor.start]
+            inserts[anchor.end] = self.generate_gzip_config(line[:len(line) - len(line.lstrip())], server)
+        applied = len(inserts)
+        
+        new_lines = []
+        for i, line in enumerate(lines):
+            new_lines.append(line)
+            if i in inserts:
+                new_lines.append(inserts[i])
+        
+        if applied == 0:
+            print("未找到root指令，gzip_static只适用于静态站点", file=sys.stderr)
+            return False
+        
+        # 写入配置文件
+        if self.write_config(new_lines):
+            print(f"gzip_static开启成功（{applied} 个server块）")
+            return True
+        else:
+            print("gzip_static开启失败，正在恢复备份...")
+            self.restore_config()
+            return False
+    
+    def disable_gzip_static(self) -> bool:
+        """关闭gzip_static"""
+        print("正在关闭gzip_static...")
+        
+        # 备份配置文件
+        if not self.backup_config():
+            return False
+        
+        lines = self.read_config()
+        if not lines:
+            return False
+        
+        if not any(line.strip() == self.gzip_marker for line in lines):
+            print("未找到gzip_static配置")
+            return True
+        
+        if self.write_config(self.remove_gzip_internal(lines)):
+            print("gzip_static已关闭")
+            return True
+        else:
+            print("gzip_static关闭失败，正在恢复备份...")
+            self.restore_config()
+            return False
+    
+    def check_status(self) -> bool:
+        """检查gzip_static和预压缩状态"""
+        lines = self.read_config()
+        if not lines:
+            return False
+        
+        enabled = any(line.strip() == self.gzip_marker for line in lines)
+        print(f"gzip_static: {'已开启' if enabled else '未开启'}")
+        
+        state = self.load_state()
+        for root in self.find_site_roots(lines):
+            if not os.path.isdir(root):
+                continue
+            root_state = state.get(root, {})
+            current = self.scan_files(root)
+            outdated = sum(1 for relpath, signature in current.items()
+                           if not is_up_to_date(root, relpath, root_state.get(relpath), signature, self.use_brotli))
+            skipped = sum(1 for relpath, signature in current.items()
+                          if len(root_state.get(relpath, [])) > 2 and not root_state[relpath][2])
+            print(f"站点目录: {root}")
+            print(f"可压缩文件 {len(current)} 个，已处理 {len(current) - outdated} 个"
+                  f"（其中 {skipped} 个压缩收益不足未生成.gz），待更新 {outdated} 个")
+        return enabled
+    
+    @timed("nginx_test")
+    def validate_config(self) -> bool:
+        """验证nginx配置语法"""
+        try:
+            result = subprocess.run(['nginx', '-t'],
+                                  capture_output=True,
+                                  text=True,
+                                  timeout=10)
+            if result.returncode == 0:
+                print("nginx配置语法验证通过")
+                return True
+            else:
+                print("nginx配置语法错误:")
+                print(result.stderr)
+                return False
+        except Exception as e:
+            print(f"无法验证nginx配置: {e}")
+            return False
+
+def main():
+    enable_profiling("precompress", action_index=2)
+    if len(sys.argv) < 3:
+        print("用法: precompress.py <conf_file> <action> [workers]")
+        print("actions: compress, enable, disable, status, validate")
+        sys.exit(1)
+    
+    conf_file = sys.argv[1]
+    action = sys.argv[2]
+    
+    if not os.path.exists(conf_file):
+        print(f"配置文件不存在: {conf_file}", file=sys.stderr)
+        sys.exit(1)
+    
+    manager = StaticPrecompressor(conf_file)
+    
+    if action == "compress":
+        workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+        success = manager.precompress(workers)
+        sys.exit(0 if success else 1)
+    
+    elif action == "enable":
+        success = manager.enable_gzip_static()
+        if success:
+            manager.validate_config()
+        sys.exit(0 if success else 1)
+    
+    elif action == "disable":
+        success = manager.disable_gzip_static()
+        if success:
+            manager.validate_config()
+        sys.exit(0 if success else 1)
+    
+    elif action == "status":
+        manager.check_status()
+        sys.exit(0)
+    
+    elif action == "validate":
+        success = manager.validate_config()
+        sys.exit(0 if success else 1)
+    
+    else:
+        print(f"未知操作: {action}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+管理脚本的阶段计时与性能分析
+设置环境变量 NGINX_MANAGER_PROFILE=1 或在命令行加 --profile 后，脚本结束时向stderr输出一行JSON：
+各阶段（读取、解析、去重修复、写入、nginx -t 等）的耗时、CPU时间，以及读写的文件数和行数。
+--profile-dump=<文件>（或 NGINX_MANAGER_PROFILE_DUMP）额外保存整次运行的cProfile结果；
+NGINX_MANAGER_PROFILE_LOG=<文件> 时同时追加到该文件，可用 summarize 汇总多次运行
+"""
+
+import sys
+import os
+import json
+import time
+import atexit
+import functools
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+ENV_ENABLE = "NGINX_MANAGER_PROFILE"
+ENV_DUMP = "NGINX_MANAGER_PROFILE_DUMP"
+ENV_LOG = "NGINX_MANAGER_PROFILE_LOG"
+
+class PhaseRecorder:
+    def __init__(self):
+        self.enabled = False
+        self.tool = ""
+        self.action = ""
+        self.phases: Dict[str, Dict[str, float]] = {}
+        self.counts: Dict[str, int] = {}
+        self.started_wall = 0.0
+        self.started_cpu = 0.0
+        self.profiler = None
+        self.dump_file: Optional[str] = None
+        self.log_file: Optional[str] = None
+        # 阶段嵌套时只统计最外层，避免重复计时
+        self.depth = 0
+    
+    def add(self, name: str, wall: float, cpu: float) -> None:
+        phase = self.phases.setdefault(name, {'calls': 0, 'wall_ms': 0.0, 'cpu_ms': 0.0})
+        phase['calls'] += 1
+        phase['wall_ms'] += wall * 1000
+        phase['cpu_ms'] += cpu * 1000
+    
+    def record(self) -> Dict[str, object]:
+        """生成本次运行的记录"""
+        return {
+            'tool': self.tool,
+            'action': self.action,
+            'time': int(time.time()),
+            'total_wall_ms': round((time.perf_counter() - self.started_wall) * 1000, 2),
+            'total_cpu_ms': round((time.process_time() - self.started_cpu) * 1000, 2),
+            'phases': {name: {'calls': int(phase['calls']), 'wall_ms': round(phase['wall_ms'], 2),
+                              'cpu_ms': round(phase['cpu_ms'], 2)}
+                       for name, phase in self.phases.items()},
+            'counts': self.counts,
+        }
+    
+    def finish(self) -> None:
+        """进程退出时输出记录（atexit回调）"""
+        if self.profiler is not None:
+            self.profiler.disable()
+            try:
+                self.profiler.dump_stats(self.dump_file)
+            except OSError as e:
+                print(f"保存cProfile结果失败: {e}", file=sys.stderr)
+        line = json.dumps(self.record(), ensure_ascii=False)
+        print(line, file=sys.stderr)
+        if self.log_file:
+            try:
+                with open(self.log_file, 'a', encoding='utf-8') as f:
+                    f.write(line + "\n")
+            except OSError:
+                pass
+
+RECORDER = PhaseRecorder()
+
+def enable_profiling(tool: str, action_index: int = 1) -> bool:
+    """
+    在main()开头调用：去掉命令行中的 --profile/--profile-dump 参数（不影响原有参数解析），
+    按参数或环境变量启用计时，返回是否启用
+    """
+    enabled = os.environ.get(ENV_ENABLE, "") not in ("", "0")
+    dump_file = os.environ.get(ENV_DUMP) or None
+    args = []
+    for arg in sys.argv[1:]:
+        if arg == "--profile":
+            enabled = True
+        elif arg.startswith("--profile-dump="):
+            dump_file = arg.split("=", 1)[1]
+        else:
+            args.append(arg)
+    sys.argv[1:] = args
+    if dump_file:
+        enabled = True
+    if not enabled:
+        return False
+    
+    RECORDER.enabled = True
+    RECORDER.tool = tool
+    RECORDER.action = sys.argv[action_index] if len(sys.argv) > action_index else ""
+    RECORDER.log_file = os.environ.get(ENV_LOG) or None
+    RECORDER.started_wall = time.perf_counter()
+    RECORDER.started_cpu = time.process_time()
+    if dump_file:
+        import cProfile
+        RECORDER.dump_file = dump_file
+        RECORDER.profiler = cProfile.Profile()
+        RECORDER.profiler.enable()
+    atexit.register(RECORDER.finish)
+    return True
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """统计一个阶段的耗时（未启用时不做任何事）"""
+    if not RECORDER.enabled or RECORDER.depth:
+        yield
+        return
+    RECORDER.depth += 1
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield
+    finally:
+        RECORDER.depth -= 1
+        RECORDER.add(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+def count(name: str, value: int = 1) -> None:
+    """累加计数（文件数、行数等）"""
+    if RECORDER.enabled:
+        RECORDER.counts[name] = RECORDER.counts.get(name, 0) + value
+
+def timed(name: str, lines: Optional[str] = None) -> Callable:
+    """
+    方法计时装饰器
+    lines="read" 时把返回的行列表计入读取的文件数/行数，lines="write" 时把第一个参数计入写入的文件数/行数
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not RECORDER.enabled:
+                return func(*args, **kwargs)
+            with phase(name):
+                result = func(*args, **kwargs)
+            if lines == "read" and isinstance(result, list):
+                count("files_read")
+                count("lines_read", len(result))
+            elif lines == "write" and len(args) > 1 and isinstance(args[1], list):
+                count("files_written")
+                count("lines_written", len(args[1]))
+            return result
+        return wrapper
+    return decorator
+
+def percentile(values: List[float], ratio: float) -> float:
+    """取分位数（最近秩）"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+def summarize(lines: Iterator[str]) -> Dict[str, Dict[str, object]]:
+    """按 工具+操作 汇总多次运行的记录"""
+    groups: Dict[str, Dict[str, object]] = {}
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(record, dict) or 'phases' not in record:
+            continue
+        key = f"{record.get('tool', '-')} {record.get('action', '')}".strip()
+        group = groups.setdefault(key, {'runs': 0, 'total': [], 'phases': {}})
+        group['runs'] += 1
+        group['total'].append(record.get('total_wall_ms', 0.0))
+        for name, phase_data in record['phases'].items():
+            group['phases'].setdefault(name, []).append(phase_data.get('wall_ms', 0.0))
+    return groups
+
+def print_summary(groups: Dict[str, Dict[str, object]]) -> None:
+    """输出汇总表（毫秒）"""
+    if not groups:
+        print("没有可汇总的记录")
+        return
+    for key, group in sorted(groups.items()):
+        total = group['total']
+        print(f"{key}（{group['runs']} 次运行，总耗时 p50 {percentile(total, 0.5):.1f}ms，"
+              f"p95 {percentile(total, 0.95):.1f}ms）")
+        print(f"  {'阶段':<18} {'次数':<6} {'平均':<10} {'p50':<10} {'p95':<10} {'最大':<10}")
+        for name, values in sorted(group['phases'].items(), key=lambda item: -sum(item[1])):
+            print(f"  {name:<18} {len(values):<6} {sum(values) / len(values):<10.1f} "
+                  f"{percentile(values, 0.5):<10.1f} {percentile(values, 0.95):<10.1f} {max(values):<10.1f}")
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] != "summarize":
+        print("用法: profiling.py summarize [记录文件...]（不指定文件时从标准输入读取）")
+        sys.exit(1)
+    
+    files = sys.argv[2:]
+    if files:
+        lines: List[str] = []
+        for path in files:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    lines.extend(f)
+            except OSError as e:
+                print(f"读取 {path} 失败: {e}", file=sys.stderr)
+        print_summary(summarize(iter(lines)))
+    else:
+        print_summary(summarize(sys.stdin))
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Prometheus textfile导出
+定时运行（cron每分钟一次），按记录的偏移量只解析各站点日志新增的部分，累加计数后
+原子写入node_exporter textfile目录下的.prom文件：请求数、字节数、状态码分类、429次数、
+请求耗时直方图，以及每站点有上限的路由请求数（防止URL数量暴增导致标签基数失控）
+"""
+
+import sys
+import os
+import json
+import time
+import fcntl
+from typing import Dict, List, Tuple
+
+from log_engine import iter_new_lines, normalize_route, parse_line, request_times, site_access_logs
+
+VHOST_DIR = "/usr/local/nginx/conf/vhost"
+STATE_FILE = "/usr/local/nginx/logs/.prom-exporter-state.json"
+TEXTFILE = "/var/lib/node_exporter/textfile_collector/nginx_sites.prom"
+CRON_FILE = "/etc/cron.d/nginx-prom-exporter"
+
+# 请求耗时直方图的桶（秒）
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+# 标签基数上限：站点数、每站点路由数，超出部分计入 _other
+MAX_SITES = 500
+MAX_ROUTES = 20
+STATUS_CLASSES = ["1xx", "2xx", "3xx", "4xx", "5xx"]
+
+def escape_label(value: str) -> str:
+    """转义Prometheus标签值"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def new_site_counters() -> Dict[str, object]:
+    """站点的累计计数"""
+    return {
+        'requests': 0,
+        'bytes': 0,
+        'status': {status_class: 0 for status_class in STATUS_CLASSES},
+        'rate_limited': 0,
+        'latency_buckets': [0] * len(LATENCY_BUCKETS),
+        'latency_sum': 0.0,
+        'latency_count': 0,
+        'routes': {},
+        'parse_errors': 0,
+    }
+
+class PromExporter:
+    def __init__(self, vhost_dir: str = VHOST_DIR, state_file: str = STATE_FILE, textfile: str = TEXTFILE):
+        self.vhost_dir = vhost_dir
+        self.state_file = state_file
+        self.textfile = textfile
+        # offsets: 日志路径 -> {inode, offset}；sites: 站点 -> 累计计数（每次运行是新进程，计数需持久化）
+        self.state: Dict[str, Dict] = {'offsets': {}, 'sites': {}}
+        self.load_state()
+    
+    def load_state(self) -> None:
+        """读取持久化的日志偏移和累计计数"""
+        self.state = {'offsets': {}, 'sites': {}}
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                loaded = json.load(f)
+            self.state['offsets'] = loaded.get('offsets', {})
+            self.state['sites'] = loaded.get('sites', {})
+        except (OSError, ValueError, AttributeError):
+            pass
+    
+    def site_logs(self) -> List[Tuple[str, str]]:
+        """返回(站点, 日志路径)，同一日志文件只归属一个站点，避免重复计数"""
+        return site_access_logs(self.vhost_dir)
+    
+    def site_label(self, site: str) -> str:
+        """超过站点数上限的新站点计入 _other"""
+        sites = self.state['sites']
+        if site in sites or len(sites) < MAX_SITES:
+            return site
+        return "_other"
+    
+    def process_log(self, site: str, log_path: str, from_start: bool = False) -> int:
+        """解析日志新增部分并累加到站点计数，返回处理的行数"""
+        offsets = self.state['offsets']
+        position = offsets.get(log_path)
+        if position is None:
+            # 首次发现的日志默认从当前末尾开始计数，避免一次解析全部历史日志
+            position = {}
+            if not from_start:
+                try:
+                    stat = os.stat(log_path)
+                    position = {'inode': stat.st_ino, 'offset': stat.st_size}
+                except OSError:
+                    return 0
+            offsets[log_path] = position
+        
+        counters = self.state['sites'].setdefault(self.site_label(site), new_site_counters())
+        processed = 0
+        for line in iter_new_lines(log_path, position):
+            processed += 1
+            record = parse_line(line)
+            if record is None:
+                counters['parse_errors'] += 1
+                continue
+            counters['requests'] += 1
+            counters['bytes'] += record.body_bytes
+            status_class = f"{record.status // 100}xx"
+            if status_class in counters['status']:
+                counters['status'][status_class] += 1
+            if record.status == 429:
+                counters['rate_limited'] += 1
+            
+            request_time, _ = request_times(record.extra)
+            if request_time is not None:
+                counters['latency_sum'] += request_time
+                counters['latency_count'] += 1
+                for idx, bound in enumerate(LATENCY_BUCKETS):
+                    if request_time <= bound:
+                        counters['latency_buckets'][idx] += 1
+                        break
+            
+            routes = counters['routes']
+            route = normalize_route(record.path)
+            if route not in routes and len(routes) >= MAX_ROUTES:
+                route = "_other"
+            routes[route] = routes.get(route, 0) + 1
+        return processed
+    
+    def render(self, duration: float, lines: int) -> str:
+        """生成textfile内容"""
+        sites = self.state['sites']
+        output: List[str] = []
+        
+        def metric(name: str, metric_type: str, help_text: str) -> None:
+            output.append(f"# HELP {name} {help_text}")
+            output.append(f"# TYPE {name} {metric_type}")
+        
+        metric("nginx_site_requests_total", "counter", "Requests parsed from the site access log.")
+        for site, counters in sorted(sites.items()):
+            output.append(f'nginx_site_requests_total{{site="{escape_label(site)}"}} {counters["requests"]}')
+        metric("nginx_site_response_bytes_total", "counter", "Response body bytes sent.")
+        for site, counters in sorted(sites.items()):
+            output.append(f'nginx_site_response_bytes_total{{site="{escape_label(site)}"}} {counters["bytes"]}')
+        metric("nginx_site_responses_total", "counter", "Responses by status class.")
+        for site, counters in sorted(sites.items()):
+            for status_class in STATUS_CLASSES:
+                output.append(f'nginx_site_responses_total{{site="{escape_label(site)}",class="{status_class}"}} '
+                              f'{counters["status"][status_class]}')
+        metric("nginx_site_rate_limited_total", "counter", "Requests rejected with 429.")
+        for site, counters in sorted(sites.items()):
+            output.append(f'nginx_site_rate_limited_total{{site="{escape_label(site)}"}} {counters["rate_limited"]}')
+        metric("nginx_site_request_duration_seconds", "histogram",
+               "Request time from the rt= log field (only logs with timing fields).")
+        for site, counters in sorted(sites.items()):
+            label = escape_label(site)
+            cumulative = 0
+            for bound, bucket in zip(LATENCY_BUCKETS, counters['latency_buckets']):
+                cumulative += bucket
+                output.append(f'nginx_site_request_duration_seconds_bucket{{site="{label}",le="{bound}"}} {cumulative}')
+            output.append(f'nginx_site_request_duration_seconds_bucket{{site="{label}",le="+Inf"}} '
+                          f'{counters["latency_count"]}')
+            output.append(f'nginx_site_request_duration_seconds_sum{{site="{label}"}} {counters["latency_sum"]:.6f}')
+            output.append(f'nginx_site_request_duration_seconds_count{{site="{label}"}} {counters["latency_count"]}')
+        metric("nginx_site_route_requests_total", "counter",
+               f"Requests by normalized route (at most {MAX_ROUTES} routes per site, the rest as _other).")
+        for site, counters in sorted(sites.items()):
+            for route, value in sorted(counters['routes'].items()):
+                output.append(f'nginx_site_route_requests_total{{site="{escape_label(site)}",'
+                              f'route="{escape_label(route)}"}} {value}')
+        metric("nginx_site_log_parse_errors_total", "counter", "Log lines that could not be parsed.")
+        for site, counters in sorted(sites.items()):
+            output.append(f'nginx_site_log_parse_errors_total{{site="{escape_label(site)}"}} {counters["parse_errors"]}')
+        metric("nginx_exporter_last_run_timestamp_seconds", "gauge", "Time of the last exporter run.")
+        output.append(f"nginx_exporter_last_run_timestamp_seconds {int(time.time())}")
+        metric("nginx_exporter_run_duration_seconds", "gauge", "Duration of the last exporter run.")
+        output.append(f"nginx_exporter_run_duration_seconds {duration:.6f}")
+        metric("nginx_exporter_lines_processed", "gauge", "Log lines processed in the last run.")
+        output.append(f"nginx_exporter_lines_processed {lines}")
+        return "\n".join(output) + "\n"
+    
+    def write_atomic(self, path: str, content: str) -> None:
+        """写临时文件后rename，node_exporter不会读到写了一半的文件"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_file = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_file, path)
+    
+    def run(self, from_start: bool = False) -> Tuple[int, float]:
+        """执行一次导出，返回(处理行数, 耗时)"""
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        with open(f"{self.state_file}.lock", 'a') as lock:
+            # cron和手动运行同时执行时串行处理，在锁内重新读取状态，避免重复累加或覆盖对方的计数
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.load_state()
+            started = time.monotonic()
+            lines = 0
+            active = set()
+            for site, log_path in self.site_logs():
+                lines += self.process_log(site, log_path, from_start)
+                active.add(log_path)
+            # 已删除站点的日志不再跟踪偏移（计数保留，Prometheus计数器不能回退）
+            for log_path in [path for path in self.state['offsets'] if path not in active]:
+                del self.state['offsets'][log_path]
+            
+            duration = time.monotonic() - started
+            self.write_atomic(self.textfile, self.render(duration, lines))
+            self.write_atomic(self.state_file, json.dumps(self.state))
+        return lines, duration
+
+def install_cron(interval: int, textfile: str) -> bool:
+    """安装cron定时任务"""
+    script = os.path.abspath(__file__)
+    try:
+        with open(CRON_FILE, 'w', encoding='utf-8') as f:
+            f.write(f"*/{interval} * * * * root /usr/bin/env python3 {script} run --textfile={textfile} >/dev/null 2>&1\n")
+        os.chmod(CRON_FILE, 0o644)
+    except OSError as e:
+        print(f"写入定时任务失败: {e}")
+        return False
+    print(f"已安装定时任务: {CRON_FILE}（每 {interval} 分钟导出一次到 {textfile}）")
+    return True
+
+def main():
+    if len(sys.argv) < 2:
+        print("用法: prom-exporter.py <run|show|install-cron|remove-cron> [选项]")
+        print("  run [--textfile=路径] [--from-start]  - 导出一次（首次默认从日志末尾开始计数）")
+        print("  show [--textfile=路径]                - 查看上次导出的内容")
+        print("  install-cron [--interval=1]          - 安装cron定时导出")
+        print("  remove-cron                          - 删除定时任务")
+        sys.exit(1)
+    
+    action = sys.argv[1]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[2:] if arg.startswith("--") and "=" in arg)
+    textfile = options.get("textfile", TEXTFILE)
+    
+    if action == "run":
+        exporter = PromExporter(textfile=textfile)
+        lines, duration = exporter.run(from_start="--from-start" in sys.argv)
+        print(f"已导出 {len(exporter.state['sites'])} 个站点，本次解析 {lines} 行，耗时 {duration:.3f}s -> {textfile}")
+        sys.exit(0)
+    elif action == "show":
+        try:
+            with open(textfile, 'r', encoding='utf-8') as f:
+                print(f.read(), end="")
+        except OSError:
+            print(f"尚未导出: {textfile}")
+            sys.exit(1)
+        sys.exit(0)
+    elif action == "install-cron":
+        interval = options.get("interval", "1")
+        if not interval.isdigit() or not 1 <= int(interval) <= 59:
+            print("--interval 必须是1-59之间的分钟数")
+            sys.exit(1)
+        sys.exit(0 if install_cron(int(interval), textfile) else 1)
+    elif action == "remove-cron":
+        if os.path.exists(CRON_FILE):
+            os.remove(CRON_FILE)
+            print("已删除定时任务")
+        else:
+            print("未安装定时任务")
+        sys.exit(0)
+    else:
+        print(f"未知操作: {action}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
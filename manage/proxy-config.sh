@@ -21,6 +21,11 @@ auto_fix_nginx_config() {
     echo "正在检查并修复重复的server配置..."
     python3 "$script_dir/config-fix-utils.py" fix >/dev/null 2>&1
   fi
+  # 跨文件重复的server_name会涉及其他站点的配置，只报告，不自动修改
+  if [ -f "$script_dir/server_index.py" ] && ! python3 "$script_dir/server_index.py" conflicts >/dev/null 2>&1; then
+    python3 "$script_dir/server_index.py" conflicts || true
+    echo "如需处理请运行: python3 $script_dir/config-fix-utils.py fix-conflicts --dry-run 查看改动后再执行"
+  fi
   
   # 检查nginx是否安装
   if ! command -v nginx >/dev/null 2>&1; then
@@ -263,6 +268,15 @@ gentle_nginx_reload() {
       return 1
     fi
   else
+    # 交给重载协调器合并短时间内的多次修改，只做一次验证+平滑重载
+    script_dir="$(dirname "$0")"
+    if command -v python3 >/dev/null 2>&1 && [ -f "$script_dir/reload_coordinator.py" ]; then
+      if python3 "$script_dir/reload_coordinator.py" notify proxy-config; then
+        return 0
+      fi
+      return 1
+    fi
+    
     echo "正在重载nginx配置..."
     # 先测试配置
     if [ -x "$nginx_bin" ]; then
@@ -285,27 +299,9 @@ gentle_nginx_reload() {
       fi
     fi
     
-    echo "重载失败，尝试重启nginx..."
-    # 停止nginx
-    nginx -s quit 2>/dev/null || nginx -s stop 2>/dev/null || systemctl stop nginx 2>/dev/null || service nginx stop 2>/dev/null
-    sleep 3
-    # 如果还有进程，强制停止
-    if pgrep -x nginx >/dev/null 2>&1; then
-      echo "强制停止剩余的nginx进程..."
-      pkill -9 nginx 2>/dev/null || true
-      sleep 2
-    fi
-    # 清理PID文件
-    if [ -f "/usr/local/nginx/logs/nginx.pid" ]; then
-      rm -f /usr/local/nginx/logs/nginx.pid
-    fi
-    # 重新启动
-    if [ -x "$nginx_bin" ]; then
-      $nginx_bin
-    else
-      nginx
-    fi
-    echo "Nginx已重启。"
+    # 不强制重启正在运行的nginx，避免中断现有连接
+    echo "❌ 重载失败，当前运行的nginx保持原配置，请检查配置后重试。"
+    return 1
   fi
 }
 
@@ -323,6 +319,16 @@ function list_sites() {
 function list_sites_array() {
   site_list=()
   i=1
+  # 优先使用server索引（文件未变化时不重新解析），顺序与get_conf_by_index一致
+  script_dir="$(dirname "$0")"
+  if command -v python3 >/dev/null 2>&1 && [ -f "$script_dir/server_index.py" ] && ls $PROXY_CONF/*.conf >/dev/null 2>&1; then
+    while IFS='|' read -r server_name target_port conf; do
+      site_list+=("$server_name|$target_port|$conf")
+      printf "%2d. %-25s 目标端口: %-8s\n" "$i" "$server_name" "$target_port"
+      i=$((i+1))
+    done < <(python3 "$script_dir/server_index.py" sites $PROXY_CONF/*.conf 2>/dev/null)
+    [ ${#site_list[@]} -gt 0 ] && return 0
+  fi
   for conf in $PROXY_CONF/*.conf; do
     [ -e "$conf" ] || continue
     server_name=$(grep -m1 'server_name' "$conf" | awk '{print $2}' | sed 's/;//' | sed 's/(.*)//')
@@ -450,6 +456,11 @@ function add_proxy() {
   echo "5. 访问加密"
   echo "6. 防盗链设置"
   echo "7. 流量限制"
+  echo "8. 上游连接池（后端长连接）"
+  echo "9. 反向代理缓存"
+  echo "10. 静态资源预压缩（gzip_static）"
+  echo "11. TLS握手优化（会话复用/OCSP/HTTP2）"
+  echo "12. 站点独立访问日志（缓冲写入/日志轮转）"
   echo "0. 返回上一级"
   read -p "输入选项: " mode
   if [[ $mode == 0 ]]; then
@@ -771,18 +782,31 @@ EOF
     fi
     echo "1. 添加防盗链规则"
     echo "2. 删除防盗链规则"
-    echo "3. 返回上一级"
+    echo "3. 添加防盗链规则（共享白名单，适合大量来源域名）"
+    echo "4. 返回上一级"
     read -p "请选择操作: " hotlink_op
-    if [[ $hotlink_op == 1 ]]; then
+    if [[ $hotlink_op == 1 || $hotlink_op == 3 ]]; then
       read -p "请输入允许的域名（空格分隔，留空仅允许本站）: " allowed_domains
       if [ -n "$allowed_domains" ]; then
         referers="none blocked server_names $allowed_domains"
       else
         referers="none blocked server_names"
       fi
+      hotlink_action="add"
+      [[ $hotlink_op == 3 ]] && hotlink_action="add-map"
+      hotlink_opts=()
+      read -p "是否同时启用静态资源性能优化（浏览器缓存、文件句柄缓存、sendfile）？(y/N): " static_tuning
+      if [[ $static_tuning == "y" || $static_tuning == "Y" ]]; then
+        read -p "静态资源访问日志：1. 与站点日志相同  2. 关闭（默认1）: " static_log
+        if [[ $static_log == 2 ]]; then
+          hotlink_opts+=("--static-log=off")
+        else
+          hotlink_opts+=("--static")
+        fi
+      fi
       # 使用新的防盗链管理器
       script_dir="$(dirname "$0")"
-      if python3 "$script_dir/hotlink-manager.py" "$conf_file" "add" "$referers"; then
+      if python3 "$script_dir/hotlink-manager.py" "$conf_file" "$hotlink_action" "$referers" "${hotlink_opts[@]}"; then
         echo "✅ 防盗链规则添加成功"
       else
         echo "❌ 防盗链规则添加失败"
@@ -882,6 +906,252 @@ EOF
     fi
     auto_fix_nginx; gentle_nginx_reload; return
   fi
+  if [[ $mode == 8 ]]; then
+    # 上游连接池
+    idx=1
+    for conf in $PROXY_CONF/*.conf; do
+      [ -e "$conf" ] || continue
+      server_name=$(grep -m1 'server_name' "$conf" | awk '{print $2}' | sed 's/;//')
+      printf "%2d. %s\n" "$idx" "$server_name"
+      idx=$((idx+1))
+    done
+    read -p "请选择要设置上游连接池的站点序号: " site_idx
+    conf_file=$(get_conf_by_index "$site_idx")
+    if [ -z "$conf_file" ] || [ ! -f "$conf_file" ]; then
+      echo "无效序号。"; return
+    fi
+    echo "1. 启用上游连接池"
+    echo "2. 关闭上游连接池"
+    echo "3. 查看状态"
+    echo "4. 返回上一级"
+    read -p "请选择操作: " upstream_op
+    script_dir="$(dirname "$0")"
+    if [[ $upstream_op == 1 ]]; then
+      echo "后端列表格式: 地址:端口=权重，多个用逗号分隔（留空使用当前反代地址）"
+      read -p "请输入后端列表: " upstream_servers
+      read -p "每个worker保持的空闲长连接数（默认32）: " upstream_keepalive
+      if python3 "$script_dir/upstream-manager.py" "$conf_file" "add" "$upstream_servers" "${upstream_keepalive:-32}"; then
+        echo "✅ 上游连接池启用成功"
+      else
+        echo "❌ 上游连接池启用失败"
+        return 1
+      fi
+    elif [[ $upstream_op == 2 ]]; then
+      if python3 "$script_dir/upstream-manager.py" "$conf_file" "remove"; then
+        echo "✅ 上游连接池已关闭"
+      else
+        echo "❌ 上游连接池关闭失败"
+        return 1
+      fi
+    elif [[ $upstream_op == 3 ]]; then
+      python3 "$script_dir/upstream-manager.py" "$conf_file" "status"
+      return
+    else
+      echo "返回上一级。"; return
+    fi
+    auto_fix_nginx; gentle_nginx_reload; return
+  fi
+  if [[ $mode == 9 ]]; then
+    # 反向代理缓存
+    idx=1
+    for conf in $PROXY_CONF/*.conf; do
+      [ -e "$conf" ] || continue
+      server_name=$(grep -m1 'server_name' "$conf" | awk '{print $2}' | sed 's/;//')
+      printf "%2d. %s\n" "$idx" "$server_name"
+      idx=$((idx+1))
+    done
+    read -p "请选择要设置缓存的站点序号: " site_idx
+    conf_file=$(get_conf_by_index "$site_idx")
+    if [ -z "$conf_file" ] || [ ! -f "$conf_file" ]; then
+      echo "无效序号。"; return
+    fi
+    echo "1. 启用缓存"
+    echo "2. 关闭缓存"
+    echo "3. 查看缓存命中率"
+    echo "4. 返回上一级"
+    read -p "请选择操作: " cache_op
+    script_dir="$(dirname "$0")"
+    if [[ $cache_op == 1 ]]; then
+      echo "请选择缓存策略："
+      echo "1. 保守（200缓存1分钟）"
+      echo "2. 默认（200/301/302缓存10分钟）"
+      echo "3. 激进（200/301/302缓存1小时）"
+      read -p "请选择: " cache_policy
+      case $cache_policy in
+        1) cache_policy="conservative";;
+        3) cache_policy="aggressive";;
+        *) cache_policy="default";;
+      esac
+      read -p "磁盘缓存上限（如 1g、512m，默认1g）: " cache_max_size
+      read -p "平均缓存对象大小（如 64k，默认64k）: " cache_avg_object
+      if python3 "$script_dir/cache-manager.py" "$conf_file" "add" "$cache_policy" "${cache_max_size:-1g}" "${cache_avg_object:-64k}"; then
+        echo "✅ 反向代理缓存启用成功"
+      else
+        echo "❌ 反向代理缓存启用失败"
+        return 1
+      fi
+    elif [[ $cache_op == 2 ]]; then
+      if python3 "$script_dir/cache-manager.py" "$conf_file" "remove"; then
+        echo "✅ 反向代理缓存已关闭"
+      else
+        echo "❌ 反向代理缓存关闭失败"
+        return 1
+      fi
+    elif [[ $cache_op == 3 ]]; then
+      python3 "$script_dir/cache-manager.py" "$conf_file" "stats"
+      return
+    else
+      echo "返回上一级。"; return
+    fi
+    auto_fix_nginx; gentle_nginx_reload; return
+  fi
+  if [[ $mode == 10 ]]; then
+    # 静态资源预压缩
+    idx=1
+    for conf in $PROXY_CONF/*.conf; do
+      [ -e "$conf" ] || continue
+      server_name=$(grep -m1 'server_name' "$conf" | awk '{print $2}' | sed 's/;//')
+      printf "%2d. %s\n" "$idx" "$server_name"
+      idx=$((idx+1))
+    done
+    read -p "请选择静态站点序号: " site_idx
+    conf_file=$(get_conf_by_index "$site_idx")
+    if [ -z "$conf_file" ] || [ ! -f "$conf_file" ]; then
+      echo "无效序号。"; return
+    fi
+    echo "1. 预压缩静态资源并开启gzip_static"
+    echo "2. 仅重新预压缩（增量）"
+    echo "3. 关闭gzip_static"
+    echo "4. 查看状态"
+    echo "5. 返回上一级"
+    read -p "请选择操作: " gzip_op
+    script_dir="$(dirname "$0")"
+    if [[ $gzip_op == 1 ]]; then
+      if python3 "$script_dir/precompress.py" "$conf_file" "compress" && \
+         python3 "$script_dir/precompress.py" "$conf_file" "enable"; then
+        echo "✅ gzip_static开启成功"
+      else
+        echo "❌ gzip_static开启失败"
+        return 1
+      fi
+    elif [[ $gzip_op == 2 ]]; then
+      python3 "$script_dir/precompress.py" "$conf_file" "compress"
+      return
+    elif [[ $gzip_op == 3 ]]; then
+      if python3 "$script_dir/precompress.py" "$conf_file" "disable"; then
+        echo "✅ gzip_static已关闭"
+      else
+        echo "❌ gzip_static关闭失败"
+        return 1
+      fi
+    elif [[ $gzip_op == 4 ]]; then
+      python3 "$script_dir/precompress.py" "$conf_file" "status"
+      return
+    else
+      echo "返回上一级。"; return
+    fi
+    auto_fix_nginx; gentle_nginx_reload; return
+  fi
+  if [[ $mode == 11 ]]; then
+    # TLS握手优化
+    idx=1
+    for conf in $PROXY_CONF/*.conf; do
+      [ -e "$conf" ] || continue
+      server_name=$(grep -m1 'server_name' "$conf" | awk '{print $2}' | sed 's/;//')
+      printf "%2d. %s\n" "$idx" "$server_name"
+      idx=$((idx+1))
+    done
+    read -p "请选择站点序号（输入a表示全部HTTPS站点）: " site_idx
+    if [[ $site_idx == "a" || $site_idx == "A" ]]; then
+      conf_file="all"
+    else
+      conf_file=$(get_conf_by_index "$site_idx")
+      if [ -z "$conf_file" ] || [ ! -f "$conf_file" ]; then
+        echo "无效序号。"; return
+      fi
+    fi
+    echo "1. 启用TLS握手优化"
+    echo "2. 关闭TLS握手优化"
+    echo "3. 查看状态"
+    echo "4. 返回上一级"
+    read -p "请选择操作: " tls_op
+    script_dir="$(dirname "$0")"
+    if [[ $tls_op == 1 ]]; then
+      read -p "预计每天的独立客户端数（用于估算会话缓存，默认40000）: " tls_clients
+      if python3 "$script_dir/tls-manager.py" "$conf_file" "add" "${tls_clients:-40000}"; then
+        echo "✅ TLS握手优化已启用"
+      else
+        echo "❌ TLS握手优化启用失败"
+        return 1
+      fi
+    elif [[ $tls_op == 2 ]]; then
+      if python3 "$script_dir/tls-manager.py" "$conf_file" "remove"; then
+        echo "✅ TLS握手优化已关闭"
+      else
+        echo "❌ TLS握手优化关闭失败"
+        return 1
+      fi
+    elif [[ $tls_op == 3 ]]; then
+      python3 "$script_dir/tls-manager.py" "$conf_file" "status"
+      return
+    else
+      echo "返回上一级。"; return
+    fi
+    auto_fix_nginx; gentle_nginx_reload; return
+  fi
+  if [[ $mode == 12 ]]; then
+    # 站点独立访问日志
+    idx=1
+    for conf in $PROXY_CONF/*.conf; do
+      [ -e "$conf" ] || continue
+      server_name=$(grep -m1 'server_name' "$conf" | awk '{print $2}' | sed 's/;//')
+      printf "%2d. %s\n" "$idx" "$server_name"
+      idx=$((idx+1))
+    done
+    read -p "请选择站点序号（输入a表示全部站点）: " site_idx
+    if [[ $site_idx == "a" || $site_idx == "A" ]]; then
+      conf_file="all"
+    else
+      conf_file=$(get_conf_by_index "$site_idx")
+      if [ -z "$conf_file" ] || [ ! -f "$conf_file" ]; then
+        echo "无效序号。"; return
+      fi
+    fi
+    echo "1. 启用站点独立日志（缓冲写入）"
+    echo "2. 恢复原有日志设置"
+    echo "3. 立即轮转日志（USR1，不重载）"
+    echo "4. 查看状态"
+    echo "5. 返回上一级"
+    read -p "请选择操作: " log_op
+    script_dir="$(dirname "$0")"
+    if [[ $log_op == 1 ]]; then
+      read -p "缓冲区大小（默认64k）: " log_buffer
+      read -p "最长刷新间隔（默认5s）: " log_flush
+      read -p "gzip压缩级别1-9（留空不压缩）: " log_gzip
+      if python3 "$script_dir/access-log-manager.py" "$conf_file" "add" "${log_buffer:-64k}" "${log_flush:-5s}" $log_gzip; then
+        echo "✅ 站点独立日志已启用"
+      else
+        echo "❌ 站点独立日志启用失败"
+        return 1
+      fi
+    elif [[ $log_op == 2 ]]; then
+      if python3 "$script_dir/access-log-manager.py" "$conf_file" "remove"; then
+        echo "✅ 已恢复原有日志设置"
+      else
+        echo "❌ 恢复失败"
+        return 1
+      fi
+    elif [[ $log_op == 3 ]]; then
+      python3 "$script_dir/access-log-manager.py" "$conf_file" "rotate"
+      return
+    elif [[ $log_op == 4 ]]; then
+      python3 "$script_dir/access-log-manager.py" "$conf_file" "status"
+      return
+    else
+      echo "返回上一级。"; return
+    fi
+    auto_fix_nginx; gentle_nginx_reload; return
+  fi
   read -p "请输入本地监听端口: " listen_port
   case $mode in
     1)
@@ -1145,9 +1415,9 @@ function toggle_ssl() {
     echo "未找到该站点配置。"
     exit 1
   fi
-  if grep -q 'listen 443 ssl;' "$conf_file"; then
+  if grep -qE 'listen[[:space:]]+443[[:space:]]+ssl[^;]*;' "$conf_file"; then
     # 取消SSL
-    awk '/listen 443 ssl;/{flag=1} /server \/\/{if(flag){flag=0;next}} !flag' "$conf_file" > "$conf_file.tmp"
+    awk '/listen[[:space:]]+443[[:space:]]+ssl[^;]*;/{flag=1} /server \/\/{if(flag){flag=0;next}} !flag' "$conf_file" > "$conf_file.tmp"
     mv "$conf_file.tmp" "$conf_file"
     echo "已取消SSL(https)配置。"
     # 自动修复并重载nginx
@@ -10,6 +10,9 @@ import os
 import subprocess
 from typing import List, Tuple, Optional
 
+from profiling import enable_profiling, timed
+from snapshot_store import snapshot_files
+
 class RateLimitManager:
     def __init__(self, conf_file: str):
         self.conf_file = conf_file
@@ -17,6 +20,7 @@ class RateLimitManager:
         self.rate_limit_marker = "# 流量限制配置"
         self.nginx_main_conf = "/usr/local/nginx/conf/nginx.conf"
         
+    @timed("backup")
     def backup_config(self) -> bool:
         """备份配置文件"""
         try:
@@ -24,6 +28,7 @@ class RateLimitManager:
                 with open(self.conf_file, 'r', encoding='utf-8') as src:
                     with open(self.backup_file, 'w', encoding='utf-8') as dst:
                         dst.write(src.read())
+                snapshot_files([self.conf_file], "ratelimit")
                 return True
         except Exception as e:
             print(f"备份配置文件失败: {e}", file=sys.stderr)
@@ -41,6 +46,7 @@ class RateLimitManager:
             print(f"恢复配置文件失败: {e}", file=sys.stderr)
         return False
     
+    @timed("read", lines="read")
     def read_config(self) -> List[str]:
         """读取配置文件"""
         try:
@@ -50,6 +56,7 @@ class RateLimitManager:
             print(f"读取配置文件失败: {e}", file=sys.stderr)
             return []
     
+    @timed("write", lines="write")
     def write_config(self, lines: List[str]) -> bool:
         """写入配置文件"""
         try:
@@ -60,6 +67,7 @@ class RateLimitManager:
             print(f"写入配置文件失败: {e}", file=sys.stderr)
             return False
     
+    @timed("read", lines="read")
     def read_main_config(self) -> List[str]:
         """读取nginx主配置文件"""
         try:
@@ -69,6 +77,7 @@ class RateLimitManager:
             print(f"读取nginx主配置文件失败: {e}", file=sys.stderr)
             return []
     
+    @timed("write", lines="write")
     def write_main_config(self, lines: List[str]) -> bool:
         """写入nginx主配置文件"""
         try:
@@ -79,6 +88,7 @@ class RateLimitManager:
             print(f"写入nginx主配置文件失败: {e}", file=sys.stderr)
             return False
     
+    @timed("parse")
     def find_rate_limit_config(self, lines: List[str]) -> Optional[Tuple[int, int]]:
         """查找现有的流量限制配置"""
         start_line = None
@@ -350,6 +360,7 @@ class RateLimitManager:
             print("流量限制配置未启用")
             return False
     
+    @timed("fix_duplicates")
     def fix_duplicate_servers(self) -> bool:
         """修复重复的server配置"""
         print("正在检查并修复重复的server配置...")
@@ -407,7 +418,7 @@ class RateLimitManager:
                                 server_name = name_match.group(1).strip()
                         elif 'listen' in lines[j] and not server_port:
                             # 提取端口信息
-                            port_match = re.search(r'listen\s+(\d+)(?:\s+ssl)?;', lines[j])
+                            port_match = re.search(r'listen\s+(?:\S*:)?(\d+)[^;]*;', lines[j])
                             if port_match:
                                 server_port = port_match.group(1)
                         elif '{' in lines[j]:
@@ -443,6 +454,7 @@ class RateLimitManager:
             print(f"修复文件 {config_file} 时出错: {e}")
             return False
     
+    @timed("fix_duplicates")
     def fix_duplicate_directives(self) -> bool:
         """修复重复的nginx指令"""
         print("正在检查并修复重复的nginx指令...")
@@ -479,6 +491,7 @@ class RateLimitManager:
         
         return True
     
+    @timed("nginx_test")
     def validate_config(self) -> bool:
         """验证nginx配置语法"""
         try:
@@ -506,6 +519,7 @@ class RateLimitManager:
             return False
 
 def main():
+    enable_profiling("rate-limit-manager", action_index=2)
     if len(sys.argv) < 3:
         print("用法: rate-limit-manager.py <conf_file> <action> [req_limit] [conn_limit]")
         print("actions: add, remove, status, validate")
@@ -16,18 +16,44 @@ select redirect_type in \
   "仅根目录重定向" \
   "自定义 location 重定向" \
   "删除重定向" \
+  "批量URL重定向（规则表，适合大量旧URL）" \
   "退出"; do
   case $REPLY in
-    1|2|3|4|5|6) break;;
+    1|2|3|4|5|6|7) break;;
     *) echo "无效选项，请重新选择。";;
   esac
 done
 
-if [[ $REPLY == 6 ]]; then
+if [[ $REPLY == 7 ]]; then
   echo "已取消。"
   exit 0
 fi
 
+if [[ $REPLY == 6 ]]; then
+  # 大量重定向使用map规则表，不再逐条生成location块
+  redirect_map="python3 $(dirname "$0")/redirect-map.py"
+  PS3="请选择操作: "
+  select map_op in "从CSV导入" "添加规则" "删除规则" "查看规则" "应用规则表" "停用规则表" "查找耗时对比"; do
+    case $REPLY in
+      1) read -p "请输入CSV路径（源路径,目标[,状态码[,类型]]）: " csv_file
+         $redirect_map "$CONF_FILE" import "$csv_file" && $redirect_map "$CONF_FILE" apply;;
+      2) read -p "请输入源路径（/old/* 为前缀，~ 开头为正则）: " map_source
+         read -p "请输入目标: " map_target
+         read -p "状态码（默认301）: " map_code
+         $redirect_map "$CONF_FILE" add "$map_source" "$map_target" "${map_code:-301}" && $redirect_map "$CONF_FILE" apply;;
+      3) read -p "请输入要删除的源路径: " map_source
+         $redirect_map "$CONF_FILE" remove "$map_source" && $redirect_map "$CONF_FILE" apply;;
+      4) $redirect_map "$CONF_FILE" list;;
+      5) $redirect_map "$CONF_FILE" apply;;
+      6) $redirect_map "$CONF_FILE" disable;;
+      7) $redirect_map "$CONF_FILE" bench;;
+      *) echo "无效选项，请重新选择。"; continue;;
+    esac
+    break
+  done
+  exit 0
+fi
+
 # 选择作用端口
 PS3="请选择要设置重定向的端口: "
 select port_mode in \
@@ -0,0 +1,537 @@
+#!/usr/bin/env python3
+"""
+重定向规则表管理
+站点的重定向规则保存在数据文件中，编译为 map $uri 查找表：精确路径放在map的哈希表中，
+前缀和正则规则按优先级整理成尽量少的有序正则，server块中只需一个 if 判断。
+适合迁移大量旧URL，避免成千上万个 location 块拖慢配置加载和请求匹配
+"""
+
+import sys
+import os
+import re
+import csv
+import json
+import time
+import random
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+from nginx_conf import ConfigParseError, iter_servers, parse_lines
+from reload_coordinator import ReloadCoordinator
+from snapshot_store import snapshot_files
+
+NGINX_CONF = "/usr/local/nginx/conf/nginx.conf"
+REDIRECT_DIR = "/usr/local/nginx/conf/redirects"
+MAP_MARKER = "# 重定向规则表"
+MAP_END_MARKER = "# 重定向规则表结束"
+HASH_MARKER = "# 重定向规则表哈希大小"
+RULE_TYPES = ("exact", "prefix", "regex")
+CODES = (301, 302, 307, 308)
+# nginx默认的map哈希表大小，规则超过时需要在http块中调大
+DEFAULT_HASH_MAX_SIZE = 2048
+DEFAULT_HASH_BUCKET_SIZE = 64
+
+class Rule:
+    __slots__ = ('type', 'source', 'target', 'code')
+    
+    def __init__(self, rule_type: str, source: str, target: str, code: int = 301):
+        self.type = rule_type
+        self.source = source
+        self.target = target
+        self.code = code
+    
+    def to_dict(self) -> Dict[str, object]:
+        return {'type': self.type, 'source': self.source, 'target': self.target, 'code': self.code}
+    
+    def pattern(self) -> str:
+        """前缀规则转换为正则，剩余部分可在目标中用$1引用"""
+        if self.type == "prefix":
+            return f"^{re.escape(self.source)}(.*)$"
+        return self.source
+
+def split_source(source: str, rule_type: Optional[str] = None) -> Tuple[str, str]:
+    """
+    返回(规则类型, 源路径)。未指定类型时按源路径判断：~开头为正则，*结尾为前缀，其余为精确路径。
+    map匹配的$uri是解码并合并斜杠后的路径，精确和前缀源路径中的%编码按同样方式解码
+    """
+    source = source.strip()
+    if rule_type is None:
+        if source.startswith("~"):
+            rule_type = "regex"
+        elif source.endswith("*"):
+            rule_type = "prefix"
+        else:
+            rule_type = "exact"
+    if rule_type not in RULE_TYPES:
+        raise ValueError(f"未知的规则类型: {rule_type}")
+    if rule_type == "regex":
+        source = source.lstrip("~").strip()
+        if re.search(r'%[0-9A-Fa-f]{2}', source):
+            raise ValueError(f"正则匹配的是解码后的$uri，请把%编码写成原字符: {source}")
+        return rule_type, source
+    if rule_type == "prefix":
+        source = source.rstrip("*")
+    # 先检查查询参数，解码出的?（%3F）是路径的一部分
+    if "?" in source:
+        raise ValueError(f"$uri不含查询参数，无法按查询参数匹配: {source}")
+    try:
+        source = unquote(source, errors="strict")
+    except UnicodeDecodeError:
+        raise ValueError(f"%编码不是有效的UTF-8: {source}")
+    source = re.sub(r'/{2,}', '/', source)
+    if re.search(r'/\.\.?(/|$)', source):
+        raise ValueError(f"源路径不能包含.或..路径段（$uri中已被解析）: {source}")
+    return rule_type, source
+
+def make_rule(source: str, target: str, code: int = 301, rule_type: Optional[str] = None) -> Rule:
+    """
+    创建并校验规则，源路径的类型判断和规范化见split_source。
+    前缀规则的目标以*结尾时保留剩余路径（等同于$1）
+    """
+    target = target.strip()
+    rule_type, source = split_source(source, rule_type)
+    if rule_type == "prefix" and target.endswith("*"):
+        target = target[:-1] + "$1"
+    if code not in CODES:
+        raise ValueError(f"不支持的状态码: {code}")
+    forbidden = r'[\s;{}"]' if rule_type == "regex" else r'[\s;{}"\\]'
+    # 解码后的路径可以包含空格（map中的源路径带引号）
+    checked = source if rule_type == "regex" else source.replace(" ", "")
+    if not source or not target or re.search(forbidden, checked + target):
+        raise ValueError(f"无效的规则: {source} -> {target}")
+    if rule_type != "regex" and not source.startswith("/"):
+        raise ValueError(f"路径应以/开头: {source}")
+    if rule_type == "regex":
+        try:
+            re.compile(source)
+        except re.error as e:
+            raise ValueError(f"无效的正则 {source}: {e}")
+    # 目标中的$会被nginx当作变量，只允许引用正则捕获
+    if re.search(r'\$(?!\d)', target) or rule_type == "exact" and "$" in target:
+        raise ValueError(f"目标中不能包含变量: {target}")
+    return Rule(rule_type, source, target, code)
+
+def resolve(exact: Dict[str, Rule], ordered: List[Tuple['re.Pattern', Rule]], uri: str) -> Optional[Tuple[int, str]]:
+    """按map的查找顺序解析：先查精确路径的哈希表，再按顺序匹配正则"""
+    rule = exact.get(uri)
+    if rule is not None:
+        return rule.code, rule.target
+    for pattern, rule in ordered:
+        match = pattern.search(uri)
+        if match:
+            return rule.code, match.expand(rule.target.replace("$", "\\"))
+    return None
+
+class RedirectMap:
+    def __init__(self, conf_file: str, redirect_dir: str = REDIRECT_DIR, nginx_conf: str = NGINX_CONF):
+        self.conf_file = conf_file
+        self.nginx_conf = nginx_conf
+        name = os.path.basename(conf_file)
+        name = name[:-5] if name.endswith(".conf") else name
+        self.site_id = re.sub(r'[^A-Za-z0-9]', '_', name)
+        self.data_file = os.path.join(redirect_dir, f"{name}.json")
+        self.map_file = os.path.join(redirect_dir, f"{name}.map.conf")
+        self.server_file = os.path.join(redirect_dir, f"{name}.server.conf")
+        self.variable = f"$redirect_target_{self.site_id}"
+        self.rules: List[Rule] = self.load()
+    
+    def load(self) -> List[Rule]:
+        try:
+            with open(self.data_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return []
+        return [Rule(item['type'], item['source'], item['target'], int(item.get('code', 301)))
+                for item in data.get('rules', [])]
+    
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.data_file), exist_ok=True)
+        tmp_file = f"{self.data_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'rules': [rule.to_dict() for rule in self.rules]}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_file, self.data_file)
+    
+    def add(self, rule: Rule) -> bool:
+        """添加规则，同类型同源路径的规则被替换；返回是否有变化"""
+        for idx, existing in enumerate(self.rules):
+            if existing.type == rule.type and existing.source == rule.source:
+                if existing.to_dict() == rule.to_dict():
+                    return False
+                self.rules[idx] = rule
+                return True
+        self.rules.append(rule)
+        return True
+    
+    def remove(self, source: str) -> int:
+        """删除与源路径写法对应类型的规则：/old/* 只删前缀规则，/old/ 只删精确规则"""
+        rule_type, normalized = split_source(source)
+        before = len(self.rules)
+        self.rules = [rule for rule in self.rules
+                      if rule.type != rule_type or rule.source != normalized]
+        return before - len(self.rules)
+    
+    def import_csv(self, path: str, replace: bool = False) -> Tuple[int, List[str]]:
+        """从CSV导入规则（源路径,目标[,状态码[,类型]]，可带表头），返回(变化的规则数, 错误)"""
+        if replace:
+            self.rules = []
+        changed = 0
+        errors = []
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            for line_no, row in enumerate(csv.reader(f), 1):
+                if not row or not row[0].strip() or row[0].strip().startswith("#"):
+                    continue
+                if line_no == 1 and row[0].strip().lower() in ("source", "from", "源路径"):
+                    continue
+                try:
+                    code = int(row[2]) if len(row) > 2 and row[2].strip() else 301
+                    rule_type = row[3].strip() if len(row) > 3 and row[3].strip() else None
+                    if len(row) < 2:
+                        raise ValueError("缺少目标")
+                    changed += self.add(make_rule(row[0], row[1], code, rule_type))
+                except ValueError as e:
+                    errors.append(f"第{line_no}行: {e}")
+        return changed, errors
+    
+    def compile(self) -> Tuple[Dict[str, Rule], List[Rule], List[Rule]]:
+        """
+        整理规则：精确路径进入哈希表；前缀规则按长度从长到短排列（最长前缀优先），之后是按添加顺序的正则规则。
+        去掉被更短前缀完全覆盖（重定向结果相同）的前缀规则和重复的正则，返回(精确, 有序规则, 被去掉的规则)
+        """
+        exact: Dict[str, Rule] = {}
+        for rule in self.rules:
+            if rule.type == "exact":
+                exact[rule.source] = rule
+        prefixes = sorted((rule for rule in self.rules if rule.type == "prefix"), key=lambda rule: -len(rule.source))
+        dropped = []
+        kept_prefixes = []
+        for idx, rule in enumerate(prefixes):
+            covered = False
+            for shorter in prefixes[idx + 1:]:
+                if not rule.source.startswith(shorter.source):
+                    continue
+                # 外层前缀保留剩余路径时，得到的目标与本规则相同就不需要本规则
+                expected = shorter.target[:-2] + rule.source[len(shorter.source):] + "$1"
+                covered = shorter.target.endswith("$1") and rule.target == expected and rule.code == shorter.code
+                break
+            if covered:
+                dropped.append(rule)
+            else:
+                kept_prefixes.append(rule)
+        regexes = []
+        seen = set()
+        for rule in self.rules:
+            if rule.type != "regex":
+                continue
+            if rule.source in seen:
+                dropped.append(rule)
+                continue
+            seen.add(rule.source)
+            regexes.append(rule)
+        return exact, kept_prefixes + regexes, dropped
+    
+    def render(self) -> Tuple[str, str]:
+        """生成http级的map文件和server块中引用的判断文件"""
+        exact, ordered, _ = self.compile()
+        rules = list(exact.values()) + ordered
+        codes = sorted({rule.code for rule in rules}) or [301]
+        mixed = len(codes) > 1
+        
+        def value(rule: Rule) -> str:
+            # 状态码不同的规则混在一起时，在值前面加上状态码，再由各状态码的map拆出目标
+            return f'"{rule.code}|{rule.target}"' if mixed else f'"{rule.target}"'
+        
+        lines = [
+            f"# 由 redirect-map.py 根据 {os.path.basename(self.data_file)} 生成，请勿手动修改",
+            f"map $uri {self.variable} {{",
+            '    default "";',
+        ]
+        for source, rule in exact.items():
+            lines.append(f'    "{source}" {value(rule)};')
+        for rule in ordered:
+            lines.append(f'    "~{rule.pattern()}" {value(rule)};')
+        lines.append("}")
+        checks = []
+        if mixed:
+            for code in codes:
+                variable = f"$redirect_{code}_{self.site_id}"
+                lines.extend([
+                    f"map {self.variable} {variable} {{",
+                    '    default "";',
+                    f'    "~^{code}\\|(.*)$" $1;',
+                    "}",
+                ])
+                checks.append(f"if ({variable}) {{ return {code} {variable}; }}")
+        else:
+            checks.append(f"if ({self.variable}) {{ return {codes[0]} {self.variable}; }}")
+        server = [f"# 由 redirect-map.py 生成，请勿手动修改"] + checks
+        return "\n".join(lines) + "\n", "\n".join(server) + "\n"
+    
+    def hash_sizes(self) -> Tuple[int, int]:
+        """所有站点规则表需要的map_hash_max_size和map_hash_bucket_size"""
+        entries, longest = 0, 0
+        directory = os.path.dirname(self.data_file)
+        for name in os.listdir(directory) if os.path.isdir(directory) else []:
+            if not name.endswith(".json"):
+                continue
+            site = self if os.path.join(directory, name) == self.data_file else None
+            rules = site.rules if site else RedirectMap(os.path.join(directory, name[:-5] + ".conf"), directory).rules
+            exact = [rule for rule in rules if rule.type == "exact"]
+            entries = max(entries, len(exact))
+            longest = max([longest] + [len(rule.source.encode()) for rule in exact])
+        max_size = DEFAULT_HASH_MAX_SIZE
+        while max_size < entries * 2:
+            max_size *= 2
+        bucket_size = DEFAULT_HASH_BUCKET_SIZE
+        while bucket_size < longest + 16:
+            bucket_size *= 2
+        return max_size, bucket_size
+    
+    def main_conf_lines(self) -> Optional[List[str]]:
+        """规则多或路径长时在http块中设置map哈希表大小，返回需要写入的nginx.conf内容（无需修改时为None）"""
+        with open(self.nginx_conf, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        max_size, bucket_size = self.hash_sizes()
+        start = next((i for i, line in enumerate(lines) if line.strip() == HASH_MARKER), None)
+        if start is not None:
+            current = "".join(lines[start + 1:start + 3])
+            sizes = [int(value) for value in re.findall(r'map_hash_\w+_size\s+(\d+);', current)]
+            if len(sizes) == 2 and sizes[0] >= max_size and sizes[1] >= bucket_size:
+                return None
+            del lines[start:start + 3]
+        elif max_size == DEFAULT_HASH_MAX_SIZE and bucket_size == DEFAULT_HASH_BUCKET_SIZE:
+            return None
+        elif any(re.match(r'\s*map_hash_(max|bucket)_size', line) for line in lines):
+            print("nginx.conf中已手动设置map哈希表大小，请确认其不小于"
+                  f" map_hash_max_size {max_size}; map_hash_bucket_size {bucket_size};")
+            return None
+        http_start = next((i for i, line in enumerate(lines) if re.match(r'\s*http\s*{', line)), None)
+        if http_start is None:
+            raise ValueError("未找到http块，无法设置map哈希表大小")
+        lines[http_start + 1:http_start + 1] = [
+            f"    {HASH_MARKER}\n",
+            f"    map_hash_max_size {max_size};\n",
+            f"    map_hash_bucket_size {bucket_size};\n",
+        ]
+        return lines
+    
+    def site_conf_lines(self) -> Optional[List[str]]:
+        """在站点配置中引入规则表，返回修改后的内容（已引入时为None）"""
+        with open(self.conf_file, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        if any(line.strip() == MAP_MARKER for line in lines):
+            return None
+        try:
+            servers = list(iter_servers(parse_lines(lines)))
+        except ConfigParseError as e:
+            raise ValueError(f"无法解析 {self.conf_file}: {e}")
+        if not servers:
+            raise ValueError(f"{self.conf_file} 中没有server块")
+        inserted: Dict[int, List[str]] = {}
+        for server in servers:
+            anchor = server.first('server_name')
+            position = anchor.end if anchor else server.start
+            inserted[position] = [
+                f"    {MAP_MARKER}\n",
+                f"    include {self.server_file};\n",
+                f"    {MAP_END_MARKER}\n",
+            ]
+        new_lines = [f"{MAP_MARKER}\n", f"include {self.map_file};\n", f"{MAP_END_MARKER}\n"]
+        for i, line in enumerate(lines):
+            new_lines.append(line)
+            new_lines.extend(inserted.get(i, []))
+        return new_lines
+    
+    def apply(self) -> bool:
+        """编译规则表并写入，有变化时验证并重载，失败时恢复"""
+        if not self.rules:
+            print("规则表为空，如需停用请使用 disable")
+            return False
+        map_content, server_content = self.render()
+        try:
+            files: Dict[str, str] = {self.map_file: map_content, self.server_file: server_content}
+            site_lines = self.site_conf_lines()
+            if site_lines is not None:
+                files[self.conf_file] = "".join(site_lines)
+            main_lines = self.main_conf_lines()
+            if main_lines is not None:
+                files[self.nginx_conf] = "".join(main_lines)
+        except (OSError, ValueError) as e:
+            print(f"生成规则表失败: {e}")
+            return False
+        
+        previous: Dict[str, Optional[str]] = {}
+        for path in files:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    previous[path] = f.read()
+            except OSError:
+                previous[path] = None
+        files = {path: content for path, content in files.items() if previous[path] != content}
+        if not files:
+            print("规则表无变化")
+            return True
+        snapshot_files([path for path in files if previous[path] is not None], "redirect-map")
+        os.makedirs(os.path.dirname(self.map_file), exist_ok=True)
+        for path, content in files.items():
+            tmp_file = f"{path}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(tmp_file, path)
+        
+        if not ReloadCoordinator(debounce=0).notify("redirect-map"):
+            for path in files:
+                if previous[path] is None:
+                    os.remove(path)
+                else:
+                    with open(path, 'w', encoding='utf-8') as f:
+                        f.write(previous[path])
+            print("验证或重载失败，已恢复原配置")
+            return False
+        exact, ordered, dropped = self.compile()
+        print(f"规则表已生效：精确路径 {len(exact)} 条，前缀/正则 {len(ordered)} 条"
+              f"{f'（去掉 {len(dropped)} 条被覆盖的规则）' if dropped else ''}")
+        return True
+    
+    def disable(self) -> bool:
+        """从站点配置中移除规则表的引用（保留数据文件）"""
+        with open(self.conf_file, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        new_lines = []
+        in_block = False
+        for line in lines:
+            stripped = line.strip()
+            if stripped == MAP_MARKER:
+                in_block = True
+                continue
+            if in_block:
+                in_block = stripped != MAP_END_MARKER
+                continue
+            new_lines.append(line)
+        if new_lines == lines:
+            print("站点未启用规则表")
+            return True
+        snapshot_files([self.conf_file], "redirect-map")
+        with open(self.conf_file, 'w', encoding='utf-8') as f:
+            f.writelines(new_lines)
+        return ReloadCoordinator(debounce=0).notify("redirect-map")
+    
+    def print_rules(self) -> None:
+        exact, ordered, dropped = self.compile()
+        print(f"精确路径 {len(exact)} 条，前缀/正则 {len(ordered)} 条，被覆盖 {len(dropped)} 条（数据文件: {self.data_file}）")
+        for rule in list(exact.values()) + ordered:
+            source = f"{rule.source}*" if rule.type == "prefix" else f"~{rule.source}" if rule.type == "regex" else rule.source
+            print(f"  {rule.code} {source} -> {rule.target}")
+    
+    def benchmark(self, lookups: int = 100000) -> Dict[str, float]:
+        """
+        查找耗时对比（进程内模拟）：编译后的规则表（哈希+有序正则）与
+        每条规则一个location块时逐条匹配的方式，样本为规则表中的路径和一半未命中的路径
+        """
+        exact, ordered, _ = self.compile()
+        compiled = [(re.compile(rule.pattern()), rule) for rule in ordered]
+        # 逐条匹配：每条规则（包括精确路径）都作为一个待匹配的条件
+        linear = [(re.compile(f"^{re.escape(rule.source)}$" if rule.type == "exact" else rule.pattern()), rule)
+                  for rule in self.rules]
+        samples = [rule.source for rule in exact.values()] or ["/"]
+        samples += [rule.source + "x/1" for rule in ordered if rule.type == "prefix"]
+        samples = [random.choice(samples) if i % 2 else f"/missing/{i}" for i in range(min(lookups, 10000))]
+        
+        def run(lookup) -> float:
+            started = time.perf_counter()
+            for i in range(lookups):
+                lookup(samples[i % len(samples)])
+            return (time.perf_counter() - started) / lookups * 1e6
+        
+        def linear_lookup(uri: str):
+            for pattern, rule in linear:
+                if pattern.search(uri):
+                    return rule
+            return None
+        
+        mismatches = sum(1 for uri in samples[:1000]
+                         if (resolve(exact, compiled, uri) is None) != (linear_lookup(uri) is None))
+        return {
+            'rules': len(self.rules),
+            'compiled_us': run(lambda uri: resolve(exact, compiled, uri)),
+            'linear_us': run(linear_lookup),
+            'mismatches': mismatches,
+        }
+
+def main():
+    if len(sys.argv) < 3:
+        print("用法: redirect-map.py <conf_file> <action> [参数]")
+        print("  add <源路径> <目标> [状态码] [exact|prefix|regex]  - 添加规则（/old/* 为前缀，~ 开头为正则）")
+        print("  remove <源路径>                                    - 删除规则")
+        print("  import <csv> [--replace]                           - 从CSV批量导入（源路径,目标[,状态码[,类型]]）")
+        print("  list                                               - 查看规则")
+        print("  apply                                              - 编译规则表并重载nginx")
+        print("  disable                                            - 停用站点的规则表")
+        print("  bench [次数]                                       - 查找耗时对比")
+        sys.exit(1)
+    
+    conf_file, action = sys.argv[1], sys.argv[2]
+    args = [arg for arg in sys.argv[3:] if not arg.startswith("--")]
+    if not os.path.exists(conf_file):
+        print(f"配置文件不存在: {conf_file}")
+        sys.exit(1)
+    table = RedirectMap(conf_file)
+    
+    if action == "add" and len(args) >= 2:
+        try:
+            rule = make_rule(args[0], args[1], int(args[2]) if len(args) > 2 else 301, args[3] if len(args) > 3 else None)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        if table.add(rule):
+            table.save()
+            print("规则已添加，执行 apply 后生效")
+        else:
+            print("规则已存在")
+        sys.exit(0)
+    elif action == "remove" and args:
+        try:
+            removed = table.remove(args[0])
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        table.save()
+        print(f"已删除 {removed} 条规则，执行 apply 后生效")
+        sys.exit(0 if removed else 1)
+    elif action == "import" and args:
+        try:
+            changed, errors = table.import_csv(args[0], replace="--replace" in sys.argv)
+        except OSError as e:
+            print(f"读取CSV失败: {e}")
+            sys.exit(1)
+        for error in errors[:20]:
+            print(error)
+        if len(errors) > 20:
+            print(f"... 共 {len(errors)} 行有误")
+        table.save()
+        print(f"导入完成：{changed} 条规则有变化，共 {len(table.rules)} 条，执行 apply 后生效")
+        sys.exit(0 if not errors else 1)
+    elif action == "list":
+        table.print_rules()
+        sys.exit(0)
+    elif action == "apply":
+        sys.exit(0 if table.apply() else 1)
+    elif action == "disable":
+        sys.exit(0 if table.disable() else 1)
+    elif action == "bench":
+        if not table.rules:
+            print("规则表为空")
+            sys.exit(1)
+        result = table.benchmark(int(args[0]) if args and args[0].isdigit() else 100000)
+        print(f"规则数: {result['rules']}")
+        print(f"规则表（哈希+有序正则）: {result['compiled_us']:.2f} 微秒/次")
+        print(f"逐条匹配（每条规则一个location）: {result['linear_us']:.2f} 微秒/次")
+        print(f"加速比: {result['linear_us'] / max(result['compiled_us'], 1e-9):.1f}x")
+        if result['mismatches']:
+            print(f"注意: {result['mismatches']} 个样本两种方式的命中结果不同（前缀/正则的优先级不同）")
+        sys.exit(0)
+    else:
+        print(f"未知操作或缺少参数: {action}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
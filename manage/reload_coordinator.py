@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+"""
+nginx重载协调器
+各管理脚本修改配置后只登记一条重载通知，协调器在静默窗口内合并所有通知，
+验证配置后只发送一次平滑重载（HUP），并记录重载耗时和新旧worker并存时间。
+配置验证或重载失败时保留正在运行的master，不做强制重启；通知被合并到其他进程的重载时，
+等待该次重载完成并返回它的结果
+"""
+
+import sys
+import os
+import json
+import time
+import fcntl
+import signal
+import shutil
+import subprocess
+from typing import Dict, List, Optional, Set
+
+LOG_DIR = "/usr/local/nginx/logs"
+PID_FILE = f"{LOG_DIR}/nginx.pid"
+QUEUE_FILE = f"{LOG_DIR}/.reload-queue"
+LOCK_FILE = f"{LOG_DIR}/.reload-queue.lock"
+FLUSH_LOCK_FILE = f"{LOG_DIR}/.reload-flush.lock"
+HISTORY_FILE = f"{LOG_DIR}/reload-history.jsonl"
+HISTORY_LOCK_FILE = f"{LOG_DIR}/.reload-history.lock"
+RESULT_FILE = f"{LOG_DIR}/.reload-results.json"
+
+# 静默窗口：最后一条通知之后这么久没有新通知才重载；最长等待时间防止持续通知时一直不重载
+DEBOUNCE_SECONDS = float(os.environ.get("NGINX_RELOAD_DEBOUNCE", "1.5"))
+MAX_WAIT_SECONDS = 10.0
+# 发送HUP后等待新worker出现的最长时间，超时视为新配置未生效（如端口绑定失败、worker启动失败）
+READY_TIMEOUT = float(os.environ.get("NGINX_RELOAD_READY_TIMEOUT", "5"))
+# 后台测量新旧worker并存时间的最长时间（长连接较多时旧worker会延迟退出）
+OVERLAP_TIMEOUT = 30.0
+HISTORY_LIMIT = 500
+# 重载结果保留时间，供合并到该次重载的其他进程查询
+RESULT_TTL = 3600
+
+def nginx_binary() -> Optional[str]:
+    """返回nginx可执行文件路径"""
+    if os.access("/usr/local/nginx/sbin/nginx", os.X_OK):
+        return "/usr/local/nginx/sbin/nginx"
+    return shutil.which("nginx")
+
+def master_pid(pid_file: str = PID_FILE) -> Optional[int]:
+    """读取master进程号，进程不存在时返回None"""
+    try:
+        with open(pid_file, 'r') as f:
+            pid = int(f.read().strip())
+        os.kill(pid, 0)
+        return pid
+    except (OSError, ValueError):
+        return None
+
+def worker_pids(master: int) -> Set[int]:
+    """返回master当前的全部子进程（worker和cache进程）"""
+    pids: Set[int] = set()
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", 'r') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # 进程名可能包含空格，从最后一个右括号之后取字段：状态、ppid
+        fields = stat.rsplit(')', 1)[-1].split()
+        if len(fields) > 1 and fields[1] == str(master) and fields[0] != 'Z':
+            pids.add(int(entry))
+    return pids
+
+class ReloadCoordinator:
+    def __init__(self, debounce: float = DEBOUNCE_SECONDS, pid_file: str = PID_FILE):
+        self.debounce = debounce
+        self.pid_file = pid_file
+        self.nginx_bin = nginx_binary()
+    
+    def _lock(self, path: str, blocking: bool = True):
+        """获取文件锁，非阻塞模式下已被占用时返回None"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle = open(path, 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            handle.close()
+            return None
+        return handle
+    
+    def enqueue(self, source: str) -> str:
+        """登记一条重载通知，返回通知ID（用于查询合并重载的结果）"""
+        token = f"{os.getpid()}-{time.time_ns()}"
+        handle = self._lock(LOCK_FILE)
+        try:
+            with open(QUEUE_FILE, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'time': time.time(), 'source': source, 'id': token}, ensure_ascii=False) + "\n")
+        finally:
+            handle.close()
+        return token
+    
+    def read_queue(self) -> List[Dict[str, object]]:
+        """读取当前排队的通知"""
+        entries = []
+        try:
+            with open(QUEUE_FILE, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            pass
+        return entries
+    
+    def take_queue(self) -> List[Dict[str, object]]:
+        """取出并清空排队的通知"""
+        handle = self._lock(LOCK_FILE)
+        try:
+            entries = self.read_queue()
+            if entries:
+                os.remove(QUEUE_FILE)
+            return entries
+        finally:
+            handle.close()
+    
+    def wait_quiet(self) -> None:
+        """等待通知静默（合并短时间内的连续修改）"""
+        started = time.time()
+        while time.time() - started < MAX_WAIT_SECONDS:
+            entries = self.read_queue()
+            last = max((entry.get('time', 0) for entry in entries), default=0)
+            remaining = last + self.debounce - time.time()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, MAX_WAIT_SECONDS - (time.time() - started)) + 0.01)
+    
+    def test_config(self) -> bool:
+        """nginx -t 验证配置"""
+        if not self.nginx_bin:
+            print("❌ 未找到nginx可执行文件")
+            return False
+        result = subprocess.run([self.nginx_bin, '-t'], capture_output=True, text=True)
+        if result.returncode != 0:
+            print("❌ nginx配置验证失败，未重载（当前运行的配置保持不变）:")
+            print(result.stderr.strip())
+            return False
+        return True
+    
+    def start(self) -> bool:
+        """nginx未运行时直接启动"""
+        if os.path.exists(self.pid_file):
+            os.remove(self.pid_file)
+        result = subprocess.run([self.nginx_bin], capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"❌ Nginx启动失败: {result.stderr.strip()}")
+            return False
+        print("Nginx已启动。")
+        return True
+    
+    def signal_reload(self, master: int, record_id: str) -> Dict[str, object]:
+        """向master发送HUP，等待新worker就绪（最多READY_TIMEOUT秒）并测量就绪耗时；
+        旧worker仍在处理存量连接时，并存时间交给后台进程测量，不阻塞调用方"""
+        old_workers = worker_pids(master)
+        started = time.time()
+        os.kill(master, signal.SIGHUP)
+        
+        latency = None
+        new_workers: Set[int] = set()
+        current = old_workers
+        while time.time() - started < READY_TIMEOUT:
+            current = worker_pids(master)
+            new_workers = current - old_workers
+            if new_workers:
+                latency = time.time() - started
+                break
+            if master_pid(self.pid_file) != master:
+                break
+            time.sleep(0.05)
+        
+        remaining = current & old_workers
+        result: Dict[str, object] = {
+            'ready': latency is not None,
+            'latency_ms': round(latency * 1000, 1) if latency is not None else None,
+            'old_workers': len(old_workers),
+            'new_workers': len(new_workers),
+            'old_workers_remaining': len(remaining),
+        }
+        if latency is not None and not remaining:
+            result['overlap_ms'] = round((time.time() - started) * 1000, 1)
+        elif latency is not None:
+            self.spawn_overlap_watch(record_id, master, old_workers, started)
+        return result
+    
+    def watch_overlap(self, record_id: str, master: int, old_workers: Set[int], started: float) -> None:
+        """后台等待旧worker退出，把新旧worker并存时间补记到对应的重载记录"""
+        while time.time() - started < OVERLAP_TIMEOUT:
+            if not (worker_pids(master) & old_workers) or master_pid(self.pid_file) != master:
+                break
+            time.sleep(0.2)
+        fields = {
+            'overlap_ms': round((time.time() - started) * 1000, 1),
+            'old_workers_remaining': len(worker_pids(master) & old_workers),
+        }
+        # 重载记录在发出HUP之后才写入，旧worker很快退出时稍等记录落盘
+        for _ in range(20):
+            if self.update_record(record_id, fields):
+                break
+            time.sleep(0.1)
+    
+    def spawn_overlap_watch(self, record_id: str, master: int, old_workers: Set[int], started: float) -> None:
+        """启动独立的后台进程测量并存时间（调用方退出后继续运行）"""
+        try:
+            subprocess.Popen([sys.executable, os.path.abspath(__file__), 'watch', record_id, str(master),
+                              f"{started:.3f}", *[str(pid) for pid in sorted(old_workers)]],
+                             stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                             start_new_session=True)
+        except OSError:
+            pass
+    
+    def reload_once(self, entries: List[Dict[str, object]]) -> bool:
+        """合并后的一次验证+重载"""
+        sources = sorted({str(entry.get('source', '-')) for entry in entries})
+        record: Dict[str, object] = {'id': f"{os.getpid()}-{time.time_ns()}", 'time': int(time.time()),
+                                     'sources': sources, 'notifications': len(entries)}
+        
+        if not self.test_config():
+            record['result'] = "invalid"
+            self.record(record)
+            return False
+        
+        master = master_pid(self.pid_file)
+        if master is None:
+            print("Nginx未运行，正在启动...")
+            ok = self.start()
+            record['result'] = "started" if ok else "start_failed"
+            self.record(record)
+            return ok
+        
+        try:
+            record.update(self.signal_reload(master, str(record['id'])))
+        except OSError as e:
+            # 没有权限向master发信号时交给nginx -s reload（无法确认新worker是否就绪）
+            result = subprocess.run([self.nginx_bin, '-s', 'reload'], capture_output=True, text=True)
+            if result.returncode != 0:
+                print(f"❌ 重载失败，保留当前运行的nginx: {e}")
+                record['result'] = "failed"
+                self.record(record)
+                return False
+            record['ready'] = None
+        
+        if record.get('ready') is False:
+            record['result'] = "not_ready"
+            self.record(record)
+            print(f"❌ 发送重载信号后 {READY_TIMEOUT:g}s 内没有新worker启动，新配置可能未生效，"
+                  f"请检查 {LOG_DIR}/error.log")
+            return False
+        record['result'] = "reloaded"
+        self.record(record)
+        
+        latency = record.get('latency_ms')
+        print(f"Nginx配置重载成功（合并 {len(entries)} 次修改"
+              f"{f'，新worker就绪 {latency:.0f}ms' if latency is not None else ''}）。")
+        if record.get('old_workers_remaining'):
+            print(f"  仍有 {record['old_workers_remaining']} 个旧worker在处理存量连接，将在连接结束后退出")
+        return True
+    
+    def save_results(self, entries: List[Dict[str, object]], ok: bool) -> None:
+        """记录本次重载处理的通知ID及结果（只由持有执行锁的进程写入）"""
+        now = time.time()
+        results = {token: item for token, item in self.load_results().items()
+                   if now - item.get('time', 0) < RESULT_TTL}
+        for entry in entries:
+            if entry.get('id'):
+                results[str(entry['id'])] = {'time': now, 'ok': ok}
+        try:
+            tmp_file = f"{RESULT_FILE}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(results, f)
+            os.replace(tmp_file, RESULT_FILE)
+        except OSError:
+            pass
+    
+    def load_results(self) -> Dict[str, Dict[str, object]]:
+        try:
+            with open(RESULT_FILE, 'r', encoding='utf-8') as f:
+                results = json.load(f)
+            return results if isinstance(results, dict) else {}
+        except (OSError, ValueError):
+            return {}
+    
+    def flush(self, wait: bool = True, token: Optional[str] = None) -> bool:
+        """成为执行者并处理队列；已有执行者时等待其完成，再处理剩余通知。
+        指定token时返回处理该通知的那次重载的结果"""
+        flush_handle = self._lock(FLUSH_LOCK_FILE, blocking=False)
+        if flush_handle is None:
+            print("已有重载正在进行，本次修改将合并到该次重载，等待其结果...")
+            flush_handle = self._lock(FLUSH_LOCK_FILE)
+        
+        ok = True
+        try:
+            while True:
+                if wait:
+                    self.wait_quiet()
+                entries = self.take_queue()
+                if entries:
+                    reloaded = self.reload_once(entries)
+                    self.save_results(entries, reloaded)
+                    ok = reloaded and ok
+                # 持有队列锁确认队列为空后再释放执行锁，避免漏掉刚登记的通知
+                queue_handle = self._lock(LOCK_FILE)
+                try:
+                    if not self.read_queue():
+                        flush_handle.close()
+                        flush_handle = None
+                        break
+                finally:
+                    queue_handle.close()
+        finally:
+            if flush_handle is not None:
+                flush_handle.close()
+        
+        if token is None:
+            return ok
+        result = self.load_results().get(token)
+        if result is None:
+            print("❌ 未找到本次修改对应的重载结果")
+            return False
+        if not result.get('ok'):
+            print("❌ 本次修改所在的合并重载未成功")
+        return bool(result.get('ok'))
+    
+    def notify(self, source: str, wait: bool = True) -> bool:
+        """登记通知并在需要时执行合并重载，返回包含本次通知的那次重载的结果"""
+        token = self.enqueue(source)
+        return self.flush(wait, token)
+    
+    def write_history(self, history: List[Dict[str, object]]) -> None:
+        tmp_file = f"{HISTORY_FILE}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            for item in history:
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        os.replace(tmp_file, HISTORY_FILE)
+    
+    def record(self, entry: Dict[str, object]) -> None:
+        """追加一条重载记录（保留最近HISTORY_LIMIT条）"""
+        try:
+            handle = self._lock(HISTORY_LOCK_FILE)
+            try:
+                history = self.history(HISTORY_LIMIT - 1)
+                history.append(entry)
+                self.write_history(history)
+            finally:
+                handle.close()
+        except OSError:
+            pass
+    
+    def update_record(self, record_id: str, fields: Dict[str, object]) -> bool:
+        """补记已有重载记录的字段（后台测量的并存时间），记录不存在时返回False"""
+        try:
+            handle = self._lock(HISTORY_LOCK_FILE)
+            try:
+                history = self.history(HISTORY_LIMIT)
+                for item in history:
+                    if item.get('id') == record_id:
+                        item.update(fields)
+                        self.write_history(history)
+                        return True
+            finally:
+                handle.close()
+        except OSError:
+            pass
+        return False
+    
+    def history(self, limit: int = 20) -> List[Dict[str, object]]:
+        """读取最近的重载记录"""
+        entries = []
+        try:
+            with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            pass
+        return entries[-limit:] if limit > 0 else []
+    
+    def show_status(self) -> None:
+        """显示队列和最近的重载记录"""
+        master = master_pid(self.pid_file)
+        print(f"master进程: {master if master else '未运行'}")
+        if master:
+            print(f"当前worker数: {len(worker_pids(master))}")
+        print(f"排队通知: {len(self.read_queue())}")
+        
+        history = self.history()
+        if not history:
+            print("暂无重载记录")
+            return
+        print(f"{'时间':<20} {'结果':<10} {'合并数':<6} {'就绪ms':<8} {'并存ms':<8} {'残留':<4} 来源")
+        for entry in history:
+            latency = entry.get('latency_ms')
+            overlap = entry.get('overlap_ms')
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry.get('time', 0))):<20} "
+                  f"{entry.get('result', '-'):<10} {entry.get('notifications', 0):<6} "
+                  f"{'-' if latency is None else latency:<8} {'-' if overlap is None else overlap:<8} "
+                  f"{entry.get('old_workers_remaining', '-'):<4} {','.join(entry.get('sources', []))}")
+
+def main():
+    if len(sys.argv) < 2:
+        print("用法: reload_coordinator.py <notify|flush|status> [来源] [--now]")
+        print("  notify [来源] [--now] - 登记修改并合并重载（--now不等待静默窗口）")
+        print("  flush                 - 立即处理排队的通知")
+        print("  status                - 查看队列和最近的重载记录")
+        sys.exit(1)
+    
+    action = sys.argv[1]
+    args = [arg for arg in sys.argv[2:] if not arg.startswith("--")]
+    coordinator = ReloadCoordinator()
+    
+    if action == "notify":
+        source = args[0] if args else "manual"
+        ok = coordinator.notify(source, wait="--now" not in sys.argv)
+        sys.exit(0 if ok else 1)
+    elif action == "flush":
+        sys.exit(0 if coordinator.flush(wait=False) else 1)
+    elif action == "status":
+        coordinator.show_status()
+        sys.exit(0)
+    elif action == "watch" and len(args) >= 3:
+        # 内部使用：后台测量新旧worker并存时间
+        coordinator.watch_overlap(args[0], int(args[1]), {int(pid) for pid in args[3:]}, float(args[2]))
+        sys.exit(0)
+    else:
+        print(f"未知操作: {action}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
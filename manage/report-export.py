@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+按时间范围导出站点访问日志
+在按时间顺序写入的日志中二分查找起始位置，只流式读取时间范围内的行，边读边压缩（gzip/zstd），
+同一次遍历中统计流量、热门URL、访问IP和状态码分布，在导出文件旁写出CSV/JSON摘要
+"""
+
+import sys
+import os
+import csv
+import gzip
+import json
+import time
+import shutil
+import subprocess
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from log_engine import TopK, find_site_log, line_timestamp, parse_line, record_day, rotated_logs
+
+# 开启access_log缓冲或多个worker同时写入时，相邻行的时间可能有少量乱序
+ORDER_SLACK = 300
+# 二分查找缩小到这个范围后改为顺序扫描
+SEEK_WINDOW = 64 * 1024
+# 查找时间戳时最多向后读取的行数（跳过无法识别的行）
+PROBE_LINES = 50
+COMPRESSORS = ("gzip", "zstd", "none")
+
+def parse_time_arg(value: str, now: float) -> Optional[float]:
+    """解析时间参数：相对时间（30m、12h、7d）或本地时间（2024-01-01、2024-01-01 08:00[:00]）"""
+    value = value.strip()
+    units = {'m': 60, 'h': 3600, 'd': 86400}
+    if len(value) > 1 and value[-1] in units and value[:-1].isdigit():
+        return now - int(value[:-1]) * units[value[-1]]
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(datetime.strptime(value, fmt).timetuple())
+        except ValueError:
+            continue
+    return None
+
+def probe_timestamp(f, offset: int, limit: int) -> Tuple[Optional[int], int]:
+    """从offset之后的第一个完整行开始找到第一个可识别的时间，返回(时间戳, 该行起始位置)"""
+    f.seek(offset)
+    if offset:
+        f.readline()
+    for _ in range(PROBE_LINES):
+        start = f.tell()
+        if start >= limit:
+            break
+        raw = f.readline()
+        if not raw:
+            break
+        ts = line_timestamp(raw.decode('utf-8', errors='replace'))
+        if ts is not None:
+            return ts, start
+    return None, limit
+
+def seek_time(f, since: float, size: int) -> int:
+    """二分查找第一条时间不早于since的行附近的位置（返回值总是行首）"""
+    lo, hi = 0, size
+    while hi - lo > SEEK_WINDOW:
+        mid = (lo + hi) // 2
+        ts, start = probe_timestamp(f, mid, hi)
+        if ts is None or start >= hi:
+            hi = mid
+        elif ts < since - ORDER_SLACK:
+            lo = start
+        else:
+            hi = mid
+    return lo
+
+def last_timestamp(path: str) -> Optional[int]:
+    """读取未压缩日志最后一个可识别的时间"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - SEEK_WINDOW))
+        lines = f.read().splitlines()
+    for raw in reversed(lines):
+        ts = line_timestamp(raw.decode('utf-8', errors='replace'))
+        if ts is not None:
+            return ts
+    return None
+
+def first_timestamp(path: str) -> Optional[int]:
+    """读取日志开头第一个可识别的时间（压缩日志只需解压开头一小段）"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        ts, _ = probe_timestamp(f, 0, sys.maxsize)
+    return ts
+
+class CompressedOutput:
+    """边写边压缩的输出文件"""
+    
+    def __init__(self, path: str, compressor: str):
+        self.path = path
+        self.process = None
+        if compressor == "zstd":
+            self.process = subprocess.Popen(['zstd', '-q', '-f', '-T0', '-o', path], stdin=subprocess.PIPE)
+            self.handle = self.process.stdin
+        elif compressor == "gzip":
+            self.handle = gzip.open(path, 'wb', compresslevel=6)
+        else:
+            self.handle = open(path, 'wb')
+    
+    def write(self, data: bytes) -> None:
+        self.handle.write(data)
+    
+    def close(self) -> bool:
+        """关闭输出，zstd进程失败时返回False"""
+        self.handle.close()
+        if self.process is not None:
+            return self.process.wait() == 0
+        return True
+
+class ReportExporter:
+    def __init__(self, site: str, since: float, until: float, top: int = 20, capacity: int = 1000):
+        self.site = site
+        self.since = since
+        self.until = until
+        self.top = top
+        self.requests = 0
+        self.body_bytes = 0
+        self.log_bytes = 0
+        self.unparsed = 0
+        self.scanned_bytes = 0
+        self.skipped_bytes = 0
+        self.first_ts: Optional[int] = None
+        self.last_ts: Optional[int] = None
+        self.status: Dict[int, int] = {}
+        self.daily: Dict[str, Dict[str, int]] = {}
+        self.urls = TopK(capacity)
+        self.ips = TopK(capacity)
+    
+    def find_log_files(self) -> List[str]:
+        """站点日志及其轮转文件（从旧到新）"""
+        log_file = find_site_log(self.site)
+        if not log_file:
+            return []
+        return rotated_logs(log_file)
+    
+    def add_line(self, raw: bytes, ts: int, output: CompressedOutput) -> None:
+        """导出一行并计入统计"""
+        output.write(raw)
+        self.log_bytes += len(raw)
+        if self.first_ts is None or ts < self.first_ts:
+            self.first_ts = ts
+        if self.last_ts is None or ts > self.last_ts:
+            self.last_ts = ts
+        record = parse_line(raw.decode('utf-8', errors='replace'))
+        if record is None:
+            self.unparsed += 1
+            return
+        self.requests += 1
+        self.body_bytes += record.body_bytes
+        self.status[record.status] = self.status.get(record.status, 0) + 1
+        day = record_day(record.time_local)
+        daily = self.daily.setdefault(day.isoformat() if day else "-", {'requests': 0, 'bytes': 0})
+        daily['requests'] += 1
+        daily['bytes'] += record.body_bytes
+        url = self.urls.add(record.path.split('?', 1)[0])
+        url['bytes'] = url.get('bytes', 0) + record.body_bytes
+        ip = self.ips.add(record.remote_addr)
+        ip['bytes'] = ip.get('bytes', 0) + record.body_bytes
+    
+    def export_plain(self, path: str, output: CompressedOutput) -> None:
+        """未压缩日志：二分定位起点后顺序读取，越过结束时间即停止"""
+        size = os.path.getsize(path)
+        last = last_timestamp(path)
+        if last is not None and last < self.since - ORDER_SLACK:
+            self.skipped_bytes += size
+            return
+        with open(path, 'rb') as f:
+            start = seek_time(f, self.since, size)
+            self.skipped_bytes += start
+            f.seek(start)
+            for raw in f:
+                self.scanned_bytes += len(raw)
+                ts = line_timestamp(raw.decode('utf-8', errors='replace'))
+                if ts is None:
+                    continue
+                if ts > self.until + ORDER_SLACK:
+                    break
+                if self.since <= ts <= self.until:
+                    self.add_line(raw if raw.endswith(b'\n') else raw + b'\n', ts, output)
+            self.skipped_bytes += max(0, size - f.tell())
+    
+    def export_gzip(self, path: str, output: CompressedOutput) -> None:
+        """压缩的轮转日志无法随机定位，顺序解压并在越过结束时间后停止"""
+        with gzip.open(path, 'rb') as f:
+            for raw in f:
+                self.scanned_bytes += len(raw)
+                ts = line_timestamp(raw.decode('utf-8', errors='replace'))
+                if ts is None:
+                    continue
+                if ts > self.until + ORDER_SLACK:
+                    break
+                if self.since <= ts <= self.until:
+                    self.add_line(raw if raw.endswith(b'\n') else raw + b'\n', ts, output)
+    
+    def export(self, log_files: List[str], output: CompressedOutput) -> None:
+        """按从旧到新的顺序导出；下一个文件的开头已早于起始时间时，当前文件整体跳过"""
+        for idx, path in enumerate(log_files):
+            try:
+                newer = first_timestamp(log_files[idx + 1]) if idx + 1 < len(log_files) else None
+                if newer is not None and newer < self.since - ORDER_SLACK:
+                    self.skipped_bytes += os.path.getsize(path)
+                elif path.endswith('.gz'):
+                    self.export_gzip(path, output)
+                else:
+                    self.export_plain(path, output)
+            except (OSError, EOFError) as e:
+                print(f"读取 {path} 失败: {e}", file=sys.stderr)
+    
+    def summary(self, log_files: List[str], output_file: str) -> Dict[str, object]:
+        """导出摘要"""
+        fmt = lambda ts: time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ts)) if ts is not None else None
+        status_class: Dict[str, int] = {}
+        for code, count in self.status.items():
+            key = f"{code // 100}xx"
+            status_class[key] = status_class.get(key, 0) + count
+        return {
+            'site': self.site,
+            'since': fmt(self.since),
+            'until': fmt(self.until),
+            'first': fmt(self.first_ts),
+            'last': fmt(self.last_ts),
+            'log_files': log_files,
+            'output': output_file,
+            'requests': self.requests,
+            'body_bytes': self.body_bytes,
+            'log_bytes': self.log_bytes,
+            'unparsed_lines': self.unparsed,
+            'scanned_bytes': self.scanned_bytes,
+            'skipped_bytes': self.skipped_bytes,
+            'daily': self.daily,
+            'status': {str(code): count for code, count in sorted(self.status.items())},
+            'status_class': dict(sorted(status_class.items())),
+            'top_urls': [{'url': url, 'requests': count, 'bytes': metrics.get('bytes', 0)}
+                         for url, count, metrics in self.urls.items(self.top)],
+            'top_ips': [{'ip': ip, 'requests': count, 'bytes': metrics.get('bytes', 0)}
+                        for ip, count, metrics in self.ips.items(self.top)],
+            'approximate': bool(self.urls.evicted or self.ips.evicted),
+        }
+    
+    def write_summary(self, summary: Dict[str, object], base: str) -> Tuple[str, str]:
+        """写出 <base>.summary.json 和 <base>.summary.csv"""
+        json_file = f"{base}.summary.json"
+        with open(json_file, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        
+        csv_file = f"{base}.summary.csv"
+        with open(csv_file, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['section', 'key', 'requests', 'bytes'])
+            writer.writerow(['total', self.site, summary['requests'], summary['body_bytes']])
+            for day, daily in sorted(self.daily.items()):
+                writer.writerow(['day', day, daily['requests'], daily['bytes']])
+            for code, count in summary['status'].items():
+                writer.writerow(['status', code, count, ''])
+            for item in summary['top_urls']:
+                writer.writerow(['url', item['url'], item['requests'], item['bytes']])
+            for item in summary['top_ips']:
+                writer.writerow(['ip', item['ip'], item['requests'], item['bytes']])
+        return json_file, csv_file
+
+def main():
+    if len(sys.argv) < 2:
+        print("用法: report-export.py <site> [--since=时间] [--until=时间] [--compress=gzip|zstd|none] [--out=目录] [--top=N]")
+        print("  时间格式: 相对时间 30m/12h/7d，或本地时间 2024-01-01 / '2024-01-01 08:00'")
+        print("  默认导出最近1天，压缩格式gzip，输出到 $HOME")
+        sys.exit(1)
+    
+    site = sys.argv[1]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[2:] if arg.startswith("--") and "=" in arg)
+    now = time.time()
+    since = parse_time_arg(options.get("since", "1d"), now)
+    until = parse_time_arg(options["until"], now) if "until" in options else now
+    if since is None or until is None or since > until:
+        print("时间范围无效", file=sys.stderr)
+        sys.exit(1)
+    compressor = options.get("compress", "gzip")
+    if compressor not in COMPRESSORS:
+        print(f"不支持的压缩格式: {compressor}", file=sys.stderr)
+        sys.exit(1)
+    if compressor == "zstd" and not shutil.which("zstd"):
+        print("未检测到zstd命令，改用gzip压缩")
+        compressor = "gzip"
+    out_dir = options.get("out", os.path.expanduser("~"))
+    top = int(options.get("top", "20"))
+    
+    exporter = ReportExporter(site, since, until, top)
+    log_files = exporter.find_log_files()
+    if not log_files:
+        print("未找到该站点日志文件", file=sys.stderr)
+        sys.exit(1)
+    
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = lambda ts: time.strftime('%Y%m%d%H%M', time.localtime(ts))
+    base = os.path.join(out_dir, f"{site}_{stamp(since)}-{stamp(until)}")
+    suffix = {'gzip': '.log.gz', 'zstd': '.log.zst', 'none': '.log'}[compressor]
+    output_file = base + suffix
+    output = CompressedOutput(output_file, compressor)
+    try:
+        exporter.export(log_files, output)
+    finally:
+        ok = output.close()
+    if not ok:
+        print(f"压缩失败: {output_file}", file=sys.stderr)
+        sys.exit(1)
+    
+    summary = exporter.summary(log_files, output_file)
+    json_file, csv_file = exporter.write_summary(summary, base)
+    mb = lambda value: value / 1024 / 1024
+    print(f"========= {site} 日志导出 =========")
+    print(f"时间范围: {summary['since']} ~ {summary['until']}")
+    print(f"请求数: {exporter.requests}，响应流量: {mb(exporter.body_bytes):.2f} MB，导出日志: {mb(exporter.log_bytes):.2f} MB")
+    print(f"读取 {mb(exporter.scanned_bytes):.2f} MB，跳过 {mb(exporter.skipped_bytes):.2f} MB")
+    print(f"日志文件: {output_file}")
+    print(f"摘要: {json_file}")
+    print(f"      {csv_file}")
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+日志统计汇总存储
+按 类型/站点/日期 保存每天的汇总结果（JSON），查询较长时间范围时只需合并每天的汇总，
+不必重新扫描日志；超过保留天数的汇总自动清理。
+一个日志本次新增部分合并后的各天汇总与它的新偏移通过journal一起提交，中途崩溃不会重复累加
+"""
+
+import os
+import json
+import shutil
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+ROLLUP_DIR = os.environ.get("NGINX_ROLLUP_DIR", "/usr/local/nginx/logs/rollup")
+RETENTION_DAYS = 30
+
+class RollupStore:
+    def __init__(self, kind: str, root: str = ROLLUP_DIR, retention_days: int = RETENTION_DAYS):
+        self.kind = kind
+        self.root = os.path.join(root, kind)
+        self.retention_days = retention_days
+    
+    def site_dir(self, site: str) -> str:
+        return os.path.join(self.root, site.replace('/', '_'))
+    
+    def day_file(self, site: str, day: date) -> str:
+        return os.path.join(self.site_dir(site), f"{day.isoformat()}.json")
+    
+    def load_day(self, site: str, day: date) -> Dict[str, object]:
+        """读取某天的汇总，不存在时返回空字典"""
+        try:
+            with open(self.day_file(site, day), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def save_day(self, site: str, day: date, data: Dict[str, object]) -> None:
+        """原子写入某天的汇总"""
+        self.write_json(self.day_file(site, day), data)
+    
+    def sites(self) -> List[str]:
+        """有汇总数据的站点"""
+        try:
+            return sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+        except OSError:
+            return []
+    
+    def iter_days(self, site: str, days: int, until: Optional[date] = None) -> Iterator[Tuple[date, Dict[str, object]]]:
+        """按日期顺序返回最近days天（含until当天）的汇总"""
+        until = until or date.today()
+        for offset in range(days - 1, -1, -1):
+            day = until - timedelta(days=offset)
+            data = self.load_day(site, day)
+            if data:
+                yield day, data
+    
+    def prune(self, today: Optional[date] = None) -> int:
+        """删除超过保留天数的汇总，返回删除的文件数"""
+        cutoff = (today or date.today()) - timedelta(days=self.retention_days)
+        removed = 0
+        for site in self.sites():
+            site_dir = self.site_dir(site)
+            for name in os.listdir(site_dir):
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    day = date.fromisoformat(name[:-5])
+                except ValueError:
+                    continue
+                if day < cutoff:
+                    os.remove(os.path.join(site_dir, name))
+                    removed += 1
+            if not os.listdir(site_dir):
+                shutil.rmtree(site_dir, ignore_errors=True)
+        return removed
+    
+    def journal_file(self) -> str:
+        return os.path.join(self.root, ".journal.json")
+    
+    def write_json(self, path: str, data: object) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_file = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_file, path)
+    
+    def commit(self, site: str, days: Dict[date, Dict[str, object]], offsets: Dict[str, Dict[str, int]]) -> None:
+        """
+        提交一个日志的处理结果：days是合并后的完整日汇总，offsets已包含该日志的新位置。
+        先把两者写入journal，再逐个写入汇总文件和偏移，最后删除journal；
+        中途崩溃时由下次load_offsets重放journal（写入的是合并后的结果，重放不会重复累加）
+        """
+        journal = {'site': site, 'days': {day.isoformat(): data for day, data in days.items()}, 'offsets': offsets}
+        self.write_json(self.journal_file(), journal)
+        self.apply_journal(journal)
+    
+    def apply_journal(self, journal: Dict[str, object]) -> None:
+        for day_text, data in journal['days'].items():
+            self.save_day(journal['site'], date.fromisoformat(day_text), data)
+        self.save_offsets(journal['offsets'])
+        os.remove(self.journal_file())
+    
+    def load_offsets(self) -> Dict[str, Dict[str, int]]:
+        """增量读取的日志位置（日志路径 -> {inode, offset}），先重放上次未完成的提交"""
+        try:
+            with open(self.journal_file(), 'r', encoding='utf-8') as f:
+                journal = json.load(f)
+        except ValueError:
+            # journal本身没写完时汇总和偏移都还没改动，直接丢弃
+            os.remove(self.journal_file())
+        except OSError:
+            pass
+        else:
+            self.apply_journal(journal)
+        try:
+            with open(os.path.join(self.root, ".offsets.json"), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def save_offsets(self, offsets: Dict[str, Dict[str, int]]) -> None:
+        self.write_json(os.path.join(self.root, ".offsets.json"), offsets)
+    
+    def in_retention(self, day: date, today: Optional[date] = None) -> bool:
+        """日期是否在保留期内"""
+        return day >= (today or date.today()) - timedelta(days=self.retention_days)
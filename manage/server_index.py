@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+server_name/listen全局索引
+沿nginx.conf的include树解析所有配置文件，建立 (server_name, 端口, ssl) -> 文件和行范围 的索引，
+按文件mtime增量更新并持久化。用于快速查找站点配置，以及检测和处理跨文件的重复server_name
+（nginx -t 的 "conflicting server name" 告警）
+"""
+
+import sys
+import os
+import glob
+import json
+from typing import Dict, List, Optional, Tuple
+
+from nginx_conf import ConfigParseError, iter_servers, listens, parse_file, server_names, vhost_files, walk
+from snapshot_store import snapshot_files
+
+NGINX_CONF = "/usr/local/nginx/conf/nginx.conf"
+VHOST_DIR = "/usr/local/nginx/conf/vhost"
+INDEX_FILE = os.path.expanduser("~/.cache/nginx-server-index.json")
+DUPLICATE_MARK = "# 重复server已注释: "
+
+def normalize_host(host: str) -> str:
+    """0.0.0.0与未写地址等价"""
+    return "*" if host in ("*", "0.0.0.0") else host
+
+def describe_file(path: str) -> Dict[str, object]:
+    """解析一个配置文件，返回其中的server块和include"""
+    entry: Dict[str, object] = {'servers': [], 'includes': [], 'proxy_pass': None}
+    try:
+        tree = parse_file(path)
+    except (OSError, ConfigParseError) as e:
+        entry['error'] = str(e)
+        return entry
+    
+    base_dir = os.path.dirname(NGINX_CONF)
+    for directive in walk(tree):
+        if directive.name == 'include' and directive.args:
+            pattern = directive.args[0]
+            if not os.path.isabs(pattern):
+                pattern = os.path.join(base_dir, pattern)
+            entry['includes'].append(pattern)
+        elif directive.name == 'proxy_pass' and directive.args and entry['proxy_pass'] is None:
+            entry['proxy_pass'] = directive.args[0]
+    
+    for server in iter_servers(tree):
+        server_listens = [(normalize_host(host), port, 'ssl' in flags or 'quic' in flags)
+                          for host, port, flags in listens(server)] or [("*", 80, False)]
+        entry['servers'].append({
+            'names': [name for name in server_names(server) if name] or [""],
+            'listens': server_listens,
+            'start': server.start,
+            'end': server.end,
+        })
+    return entry
+
+class ServerIndex:
+    def __init__(self, nginx_conf: str = NGINX_CONF, vhost_dir: str = VHOST_DIR, index_file: str = INDEX_FILE):
+        self.nginx_conf = nginx_conf
+        self.vhost_dir = vhost_dir
+        self.index_file = index_file
+        # 路径 -> {mtime_ns, size, servers, includes, proxy_pass}
+        self.files: Dict[str, Dict[str, object]] = {}
+        self.order: List[str] = []
+        self.dirty = False
+        # 最近一次resolve_conflicts修改前的快照ID
+        self.last_snapshot: Optional[str] = None
+        try:
+            with open(index_file, 'r', encoding='utf-8') as f:
+                self.files = json.load(f).get('files', {})
+        except (OSError, ValueError, AttributeError):
+            self.files = {}
+    
+    def file_entry(self, path: str) -> Optional[Dict[str, object]]:
+        """返回文件的索引条目，文件未变化时直接使用已保存的结果"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        entry = self.files.get(path)
+        if entry and entry.get('mtime_ns') == stat.st_mtime_ns and entry.get('size') == stat.st_size:
+            return entry
+        entry = describe_file(path)
+        entry['mtime_ns'] = stat.st_mtime_ns
+        entry['size'] = stat.st_size
+        self.files[path] = entry
+        self.dirty = True
+        return entry
+    
+    def refresh(self) -> None:
+        """按nginx的加载顺序遍历include树（包括未被include的vhost文件），更新有变化的文件"""
+        order: List[str] = []
+        seen = set()
+        
+        def visit(path: str) -> None:
+            if path in seen:
+                return
+            seen.add(path)
+            entry = self.file_entry(path)
+            if entry is None:
+                return
+            order.append(path)
+            for pattern in entry['includes']:
+                # nginx按字母顺序展开include通配符
+                for included in sorted(glob.glob(pattern)):
+                    visit(included)
+        
+        visit(self.nginx_conf)
+        for path in vhost_files(self.vhost_dir):
+            visit(path)
+        
+        removed = [path for path in self.files if path not in seen]
+        for path in removed:
+            del self.files[path]
+        self.dirty = self.dirty or bool(removed)
+        self.order = order
+        self.save()
+    
+    def save(self) -> None:
+        """保存索引（只在有变化时写入）"""
+        if not self.dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+            tmp_file = f"{self.index_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({'files': self.files}, f, ensure_ascii=False)
+            os.replace(tmp_file, self.index_file)
+            self.dirty = False
+        except OSError:
+            pass
+    
+    def entries(self) -> List[Dict[str, object]]:
+        """按加载顺序返回全部 (server_name, 地址, 端口, ssl) 记录"""
+        records = []
+        for path in self.order:
+            for server_idx, server in enumerate(self.files[path]['servers']):
+                for name in server['names']:
+                    for host, port, ssl in server['listens']:
+                        records.append({
+                            'name': name,
+                            'host': host,
+                            'port': port,
+                            'ssl': ssl,
+                            'file': path,
+                            'server': server_idx,
+                            # 行号从1开始，包含server行和右大括号
+                            'lines': [server['start'] + 1, server['end'] + 1],
+                        })
+        return records
+    
+    def lookup(self, name: str, port: Optional[int] = None) -> List[Dict[str, object]]:
+        """查找server_name（可限定端口）所在的文件和行范围"""
+        return [record for record in self.entries()
+                if record['name'] == name and (port is None or record['port'] == port)]
+    
+    def sites(self, paths: Optional[List[str]] = None) -> List[Tuple[str, str, str]]:
+        """每个站点的(首个server_name, 目标端口, 文件)，默认按vhost目录列表，也可由调用方给出顺序"""
+        result = []
+        for path in paths or vhost_files(self.vhost_dir):
+            entry = self.file_entry(os.path.abspath(path))
+            if not entry:
+                continue
+            names = [name for server in entry['servers'] for name in server['names'] if name]
+            target_port = "-"
+            proxy_pass = entry.get('proxy_pass')
+            if proxy_pass:
+                port = proxy_pass.rstrip('/').rsplit(':', 1)[-1]
+                target_port = port if port.isdigit() else "-"
+            result.append((names[0] if names else os.path.basename(path)[:-5], target_port, path))
+        return result
+    
+    def conflicts(self) -> List[Dict[str, object]]:
+        """同一 server_name 在同一地址:端口 上出现在多个server块中的情况"""
+        groups: Dict[Tuple[str, str, int], List[Dict[str, object]]] = {}
+        for record in self.entries():
+            if not record['name']:
+                continue
+            groups.setdefault((record['name'], record['host'], record['port']), []).append(record)
+        result = []
+        for (name, host, port), records in groups.items():
+            blocks = {(record['file'], record['server']) for record in records}
+            if len(blocks) > 1:
+                result.append({'name': name, 'host': host, 'port': port, 'records': records})
+        return result
+    
+    def resolve_conflicts(self, dry_run: bool = False) -> List[str]:
+        """
+        处理跨文件的重复server_name，保留nginx实际生效的第一个定义：
+        后出现的server块中所有名称和端口都已被前面的定义占用时注释掉整个块，
+        只有部分名称在全部端口上重复时从server_name中去掉这些名称，其余情况只报告
+        """
+        claimed = set()
+        edits: Dict[str, List[Tuple[str, Dict[str, object], List[str]]]] = {}
+        for path in self.order:
+            for server in self.files[path]['servers']:
+                names = [name for name in server['names'] if name]
+                keys = {(name, host, port) for name in names for host, port, _ in server['listens']}
+                shadowed = [name for name in names
+                            if all((name, host, port) in claimed for host, port, _ in server['listens'])]
+                if names and len(shadowed) == len(names):
+                    edits.setdefault(path, []).append(("comment", server, shadowed))
+                elif shadowed:
+                    edits.setdefault(path, []).append(("drop_names", server, shadowed))
+                claimed.update(keys)
+        
+        for path, file_edits in edits.items():
+            for action, server, shadowed in file_edits:
+                lines_desc = f"{path}:{server['start'] + 1}-{server['end'] + 1}"
+                if action == "comment":
+                    print(f"{'将注释' if dry_run else '注释'}重复的server块: {lines_desc} ({' '.join(shadowed)})")
+                else:
+                    print(f"{'将移除' if dry_run else '移除'}重复的server_name: {lines_desc} ({' '.join(shadowed)})")
+        self.last_snapshot = None
+        if dry_run or not edits:
+            return []
+        
+        # 所有要修改的文件放在同一个快照中，调用方验证失败时可以整体还原
+        self.last_snapshot = snapshot_files(list(edits), "dedup")
+        changed = [path for path, file_edits in edits.items() if self.apply_edits(path, file_edits)]
+        if changed:
+            self.refresh()
+        return changed
+    
+    def apply_edits(self, path: str, file_edits: List[Tuple[str, Dict[str, object], List[str]]]) -> bool:
+        """在文件中注释server块或删除重复的名称，按当前文件重新解析定位server_name指令的完整范围"""
+        try:
+            tree = parse_file(path)
+            with open(path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except (OSError, ConfigParseError) as e:
+            print(f"读取 {path} 失败，跳过: {e}", file=sys.stderr)
+            return False
+        servers = {server.start: server for server in iter_servers(tree)}
+        
+        changed = False
+        for action, indexed, shadowed in file_edits:
+            server = servers.get(indexed['start'])
+            if server is None or server.end != indexed['end']:
+                print(f"{path} 在建立索引后已变化，跳过第 {indexed['start'] + 1} 行的server块", file=sys.stderr)
+                continue
+            if action == "comment":
+                for i in range(server.start, server.end + 1):
+                    lines[i] = DUPLICATE_MARK + lines[i] if lines[i].strip() else lines[i]
+                changed = True
+                continue
+            for directive in server.children('server_name'):
+                kept = [name for name in directive.args if name not in shadowed]
+                if len(kept) == len(directive.args):
+                    continue
+                # 指令可能跨多行，整体替换；与其他指令写在同一行时无法安全修改
+                text = "".join(lines[directive.start:directive.end + 1]).strip()
+                if not text.startswith("server_name") or not text.endswith(";") or text.count(";") != 1:
+                    print(f"{path}:{directive.start + 1} 的server_name与其他内容写在同一行，请手动修改", file=sys.stderr)
+                    continue
+                first = lines[directive.start]
+                indent = first[:len(first) - len(first.lstrip())]
+                if kept:
+                    lines[directive.start] = f"{indent}server_name {' '.join(kept)};\n"
+                    for i in range(directive.start + 1, directive.end + 1):
+                        lines[i] = ""
+                else:
+                    for i in range(directive.start, directive.end + 1):
+                        lines[i] = f"{indent}{DUPLICATE_MARK}{lines[i].strip()}\n" if lines[i].strip() else lines[i]
+                changed = True
+        if not changed:
+            return False
+        tmp_file = f"{path}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        os.replace(tmp_file, path)
+        return True
+    
+    def print_conflicts(self, conflicts: List[Dict[str, object]]) -> None:
+        """输出冲突报告"""
+        if not conflicts:
+            print("未发现重复的server_name")
+            return
+        print(f"发现 {len(conflicts)} 处重复的server_name（nginx只使用第一个定义）:")
+        for conflict in conflicts:
+            host = "" if conflict['host'] == "*" else f"{conflict['host']}:"
+            print(f"  {conflict['name']} on {host}{conflict['port']}")
+            for idx, record in enumerate(conflict['records']):
+                state = "生效" if idx == 0 else "被忽略"
+                print(f"    [{state}] {record['file']}:{record['lines'][0]}-{record['lines'][1]}")
+
+def main():
+    if len(sys.argv) < 2:
+        print("用法: server_index.py <lookup|sites|conflicts|fix> [参数]")
+        print("  lookup <域名> [端口]  - 查找站点所在的配置文件和行范围")
+        print("  sites [配置文件...]   - 列出站点（域名|目标端口|配置文件）")
+        print("  conflicts [--json]    - 报告跨文件重复的server_name")
+        print("  fix [--dry-run]       - 处理重复的server_name（保留nginx实际生效的定义）")
+        sys.exit(1)
+    
+    action = sys.argv[1]
+    args = [arg for arg in sys.argv[2:] if not arg.startswith("--")]
+    index = ServerIndex()
+    index.refresh()
+    
+    if action == "lookup" and args:
+        port = int(args[1]) if len(args) > 1 and args[1].isdigit() else None
+        records = index.lookup(args[0], port)
+        if not records:
+            print(f"未找到 {args[0]}")
+            sys.exit(1)
+        for record in records:
+            print(f"{record['file']}:{record['lines'][0]}-{record['lines'][1]} "
+                  f"{record['host']}:{record['port']}{' ssl' if record['ssl'] else ''}")
+        sys.exit(0)
+    elif action == "sites":
+        for name, target_port, path in index.sites(args or None):
+            print(f"{name}|{target_port}|{path}")
+        sys.exit(0)
+    elif action == "conflicts":
+        conflicts = index.conflicts()
+        if "--json" in sys.argv:
+            print(json.dumps(conflicts, ensure_ascii=False, indent=2))
+        else:
+            index.print_conflicts(conflicts)
+        sys.exit(1 if conflicts else 0)
+    elif action == "fix":
+        changed = index.resolve_conflicts(dry_run="--dry-run" in sys.argv)
+        remaining = index.conflicts()
+        if remaining:
+            index.print_conflicts(remaining)
+        elif not changed:
+            print("未发现重复的server_name")
+        sys.exit(0)
+    else:
+        print(f"未知操作或缺少参数: {action}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+站点与证书清单
+单进程完成show_sites的全部查询：一次读取监听端口快照，用共享解析器解析每个vhost，
+在进程内解码证书颁发者和到期时间（按路径+mtime缓存），输出表格或JSON。
+status --all 在同一次解析中汇总每个站点的防盗链、流量限制、限速区域、SSL、后端和监听状态
+"""
+
+import sys
+import os
+import re
+import json
+import time
+import subprocess
+from typing import Dict, List, Optional, Set
+
+from cert_info import CertificateCache
+from nginx_conf import (ConfigParseError, Directive, is_ssl_server, iter_servers, listens, parse_file,
+                        server_names, vhost_files, walk)
+
+VHOST_DIR = "/usr/local/nginx/conf/vhost"
+NGINX_CONF = "/usr/local/nginx/conf/nginx.conf"
+REFERER_MAP_FILE = "/usr/local/nginx/conf/hotlink-referers.conf"
+REFERER_MAP_VAR = "$hotlink_referer_ok"
+
+def listening_ports() -> Set[int]:
+    """读取当前所有TCP监听端口（优先/proc/net/tcp*，不可用时执行一次ss）"""
+    ports: Set[int] = set()
+    found = False
+    for path in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(path, 'r') as f:
+                next(f, None)
+                for line in f:
+                    fields = line.split()
+                    # 第4列为连接状态，0A表示LISTEN
+                    if len(fields) > 3 and fields[3] == '0A':
+                        ports.add(int(fields[1].rsplit(':', 1)[1], 16))
+            found = True
+        except OSError:
+            continue
+    if found:
+        return ports
+    
+    try:
+        result = subprocess.run(['ss', '-lntH'], capture_output=True, text=True, timeout=10)
+        for line in result.stdout.splitlines():
+            fields = line.split()
+            if len(fields) > 3:
+                port = fields[3].rsplit(':', 1)[-1]
+                if port.isdigit():
+                    ports.add(int(port))
+    except Exception:
+        pass
+    return ports
+
+def directive_options(args: List[str]) -> Dict[str, str]:
+    """把 zone=xxx burst=10 nodelay 形式的参数转为字典"""
+    options = {}
+    for arg in args:
+        key, sep, value = arg.partition('=')
+        options[key] = value if sep else "on"
+    return options
+
+class SiteInventory:
+    def __init__(self, vhost_dir: str = VHOST_DIR, nginx_conf: str = NGINX_CONF):
+        self.vhost_dir = vhost_dir
+        self.nginx_conf = nginx_conf
+        self.certs = CertificateCache()
+        self.ports = listening_ports()
+        self._zones: Optional[Dict[str, Dict[str, Dict[str, str]]]] = None
+        self._referer_map_sizes: Optional[Dict[str, int]] = None
+    
+    def describe_site(self, conf_file: str, tree: Optional[List[Directive]] = None) -> Dict[str, object]:
+        """汇总一个vhost的站点信息（字段含义与show_sites一致）"""
+        site: Dict[str, object] = {
+            'conf': conf_file,
+            'server_name': os.path.basename(conf_file).rsplit('.conf', 1)[0],
+            'target_port': "-",
+            'type': "静态网页",
+            'status': "未监听",
+            'https': False,
+            'ca': "-",
+            'days': None,
+            'expired': False,
+            'not_after': None,
+        }
+        if tree is None:
+            try:
+                tree = parse_file(conf_file)
+            except (OSError, ConfigParseError) as e:
+                site['error'] = str(e)
+                return site
+        
+        for server in iter_servers(tree):
+            names = server_names(server)
+            if names:
+                site['server_name'] = names[0]
+                break
+        
+        proxy_pass = next((d.args[0] for d in walk(tree) if d.name == 'proxy_pass' and d.args), None)
+        if proxy_pass:
+            # proxy_pass指向upstream连接池时按池中的后端判断类型、端口和状态
+            pool = self.upstream_status(tree, proxy_pass)['pool']
+            targets = [f"http://{server}" for server in pool['servers']] if pool and pool['servers'] else [proxy_pass]
+            target = targets[0]
+            port_match = re.search(r'(\d+)/?$', target)
+            site['target_port'] = port_match.group(1) if port_match else "-"
+            if target.startswith("http://127.0.0.1"):
+                site['type'] = "本机端口"
+            elif re.match(r'^http://\d+\.\d+\.\d+\.\d+', target):
+                site['type'] = "公网IP"
+            else:
+                site['type'] = "域名"
+            for candidate in targets:
+                port_match = re.search(r':(\d+)/?$', candidate)
+                if port_match and int(port_match.group(1)) in self.ports:
+                    site['status'] = "运行中"
+                    break
+        
+        ssl_cert = next((d.args[0] for d in walk(tree) if d.name == 'ssl_certificate' and d.args), None)
+        if ssl_cert and os.path.isfile(ssl_cert):
+            site['https'] = True
+            site['cert'] = ssl_cert
+            info = self.certs.get(ssl_cert)
+            if info:
+                site['ca'] = info['issuer_cn'] or "-"
+                not_after = info['not_after']
+                if not_after is not None:
+                    site['not_after'] = int(not_after)
+                    remaining = not_after - time.time()
+                    if remaining > 0:
+                        site['days'] = int(remaining // 86400)
+                    else:
+                        site['expired'] = True
+        return site
+    
+    def zones(self) -> Dict[str, Dict[str, Dict[str, str]]]:
+        """读取主配置中定义的限速区域（整个进程只解析一次）"""
+        if self._zones is None:
+            self._zones = {'limit_req_zone': {}, 'limit_conn_zone': {}}
+            try:
+                tree = parse_file(self.nginx_conf)
+            except (OSError, ConfigParseError):
+                tree = []
+            for directive in walk(tree):
+                if directive.name in self._zones and directive.args:
+                    options = directive_options(directive.args[1:])
+                    name, _, size = options.get('zone', "").partition(':')
+                    if name:
+                        zone = {'key': directive.args[0], 'size': size}
+                        if 'rate' in options:
+                            zone['rate'] = options['rate']
+                        self._zones[directive.name][name] = zone
+        return self._zones
+    
+    def referer_map_size(self, map_var: str) -> int:
+        """共享防盗链map文件中某个站点（map变量）的来源规则数"""
+        if self._referer_map_sizes is None:
+            self._referer_map_sizes = {}
+            try:
+                tree = parse_file(REFERER_MAP_FILE)
+            except (OSError, ConfigParseError):
+                tree = []
+            for directive in tree:
+                if directive.name == 'map' and directive.block is not None and len(directive.args) > 1 \
+                        and directive.args[1].startswith(REFERER_MAP_VAR):
+                    self._referer_map_sizes[directive.args[1]] = sum(
+                        1 for entry in directive.block if entry.name not in ('default', 'hostnames'))
+        return self._referer_map_sizes.get(map_var, 0)
+    
+    def hotlink_status(self, tree: List[Directive]) -> Dict[str, object]:
+        """防盗链状态：valid_referers白名单或共享map模式"""
+        status: Dict[str, object] = {'enabled': False}
+        for directive in walk(tree):
+            if directive.name != 'location' or directive.block is None:
+                continue
+            referers = directive.first('valid_referers')
+            map_var = next((arg.strip('()') for check in directive.children('if') for arg in check.args
+                            if REFERER_MAP_VAR in arg), None)
+            if not referers and not map_var:
+                continue
+            status['enabled'] = True
+            status['location'] = " ".join(directive.args)
+            if referers:
+                status['mode'] = "referers"
+                status['referers'] = referers.args
+            else:
+                status['mode'] = "map"
+                status['map_rules'] = self.referer_map_size(map_var)
+            status['static_tuning'] = directive.first('open_file_cache') is not None
+            break
+        return status
+    
+    def rate_limit_status(self, server: Optional[Directive]) -> Dict[str, object]:
+        """流量限制状态和参数，以及引用的限速区域是否已在主配置中定义"""
+        status: Dict[str, object] = {'enabled': False}
+        if server is None:
+            return status
+        zones = self.zones()
+        limit_req = server.first('limit_req')
+        limit_conn = server.first('limit_conn')
+        if limit_req:
+            options = directive_options(limit_req.args)
+            zone = options.get('zone', "")
+            status['req'] = {
+                'zone': zone,
+                'burst': int(options['burst']) if options.get('burst', "").isdigit() else 0,
+                'nodelay': 'nodelay' in options,
+                'rate': zones['limit_req_zone'].get(zone, {}).get('rate'),
+                'zone_defined': zone in zones['limit_req_zone'],
+            }
+        if limit_conn and len(limit_conn.args) > 1:
+            zone = limit_conn.args[0]
+            status['conn'] = {
+                'zone': zone,
+                'limit': int(limit_conn.args[1]) if limit_conn.args[1].isdigit() else limit_conn.args[1],
+                'zone_defined': zone in zones['limit_conn_zone'],
+            }
+        body_size = server.first('client_max_body_size')
+        if body_size and body_size.args:
+            status['client_max_body_size'] = body_size.args[0]
+        req_status = server.first('limit_req_status')
+        if req_status and req_status.args:
+            status['status_code'] = int(req_status.args[0]) if req_status.args[0].isdigit() else req_status.args[0]
+        status['enabled'] = 'req' in status or 'conn' in status
+        return status
+    
+    def upstream_status(self, tree: List[Directive], proxy_pass: Optional[str]) -> Dict[str, object]:
+        """后端目标：直连地址或本文件中定义的upstream连接池"""
+        status: Dict[str, object] = {'proxy_pass': proxy_pass, 'pool': None}
+        if not proxy_pass:
+            return status
+        host = re.sub(r'^\w+://', '', proxy_pass).split('/', 1)[0]
+        for directive in tree:
+            if directive.name == 'upstream' and directive.args and directive.args[0] == host and directive.block is not None:
+                keepalive = directive.first('keepalive')
+                status['pool'] = {
+                    'name': host,
+                    'servers': [entry.args[0] for entry in directive.children('server') if entry.args],
+                    'keepalive': int(keepalive.args[0]) if keepalive and keepalive.args and keepalive.args[0].isdigit() else None,
+                }
+                break
+        targets = status['pool']['servers'] if status['pool'] else [host]
+        backends = []
+        for target in targets:
+            port_match = re.search(r':(\d+)$', target)
+            port = int(port_match.group(1)) if port_match else None
+            local = re.match(r'^(127\.0\.0\.1|localhost|\[::1\])(:|$)', target) is not None
+            # 只能判断本机后端是否在监听，远程后端记为未知
+            backends.append({'target': target, 'listening': (port in self.ports) if local and port else None})
+        status['backends'] = backends
+        return status
+    
+    def site_status(self, conf_file: str) -> Dict[str, object]:
+        """解析一次vhost，汇总站点全部功能状态"""
+        try:
+            tree = parse_file(conf_file)
+        except (OSError, ConfigParseError) as e:
+            site = self.describe_site(conf_file, [])
+            site['error'] = str(e)
+            return site
+        
+        site = self.describe_site(conf_file, tree)
+        servers = list(iter_servers(tree))
+        ssl_servers = [server for server in servers if is_ssl_server(server)]
+        # 流量限制写在server级别，优先取已配置限制的server
+        limited_server = next((server for server in servers if server.first('limit_req') or server.first('limit_conn')),
+                              servers[0] if servers else None)
+        
+        site['listeners'] = []
+        seen = set()
+        for server in servers:
+            for host, port, flags in listens(server):
+                if (host, port) in seen:
+                    continue
+                seen.add((host, port))
+                site['listeners'].append({'address': host, 'port': port, 'ssl': 'ssl' in flags,
+                                          'listening': port in self.ports})
+        site['ssl'] = {
+            'enabled': bool(ssl_servers),
+            'cert': site.get('cert'),
+            'issuer': site['ca'] if site['ca'] != "-" else None,
+            'days_left': site['days'],
+            'expired': site['expired'],
+            'http2': any('http2' in flags for server in ssl_servers for _, _, flags in listens(server))
+                     or any(d.name == 'http2' and d.args == ['on'] for server in ssl_servers for d in server.block),
+        }
+        site['hotlink'] = self.hotlink_status(tree)
+        site['rate_limit'] = self.rate_limit_status(limited_server)
+        proxy_pass = next((d.args[0] for d in walk(tree) if d.name == 'proxy_pass' and d.args), None)
+        site['upstream'] = self.upstream_status(tree, proxy_pass)
+        return site
+    
+    def collect_status(self, conf_files: Optional[List[str]] = None) -> Dict[str, object]:
+        """收集全部（或指定）站点的功能状态"""
+        sites = [self.site_status(conf_file) for conf_file in (conf_files or vhost_files(self.vhost_dir))]
+        self.certs.save()
+        return {'generated': int(time.time()), 'zones': self.zones(), 'sites': sites}
+    
+    def print_status(self, status: Dict[str, object]) -> None:
+        """输出站点功能总览表"""
+        line = "=" * 100
+        print(f"{'序号':<4} {'站点':<25} {'防盗链':<8} {'流量限制':<14} {'HTTPS':<10} {'后端':<24} {'后端状态':<8}")
+        print(line)
+        for idx, site in enumerate(status['sites'], 1):
+            hotlink = site.get('hotlink', {})
+            hotlink_text = ("map" if hotlink.get('mode') == "map" else "是") if hotlink.get('enabled') else "否"
+            rate_limit = site.get('rate_limit', {})
+            if rate_limit.get('enabled'):
+                req = rate_limit.get('req', {})
+                conn = rate_limit.get('conn', {})
+                rate_text = f"{req.get('rate') or '-'}/{conn.get('limit', '-')}"
+                if not req.get('zone_defined', True) or not conn.get('zone_defined', True):
+                    rate_text += "!"
+            else:
+                rate_text = "否"
+            ssl = site.get('ssl', {})
+            if not ssl.get('enabled'):
+                https_text = "否"
+            elif ssl.get('expired'):
+                https_text = "过期"
+            else:
+                https_text = f"{ssl['days_left']}天" if ssl.get('days_left') is not None else "是"
+            upstream = site.get('upstream', {})
+            backends = upstream.get('backends', [])
+            target = upstream['pool']['name'] if upstream.get('pool') else (backends[0]['target'] if backends else "-")
+            states = [backend['listening'] for backend in backends]
+            if not states:
+                state_text = "-"
+            elif all(state is None for state in states):
+                state_text = "未知"
+            else:
+                state_text = "运行中" if any(states) else "未监听"
+            print(f"{idx:<4} {site['server_name']:<25} {hotlink_text:<8} {rate_text:<14} {https_text:<10} "
+                  f"{target:<24} {state_text:<8}")
+        print(line)
+        print("流量限制列为 请求速率/每IP连接数，带!表示引用的限速区域未在主配置中定义")
+    
+    def collect(self) -> List[Dict[str, object]]:
+        """收集全部站点信息"""
+        sites = [self.describe_site(conf_file) for conf_file in vhost_files(self.vhost_dir)]
+        self.certs.save()
+        return sites
+    
+    def print_table(self, sites: List[Dict[str, object]]) -> None:
+        """按show_sites的格式输出表格"""
+        line = "=" * 90
+        print(f"{'序号':<4} {'站点':<25} {'目标端口':<10} {'类型':<8} {'状态':<8} {'HTTPS':<8} {'证书颁发机构':<18} {'剩余天数':<8}")
+        print(line)
+        for idx, site in enumerate(sites, 1):
+            if site['expired']:
+                days = "过期"
+            elif site['days'] is None:
+                days = "-"
+            else:
+                days = str(site['days'])
+            print(f"{idx:<4} {site['server_name']:<25} {site['target_port']:<10} {site['type']:<8} "
+                  f"{site['status']:<8} {'是' if site['https'] else '否':<8} {site['ca']:<18} {days:<8}")
+        print(line)
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "status":
+        as_json = "--json" in sys.argv
+        conf_files = [arg for arg in sys.argv[2:] if not arg.startswith("--")]
+        if "--all" not in sys.argv and not conf_files:
+            print("用法: site-inventory.py status --all|<conf_file>... [--json]")
+            sys.exit(1)
+        inventory = SiteInventory()
+        status = inventory.collect_status(conf_files or None)
+        if as_json:
+            print(json.dumps(status, ensure_ascii=False, indent=2))
+        else:
+            inventory.print_status(status)
+        sys.exit(0)
+    
+    if len(sys.argv) > 2 or (len(sys.argv) == 2 and sys.argv[1] != "--json"):
+        print("用法: site-inventory.py [--json]")
+        print("      site-inventory.py status --all|<conf_file>... [--json]")
+        sys.exit(1)
+    
+    as_json = len(sys.argv) == 2
+    inventory = SiteInventory()
+    if not os.path.isdir(inventory.vhost_dir):
+        print("[]" if as_json else "当前无已配置站点。")
+        sys.exit(0)
+    
+    sites = inventory.collect()
+    if as_json:
+        print(json.dumps(sites, ensure_ascii=False, indent=2))
+    else:
+        inventory.print_table(sites)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
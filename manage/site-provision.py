@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+"""
+按站点清单批量生成反向代理/静态站点配置
+清单（YAML/CSV/JSON）中每个站点可指定域名、后端、SSL、防盗链来源、流量限制档位和重定向，
+用预编译的模板并行生成vhost，与现有配置对比检查server_name冲突，全部写入后只做一次验证和重载，
+验证失败时恢复原配置。重复应用同一份清单不会产生任何修改
+"""
+
+import sys
+import os
+import re
+import csv
+import json
+from concurrent.futures import ProcessPoolExecutor
+from string import Template
+from typing import Dict, List, Optional, Tuple
+
+from reload_coordinator import ReloadCoordinator
+from server_index import ServerIndex
+from snapshot_store import snapshot_files
+
+NGINX_CONF = "/usr/local/nginx/conf/nginx.conf"
+VHOST_DIR = "/usr/local/nginx/conf/vhost"
+MANAGED_HEADER = "# 由 site-provision.py 根据站点清单生成，手动修改会在下次应用清单时被覆盖\n"
+RATE_LIMIT_MARKER = "# 流量限制配置"
+HOTLINK_MARKER = "# 防盗链配置"
+# 其他脚本写入vhost的配置块标记，重新生成会丢失这些配置
+FOREIGN_MARKERS = {
+    "# 自动封禁": "abuse-detector.py",
+    "# 站点访问日志": "access-log-manager.py",
+    "# 反向代理缓存配置": "cache-manager.py",
+    "# ACME验证": "cert-renewal.py",
+    "# 静态预压缩配置": "precompress.py",
+    "# TLS握手优化": "tls-manager.py",
+    "# 上游连接池配置": "upstream-manager.py",
+    "# 原始地址:": "upstream-manager.py",
+    "# 重定向规则表": "redirect-map.py",
+}
+
+# 与proxy-config.sh中流量限制的档位一致：(每秒请求数, 并发连接数, 请求体大小KB, burst)
+RATE_ZONES_MARKER = "# 流量限制区域定义"
+CONN_ZONE = "conn_limit_per_ip"
+RATE_PROFILES = {
+    'basic': (10, 5, 1024, 20),
+    'medium': (5, 3, 512, 10),
+    'strict': (2, 1, 256, 3),
+}
+DOMAIN_PATTERN = re.compile(r'^(\*\.)?[A-Za-z0-9]([A-Za-z0-9-]*[A-Za-z0-9])?(\.[A-Za-z0-9]([A-Za-z0-9-]*[A-Za-z0-9])?)*$')
+# 写入配置的值不允许包含会破坏指令结构的字符
+UNSAFE_VALUE = re.compile(r'[\s;{}"\'#]')
+
+# 模板在模块加载时编译一次，各工作进程直接复用
+SERVER_TEMPLATE = Template("""server {
+    listen $listen;
+    server_name $names;
+$body}
+""")
+SSL_TEMPLATE = Template("""    ssl_certificate $cert;
+    ssl_certificate_key $key;
+    ssl_protocols TLSv1.2 TLSv1.3;
+    ssl_ciphers HIGH:!aNULL:!MD5;
+""")
+PROXY_TEMPLATE = Template("""    location / {
+        proxy_pass $backend;
+        proxy_set_header Host $$host;
+        proxy_set_header X-Real-IP $$remote_addr;
+        proxy_set_header X-Forwarded-For $$proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $$scheme;
+    }
+""")
+STATIC_TEMPLATE = Template("""    root $root;
+    index index.html index.htm;
+    location / {
+        try_files $$uri $$uri/ =404;
+    }
+""")
+FORCE_HTTPS_TEMPLATE = Template("""    location / {
+        return 301 https://$$host$$request_uri;
+    }
+""")
+RATE_LIMIT_TEMPLATE = Template(f"""    {RATE_LIMIT_MARKER}
+    client_max_body_size ${{body_size}}k;
+    limit_req zone=$zone burst=$burst nodelay;
+    limit_conn conn_limit_per_ip $conn;
+    limit_req_status 429;
+    limit_conn_status 429;
+""")
+HOTLINK_TEMPLATE = Template(f"""    {HOTLINK_MARKER}
+    location ~* \\.(gif|jpg|jpeg|png|bmp|swf|flv|mp4|ico|webp)$$ {{
+        valid_referers $referers;
+        if ($$invalid_referer) {{
+            return 403;
+        }}
+    }}
+""")
+REDIRECT_TEMPLATE = Template("""    location = $source {
+        return $code $target;
+    }
+""")
+
+class ManifestError(ValueError):
+    pass
+
+def split_list(value) -> List[str]:
+    """清单中的列表字段既可以写成列表，也可以写成空格/逗号分隔的字符串"""
+    if value is None or value == "":
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(item).strip() for item in value if str(item).strip()]
+    return [item for item in re.split(r'[\s,]+', str(value)) if item]
+
+def parse_bool(value) -> bool:
+    return str(value).strip().lower() in ("1", "true", "yes", "y", "on")
+
+def parse_redirects(value) -> List[Dict[str, object]]:
+    """重定向：[{from, to, code}] 或 "/old=/new /a=https://b/@302" 形式的字符串"""
+    if isinstance(value, list) and all(isinstance(item, dict) for item in value):
+        items = value
+    else:
+        items = []
+        for token in split_list(value):
+            if "=" not in token:
+                raise ManifestError(f"无效的重定向: {token}（应为 源路径=目标）")
+            source, target = token.split("=", 1)
+            code = 301
+            if "@" in target:
+                target, code_text = target.rsplit("@", 1)
+                code = int(code_text) if code_text.isdigit() else 0
+            items.append({'from': source, 'to': target, 'code': code})
+    redirects = []
+    for item in items:
+        source, target, code = str(item.get('from', '')), str(item.get('to', '')), int(item.get('code', 301))
+        if not source.startswith("/") or not target or UNSAFE_VALUE.search(source + target):
+            raise ManifestError(f"无效的重定向: {source} -> {target}")
+        if code not in (301, 302, 307, 308):
+            raise ManifestError(f"不支持的重定向状态码: {code}")
+        redirects.append({'from': source, 'to': target, 'code': code})
+    return redirects
+
+def normalize_site(raw: Dict[str, object]) -> Dict[str, object]:
+    """校验清单中的一个站点并转换为统一格式"""
+    domain = str(raw.get('domain') or "").strip().lower()
+    if not DOMAIN_PATTERN.match(domain):
+        raise ManifestError(f"无效的域名: {domain or '(空)'}")
+    site: Dict[str, object] = {'domain': domain}
+    aliases = [alias.lower() for alias in split_list(raw.get('aliases'))]
+    for alias in aliases:
+        if not DOMAIN_PATTERN.match(alias):
+            raise ManifestError(f"{domain}: 无效的别名 {alias}")
+    site['names'] = [domain] + [alias for alias in aliases if alias != domain]
+    
+    listen = str(raw.get('listen') or 80)
+    if not listen.isdigit() or not 0 < int(listen) < 65536:
+        raise ManifestError(f"{domain}: 无效的监听端口 {listen}")
+    site['listen'] = int(listen)
+    
+    backend = str(raw.get('backend') or "").strip()
+    root = str(raw.get('root') or "").strip()
+    if bool(backend) == bool(root):
+        raise ManifestError(f"{domain}: backend（反代目标）和root（静态目录）需要且只能指定一个")
+    if backend:
+        # 与add_proxy相同：纯端口为本机端口，IP:端口/域名补全为http地址
+        if backend.isdigit():
+            backend = f"http://127.0.0.1:{backend}"
+        elif not re.match(r'^https?://', backend):
+            backend = f"http://{backend}"
+        if UNSAFE_VALUE.search(backend):
+            raise ManifestError(f"{domain}: 无效的后端地址 {backend}")
+    if root and (not root.startswith("/") or UNSAFE_VALUE.search(root)):
+        raise ManifestError(f"{domain}: 静态目录应为不含空白和特殊字符的绝对路径")
+    site['backend'] = backend or None
+    site['root'] = root or None
+    
+    ssl = str(raw.get('ssl', "")).strip().lower()
+    if ssl in ("force", "forced"):
+        site['ssl'] = "force"
+    else:
+        site['ssl'] = "on" if parse_bool(ssl) else "off"
+    for key in ('cert', 'key'):
+        value = str(raw.get(key) or "").strip()
+        if value and UNSAFE_VALUE.search(value):
+            raise ManifestError(f"{domain}: 无效的证书路径 {value}")
+        site[key] = value or None
+    
+    referers = split_list(raw.get('referers'))
+    if any(UNSAFE_VALUE.search(referer) for referer in referers):
+        raise ManifestError(f"{domain}: 无效的防盗链来源")
+    site['referers'] = referers
+    
+    profile = str(raw.get('rate_limit') or "").strip().lower()
+    if profile in ("", "off", "none"):
+        profile = ""
+    elif profile not in RATE_PROFILES:
+        raise ManifestError(f"{domain}: 未知的流量限制档位 {profile}（可选: {', '.join(RATE_PROFILES)}）")
+    site['rate_limit'] = profile or None
+    site['redirects'] = parse_redirects(raw.get('redirects'))
+    return site
+
+def load_manifest(path: str) -> List[Dict[str, object]]:
+    """读取清单，按扩展名识别YAML/CSV/JSON"""
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, 'r', encoding='utf-8') as f:
+        if ext == ".csv":
+            data = [row for row in csv.DictReader(f) if any((value or "").strip() for value in row.values())]
+        elif ext in (".yaml", ".yml"):
+            try:
+                import yaml
+            except ImportError:
+                raise ManifestError("读取YAML清单需要PyYAML（pip install pyyaml），也可以改用JSON/CSV清单")
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('sites')
+    if not isinstance(data, list):
+        raise ManifestError("清单格式应为站点列表，或包含sites列表的对象")
+    
+    sites = []
+    errors = []
+    for idx, raw in enumerate(data, 1):
+        try:
+            if not isinstance(raw, dict):
+                raise ManifestError("条目应为对象")
+            sites.append(normalize_site(raw))
+        except (ManifestError, ValueError) as e:
+            errors.append(f"第{idx}个站点: {e}")
+    seen: Dict[Tuple[str, int], int] = {}
+    for idx, site in enumerate(sites):
+        for name in site['names']:
+            for port in listen_ports(site):
+                owner = seen.setdefault((name, port), idx)
+                if owner != idx:
+                    errors.append(f"{name}:{port} 在清单中重复（{sites[owner]['domain']} 与 {site['domain']}）")
+    if errors:
+        raise ManifestError("\n".join(errors))
+    return sites
+
+def req_zone(profile: str) -> str:
+    """每个档位使用单独的limit_req_zone，速率随档位不同"""
+    return f"site_req_{profile}"
+
+def listen_ports(site: Dict[str, object]) -> List[int]:
+    return [site['listen'], 443] if site['ssl'] != "off" else [site['listen']]
+
+def find_certificate(site: Dict[str, object]) -> Optional[Tuple[str, str]]:
+    """清单未指定证书时，按proxy-config.sh的顺序查找标准路径、certbot和acme.sh证书"""
+    if site['cert'] and site['key']:
+        return site['cert'], site['key']
+    domain = site['domain']
+    home = os.path.expanduser("~")
+    candidates = [
+        (f"/etc/nginx/ssl/{domain}.crt", f"/etc/nginx/ssl/{domain}.key"),
+        (f"/etc/letsencrypt/live/{domain}/fullchain.pem", f"/etc/letsencrypt/live/{domain}/privkey.pem"),
+        (f"{home}/.acme.sh/{domain}/fullchain.cer", f"{home}/.acme.sh/{domain}/{domain}.key"),
+        (f"{home}/.acme.sh/{domain}_ecc/fullchain.cer", f"{home}/.acme.sh/{domain}_ecc/{domain}.key"),
+    ]
+    for cert, key in candidates:
+        if os.path.isfile(cert) and os.path.isfile(key):
+            return cert, key
+    return None
+
+def render_site(site: Dict[str, object]) -> Tuple[str, Optional[str], Optional[str]]:
+    """生成一个站点的完整配置，返回(域名, 配置内容, 错误)；在工作进程中执行"""
+    parts = []
+    if site['rate_limit']:
+        _, conn, body_size, burst = RATE_PROFILES[site['rate_limit']]
+        parts.append(RATE_LIMIT_TEMPLATE.substitute(zone=req_zone(site['rate_limit']), body_size=body_size,
+                                                    burst=burst, conn=conn))
+    for redirect in site['redirects']:
+        parts.append(REDIRECT_TEMPLATE.substitute(source=redirect['from'], code=redirect['code'],
+                                                         target=redirect['to']))
+    if site['referers']:
+        parts.append(HOTLINK_TEMPLATE.substitute(referers=" ".join(site['referers'])))
+    if site['backend']:
+        parts.append(PROXY_TEMPLATE.substitute(backend=site['backend']))
+    else:
+        parts.append(STATIC_TEMPLATE.substitute(root=site['root']))
+    body = "".join(parts)
+    names = " ".join(site['names'])
+    
+    servers = []
+    if site['ssl'] == "force":
+        servers.append(SERVER_TEMPLATE.substitute(listen=site['listen'], names=names,
+                                                  body=FORCE_HTTPS_TEMPLATE.substitute()))
+    else:
+        servers.append(SERVER_TEMPLATE.substitute(listen=site['listen'], names=names, body=body))
+    if site['ssl'] != "off":
+        cert = find_certificate(site)
+        if cert is None:
+            return site['domain'], None, "未找到SSL证书（可在清单中用cert/key指定）"
+        ssl_body = SSL_TEMPLATE.substitute(cert=cert[0], key=cert[1]) + body
+        servers.append(SERVER_TEMPLATE.substitute(listen="443 ssl", names=names, body=ssl_body))
+    return site['domain'], MANAGED_HEADER + "".join(servers), None
+
+def foreign_tools(content: str) -> List[str]:
+    """配置中由其他脚本添加的配置块对应的脚本名（TLS优化的标记也可能写在行尾）"""
+    tools = []
+    for line in content.splitlines():
+        if "#" not in line:
+            continue
+        comment = line[line.index("#"):].strip()
+        tool = next((tool for marker, tool in FOREIGN_MARKERS.items() if comment.startswith(marker)), None)
+        if tool and tool not in tools:
+            tools.append(tool)
+    return tools
+
+class SiteProvisioner:
+    def __init__(self, vhost_dir: str = VHOST_DIR, nginx_conf: str = NGINX_CONF):
+        self.vhost_dir = vhost_dir
+        self.nginx_conf = nginx_conf
+    
+    def conf_path(self, domain: str) -> str:
+        return os.path.join(self.vhost_dir, f"{domain}.conf")
+    
+    def render_all(self, sites: List[Dict[str, object]], workers: Optional[int] = None) -> Tuple[Dict[str, str], List[str]]:
+        """并行生成全部站点配置，返回(域名 -> 配置内容, 错误列表)"""
+        rendered: Dict[str, str] = {}
+        errors = []
+        if len(sites) < 50 or workers == 1:
+            results = map(render_site, sites)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(render_site, sites, chunksize=32))
+        for domain, content, error in results:
+            if error:
+                errors.append(f"{domain}: {error}")
+            else:
+                rendered[domain] = content
+        return rendered, errors
+    
+    def plan(self, sites: List[Dict[str, object]], rendered: Dict[str, str],
+             force: bool = False) -> Tuple[Dict[str, List[str]], List[str]]:
+        """对比现有配置，返回({create, update, unchanged}, 冲突列表)"""
+        changes: Dict[str, List[str]] = {'create': [], 'update': [], 'unchanged': []}
+        conflicts = []
+        index = ServerIndex(self.nginx_conf, self.vhost_dir)
+        index.refresh()
+        for site in sites:
+            domain = site['domain']
+            path = self.conf_path(domain)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    current = f.read()
+            except OSError:
+                current = None
+            if current is not None and not current.startswith(MANAGED_HEADER) and not force:
+                conflicts.append(f"{domain}: {path} 已存在且不是由清单生成的（确认覆盖请加 --force）")
+                continue
+            for name in site['names']:
+                for port in listen_ports(site):
+                    for record in index.lookup(name, port):
+                        if os.path.realpath(record['file']) != os.path.realpath(path):
+                            conflicts.append(f"{name}:{port} 已在 {record['file']} 第{record['lines'][0]}行定义")
+            if current is None:
+                changes['create'].append(domain)
+            elif current != rendered[domain]:
+                tools = foreign_tools(current)
+                if tools and not force:
+                    conflicts.append(f"{domain}: {path} 中有 {'、'.join(tools)} 添加的配置，重新生成会丢失"
+                                     f"（先用对应脚本移除，或确认覆盖请加 --force）")
+                    continue
+                if tools:
+                    print(f"警告: {path} 中 {'、'.join(tools)} 添加的配置将被覆盖，需要时请重新运行对应脚本")
+                changes['update'].append(domain)
+            else:
+                changes['unchanged'].append(domain)
+        return changes, conflicts
+    
+    def zone_lines(self, profiles: List[str]) -> Optional[List[str]]:
+        """nginx.conf缺少所用档位的限速区域定义或速率不一致时，返回补上/更新定义后的内容"""
+        with open(self.nginx_conf, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        zone_pattern = re.compile(r'^\s*limit_(req|conn)_zone\s+[^;]*\bzone=([\w-]+):')
+        defined = {}
+        for i, line in enumerate(lines):
+            match = zone_pattern.match(line)
+            if match:
+                defined[match.group(2)] = i
+        
+        changed = False
+        missing = []
+        for profile in sorted(set(profiles)):
+            zone = req_zone(profile)
+            definition = (f"    limit_req_zone $binary_remote_addr zone={zone}:10m "
+                          f"rate={RATE_PROFILES[profile][0]}r/s;\n")
+            if zone not in defined:
+                missing.append(definition)
+            elif lines[defined[zone]] != definition:
+                lines[defined[zone]] = definition
+                changed = True
+        if CONN_ZONE not in defined:
+            missing.append(f"    limit_conn_zone $binary_remote_addr zone={CONN_ZONE}:10m;\n")
+        if missing:
+            http_start = next((i for i, line in enumerate(lines) if re.match(r'\s*http\s*{', line)), None)
+            if http_start is None:
+                raise ManifestError("未找到http块，无法添加限速区域")
+            if not any(line.strip() == RATE_ZONES_MARKER for line in lines):
+                missing.insert(0, f"    {RATE_ZONES_MARKER}\n")
+            lines[http_start + 1:http_start + 1] = missing
+            changed = True
+        return lines if changed else None
+    
+    def write_all(self, files: Dict[str, str]) -> Dict[str, Optional[str]]:
+        """先写完全部临时文件再逐个替换，返回原内容（新文件为None）用于回滚"""
+        previous: Dict[str, Optional[str]] = {}
+        for path in files:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    previous[path] = f.read()
+            except OSError:
+                previous[path] = None
+        snapshot_files([path for path, content in previous.items() if content is not None], "site-provision")
+        
+        os.makedirs(self.vhost_dir, exist_ok=True)
+        tmp_files = []
+        try:
+            for path, content in files.items():
+                tmp_file = f"{path}.provision.tmp"
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                tmp_files.append((tmp_file, path))
+        except OSError:
+            for tmp_file, _ in tmp_files:
+                os.remove(tmp_file)
+            raise
+        for tmp_file, path in tmp_files:
+            os.replace(tmp_file, path)
+        return previous
+    
+    def rollback(self, previous: Dict[str, Optional[str]]) -> None:
+        for path, content in previous.items():
+            if content is None:
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(content)
+    
+    def apply(self, manifest: str, force: bool = False, dry_run: bool = False,
+              workers: Optional[int] = None) -> bool:
+        try:
+            sites = load_manifest(manifest)
+        except (OSError, ValueError) as e:
+            print(f"清单有误:\n{e}")
+            return False
+        rendered, errors = self.render_all(sites, workers)
+        if errors:
+            print("生成配置失败:\n" + "\n".join(errors))
+            return False
+        changes, conflicts = self.plan(sites, rendered, force)
+        if conflicts:
+            print("与现有配置冲突，未做任何修改:\n" + "\n".join(conflicts))
+            return False
+        
+        print(f"清单共 {len(sites)} 个站点：新增 {len(changes['create'])}，更新 {len(changes['update'])}，"
+              f"无变化 {len(changes['unchanged'])}")
+        for action, label in (('create', "新增"), ('update', "更新")):
+            for domain in changes[action]:
+                print(f"  {label}: {domain}")
+        if dry_run or not changes['create'] and not changes['update']:
+            return True
+        
+        files = {self.conf_path(domain): rendered[domain] for domain in changes['create'] + changes['update']}
+        try:
+            profiles = [site['rate_limit'] for site in sites if site['rate_limit']]
+            if profiles:
+                zone_lines = self.zone_lines(profiles)
+                if zone_lines is not None:
+                    files[self.nginx_conf] = "".join(zone_lines)
+            previous = self.write_all(files)
+        except (OSError, ValueError) as e:
+            print(f"写入配置失败，未做任何修改: {e}")
+            return False
+        
+        if not ReloadCoordinator(debounce=0).notify("site-provision"):
+            self.rollback(previous)
+            print("验证或重载失败，已恢复本次修改前的配置")
+            return False
+        print(f"已写入 {len(previous)} 个配置文件并重载")
+        return True
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ("plan", "apply"):
+        print("用法: site-provision.py <plan|apply> <清单文件(.yaml/.csv/.json)> [--force] [--workers=N]")
+        print("  plan   - 只检查并列出将要新增/更新的站点")
+        print("  apply  - 生成配置，全部写入后验证并重载一次（失败时恢复）")
+        print("清单字段: domain, aliases, listen, backend 或 root, ssl(true/false/force), cert, key,")
+        print(f"          referers, rate_limit({'/'.join(RATE_PROFILES)}), redirects(/旧路径=目标[@302] ...)")
+        sys.exit(1)
+    
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[3:] if arg.startswith("--") and "=" in arg)
+    workers = int(options["workers"]) if options.get("workers", "").isdigit() else None
+    provisioner = SiteProvisioner()
+    ok = provisioner.apply(sys.argv[2], force="--force" in sys.argv, dry_run=sys.argv[1] == "plan",
+                           workers=workers)
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""
+配置快照存储
+按内容哈希把文件存入对象目录，每次快照只记录一份清单（路径 -> 哈希/权限/mtime），
+未变化的文件不占用额外空间。支持还原单个vhost或整棵目录树，并按保留策略清理旧快照：
+每种标签（各管理脚本的修改前快照、pre-restore等）分别保留，backup-nginx.sh创建的完整备份（backup）
+使用单独的、更长的保留策略，不会被频繁的配置修改挤掉
+"""
+
+import sys
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+STORE_DIR = os.environ.get("NGINX_SNAPSHOT_DIR", "/usr/local/nginx/snapshots")
+VHOST_DIR = "/usr/local/nginx/conf/vhost"
+CONF_ROOTS = ["/usr/local/nginx/conf", "/usr/local/nginx/ssl", "/etc/nginx/ssl"]
+FULL_ROOTS = CONF_ROOTS + ["/usr/local/nginx/html"]
+
+KEEP_SNAPSHOTS = 10
+KEEP_DAYS = 30
+BACKUP_LABEL = "backup"
+KEEP_BACKUPS = 10
+KEEP_BACKUP_DAYS = 365
+CHUNK_SIZE = 1024 * 1024
+# 索引追加日志超过该条数时在gc中合并回index.json
+INDEX_LOG_COMPACT = 10000
+
+def file_digest(path: str) -> str:
+    """计算文件内容的sha256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def iter_files(roots: Iterable[str], exclude: str = STORE_DIR) -> Iterable[str]:
+    """遍历目录树中的普通文件和符号链接（跳过快照目录自身）"""
+    for root in roots:
+        if os.path.isfile(root) or os.path.islink(root):
+            yield os.path.abspath(root)
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if os.path.join(dirpath, d) != exclude)
+            for name in sorted(filenames):
+                yield os.path.join(dirpath, name)
+
+class SnapshotStore:
+    def __init__(self, store_dir: str = STORE_DIR):
+        self.store_dir = store_dir
+        self.objects_dir = os.path.join(store_dir, "objects")
+        self.manifests_dir = os.path.join(store_dir, "manifests")
+        self.index_file = os.path.join(store_dir, "index.json")
+        # 各管理脚本的小快照只把变化的索引项追加到日志，不重写整个index.json
+        self.index_log = os.path.join(store_dir, "index.log")
+        self.lock_file = os.path.join(store_dir, ".lock")
+        # 路径 -> [size, mtime_ns, inode, hash]，文件未变化时不重新计算哈希
+        self.index: Dict[str, List] = {}
+        self.index_updates: Dict[str, Optional[List]] = {}
+        self.index_log_entries = 0
+        self.load_index()
+    
+    def load_index(self) -> None:
+        """读取index.json并重放追加日志（最后一行可能未写完，忽略无法解析的行）"""
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+        self.index_log_entries = 0
+        try:
+            with open(self.index_log, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        path, entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.index_log_entries += 1
+                    if entry is None:
+                        self.index.pop(path, None)
+                    else:
+                        self.index[path] = entry
+        except OSError:
+            pass
+    
+    def append_index_updates(self) -> None:
+        if not self.index_updates:
+            return
+        with open(self.index_log, 'a', encoding='utf-8') as f:
+            f.write("".join(json.dumps([path, entry], ensure_ascii=False) + "\n"
+                            for path, entry in self.index_updates.items()))
+        self.index_log_entries += len(self.index_updates)
+        self.index_updates = {}
+    
+    def compact_index(self) -> None:
+        """把索引写回index.json并清空追加日志（需持有锁）"""
+        self.write_json(self.index_file, self.index)
+        if os.path.exists(self.index_log):
+            os.remove(self.index_log)
+        self.index_log_entries = 0
+    
+    @contextmanager
+    def locked(self):
+        """create和gc互斥：gc不能删除正在创建的快照引用的对象"""
+        os.makedirs(self.store_dir, exist_ok=True)
+        with open(self.lock_file, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+    
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest[2:])
+    
+    def store_file(self, path: str, stat: os.stat_result) -> Tuple[str, int]:
+        """把文件存入对象目录，返回(哈希, 新增字节数)"""
+        cached = self.index.get(path)
+        if cached and cached[:3] == [stat.st_size, stat.st_mtime_ns, stat.st_ino] \
+                and os.path.exists(self.object_path(cached[3])):
+            return cached[3], 0
+        
+        digest = file_digest(path)
+        self.index[path] = self.index_updates[path] = [stat.st_size, stat.st_mtime_ns, stat.st_ino, digest]
+        target = self.object_path(digest)
+        if os.path.exists(target):
+            return digest, 0
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp_file = f"{target}.tmp{os.getpid()}"
+        shutil.copyfile(path, tmp_file)
+        # 复制过程中文件被修改时以实际写入的内容为准，下次重新计算哈希
+        actual = file_digest(tmp_file)
+        if actual != digest:
+            digest = actual
+            self.index.pop(path, None)
+            self.index_updates[path] = None
+            target = self.object_path(digest)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(tmp_file, target)
+        return digest, stat.st_size
+    
+    def create(self, roots: Iterable[str], label: str = "manual") -> Optional[Dict[str, object]]:
+        """创建一个快照，返回清单"""
+        roots = [os.path.abspath(root) for root in roots if os.path.lexists(root)]
+        if not roots:
+            return None
+        
+        with self.locked():
+            # 其他进程可能刚更新过索引
+            self.load_index()
+            files: Dict[str, Dict[str, object]] = {}
+            added_bytes = 0
+            total_bytes = 0
+            for path in iter_files(roots, os.path.abspath(self.store_dir)):
+                try:
+                    stat = os.lstat(path)
+                    if os.path.islink(path):
+                        files[path] = {'link': os.readlink(path), 'uid': stat.st_uid, 'gid': stat.st_gid}
+                        continue
+                    if not os.path.isfile(path):
+                        continue
+                    digest, added = self.store_file(path, stat)
+                except OSError as e:
+                    print(f"跳过无法读取的文件 {path}: {e}", file=sys.stderr)
+                    continue
+                files[path] = {'hash': digest, 'mode': stat.st_mode & 0o7777, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+                               'uid': stat.st_uid, 'gid': stat.st_gid}
+                added_bytes += added
+                total_bytes += stat.st_size
+        
+            created = time.time()
+            snapshot_id = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(created))}-{label}"
+            suffix = 1
+            while os.path.exists(os.path.join(self.manifests_dir, f"{snapshot_id}.json")):
+                suffix += 1
+                snapshot_id = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(created))}-{label}-{suffix}"
+            manifest = {
+                'id': snapshot_id,
+                'time': int(created),
+                'label': label,
+                'roots': roots,
+                'files': files,
+                'total_bytes': total_bytes,
+                'added_bytes': added_bytes,
+            }
+            os.makedirs(self.manifests_dir, exist_ok=True)
+            self.write_json(os.path.join(self.manifests_dir, f"{snapshot_id}.json"), manifest)
+            self.append_index_updates()
+            if self.index_log_entries > INDEX_LOG_COMPACT:
+                self.compact_index()
+            return manifest
+    
+    def write_json(self, path: str, data: object) -> None:
+        """原子写入JSON文件"""
+        tmp_file = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_file, path)
+    
+    def list_snapshots(self) -> List[str]:
+        """按时间顺序返回全部快照ID"""
+        try:
+            names = os.listdir(self.manifests_dir)
+        except OSError:
+            return []
+        return sorted(name[:-5] for name in names if name.endswith(".json"))
+    
+    def load(self, snapshot_id: str) -> Optional[Dict[str, object]]:
+        """读取快照清单（ID可以只写前缀）"""
+        candidates = [sid for sid in self.list_snapshots() if sid.startswith(snapshot_id)]
+        if snapshot_id in candidates:
+            candidates = [snapshot_id]
+        if len(candidates) != 1:
+            return None
+        try:
+            with open(os.path.join(self.manifests_dir, f"{candidates[0]}.json"), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def resolve_target(self, manifest: Dict[str, object], target: Optional[str]) -> List[str]:
+        """把还原目标（绝对路径、目录、vhost文件名或域名）解析为清单中的文件"""
+        files = manifest['files']
+        if not target:
+            return sorted(files)
+        path = os.path.abspath(target) if os.path.isabs(target) else None
+        if path:
+            if path in files:
+                return [path]
+            prefix = path.rstrip('/') + '/'
+            return sorted(p for p in files if p.startswith(prefix))
+        name = target if target.endswith(".conf") else f"{target}.conf"
+        vhost_path = os.path.join(VHOST_DIR, name)
+        if vhost_path in files:
+            return [vhost_path]
+        return sorted(p for p in files if p.endswith('/' + target))
+    
+    def restore_owner(self, path: str, entry: Dict[str, object]) -> None:
+        """还原属主和属组（旧快照没有记录时保持不变；非root用户无权修改时给出提示）"""
+        if 'uid' not in entry:
+            return
+        try:
+            os.lchown(path, entry['uid'], entry['gid'])
+        except PermissionError:
+            print(f"无权限还原 {path} 的属主（{entry['uid']}:{entry['gid']}），请用root运行", file=sys.stderr)
+    
+    def restore_file(self, path: str, entry: Dict[str, object]) -> None:
+        """原子还原一个文件（先写临时文件再替换），包括权限、属主和mtime"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_file = f"{path}.snapshot-tmp"
+        if 'link' in entry:
+            if os.path.lexists(tmp_file):
+                os.remove(tmp_file)
+            os.symlink(entry['link'], tmp_file)
+            self.restore_owner(tmp_file, entry)
+            os.replace(tmp_file, path)
+            return
+        source = self.object_path(entry['hash'])
+        shutil.copyfile(source, tmp_file)
+        # 先改属主再设置权限，chown会清除setuid/setgid位
+        self.restore_owner(tmp_file, entry)
+        os.chmod(tmp_file, entry['mode'])
+        os.utime(tmp_file, ns=(entry['mtime_ns'], entry['mtime_ns']))
+        os.replace(tmp_file, path)
+    
+    def changed_paths(self, manifest: Dict[str, object], paths: List[str]) -> List[str]:
+        """返回当前内容与快照不同的文件"""
+        changed = []
+        for path in paths:
+            entry = manifest['files'][path]
+            try:
+                if 'link' in entry:
+                    if not os.path.islink(path) or os.readlink(path) != entry['link']:
+                        changed.append(path)
+                    continue
+                stat = os.lstat(path)
+                if 'uid' in entry and (stat.st_uid, stat.st_gid) != (entry['uid'], entry['gid']):
+                    changed.append(path)
+                    continue
+                if stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']:
+                    continue
+                if os.path.islink(path) or file_digest(path) != entry['hash']:
+                    changed.append(path)
+            except OSError:
+                changed.append(path)
+        return changed
+    
+    def restore(self, snapshot_id: str, target: Optional[str] = None) -> bool:
+        """还原快照中的单个文件/目录或全部文件，只写入有变化的文件"""
+        manifest = self.load(snapshot_id)
+        if not manifest:
+            print(f"未找到快照: {snapshot_id}")
+            return False
+        paths = self.resolve_target(manifest, target)
+        if not paths:
+            print(f"快照 {manifest['id']} 中没有匹配 {target} 的文件")
+            return False
+        
+        changed = self.changed_paths(manifest, paths)
+        if not changed:
+            print("当前文件与快照一致，无需还原")
+            return True
+        
+        missing = [p for p in changed if 'hash' in manifest['files'][p]
+                   and not os.path.exists(self.object_path(manifest['files'][p]['hash']))]
+        if missing:
+            print(f"快照对象缺失，无法还原: {', '.join(missing[:5])}")
+            return False
+        
+        # 先为即将被覆盖的文件建一个快照，还原本身也可以撤销
+        existing = [p for p in changed if os.path.lexists(p)]
+        if existing:
+            before = self.create(existing, "pre-restore")
+            if before:
+                print(f"已保存还原前的文件: {before['id']}")
+        
+        for path in changed:
+            try:
+                self.restore_file(path, manifest['files'][path])
+            except OSError as e:
+                print(f"还原 {path} 失败: {e}")
+                return False
+        print(f"已从快照 {manifest['id']} 还原 {len(changed)} 个文件（共匹配 {len(paths)} 个）")
+        return True
+    
+    def diff(self, snapshot_id: str) -> bool:
+        """比较快照与当前文件"""
+        manifest = self.load(snapshot_id)
+        if not manifest:
+            print(f"未找到快照: {snapshot_id}")
+            return False
+        paths = sorted(manifest['files'])
+        changed = set(self.changed_paths(manifest, paths))
+        current = set(iter_files(manifest['roots'], os.path.abspath(self.store_dir)))
+        for path in paths:
+            if path in changed:
+                print(f"{'M' if os.path.lexists(path) else 'D'} {path}")
+        for path in sorted(current - set(paths)):
+            print(f"A {path}")
+        return True
+    
+    def gc(self, keep: int = KEEP_SNAPSHOTS, days: int = KEEP_DAYS,
+           backup_keep: int = KEEP_BACKUPS, backup_days: int = KEEP_BACKUP_DAYS) -> Tuple[int, int]:
+        """按保留策略删除旧快照，再清理不再被引用的对象。
+        每种标签分别保留最近keep个以及days天内的快照；完整备份（backup）按backup_keep/backup_days保留"""
+        with self.locked():
+            now = time.time()
+            by_label: Dict[str, List[Dict[str, object]]] = {}
+            broken = []
+            for snapshot_id in self.list_snapshots():
+                manifest = self.load(snapshot_id)
+                if manifest:
+                    by_label.setdefault(manifest.get('label', ""), []).append(manifest)
+                else:
+                    broken.append(snapshot_id)
+        
+            removed = 0
+            referenced = set()
+            for label, manifests in by_label.items():
+                label_keep, label_days = (backup_keep, backup_days) if label == BACKUP_LABEL else (keep, days)
+                cutoff = now - label_days * 86400
+                for index, manifest in enumerate(manifests):
+                    recent = index >= len(manifests) - label_keep
+                    if recent or manifest['time'] >= cutoff:
+                        referenced.update(entry['hash'] for entry in manifest['files'].values() if 'hash' in entry)
+                        continue
+                    os.remove(os.path.join(self.manifests_dir, f"{manifest['id']}.json"))
+                    removed += 1
+            for snapshot_id in broken:
+                os.remove(os.path.join(self.manifests_dir, f"{snapshot_id}.json"))
+                removed += 1
+        
+            freed = 0
+            if os.path.isdir(self.objects_dir):
+                for prefix in os.listdir(self.objects_dir):
+                    prefix_dir = os.path.join(self.objects_dir, prefix)
+                    for name in os.listdir(prefix_dir):
+                        if prefix + name in referenced:
+                            continue
+                        object_file = os.path.join(prefix_dir, name)
+                        freed += os.path.getsize(object_file)
+                        os.remove(object_file)
+                    if not os.listdir(prefix_dir):
+                        os.rmdir(prefix_dir)
+            # 合并索引日志，去掉指向已删除对象的索引项
+            self.load_index()
+            self.index = {path: entry for path, entry in self.index.items() if entry[3] in referenced}
+            self.compact_index()
+            return removed, freed
+    
+    def print_list(self) -> None:
+        """列出全部快照"""
+        snapshots = self.list_snapshots()
+        if not snapshots:
+            print("暂无快照")
+            return
+        print(f"{'快照ID':<40} {'文件数':<8} {'总大小':<12} {'新增':<12}")
+        for snapshot_id in snapshots:
+            manifest = self.load(snapshot_id)
+            if not manifest:
+                continue
+            print(f"{snapshot_id:<40} {len(manifest['files']):<8} {format_size(manifest['total_bytes']):<12} "
+                  f"{format_size(manifest['added_bytes']):<12}")
+
+def format_size(size: float) -> str:
+    """格式化字节数"""
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+def snapshot_files(paths: Iterable[str], label: str) -> Optional[str]:
+    """供各管理脚本在修改配置前调用：为指定文件建快照，失败时不影响调用方。
+    各脚本自己的.bak只保留最近一次修改前的内容，用于本次操作失败时回滚，历史版本以这里的快照为准"""
+    try:
+        manifest = SnapshotStore().create(paths, label)
+        return manifest['id'] if manifest else None
+    except Exception as e:
+        print(f"创建配置快照失败: {e}", file=sys.stderr)
+        return None
+
+def main():
+    if len(sys.argv) < 2:
+        print("用法: snapshot_store.py <create|list|diff|restore|gc> [参数]")
+        print("  create [标签] [--conf-only]       - 创建快照（默认包含配置、证书和静态文件）")
+        print("  list                              - 列出快照")
+        print("  diff <快照ID>                     - 比较快照与当前文件")
+        print("  restore <快照ID> [路径|域名]      - 还原整个快照或单个vhost/目录")
+        print(f"  gc [--keep={KEEP_SNAPSHOTS}] [--days={KEEP_DAYS}] [--backup-keep={KEEP_BACKUPS}] "
+              f"[--backup-days={KEEP_BACKUP_DAYS}]")
+        print("                                    - 按保留策略清理旧快照（每种标签分别保留，完整备份单独保留）")
+        sys.exit(1)
+    
+    action = sys.argv[1]
+    args = [arg for arg in sys.argv[2:] if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[2:] if arg.startswith("--") and "=" in arg)
+    store = SnapshotStore()
+    
+    if action == "create":
+        roots = CONF_ROOTS if "--conf-only" in sys.argv else FULL_ROOTS
+        manifest = store.create(roots, args[0] if args else "manual")
+        if not manifest:
+            print("没有可备份的目录")
+            sys.exit(1)
+        print(f"已创建快照: {manifest['id']}")
+        print(f"  文件数: {len(manifest['files'])}，总大小: {format_size(manifest['total_bytes'])}，"
+              f"新增存储: {format_size(manifest['added_bytes'])}")
+        sys.exit(0)
+    elif action == "list":
+        store.print_list()
+        sys.exit(0)
+    elif action == "diff" and args:
+        sys.exit(0 if store.diff(args[0]) else 1)
+    elif action == "restore" and args:
+        sys.exit(0 if store.restore(args[0], args[1] if len(args) > 1 else None) else 1)
+    elif action == "gc":
+        try:
+            keep = int(options.get("keep", KEEP_SNAPSHOTS))
+            days = int(options.get("days", KEEP_DAYS))
+            backup_keep = int(options.get("backup-keep", KEEP_BACKUPS))
+            backup_days = int(options.get("backup-days", KEEP_BACKUP_DAYS))
+        except ValueError:
+            print("--keep、--days、--backup-keep 和 --backup-days 必须是整数")
+            sys.exit(1)
+        removed, freed = store.gc(keep, days, backup_keep, backup_days)
+        print(f"已删除 {removed} 个旧快照，释放 {format_size(freed)}")
+        sys.exit(0)
+    else:
+        print(f"未知操作或缺少参数: {action}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
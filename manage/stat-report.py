@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+站点流量/热门URL/访问IP统计
+单次遍历日志完成统计，并按User-Agent类别（浏览器、搜索引擎、AI爬虫、无头浏览器、程序/库等）拆分，
+便于看清机器流量占比，针对爬虫做限流和防盗链决策。stat-traffic.sh、stat-hoturl.sh、stat-top-ip.sh优先调用本脚本
+"""
+
+import sys
+import os
+import time
+from datetime import date
+from typing import Dict, List, Optional
+
+from log_engine import (HUMAN_FAMILIES, LOG_DIR, UA_FAMILY_NAMES, UNKNOWN_FAMILY, TopK, classify_user_agent,
+                        find_site_log, is_bot_family, iter_records, record_day, record_timestamp, rotated_logs)
+from mmdb import GeoResolver, InvalidDatabaseError
+
+BAR_MAX = 50
+TRAFFIC_WINDOWS = [("1天", 1), ("1周", 7), ("1月", 30)]
+
+def bar(value: int, max_value: int, char: str = "#") -> str:
+    return char * (value * BAR_MAX // max(max_value, 1))
+
+class StatReport:
+    def __init__(self, site: Optional[str], family: Optional[str] = None, top: int = 20, capacity: int = 1000):
+        self.site = site
+        self.family = family
+        self.top = top
+        self.capacity = capacity
+    
+    def log_files(self) -> List[str]:
+        """站点日志及轮转文件；不指定站点时统计共享的access.log"""
+        log_file = find_site_log(self.site) if self.site else os.path.join(LOG_DIR, "access.log")
+        if not log_file or not os.path.exists(log_file):
+            return []
+        return rotated_logs(log_file)
+    
+    def accept(self, family: str) -> bool:
+        """按 --family 过滤：bot/human 或具体类别（unknown不属于bot也不属于human）"""
+        if not self.family:
+            return True
+        if self.family == "bot":
+            return is_bot_family(family)
+        if self.family == "human":
+            return family in HUMAN_FAMILIES
+        return family == self.family
+    
+    def filter_desc(self) -> str:
+        if not self.family:
+            return ""
+        names = {"bot": "机器流量", "human": "真实用户"}
+        return f"（仅{names.get(self.family, UA_FAMILY_NAMES.get(self.family, self.family))}）"
+    
+    def traffic(self) -> None:
+        """1天/1周/1月的响应流量，以及各UA类别的占比"""
+        now = time.time()
+        totals = {label: 0 for label, _ in TRAFFIC_WINDOWS}
+        families: Dict[str, Dict[str, List[int]]] = {label: {} for label, _ in TRAFFIC_WINDOWS}
+        oldest = now - max(days for _, days in TRAFFIC_WINDOWS) * 86400
+        for path in self.log_files():
+            for record in iter_records(path):
+                ts = record_timestamp(record.time_local)
+                if ts is None or ts < oldest:
+                    continue
+                family = classify_user_agent(record.user_agent)
+                if not self.accept(family):
+                    continue
+                for label, days in TRAFFIC_WINDOWS:
+                    if ts >= now - days * 86400:
+                        totals[label] += record.body_bytes
+                        counter = families[label].setdefault(family, [0, 0])
+                        counter[0] += 1
+                        counter[1] += record.body_bytes
+        
+        max_value = max(totals.values())
+        print(f"========= {self.site} 流量统计{self.filter_desc()} =========")
+        for label, _ in TRAFFIC_WINDOWS:
+            print(f"{label:<6} {totals[label] / 1024 / 1024:>10.2f} MB |{bar(totals[label], max_value)}")
+        print("================================")
+        
+        month = families[TRAFFIC_WINDOWS[-1][0]]
+        if not month:
+            return
+        print("按客户端类别（近1月）:")
+        print(f"{'类别':<10} {'请求数':>10} {'流量(MB)':>12} {'流量占比':>8}  近1天(MB)")
+        total_bytes = sum(counter[1] for counter in month.values()) or 1
+        for family, (requests, sent) in sorted(month.items(), key=lambda item: -item[1][1]):
+            day_bytes = families[TRAFFIC_WINDOWS[0][0]].get(family, [0, 0])[1]
+            print(f"{UA_FAMILY_NAMES.get(family, family):<10} {requests:>10} {sent / 1024 / 1024:>12.2f} "
+                  f"{sent * 100 / total_bytes:>7.1f}%  {day_bytes / 1024 / 1024:.2f}")
+        bot_bytes = sum(counter[1] for family, counter in month.items() if is_bot_family(family))
+        unknown_bytes = month.get(UNKNOWN_FAMILY, [0, 0])[1]
+        print(f"机器流量合计: {bot_bytes / 1024 / 1024:.2f} MB（{bot_bytes * 100 / total_bytes:.1f}%）")
+        if unknown_bytes:
+            print(f"未知/空UA（未计入机器流量）: {unknown_bytes / 1024 / 1024:.2f} MB"
+                  f"（{unknown_bytes * 100 / total_bytes:.1f}%）")
+    
+    def hot_urls(self) -> None:
+        """今天请求最多的URL，附机器流量和未知UA的占比以及主要客户端类别"""
+        today = date.today()
+        urls = TopK(self.capacity)
+        for path in self.log_files():
+            for record in iter_records(path):
+                if record_day(record.time_local) != today:
+                    continue
+                family = classify_user_agent(record.user_agent)
+                if not self.accept(family):
+                    continue
+                metrics = urls.add(record.path)
+                metrics[family] = metrics.get(family, 0) + 1
+        
+        items = urls.items(self.top)
+        print(f"========= {self.site} 今日热门URL{self.filter_desc()} =========")
+        max_count = items[0][1] if items else 1
+        for idx, (url, count, metrics) in enumerate(items, 1):
+            bots = sum(value for family, value in metrics.items() if is_bot_family(family))
+            total = max(sum(metrics.values()), 1)
+            main = max(metrics.items(), key=lambda item: item[1])[0] if metrics else UNKNOWN_FAMILY
+            print(f"{idx:2d}. {url[:40]:<40} {count:6d} 机器{bots * 100 / total:>5.1f}% "
+                  f"未知{metrics.get(UNKNOWN_FAMILY, 0) * 100 / total:>5.1f}% "
+                  f"{UA_FAMILY_NAMES.get(main, main):<6} |{bar(count, max_count, '*')}")
+        print("====================================")
+    
+    def geo_resolver(self) -> Optional[GeoResolver]:
+        """有本地GeoIP数据库时用于标注IP的国家和ASN"""
+        try:
+            resolver = GeoResolver()
+        except (OSError, InvalidDatabaseError) as e:
+            print(f"打开GeoIP数据库失败，不显示归属地: {e}", file=sys.stderr)
+            return None
+        return resolver if resolver.available else None
+    
+    def top_ips(self) -> None:
+        """访问量最多的IP，附主要客户端类别（有GeoIP数据库时附国家和ASN）"""
+        ips = TopK(self.capacity)
+        for path in self.log_files():
+            for record in iter_records(path):
+                family = classify_user_agent(record.user_agent)
+                if not self.accept(family):
+                    continue
+                metrics = ips.add(record.remote_addr)
+                metrics[family] = metrics.get(family, 0) + 1
+        
+        items = ips.items(self.top)
+        max_count = items[0][1] if items else 1
+        geo = self.geo_resolver()
+        geo_header = f"{'归属地/ASN':<16} " if geo else ""
+        print(f"{'IP地址':<16} {'访问量':<8} {'主要客户端':<10} {geo_header}访问量柱状图{self.filter_desc()}")
+        print("-------------------------------------------------------------")
+        for ip, count, metrics in items:
+            main = max(metrics.items(), key=lambda item: item[1])[0] if metrics else UNKNOWN_FAMILY
+            location = ""
+            if geo:
+                country, asn, _ = geo.resolve(ip)
+                label = f"{country or '-'} AS{asn}" if asn is not None else country or "-"
+                location = f"{label:<18} "
+            print(f"{ip:<18} {count:<10} {UA_FAMILY_NAMES.get(main, main):<10} {location}{bar(count, max_count, '*')}")
+        if geo:
+            geo.close()
+        print("-------------------------------------------------------------")
+
+def main():
+    if len(sys.argv) < 2:
+        print("用法: stat-report.py <traffic|hoturl|topip> [site] [--family=bot|human|类别] [--top=20]")
+        print(f"  类别: {', '.join(UA_FAMILY_NAMES)}")
+        sys.exit(1)
+    
+    action = sys.argv[1]
+    args = [arg for arg in sys.argv[2:] if not arg.startswith("--")]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[2:] if arg.startswith("--") and "=" in arg)
+    family = options.get("family")
+    if family and family not in ("bot", "human") and family not in UA_FAMILY_NAMES:
+        print(f"未知的客户端类别: {family}", file=sys.stderr)
+        sys.exit(1)
+    
+    site = args[0] if args else None
+    if action in ("traffic", "hoturl") and not site:
+        print("未指定站点名", file=sys.stderr)
+        sys.exit(1)
+    report = StatReport(site, family, int(options.get("top", "20")))
+    if not report.log_files():
+        print("未找到该站点日志文件", file=sys.stderr)
+        sys.exit(1)
+    
+    if action == "traffic":
+        report.traffic()
+    elif action == "hoturl":
+        report.hot_urls()
+    elif action == "topip":
+        report.top_ips()
+    else:
+        print(f"未知操作: {action}", file=sys.stderr)
+        sys.exit(1)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
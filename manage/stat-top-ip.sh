@@ -3,6 +3,11 @@ log_dir="/usr/local/nginx/logs"
 if [ ! -d "$log_dir" ]; then
   echo "未找到日志目录 $log_dir"; exit 1
 fi
+# 有python3时单次遍历日志统计，并标出每个IP的主要客户端类别；可传入站点名和--family=bot等参数
+script_dir="$(dirname "$0")"
+if command -v python3 >/dev/null 2>&1 && [ -f "$script_dir/stat-report.py" ]; then
+  exec python3 "$script_dir/stat-report.py" topip "$@"
+fi
 # 统计前20 IP及访问量
 ip_counts=$(find "$log_dir" -name "access.log*" | xargs cat 2>/dev/null | awk '{print $1}' | sort | uniq -c | sort -rn | head -20)
 max_count=$(echo "$ip_counts" | awk 'NR==1{print $1}')
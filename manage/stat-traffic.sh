@@ -7,6 +7,12 @@ fi
 if [ -z "$site" ]; then
   echo "未指定站点名"; exit 1
 fi
+# 有python3时单次遍历日志统计，并按客户端类别（浏览器/爬虫/程序等）拆分，其余参数（如--family=bot）原样传递
+script_dir="$(dirname "$0")"
+if command -v python3 >/dev/null 2>&1 && [ -f "$script_dir/stat-report.py" ]; then
+  shift
+  exec python3 "$script_dir/stat-report.py" traffic "$site" "$@"
+fi
 log_files=("$log_dir/access_$site.log" "$log_dir/access-$site.log" "$log_dir/access.log")
 found_log=""
 for f in "${log_files[@]}"; do
@@ -12,6 +12,8 @@ echo "========= 精确流量限制测试 ========="
 # 检查nginx配置
 echo "1. 检查nginx配置..."
 nginx -t 2>&1 | grep -E "(conflicting server name|syntax is ok)"
+# 列出重复server_name所在的文件和行号
+python3 "$(dirname "$0")/server_index.py" conflicts 2>/dev/null
 
 # 显示当前流量限制配置
 echo "2. 显示当前流量限制配置..."
@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+TLS握手性能管理器
+为所有TLS server块应用共享的会话缓存配置（会话票据保持关闭），开启OCSP Stapling和HTTP/2，
+并在同时存在ECDSA和RSA证书时优先使用ECDSA证书
+"""
+
+import sys
+import re
+import os
+import subprocess
+from typing import Dict, List, Tuple, Optional
+
+from cert_info import has_ocsp_url, key_type
+from nginx_conf import ConfigParseError, Directive, find_ssl_servers, parse_lines, server_names, vhost_files
+from profiling import enable_profiling, timed
+from snapshot_store import snapshot_files
+
+# 1MB共享会话缓存约可保存4000个会话
+SESSIONS_PER_MB = 4000
+# 共享会话缓存使用独立的区域名，不与其他配置中声明的shared:SSL大小冲突
+SESSION_ZONE = "TLS_TUNING"
+RESOLV_CONF = "/etc/resolv.conf"
+
+# 共享配置中包含的指令，server块中已有的同名指令会被注释掉以免重复
+TUNING_DIRECTIVES = (
+    "ssl_session_cache", "ssl_session_timeout", "ssl_session_tickets", "ssl_buffer_size",
+)
+
+def system_resolvers(path: str = RESOLV_CONF) -> List[str]:
+    """读取本机/etc/resolv.conf中的nameserver，IPv6地址按nginx的写法加方括号"""
+    resolvers = []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == "nameserver":
+                    address = parts[1].split('%', 1)[0]
+                    resolvers.append(f"[{address}]" if ':' in address else address)
+    except OSError:
+        pass
+    return resolvers
+
+class TlsManager:
+    def __init__(self, conf_file: str):
+        self.conf_file = conf_file
+        self.backup_file = f"{conf_file}.tls.bak"
+        self.nginx_main_conf = "/usr/local/nginx/conf/nginx.conf"
+        self.tuning_file = "/usr/local/nginx/conf/ssl-tuning.conf"
+        self.tls_marker = "# TLS握手优化"
+        self.tls_end_marker = "# TLS握手优化结束"
+        self.replaced_marker = "# TLS握手优化已替换:"
+        self.inline_marker = "  # TLS握手优化"
+    
+    @timed("backup")
+    def backup_config(self) -> bool:
+        """备份配置文件"""
+        try:
+            if os.path.exists(self.conf_file):
+                with open(self.conf_file, 'r', encoding='utf-8') as src:
+                    with open(self.backup_file, 'w', encoding='utf-8') as dst:
+                        dst.write(src.read())
+                snapshot_files([self.conf_file], "tls")
+                return True
+        except Exception as e:
+            print(f"备份配置文件失败: {e}", file=sys.stderr)
+        return False
+    
+    def restore_config(self) -> bool:
+        """恢复配置文件"""
+        try:
+            if os.path.exists(self.backup_file):
+                with open(self.backup_file, 'r', encoding='utf-8') as src:
+                    with open(self.conf_file, 'w', encoding='utf-8') as dst:
+                        dst.write(src.read())
+                return True
+        except Exception as e:
+            print(f"恢复配置文件失败: {e}", file=sys.stderr)
+        return False
+    
+    @timed("read", lines="read")
+    def read_config(self) -> List[str]:
+        """读取配置文件"""
+        try:
+            with open(self.conf_file, 'r', encoding='utf-8') as f:
+                return f.readlines()
+        except Exception as e:
+            print(f"读取配置文件失败: {e}", file=sys.stderr)
+            return []
+    
+    @timed("write", lines="write")
+    def write_config(self, lines: List[str]) -> bool:
+        """写入配置文件"""
+        try:
+            with open(self.conf_file, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+            return True
+        except Exception as e:
+            print(f"写入配置文件失败: {e}", file=sys.stderr)
+            return False
+    
+    def nginx_version(self) -> Tuple[int, ...]:
+        """读取nginx版本号，无法获取时返回(0,)"""
+        try:
+            result = subprocess.run(['nginx', '-v'], capture_output=True, text=True, timeout=10)
+            version_match = re.search(r'nginx/(\d+(?:\.\d+)*)', result.stderr)
+            if version_match:
+                return tuple(int(part) for part in version_match.group(1).split('.'))
+        except Exception:
+            pass
+        return (0,)
+    
+    def calculate_cache_size(self, clients: int) -> int:
+        """按会话超时时间内的独立客户端数估算共享会话缓存大小（MB）"""
+        return max(-(-clients // SESSIONS_PER_MB), 1)
+    
+    def generate_tuning_config(self, cache_mb: int) -> str:
+        """
+        生成所有TLS server共享的握手优化配置。
+        会话票据保持关闭：nginx不会自动轮换票据密钥，开启后会削弱前向保密，会话复用由共享缓存完成
+        """
+        config_lines = [
+            f"{self.tls_marker}（由tls-manager.py生成，所有TLS server共享）",
+            f"ssl_session_cache shared:{SESSION_ZONE}:{cache_mb}m;",
+            "ssl_session_timeout 1d;",
+            "ssl_session_tickets off;",
+            "ssl_buffer_size 4k;",
+        ]
+        return "\n".join(config_lines) + "\n"
+    
+    def write_tuning_config(self, clients: int) -> bool:
+        """写入共享配置文件"""
+        cache_mb = self.calculate_cache_size(clients)
+        tmp_file = f"{self.tuning_file}.tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(self.generate_tuning_config(cache_mb))
+            os.replace(tmp_file, self.tuning_file)
+        except Exception as e:
+            print(f"写入共享TLS配置失败: {e}", file=sys.stderr)
+            return False
+        print(f"共享TLS配置已写入: {self.tuning_file}（会话缓存 {cache_mb}MB，约{cache_mb * SESSIONS_PER_MB}个会话）")
+        return True
+    
+    def find_certificates(self, server: Directive) -> List[Tuple[str, str]]:
+        """返回server块中配置的(证书, 私钥)对"""
+        certs = [d.args[0] for d in server.children('ssl_certificate') if d.args]
+        keys = [d.args[0] for d in server.children('ssl_certificate_key') if d.args]
+        return list(zip(certs, keys))
+    
+    def candidate_certificates(self, domain: str) -> List[Tuple[str, str]]:
+        """按lib/ssl.sh的约定列出该域名可能存在的证书"""
+        home = os.path.expanduser("~")
+        return [
+            (f"{home}/.acme.sh/{domain}_ecc/fullchain.cer", f"{home}/.acme.sh/{domain}_ecc/{domain}.key"),
+            (f"{home}/.acme.sh/{domain}/fullchain.cer", f"{home}/.acme.sh/{domain}/{domain}.key"),
+            (f"/etc/letsencrypt/live/{domain}/fullchain.pem", f"/etc/letsencrypt/live/{domain}/privkey.pem"),
+            (f"/etc/letsencrypt/live/{domain}-ecdsa/fullchain.pem", f"/etc/letsencrypt/live/{domain}-ecdsa/privkey.pem"),
+            (f"/etc/nginx/ssl/{domain}.crt", f"/etc/nginx/ssl/{domain}.key"),
+        ]
+    
+    def plan_certificates(self, server: Directive) -> Optional[List[Tuple[str, str]]]:
+        """同时存在ECDSA和RSA证书时返回ECDSA在前的证书列表，无需调整时返回None"""
+        configured = self.find_certificates(server)
+        if not configured or any('$' in cert for cert, _ in configured):
+            return None
+        
+        by_type: Dict[str, Tuple[str, str]] = {}
+        for cert, key in configured:
+            kind = key_type(key)
+            if kind and kind not in by_type:
+                by_type[kind] = (cert, key)
+        
+        names = [name for name in server_names(server) if '*' not in name and not name.startswith('~')]
+        if names:
+            for cert, key in self.candidate_certificates(names[0]):
+                if os.path.isfile(cert) and os.path.isfile(key):
+                    kind = key_type(key)
+                    if kind and kind not in by_type:
+                        by_type[kind] = (cert, key)
+        
+        if "ecdsa" not in by_type or "rsa" not in by_type:
+            return None
+        planned = [by_type["ecdsa"], by_type["rsa"]]
+        return None if planned == configured else planned
+    
+    def comment_line(self, line: str) -> str:
+        """注释掉被替换的指令，删除优化时原样恢复"""
+        indent = line[:len(line) - len(line.lstrip())]
+        return f"{indent}{self.replaced_marker} {line.strip()}\n"
+    
+    def remove_tls_internal(self, lines: List[str]) -> List[str]:
+        """内部方法：从lines中删除TLS优化配置并恢复被替换的指令"""
+        new_lines = []
+        in_config = False
+        for line in lines:
+            stripped = line.strip()
+            if stripped == self.tls_marker:
+                in_config = True
+                continue
+            if in_config:
+                if stripped == self.tls_end_marker:
+                    in_config = False
+                continue
+            if stripped.startswith(self.replaced_marker):
+                indent = line[:len(line) - len(line.lstrip())]
+                new_lines.append(f"{indent}{stripped[len(self.replaced_marker):].strip()}\n")
+                continue
+            if line.rstrip().endswith(self.inline_marker.strip()):
+                continue
+            new_lines.append(line)
+        return new_lines
+    
+    def add_tls_tuning(self, use_http2_directive: bool, resolvers: List[str]) -> bool:
+        """为配置文件中的所有TLS server块应用握手优化，resolvers用于OCSP Stapling查询OCSP服务器"""
+        # 备份配置文件
+        if not self.backup_config():
+            return False
+        
+        lines = self.read_config()
+        if not lines:
+            return False
+        
+        if any(line.strip() == self.tls_marker for line in lines):
+            print("检测到已存在的TLS优化配置，将先删除再添加")
+            lines = self.remove_tls_internal(lines)
+        
+        try:
+            servers = find_ssl_servers(parse_lines(lines))
+        except ConfigParseError as e:
+            print(f"解析配置文件失败: {e}", file=sys.stderr)
+            return False
+        if not servers:
+            print("未找到TLS server块（listen ... ssl）")
+            return False
+        
+        replaced: Dict[int, List[str]] = {}
+        inserted: Dict[int, List[str]] = {}
+        for server in servers:
+            names = ' '.join(server_names(server)) or "(未设置server_name)"
+            indent = "    "
+            for child in server.block:
+                if child.start != server.start:
+                    indent = lines[child.start][:len(lines[child.start]) - len(lines[child.start].lstrip())]
+                    break
+            
+            for child in server.children():
+                if child.name in TUNING_DIRECTIVES and child.start == child.end:
+                    replaced[child.start] = [self.comment_line(lines[child.start])]
+            
+            block = [
+                f"{indent}{self.tls_marker}\n",
+                f"{indent}include {self.tuning_file};\n",
+            ]
+            
+            # HTTP/2：1.25.1起使用http2指令，旧版本在listen上加http2标志
+            if use_http2_directive:
+                if not server.first('http2'):
+                    block.append(f"{indent}http2 on;\n")
+            else:
+                for listen in server.children('listen'):
+                    if 'ssl' in listen.args and 'http2' not in listen.args and listen.start == listen.end:
+                        line = lines[listen.start]
+                        new_listen = re.sub(r';\s*(#.*)?$', ' http2;', line.rstrip())
+                        replaced[listen.start] = [self.comment_line(line),
+                                                  f"{new_listen}{self.inline_marker}\n"]
+            
+            planned = self.plan_certificates(server)
+            certs = planned or self.find_certificates(server)
+            if planned:
+                for child in server.children():
+                    if child.name in ("ssl_certificate", "ssl_certificate_key") and child.start == child.end:
+                        replaced[child.start] = [self.comment_line(lines[child.start])]
+                for cert, key in planned:
+                    block.append(f"{indent}ssl_certificate {cert};\n")
+                    block.append(f"{indent}ssl_certificate_key {key};\n")
+                print(f"  {names}: 同时存在ECDSA和RSA证书，已调整为ECDSA优先")
+            
+            if not server.first('ssl_stapling'):
+                if any(has_ocsp_url(cert) for cert, _ in certs):
+                    block.extend([f"{indent}ssl_stapling on;\n", f"{indent}ssl_stapling_verify on;\n"])
+                    # 只在开启OCSP Stapling时设置resolver；server中已有resolver时沿用
+                    if not server.first('resolver'):
+                        if resolvers:
+                            block.append(f"{indent}resolver {' '.join(resolvers)} valid=300s;\n")
+                            if not server.first('resolver_timeout'):
+                                block.append(f"{indent}resolver_timeout 5s;\n")
+                        else:
+                            print(f"  {names}: 未找到可用的DNS服务器，OCSP Stapling依赖http块中的resolver")
+                else:
+                    print(f"  {names}: 证书不含OCSP地址，跳过OCSP Stapling")
+            
+            block.append(f"{indent}{self.tls_end_marker}\n")
+            
+            # 插入到最后一个listen之后
+            anchor = max([d.end for d in server.children('listen')] or [server.start])
+            inserted[anchor] = block
+        
+        new_lines = []
+        for i, line in enumerate(lines):
+            new_lines.extend(replaced.get(i, [line]))
+            new_lines.extend(inserted.get(i, []))
+        
+        # 写入配置文件
+        if self.write_config(new_lines):
+            print(f"TLS握手优化已应用到 {len(servers)} 个server块: {self.conf_file}")
+            return True
+        else:
+            print("TLS握手优化应用失败，正在恢复备份...")
+            self.restore_config()
+            return False
+    
+    def remove_tls_tuning(self) -> bool:
+        """删除TLS握手优化"""
+        # 备份配置文件
+        if not self.backup_config():
+            return False
+        
+        lines = self.read_config()
+        if not lines:
+            return False
+        
+        if not any(line.strip() == self.tls_marker for line in lines):
+            print(f"未找到TLS优化配置: {self.conf_file}")
+            return True
+        
+        if self.write_config(self.remove_tls_internal(lines)):
+            print(f"TLS握手优化已删除: {self.conf_file}")
+            return True
+        else:
+            print("TLS握手优化删除失败，正在恢复备份...")
+            self.restore_config()
+            return False
+    
+    def check_status(self) -> bool:
+        """显示配置文件中每个TLS server块的握手相关设置"""
+        lines = self.read_config()
+        if not lines:
+            return False
+        try:
+            servers = find_ssl_servers(parse_lines(lines))
+        except ConfigParseError as e:
+            print(f"解析配置文件失败: {e}", file=sys.stderr)
+            return False
+        
+        enabled = any(line.strip() == self.tls_marker for line in lines)
+        print(f"{self.conf_file}: {len(servers)} 个TLS server块，握手优化{'已启用' if enabled else '未启用'}")
+        for server in servers:
+            listen_args = [' '.join(d.args) for d in server.children('listen')]
+            http2 = server.first('http2') is not None or any('http2' in d.args for d in server.children('listen'))
+            include = any(d.args and d.args[0] == self.tuning_file for d in server.children('include'))
+            certs = self.find_certificates(server)
+            kinds = [key_type(key) or "未知" for _, key in certs]
+            print(f"  第{server.start + 1}行 {' '.join(server_names(server))}")
+            print(f"    listen: {'; '.join(listen_args)}")
+            print(f"    HTTP/2: {'是' if http2 else '否'}  共享会话缓存: {'是' if include else '否'}  "
+                  f"OCSP Stapling: {'是' if server.first('ssl_stapling') else '否'}")
+            print(f"    证书类型: {' > '.join(kinds) if kinds else '无'}")
+        return enabled
+    
+    @timed("nginx_test")
+    def validate_config(self) -> bool:
+        """验证nginx配置语法"""
+        try:
+            result = subprocess.run(['nginx', '-t'],
+                                  capture_output=True,
+                                  text=True,
+                                  timeout=10)
+            if result.returncode == 0:
+                print("nginx配置语法验证通过")
+                return True
+            else:
+                print("nginx配置语法错误:")
+                print(result.stderr)
+                return False
+        except Exception as e:
+            print(f"无法验证nginx配置: {e}")
+            return False
+
+def main():
+    enable_profiling("tls-manager", action_index=2)
+    if len(sys.argv) < 3:
+        print("用法: tls-manager.py <conf_file|all> <action> [clients]")
+        print("actions: add, remove, status, validate")
+        print("clients: 会话超时(1天)内的独立客户端数，用于估算ssl_session_cache大小，默认40000")
+        print(f"--resolver=地址[,地址]: OCSP Stapling使用的DNS服务器，默认读取{RESOLV_CONF}")
+        sys.exit(1)
+    
+    target = sys.argv[1]
+    action = sys.argv[2]
+    options = dict(arg[2:].split("=", 1) for arg in sys.argv[3:] if arg.startswith("--") and "=" in arg)
+    args = [arg for arg in sys.argv[3:] if not arg.startswith("--")]
+    
+    if target == "all":
+        conf_files = vhost_files()
+    elif os.path.exists(target):
+        conf_files = [target]
+    else:
+        print(f"配置文件不存在: {target}", file=sys.stderr)
+        sys.exit(1)
+    
+    if action == "add":
+        if args and not args[0].isdigit():
+            print(f"无效的客户端数: {args[0]}", file=sys.stderr)
+            sys.exit(1)
+        clients = int(args[0]) if args else 40000
+        if "resolver" in options:
+            resolvers = [address for address in options["resolver"].split(",") if address]
+        else:
+            resolvers = system_resolvers()
+        if any(not re.match(r'^[\w.:\[\]-]+$', address) for address in resolvers):
+            print(f"无效的DNS服务器: {options.get('resolver')}", file=sys.stderr)
+            sys.exit(1)
+        first = TlsManager(conf_files[0] if conf_files else target)
+        if not first.write_tuning_config(clients):
+            sys.exit(1)
+        use_http2_directive = first.nginx_version() >= (1, 25, 1)
+        
+        applied = 0
+        for conf_file in conf_files:
+            manager = TlsManager(conf_file)
+            if target == "all" and not any(re.match(r'\s*(listen\s[^;#]*\bssl\b|ssl\s+on\s*;)', line)
+                                           for line in manager.read_config()):
+                continue
+            if manager.add_tls_tuning(use_http2_directive, resolvers):
+                applied += 1
+        if applied:
+            first.validate_config()
+        sys.exit(0 if applied else 1)
+    
+    elif action == "remove":
+        for conf_file in conf_files:
+            TlsManager(conf_file).remove_tls_tuning()
+        if conf_files:
+            TlsManager(conf_files[0]).validate_config()
+        sys.exit(0)
+    
+    elif action == "status":
+        for conf_file in conf_files:
+            TlsManager(conf_file).check_status()
+        sys.exit(0)
+    
+    elif action == "validate":
+        success = TlsManager(target).validate_config()
+        sys.exit(0 if success else 1)
+    
+    else:
+        print(f"未知操作: {action}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
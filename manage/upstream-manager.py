@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+上游连接池配置管理器
+将站点的proxy_pass转换为带keepalive的upstream块，复用到后端的TCP连接
+"""
+
+import sys
+import re
+import os
+import subprocess
+from typing import List, Tuple, Optional
+
+from nginx_conf import vhost_files
+from profiling import enable_profiling, timed
+from snapshot_store import snapshot_files
+
+class UpstreamManager:
+    def __init__(self, conf_file: str):
+        self.conf_file = conf_file
+        self.backup_file = f"{conf_file}.upstream.bak"
+        self.upstream_marker = "# 上游连接池配置"
+        self.location_marker = "# 上游连接池配置（location）"
+        self.location_end_marker = "# 上游连接池配置结束"
+        self.origin_marker = "# 原始地址:"
+    
+    @timed("backup")
+    def backup_config(self) -> bool:
+        """备份配置文件"""
+        try:
+            if os.path.exists(self.conf_file):
+                with open(self.conf_file, 'r', encoding='utf-8') as src:
+                    with open(self.backup_file, 'w', encoding='utf-8') as dst:
+                        dst.write(src.read())
+                snapshot_files([self.conf_file], "upstream")
+                return True
+        except Exception as e:
+            print(f"备份配置文件失败: {e}", file=sys.stderr)
+        return False
+    
+    def restore_config(self) -> bool:
+        """恢复配置文件"""
+        try:
+            if os.path.exists(self.backup_file):
+                with open(self.backup_file, 'r', encoding='utf-8') as src:
+                    with open(self.conf_file, 'w', encoding='utf-8') as dst:
+                        dst.write(src.read())
+                return True
+        except Exception as e:
+            print(f"恢复配置文件失败: {e}", file=sys.stderr)
+        return False
+    
+    @timed("read", lines="read")
+    def read_config(self) -> List[str]:
+        """读取配置文件"""
+        try:
+            with open(self.conf_file, 'r', encoding='utf-8') as f:
+                return f.readlines()
+        except Exception as e:
+            print(f"读取配置文件失败: {e}", file=sys.stderr)
+            return []
+    
+    @timed("write", lines="write")
+    def write_config(self, lines: List[str]) -> bool:
+        """写入配置文件"""
+        try:
+            with open(self.conf_file, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+            return True
+        except Exception as e:
+            print(f"写入配置文件失败: {e}", file=sys.stderr)
+            return False
+    
+    def defined_upstreams(self) -> List[str]:
+        """同目录其它配置文件中已定义的upstream名称（upstream在http级别全局唯一）"""
+        names = []
+        conf_dir = os.path.dirname(os.path.abspath(self.conf_file))
+        for path in vhost_files(conf_dir):
+            if os.path.abspath(path) == os.path.abspath(self.conf_file):
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    names.extend(re.findall(r'^\s*upstream\s+(\S+)\s*\{', f.read(), re.MULTILINE))
+            except Exception:
+                continue
+        return names
+    
+    def get_upstream_name(self, lines: List[str]) -> str:
+        """根据server_name生成upstream名称，与其它站点重名时改用配置文件名"""
+        base = os.path.basename(self.conf_file).rsplit('.conf', 1)[0]
+        candidates = []
+        for line in lines:
+            name_match = re.search(r'^\s*server_name\s+([^;\s]+)', line)
+            if name_match:
+                candidates.append(name_match.group(1))
+                break
+        candidates.append(base)
+        taken = self.defined_upstreams()
+        for candidate in candidates:
+            name = "backend_" + re.sub(r'[^A-Za-z0-9_]', '_', candidate)
+            if name not in taken:
+                return name
+        number = 2
+        while f"{name}_{number}" in taken:
+            number += 1
+        return f"{name}_{number}"
+    
+    def find_proxy_target(self, lines: List[str]) -> Optional[str]:
+        """查找第一个直连后端的proxy_pass地址（host:port）"""
+        for line in lines:
+            proxy_match = re.search(r'^\s*proxy_pass\s+http://([^/;\s]+)', line)
+            if proxy_match and ':' in proxy_match.group(1):
+                return proxy_match.group(1)
+        return None
+    
+    @timed("parse")
+    def find_upstream_config(self, lines: List[str]) -> Optional[Tuple[int, int]]:
+        """查找现有的upstream块"""
+        start_line = None
+        end_line = None
+        
+        for i, line in enumerate(lines):
+            if line.strip() == self.upstream_marker:
+                start_line = i
+                # 查找对应的结束大括号
+                brace_count = 0
+                for j in range(i + 1, len(lines)):
+                    if '{' in lines[j]:
+                        brace_count += 1
+                    elif '}' in lines[j]:
+                        brace_count -= 1
+                        if brace_count == 0:
+                            end_line = j
+                            break
+                break
+        
+        return (start_line, end_line) if start_line is not None and end_line is not None else None
+    
+    def parse_servers(self, servers: str) -> List[Tuple[str, int]]:
+        """解析后端列表，格式: 地址:端口[=权重],地址:端口[=权重]"""
+        result = []
+        for item in servers.split(','):
+            item = item.strip()
+            if not item:
+                continue
+            weight = 1
+            if '=' in item:
+                item, weight_str = item.split('=', 1)
+                weight = int(weight_str)
+            if not re.match(r'^[A-Za-z0-9.\-\[\]:]+:\d+$', item):
+                raise ValueError(f"无效的后端地址: {item}")
+            result.append((item, weight))
+        return result
+    
+    def generate_upstream_config(self, name: str, origin: str, servers: List[Tuple[str, int]],
+                                 keepalive: int = 32) -> str:
+        """生成upstream块"""
+        config_lines = [
+            self.upstream_marker,
+            f"upstream {name} {{",
+            f"    {self.origin_marker} {origin}",
+        ]
+        for address, weight in servers:
+            server_line = f"    server {address}"
+            if weight != 1:
+                server_line += f" weight={weight}"
+            config_lines.append(server_line + " max_fails=3 fail_timeout=10s;")
+        config_lines.extend([
+            f"    keepalive {keepalive};",
+            "    keepalive_requests 1000;",
+            "    keepalive_timeout 60s;",
+            "}",
+        ])
+        return "\n".join(config_lines) + "\n"
+    
+    def generate_location_config(self, indent: str, clear_connection: bool) -> str:
+        """生成location内的长连接配置"""
+        config_lines = [
+            f"{indent}{self.location_marker}",
+            f"{indent}proxy_http_version 1.1;",
+        ]
+        if clear_connection:
+            config_lines.append(f'{indent}proxy_set_header Connection "";')
+        config_lines.append(f"{indent}{self.location_end_marker}")
+        return "\n".join(config_lines) + "\n"
+    
+    def add_upstream(self, servers: Optional[str] = None, keepalive: int = 32) -> bool:
+        """添加upstream连接池配置"""
+        print("正在添加上游连接池配置...")
+        
+        # 备份配置文件
+        if not self.backup_config():
+            return False
+        
+        lines = self.read_config()
+        if not lines:
+            return False
+        
+        # 检查是否已存在连接池配置
+        if self.find_upstream_config(lines):
+            print("检测到已存在的上游连接池配置，将先删除再添加")
+            lines = self.remove_upstream_internal(lines)
+        
+        origin = self.find_proxy_target(lines)
+        if not origin:
+            print("未找到 proxy_pass http://地址:端口，无法转换为upstream", file=sys.stderr)
+            return False
+        
+        try:
+            server_list = self.parse_servers(servers) if servers else [(origin, 1)]
+        except ValueError as e:
+            print(str(e), file=sys.stderr)
+            return False
+        if not server_list:
+            print("后端列表为空", file=sys.stderr)
+            return False
+        
+        name = self.get_upstream_name(lines)
+        proxy_pattern = re.compile(r'^(\s*)proxy_pass\s+http://' + re.escape(origin) + r'([^;]*);')
+        
+        new_lines = []
+        converted = 0
+        for i, line in enumerate(lines):
+            proxy_match = proxy_pattern.match(line)
+            if not proxy_match:
+                new_lines.append(line)
+                continue
+            indent, suffix = proxy_match.group(1), proxy_match.group(2)
+            new_lines.append(f"{indent}proxy_pass http://{name}{suffix};\n")
+            
+            # WebSocket等自行设置Connection头的location不清空Connection
+            location_lines = []
+            for j in range(i + 1, len(lines)):
+                if '}' in lines[j]:
+                    break
+                location_lines.append(lines[j])
+            for j in range(i - 1, -1, -1):
+                if '{' in lines[j]:
+                    break
+                location_lines.append(lines[j])
+            has_connection = any(re.search(r'proxy_set_header\s+Connection\s', l) for l in location_lines)
+            has_version = any('proxy_http_version' in l for l in location_lines)
+            if not has_version or not has_connection:
+                new_lines.append(self.generate_location_config(indent, not has_connection))
+            converted += 1
+        
+        upstream_config = self.generate_upstream_config(name, origin, server_list, keepalive)
+        new_lines = [upstream_config] + new_lines
+        
+        # 写入配置文件
+        if self.write_config(new_lines):
+            print(f"上游连接池配置添加成功（upstream {name}，转换了 {converted} 处proxy_pass）")
+            return True
+        else:
+            print("上游连接池配置添加失败，正在恢复备份...")
+            self.restore_config()
+            return False
+    
+    def remove_upstream_internal(self, lines: List[str]) -> List[str]:
+        """内部方法：从lines中删除upstream配置并恢复原始proxy_pass"""
+        existing = self.find_upstream_config(lines)
+        if not existing:
+            return lines
+        start_line, end_line = existing
+        
+        name = None
+        origin = None
+        for i in range(start_line, end_line + 1):
+            name_match = re.match(r'\s*upstream\s+(\S+)\s*{', lines[i])
+            if name_match:
+                name = name_match.group(1)
+            if self.origin_marker in lines[i]:
+                origin = lines[i].split(self.origin_marker, 1)[1].strip()
+        
+        new_lines = []
+        in_location_config = False
+        for i, line in enumerate(lines):
+            if start_line <= i <= end_line:
+                continue
+            if line.strip() == self.location_marker:
+                in_location_config = True
+                continue
+            if in_location_config:
+                if line.strip() == self.location_end_marker:
+                    in_location_config = False
+                continue
+            if name and origin:
+                line = re.sub(r'(proxy_pass\s+http://)' + re.escape(name) + r'(?=[/;])', r'\g<1>' + origin, line)
+            new_lines.append(line)
+        return new_lines
+    
+    def remove_upstream(self) -> bool:
+        """删除upstream连接池配置"""
+        print("正在删除上游连接池配置...")
+        
+        # 备份配置文件
+        if not self.backup_config():
+            return False
+        
+        lines = self.read_config()
+        if not lines:
+            return False
+        
+        if not self.find_upstream_config(lines):
+            print("未找到上游连接池配置")
+            return True
+        
+        new_lines = self.remove_upstream_internal(lines)
+        
+        # 写入配置文件
+        if self.write_config(new_lines):
+            print("上游连接池配置删除成功")
+            return True
+        else:
+            print("上游连接池配置删除失败，正在恢复备份...")
+            self.restore_config()
+            return False
+    
+    def check_upstream_status(self) -> bool:
+        """检查upstream连接池配置状态"""
+        lines = self.read_config()
+        if not lines:
+            return False
+        
+        existing = self.find_upstream_config(lines)
+        if existing:
+            start_line, end_line = existing
+            print(f"上游连接池配置已启用（第{start_line + 1}行到第{end_line + 1}行）")
+            
+            # 显示配置详情
+            for i in range(start_line, end_line + 1):
+                line = lines[i].rstrip()
+                if line.strip():
+                    print(f"  {line}")
+            
+            keepalive_locations = sum(1 for line in lines if line.strip() == self.location_marker)
+            print(f"已启用HTTP/1.1长连接的location数量: {keepalive_locations}")
+            return True
+        else:
+            print("上游连接池配置未启用")
+            return False
+    
+    @timed("nginx_test")
+    def validate_config(self) -> bool:
+        """验证nginx配置语法"""
+        try:
+            result = subprocess.run(['nginx', '-t'],
+                                  capture_output=True,
+                                  text=True,
+                                  timeout=10)
+            if result.returncode == 0:
+                print("nginx配置语法验证通过")
+                return True
+            else:
+                print("nginx配置语法错误:")
+                print(result.stderr)
+                return False
+        except Exception as e:
+            print(f"无法验证nginx配置: {e}")
+            return False
+
+def main():
+    enable_profiling("upstream-manager", action_index=2)
+    if len(sys.argv) < 3:
+        print("用法: upstream-manager.py <conf_file> <action> [servers] [keepalive]")
+        print("actions: add, remove, status, validate")
+        print("servers格式: 127.0.0.1:8080=3,127.0.0.1:8081=1（=权重可省略，默认使用当前proxy_pass地址）")
+        sys.exit(1)
+    
+    conf_file = sys.argv[1]
+    action = sys.argv[2]
+    
+    if not os.path.exists(conf_file):
+        print(f"配置文件不存在: {conf_file}", file=sys.stderr)
+        sys.exit(1)
+    
+    manager = UpstreamManager(conf_file)
+    
+    if action == "add":
+        servers = sys.argv[3] if len(sys.argv) > 3 and sys.argv[3] else None
+        keepalive_arg = sys.argv[4] if len(sys.argv) > 4 and sys.argv[4] else "32"
+        if not keepalive_arg.isdigit() or int(keepalive_arg) < 1:
+            print(f"keepalive必须是正整数: {keepalive_arg}", file=sys.stderr)
+            sys.exit(1)
+        keepalive = int(keepalive_arg)
+        
+        success = manager.add_upstream(servers, keepalive)
+        if success:
+            manager.validate_config()
+        sys.exit(0 if success else 1)
+    
+    elif action == "remove":
+        success = manager.remove_upstream()
+        if success:
+            manager.validate_config()
+        sys.exit(0 if success else 1)
+    
+    elif action == "status":
+        manager.check_upstream_status()
+        sys.exit(0)
+    
+    elif action == "validate":
+        success = manager.validate_config()
+        sys.exit(0 if success else 1)
+    
+    else:
+        print(f"未知操作: {action}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
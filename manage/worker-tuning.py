@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+worker与连接数调优顾问
+根据CPU数量、cgroup CPU配额、文件描述符上限以及监听/上游数量计算worker相关参数，
+支持预览改动（diff）、应用到nginx.conf和回滚
+"""
+
+import sys
+import re
+import os
+import json
+import time
+import shutil
+import difflib
+import resource
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+from nginx_conf import ConfigParseError, Directive, iter_servers, parse_file, parse_lines, parse_listen, vhost_files, walk
+
+# 每个worker保留给日志、缓存文件、监听套接字等的描述符
+RESERVED_FDS = 256
+
+def read_int(path: str) -> Optional[int]:
+    """读取只包含一个整数的proc/sys文件"""
+    try:
+        with open(path, 'r') as f:
+            return int(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+def cgroup_cpu_limit() -> Optional[float]:
+    """读取cgroup的CPU配额（可用核数），未限制时返回None"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max", 'r') as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    quota = read_int("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+    period = read_int("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota and period and quota > 0:
+        return quota / period
+    return None
+
+class WorkerTuningAdvisor:
+    def __init__(self):
+        self.nginx_main_conf = "/usr/local/nginx/conf/nginx.conf"
+        self.vhost_dir = "/usr/local/nginx/conf/vhost"
+        self.backup_root = "/usr/local/nginx/conf/tuning-backup"
+    
+    def read_main_config(self) -> List[str]:
+        """读取nginx主配置文件"""
+        try:
+            with open(self.nginx_main_conf, 'r', encoding='utf-8') as f:
+                return f.readlines()
+        except Exception as e:
+            print(f"读取nginx主配置文件失败: {e}", file=sys.stderr)
+            return []
+    
+    def detect_hardware(self) -> Dict[str, object]:
+        """收集CPU和文件描述符限制"""
+        try:
+            cpus = len(os.sched_getaffinity(0))
+        except AttributeError:
+            cpus = os.cpu_count() or 1
+        quota = cgroup_cpu_limit()
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        return {
+            'cpus': cpus,
+            'cgroup_quota': quota,
+            'file_max': read_int("/proc/sys/fs/file-max"),
+            'nr_open': read_int("/proc/sys/fs/nr_open"),
+            'ulimit_soft': soft,
+            'ulimit_hard': hard,
+        }
+    
+    def count_listeners_and_upstreams(self) -> Tuple[List[Tuple[str, int]], int]:
+        """统计所有server块的监听地址和上游后端数量"""
+        listeners: List[Tuple[str, int]] = []
+        upstreams = 0
+        trees = []
+        for conf_file in [self.nginx_main_conf] + vhost_files(self.vhost_dir):
+            try:
+                trees.append(parse_file(conf_file))
+            except (OSError, ConfigParseError):
+                continue
+        for tree in trees:
+            for server in iter_servers(tree):
+                for listen in server.children('listen'):
+                    host, port, _ = parse_listen(listen.args)
+                    key = ("*" if host == "0.0.0.0" else host, port)
+                    if key not in listeners:
+                        listeners.append(key)
+            upstreams += sum(1 for d in walk(tree) if d.name in ('proxy_pass', 'fastcgi_pass', 'grpc_pass'))
+        return listeners, upstreams
+    
+    def recommend(self) -> Dict[str, object]:
+        """计算推荐值"""
+        hardware = self.detect_hardware()
+        listeners, upstreams = self.count_listeners_and_upstreams()
+        
+        cpus = hardware['cpus']
+        quota = hardware['cgroup_quota']
+        # worker_processes auto只看CPU亲和性，容器内有配额时需要写明实际可用核数
+        if quota is not None and int(quota + 0.5) < cpus:
+            workers = max(1, int(quota + 0.5))
+            worker_processes = str(workers)
+        else:
+            workers = cpus
+            worker_processes = "auto"
+        
+        # 每个worker的描述符上限：不超过nr_open，并给系统其它进程留出一半file-max
+        fd_limit = None
+        if hardware['file_max']:
+            fd_limit = hardware['file_max'] // 2 // workers
+        if hardware['nr_open']:
+            fd_limit = min(fd_limit or hardware['nr_open'], hardware['nr_open'])
+        
+        # worker_connections已经包含到后端的连接（每个连接一个描述符），反向代理时不再减半，
+        # 能同时服务的客户端约为一半；reuseport下每个worker各持有一份监听套接字
+        budget = fd_limit if fd_limit else 65535 + RESERVED_FDS + len(listeners)
+        connections = max(1024, min(budget - RESERVED_FDS - len(listeners), 65535))
+        # 代理请求的响应较大时还会写proxy临时文件/缓存文件，每个代理请求（最多连接数的一半）多留一个描述符
+        rlimit = connections + RESERVED_FDS + len(listeners)
+        if upstreams:
+            rlimit += connections // 2
+        if fd_limit:
+            rlimit = min(rlimit, fd_limit)
+        rlimit = max(rlimit, 4096)
+        
+        return {
+            'hardware': hardware,
+            'listeners': len(listeners),
+            'upstreams': upstreams,
+            'workers': workers,
+            'worker_processes': worker_processes,
+            'worker_rlimit_nofile': rlimit,
+            'worker_connections': connections,
+            'clients': connections // 2 if upstreams else connections,
+            'multi_accept': "on" if connections >= 4096 else "off",
+            'reuseport': workers > 1,
+        }
+    
+    def set_directive(self, lines: List[str], block: Optional[Directive], tree: List[Directive],
+                      name: str, value: str, indent: str) -> List[str]:
+        """按解析树设置指令（block为None表示main上下文）
+        
+        已有时只替换该指令本身的文本（与其它指令同行或跨行也可以）；不存在时插入到块末尾，
+        块写在同一行或右大括号与其它内容同行时按解析树重写整个块。
+        """
+        scope = block.block if block is not None else tree
+        target = next((d for d in scope if d.name == name), None)
+        if target is not None:
+            text = ''.join(lines[target.start:target.end + 1])
+            pattern = rf'(?<![\w$]){re.escape(name)}\s[^;{{}}]*;'
+            new_text = re.sub(pattern, f"{name} {value};", text, count=1)
+            return lines[:target.start] + new_text.splitlines(True) + lines[target.end + 1:]
+        
+        new_line = f"{indent}{name} {value};\n"
+        if block is None:
+            # main上下文中紧跟在worker_processes之后；其所在行还有其它指令时放到文件开头
+            anchor = next((d for d in tree if d.name == 'worker_processes'), None)
+            if anchor is None or any(d is not anchor and d.start == anchor.end for d in walk(tree)):
+                return [new_line] + lines
+            return lines[:anchor.end + 1] + [new_line] + lines[anchor.end + 1:]
+        if block.start != block.end and lines[block.end].strip() == "}":
+            return lines[:block.end] + [new_line] + lines[block.end:]
+        return self.rewrite_block(lines, block, tree, new_line)
+    
+    def rewrite_block(self, lines: List[str], block: Directive, tree: List[Directive], new_line: str) -> List[str]:
+        """将块按解析树重写为每条指令一行并追加new_line（块所在的行不能有块之外的指令）"""
+        inner = {id(d) for d in walk(block.block or [])}
+        outside = [d for d in walk(tree) if d is not block and id(d) not in inner
+                   and (block.start <= d.start <= block.end or block.start <= d.end <= block.end)]
+        if outside or any(child.block is not None for child in block.children()):
+            print(f"{block.name} 块与其它内容写在同一行，无法自动修改，请手动添加: {new_line.strip()}", file=sys.stderr)
+            return lines
+        original = lines[block.start]
+        block_indent = original[:len(original) - len(original.lstrip())]
+        child_indent = new_line[:len(new_line) - len(new_line.lstrip())]
+        rendered = [f"{block_indent}{' '.join([block.name] + block.args)} {{\n"]
+        rendered.extend(f"{child_indent}{' '.join([child.name] + child.args)};\n" for child in block.children())
+        rendered.extend([new_line, f"{block_indent}}}\n"])
+        return lines[:block.start] + rendered + lines[block.end + 1:]
+    
+    def build_main_config(self, values: Dict[str, object]) -> Optional[List[str]]:
+        """在主配置文件副本上应用推荐值（每改一处重新解析以保证行号准确）"""
+        lines = self.read_main_config()
+        if not lines:
+            return None
+        
+        edits = [
+            (None, "worker_processes", str(values['worker_processes'])),
+            (None, "worker_rlimit_nofile", str(values['worker_rlimit_nofile'])),
+            ("events", "worker_connections", str(values['worker_connections'])),
+            ("events", "multi_accept", str(values['multi_accept'])),
+        ]
+        for block_name, name, value in edits:
+            try:
+                tree = parse_lines(lines)
+            except ConfigParseError as e:
+                print(f"解析nginx主配置文件失败: {e}", file=sys.stderr)
+                return None
+            if block_name is None:
+                lines = self.set_directive(lines, None, tree, name, value, "")
+                continue
+            block = next((d for d in tree if d.name == block_name and d.block is not None), None)
+            if block is None:
+                # 没有events块时在http块之前创建
+                http = next((d for d in tree if d.name == 'http'), None)
+                insert_at = http.start if http is not None else len(lines)
+                lines = lines[:insert_at] + [f"{block_name} {{\n", "}\n", "\n"] + lines[insert_at:]
+                tree = parse_lines(lines)
+                block = next(d for d in tree if d.name == block_name)
+            lines = self.set_directive(lines, block, tree, name, value, "    ")
+        return lines
+    
+    def build_reuseport_edits(self) -> Dict[str, List[str]]:
+        """每个监听地址只能有一个listen带reuseport，选择default_server或第一个出现的listen"""
+        edits: Dict[str, List[str]] = {}
+        chosen: Dict[Tuple[str, int], Tuple[str, Optional[Directive]]] = {}
+        files = {}
+        for conf_file in [self.nginx_main_conf] + vhost_files(self.vhost_dir):
+            try:
+                with open(conf_file, 'r', encoding='utf-8') as f:
+                    lines = f.readlines()
+                tree = parse_lines(lines)
+            except (OSError, ConfigParseError):
+                continue
+            files[conf_file] = lines
+            for server in iter_servers(tree):
+                for listen in server.children('listen'):
+                    if not listen.args or listen.start != listen.end:
+                        continue
+                    host, port, _ = parse_listen(listen.args)
+                    address = ("*" if host == "0.0.0.0" else host, port)
+                    if 'reuseport' in listen.args:
+                        chosen[address] = (conf_file, None)
+                    elif conf_file == self.nginx_main_conf:
+                        # 主配置中的server只用于判断是否已有reuseport，不做修改
+                        continue
+                    elif address not in chosen or (chosen[address][1] is not None
+                                                   and 'default_server' in listen.args
+                                                   and 'default_server' not in chosen[address][1].args):
+                        chosen[address] = (conf_file, listen)
+        
+        for address, (conf_file, listen) in chosen.items():
+            if listen is None:
+                continue
+            lines = edits.setdefault(conf_file, list(files[conf_file]))
+            lines[listen.start] = re.sub(r'\s*;', ' reuseport;', lines[listen.start], count=1)
+        return edits
+    
+    def plan(self, with_reuseport: bool = True) -> Tuple[Dict[str, object], Dict[str, List[str]]]:
+        """返回推荐值和所有文件的新内容"""
+        values = self.recommend()
+        changes: Dict[str, List[str]] = {}
+        main_lines = self.build_main_config(values)
+        if main_lines is not None and main_lines != self.read_main_config():
+            changes[self.nginx_main_conf] = main_lines
+        if with_reuseport and values['reuseport']:
+            changes.update(self.build_reuseport_edits())
+        return values, changes
+    
+    def print_recommendation(self, values: Dict[str, object]) -> None:
+        """输出检测结果和推荐值"""
+        hardware = values['hardware']
+        quota = hardware['cgroup_quota']
+        print("========= 硬件与系统限制 =========")
+        print(f"CPU核数（亲和性）: {hardware['cpus']}")
+        print(f"cgroup CPU配额: {'无限制' if quota is None else f'{quota:.2f}核'}")
+        print(f"ulimit -n: {hardware['ulimit_soft']}（硬限制 {hardware['ulimit_hard']}）")
+        print(f"fs.file-max: {hardware['file_max']}  fs.nr_open: {hardware['nr_open']}")
+        print(f"监听地址: {values['listeners']} 个  上游后端引用: {values['upstreams']} 处")
+        print("========= 推荐配置 =========")
+        print(f"worker_processes {values['worker_processes']};（{values['workers']}个worker）")
+        print(f"worker_rlimit_nofile {values['worker_rlimit_nofile']};")
+        print(f"events {{ worker_connections {values['worker_connections']}; multi_accept {values['multi_accept']}; }}"
+              f"（每个worker约可同时服务 {values['clients']} 个客户端）")
+        print(f"listen ... reuseport: {'建议开启（每个监听地址一处）' if values['reuseport'] else '单worker无需开启'}")
+    
+    def show_diff(self, changes: Dict[str, List[str]]) -> None:
+        """输出预览diff"""
+        if not changes:
+            print("当前配置已是推荐值，无需修改")
+            return
+        for path, new_lines in changes.items():
+            with open(path, 'r', encoding='utf-8') as f:
+                old_lines = f.readlines()
+            sys.stdout.writelines(difflib.unified_diff(old_lines, new_lines, fromfile=path, tofile=f"{path}（调优后）"))
+    
+    def apply(self, changes: Dict[str, List[str]]) -> bool:
+        """备份并写入所有改动，验证失败时自动回滚"""
+        if not changes:
+            print("当前配置已是推荐值，无需修改")
+            return True
+        
+        backup_dir = os.path.join(self.backup_root, time.strftime("%Y%m%d%H%M%S"))
+        os.makedirs(backup_dir, exist_ok=True)
+        manifest = {}
+        for index, path in enumerate(changes):
+            backup_file = os.path.join(backup_dir, f"{index}-{os.path.basename(path)}")
+            shutil.copy2(path, backup_file)
+            manifest[path] = backup_file
+        with open(os.path.join(backup_dir, "manifest.json"), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        
+        for path, new_lines in changes.items():
+            tmp_file = f"{path}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.writelines(new_lines)
+            os.replace(tmp_file, path)
+        print(f"已修改 {len(changes)} 个文件，备份目录: {backup_dir}")
+        
+        valid = self.validate_config()
+        if valid is False:
+            print("配置验证失败，正在回滚...")
+            self.rollback(backup_dir)
+            return False
+        return True
+    
+    def rollback(self, backup_dir: Optional[str] = None) -> bool:
+        """恢复最近一次（或指定的）调优备份"""
+        if backup_dir is None:
+            if not os.path.isdir(self.backup_root):
+                print("没有可回滚的调优备份")
+                return False
+            backups = sorted(os.listdir(self.backup_root))
+            if not backups:
+                print("没有可回滚的调优备份")
+                return False
+            backup_dir = os.path.join(self.backup_root, backups[-1])
+        
+        try:
+            with open(os.path.join(backup_dir, "manifest.json"), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"读取备份清单失败: {e}", file=sys.stderr)
+            return False
+        
+        for path, backup_file in manifest.items():
+            shutil.copy2(backup_file, path)
+        shutil.rmtree(backup_dir, ignore_errors=True)
+        print(f"已回滚 {len(manifest)} 个文件（{os.path.basename(backup_dir)}）")
+        return True
+    
+    def validate_config(self) -> Optional[bool]:
+        """验证nginx配置语法，无法运行nginx时返回None"""
+        try:
+            result = subprocess.run(['nginx', '-t'],
+                                  capture_output=True,
+                                  text=True,
+                                  timeout=10)
+            if result.returncode == 0:
+                print("nginx配置语法验证通过")
+                return True
+            else:
+                print("nginx配置语法错误:")
+                print(result.stderr)
+                return False
+        except Exception as e:
+            print(f"无法验证nginx配置: {e}")
+            return None
+
+def main():
+    if len(sys.argv) < 2:
+        print("用法: worker-tuning.py <action> [--no-reuseport]")
+        print("actions: show, diff, apply, rollback")
+        sys.exit(1)
+    
+    action = sys.argv[1]
+    with_reuseport = "--no-reuseport" not in sys.argv[2:]
+    advisor = WorkerTuningAdvisor()
+    
+    if action == "show":
+        values = advisor.recommend()
+        advisor.print_recommendation(values)
+        sys.exit(0)
+    
+    elif action == "diff":
+        values, changes = advisor.plan(with_reuseport)
+        advisor.print_recommendation(values)
+        print("")
+        advisor.show_diff(changes)
+        sys.exit(0)
+    
+    elif action == "apply":
+        values, changes = advisor.plan(with_reuseport)
+        advisor.print_recommendation(values)
+        success = advisor.apply(changes)
+        sys.exit(0 if success else 1)
+    
+    elif action == "rollback":
+        success = advisor.rollback()
+        if success:
+            advisor.validate_config()
+        sys.exit(0 if success else 1)
+    
+    else:
+        print(f"未知操作: {action}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
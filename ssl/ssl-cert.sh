@@ -485,6 +485,7 @@ function renew_menu() {
   echo "1. 开启自动续签"
   echo "2. 关闭自动续签"
   echo "3. 查看当前状态"
+  echo "4. 立即批量续签（按到期时间排序并发续签，结束后统一重载）"
   echo "0. 返回上一级"
   read -p "请输入选项: " op
   if [[ $op == 1 ]]; then
@@ -563,6 +564,15 @@ function renew_menu() {
     else
       echo "❌ 未检测到可用证书工具。"
     fi
+  elif [[ $op == 4 ]]; then
+    read -p "续签多少天内到期的证书（默认30）: " renew_days
+    read -p "最大并发数（默认8）: " renew_concurrency
+    local renew_script="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)/manage/cert-renewal.py"
+    if python3 "$renew_script" --days="${renew_days:-30}" --concurrency="${renew_concurrency:-8}"; then
+      echo "✅ 批量续签完成"
+    else
+      echo "❌ 部分证书续签失败，请查看上方输出"
+    fi
   elif [[ $op == 0 ]]; then
     return
   else
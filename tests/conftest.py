@@ -0,0 +1,50 @@
+"""
+测试公共设置：把manage目录加入导入路径，并提供加载带连字符脚本的函数
+"""
+
+import os
+import sys
+import importlib.util
+
+import pytest
+
+MANAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "manage")
+sys.path.insert(0, MANAGE_DIR)
+
+def load_script(name: str):
+    """按文件名加载manage下的脚本（如 cert-renewal），注册到sys.modules，进程池可以pickle其中的函数"""
+    module_name = name.replace('-', '_')
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(MANAGE_DIR, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def country(code: str) -> dict:
+    return {'country': {'iso_code': code, 'names': {'en': code}}}
+
+# 测试用归属地数据库的内容：9.9.9.0/24和2001:db8:1::/48被拆得比缓存粒度更细
+COUNTRY_NETWORKS = [
+    ("1.2.3.0/24", country("US")),
+    ("5.6.0.0/16", {'registered_country': {'iso_code': "DE"}}),
+    ("9.9.9.0/25", country("FR")),
+    ("9.9.9.128/25", country("JP")),
+    ("2001:db8::/32", country("NL")),
+    ("2001:db8:1:1::/64", country("SE")),
+]
+ASN_NETWORKS = [
+    ("1.2.3.0/24", {'autonomous_system_number': 64500, 'autonomous_system_organization': "Example Net"}),
+    ("5.6.7.0/26", {'autonomous_system_number': 64501, 'autonomous_system_organization': "Small Net"}),
+]
+
+@pytest.fixture
+def geo_databases(tmp_path):
+    """生成(国家数据库, ASN数据库)：国家为IPv6数据库（含IPv4），ASN为IPv4数据库"""
+    from mmdb_writer import write_database
+    country_db = str(tmp_path / "country.mmdb")
+    asn_db = str(tmp_path / "asn.mmdb")
+    write_database(country_db, COUNTRY_NETWORKS)
+    write_database(asn_db, ASN_NETWORKS, ip_version=4)
+    return country_db, asn_db
@@ -0,0 +1,107 @@
+"""
+测试用的最小MaxMind DB写入器：按给定网段和记录生成.mmdb文件
+只实现测试需要的数据类型（map、array、字符串、无符号整数、布尔），不生成指针
+"""
+
+import ipaddress
+from typing import Dict, List, Tuple
+
+METADATA_MARKER = b"\xab\xcd\xefMaxMind.com"
+
+def encode_control(data_type: int, size: int) -> bytes:
+    extended = b""
+    if data_type > 7:
+        extended = bytes([data_type - 7])
+        data_type = 0
+    if size < 29:
+        return bytes([(data_type << 5) | size]) + extended
+    if size < 285:
+        return bytes([(data_type << 5) | 29]) + extended + bytes([size - 29])
+    return bytes([(data_type << 5) | 30]) + extended + (size - 285).to_bytes(2, 'big')
+
+def encode(value) -> bytes:
+    if isinstance(value, bool):
+        return encode_control(14, int(value))
+    if isinstance(value, str):
+        raw = value.encode('utf-8')
+        return encode_control(2, len(raw)) + raw
+    if isinstance(value, int):
+        raw = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+        return encode_control(6 if value < 2 ** 32 else 9, len(raw)) + raw
+    if isinstance(value, dict):
+        return encode_control(7, len(value)) + b"".join(encode(key) + encode(item) for key, item in value.items())
+    if isinstance(value, list):
+        return encode_control(11, len(value)) + b"".join(encode(item) for item in value)
+    raise TypeError(f"不支持的类型: {type(value)}")
+
+def encode_records(left: int, right: int, record_size: int) -> bytes:
+    if record_size == 24:
+        return left.to_bytes(3, 'big') + right.to_bytes(3, 'big')
+    if record_size == 28:
+        middle = ((left >> 24) << 4) | (right >> 24)
+        return (left & 0xFFFFFF).to_bytes(3, 'big') + bytes([middle]) + (right & 0xFFFFFF).to_bytes(3, 'big')
+    return left.to_bytes(4, 'big') + right.to_bytes(4, 'big')
+
+def write_database(path: str, networks: List[Tuple[str, Dict]], ip_version: int = 6,
+                   record_size: int = 24) -> None:
+    """
+    networks为[(网段, 记录)]，后面的网段可以细分前面的网段；
+    IPv6数据库中的IPv4网段放在::/96之下
+    """
+    data = b""
+    offsets: Dict[str, int] = {}
+    root: list = [None, None]
+    for cidr, record in networks:
+        network = ipaddress.ip_network(cidr)
+        key = repr(record)
+        if key not in offsets:
+            offsets[key] = len(data)
+            data += encode(record)
+        bits = network.prefixlen
+        value = int(network.network_address)
+        total = network.max_prefixlen
+        if network.version == 4 and ip_version == 6:
+            bits += 96
+            total = 128
+        node = root
+        for depth in range(bits):
+            bit = (value >> (total - 1 - depth)) & 1
+            if depth == bits - 1:
+                node[bit] = ('data', offsets[key])
+                break
+            if not isinstance(node[bit], list):
+                # 细分已有网段时，未细分的另一半仍指向原记录
+                node[bit] = [node[bit], node[bit]]
+            node = node[bit]
+
+    nodes: List[list] = []
+    def number(node: list) -> None:
+        nodes.append(node)
+        for child in node:
+            if isinstance(child, list):
+                number(child)
+    number(root)
+    ids = {id(node): idx for idx, node in enumerate(nodes)}
+    node_count = len(nodes)
+
+    def record_value(child) -> int:
+        if child is None:
+            return node_count
+        if isinstance(child, tuple):
+            return node_count + 16 + child[1]
+        return ids[id(child)]
+
+    tree = b"".join(encode_records(record_value(node[0]), record_value(node[1]), record_size) for node in nodes)
+    metadata = {
+        'node_count': node_count,
+        'record_size': record_size,
+        'ip_version': ip_version,
+        'database_type': "Test-Geo",
+        'binary_format_major_version': 2,
+        'binary_format_minor_version': 0,
+        'build_epoch': 1,
+        'languages': ["en"],
+        'description': {'en': "test"},
+    }
+    with open(path, 'wb') as f:
+        f.write(tree + b"\0" * 16 + data + METADATA_MARKER + encode(metadata))
@@ -0,0 +1,69 @@
+"""
+滥用IP检测测试：爬虫验证、网段聚合、封禁列表比较
+"""
+
+import time
+
+from conftest import load_script
+
+abuse_detector = load_script("abuse-detector")
+
+GOOGLEBOT = "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)"
+
+def detector(tmp_path, **kwargs):
+    return abuse_detector.AbuseDetector(str(tmp_path / "state.json"), str(tmp_path / "blocklist.conf"),
+                                        thresholds={'rate': 10}, **kwargs)
+
+def feed(detector, ip: str, count: int, user_agent: str) -> None:
+    stamp = time.strftime("%d/%b/%Y:%H:%M:%S +0000", time.gmtime())
+    for _ in range(count):
+        detector.process_line(f'{ip} - - [{stamp}] "GET / HTTP/1.1" 200 10 "-" "{user_agent}"\n')
+
+def test_crawler_ua_needs_forward_confirmed_dns(tmp_path, monkeypatch):
+    lookups = []
+    monkeypatch.setattr(abuse_detector, "forward_confirmed_crawler", lambda ip: lookups.append(ip) or ip == "66.249.66.1")
+    d = detector(tmp_path)
+    feed(d, "66.249.66.1", 20, GOOGLEBOT)
+    feed(d, "203.0.113.7", 20, GOOGLEBOT)
+    assert "66.249.66.1" not in d.blocked
+    assert "203.0.113.7" in d.blocked
+    # 验证结果被缓存，不会每个请求都查询DNS
+    assert lookups.count("66.249.66.1") == 1
+
+def test_monitor_ua_is_not_exempt(tmp_path):
+    d = detector(tmp_path)
+    feed(d, "203.0.113.8", 20, "UptimeRobot/2.0")
+    assert "203.0.113.8" in d.blocked
+
+def test_no_subnet_aggregation_by_default(tmp_path):
+    d = detector(tmp_path)
+    now = time.time()
+    for last in (1, 2, 3, 9):
+        d.blocked[f"198.51.100.{last}"] = {'until': now + 600, 'reason': "test", 'strikes': 1}
+    # 只做精确合并：.2和.3合并为/31，不扩大到整个/24
+    assert d.active_networks(now) == ["198.51.100.1", "198.51.100.2/31", "198.51.100.9"]
+    d.aggregate = 4
+    assert d.active_networks(now) == ["198.51.100.0/24"]
+
+def test_reason_changes_do_not_rewrite_blocklist(tmp_path, monkeypatch):
+    monkeypatch.setattr(abuse_detector, "blocklist_included", lambda: False)
+    d = detector(tmp_path)
+    (tmp_path / "blocklist.conf").write_text(
+        "geo $blocked {\n    default 0;\n    198.51.100.1 1;  # 攻击特征 5 次\n}\n")
+    assert d.write_blocklist(d.render(["198.51.100.1"])) is None
+    assert d.write_blocklist(d.render(["198.51.100.1", "198.51.100.9"])) is True
+    assert "#" not in (tmp_path / "blocklist.conf").read_text().split("{", 1)[1]
+
+def test_unblock_survives_stale_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(abuse_detector, "blocklist_included", lambda: False)
+    monkeypatch.setattr(abuse_detector, "site_access_logs", lambda: [])
+    d = detector(tmp_path)
+    feed(d, "203.0.113.9", 20, "curl/8.0")
+    d.save_state()
+    # watch进程持有解封之前的状态，run在锁内重新读取，不会把刚解封的IP写回
+    watcher = detector(tmp_path)
+    assert "203.0.113.9" in watcher.blocked
+    assert detector(tmp_path).unblock("203.0.113.0/24")
+    watcher.run()
+    assert "203.0.113.9" not in detector(tmp_path).blocked
+    assert "203.0.113.9" not in (tmp_path / "blocklist.conf").read_text()
@@ -0,0 +1,28 @@
+"""
+反向代理缓存测试：缓存location的access_log沿用站点日志的格式和参数
+"""
+
+from conftest import load_script
+from nginx_conf import iter_servers, parse
+
+cache_manager = load_script("cache-manager")
+
+def log_args(server_conf: str):
+    server = next(iter_servers(parse(server_conf)))
+    line = next(i for i, text in enumerate(server_conf.splitlines()) if "proxy_pass" in text)
+    return cache_manager.CacheManager("a.conf").cache_log_args(server, line, "/logs/default.log")
+
+def test_combined_site_log_gets_cache_status_with_same_params():
+    args = log_args("server {\n    access_log /logs/a.log site_timed buffer=64k flush=5s if=$loggable;\n"
+                    "    location / {\n        proxy_pass http://b;\n    }\n}\n")
+    assert args == [["/logs/a.log", "cache_combined", "buffer=64k", "flush=5s", "if=$loggable"]]
+
+def test_custom_format_and_disabled_log_are_kept():
+    args = log_args("server {\n    access_log /logs/a.json json_fmt buffer=32k;\n    access_log off;\n"
+                    "    location / {\n        proxy_pass http://b;\n    }\n}\n")
+    assert args == [["/logs/a.json", "json_fmt", "buffer=32k"], ["off"]]
+
+def test_location_with_own_log_is_left_alone():
+    args = log_args("server {\n    access_log /logs/a.log;\n    location / {\n"
+                    "        access_log /logs/api.log;\n        proxy_pass http://b;\n    }\n}\n")
+    assert args == []
@@ -0,0 +1,147 @@
+"""
+证书续签调度器测试
+端到端续签测试需要本地pebble（以 PEBBLE_VA_ALWAYS_VALID=1 启动）和certbot，
+设置 PEBBLE_DIRECTORY=https://localhost:14000/dir 后运行，否则跳过
+"""
+
+import os
+import time
+import shutil
+import subprocess
+
+import pytest
+
+from conftest import load_script
+
+cert_renewal = load_script("cert-renewal")
+cert_info = load_script("cert_info")
+
+PEBBLE_DIRECTORY = os.environ.get("PEBBLE_DIRECTORY")
+
+def write_conf(tmp_path, name: str, text: str) -> str:
+    path = tmp_path / f"{name}.conf"
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+def test_challenge_location_added_once(tmp_path):
+    conf = write_conf(tmp_path, "a.test", (
+        "server {\n"
+        "    listen 80;\n"
+        "    server_name a.test;\n"
+        "    location / {\n"
+        "        root /srv/a;\n"
+        "    }\n"
+        "}\n"
+    ))
+    scheduler = cert_renewal.CertRenewalScheduler(webroot=str(tmp_path / "acme"), vhost_dir=str(tmp_path))
+    assert scheduler.ensure_challenge_locations([conf]) == [conf]
+    assert scheduler.ensure_challenge_locations([conf]) == []
+    with open(conf, encoding='utf-8') as f:
+        assert f.read().count("location ^~ /.well-known/acme-challenge/") == 1
+
+def test_existing_challenge_location_is_reused(tmp_path):
+    text = (
+        "server {\n"
+        "    listen 80;\n"
+        "    server_name b.test;\n"
+        "    location ^~ /.well-known/acme-challenge/ {\n"
+        "        root /var/www/letsencrypt;\n"
+        "    }\n"
+        "}\n"
+    )
+    conf = write_conf(tmp_path, "b.test", text)
+    scheduler = cert_renewal.CertRenewalScheduler(webroot=str(tmp_path / "acme"), vhost_dir=str(tmp_path))
+    assert scheduler.ensure_challenge_locations([conf]) == []
+    with open(conf, encoding='utf-8') as f:
+        assert f.read() == text
+
+    cert = {'conf': conf, 'domains': ['b.test'], 'tool': 'certbot', 'lineage': 'b.test',
+            'key': str(tmp_path / "missing.key"), 'ca_server': ""}
+    command = scheduler.build_command(cert)
+    assert command[command.index('-w') + 1] == "/var/www/letsencrypt"
+
+def test_only_servers_without_challenge_location_are_changed(tmp_path):
+    conf = write_conf(tmp_path, "c.test", (
+        "server {\n"
+        "    listen 80;\n"
+        "    server_name c.test;\n"
+        "    location /.well-known/acme-challenge/ {\n"
+        "        alias /srv/acme/.well-known/acme-challenge/;\n"
+        "    }\n"
+        "}\n"
+        "server {\n"
+        "    listen 443 ssl;\n"
+        "    server_name c.test;\n"
+        "}\n"
+    ))
+    scheduler = cert_renewal.CertRenewalScheduler(webroot=str(tmp_path / "acme"), vhost_dir=str(tmp_path))
+    assert scheduler.ensure_challenge_locations([conf]) == [conf]
+    with open(conf, encoding='utf-8') as f:
+        assert f.read().count("acme-challenge/ {") == 2
+    assert scheduler.conf_webroots[conf] == "/srv/acme"
+
+def certbot(config_dir: str, *args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(['certbot', *args, '--config-dir', config_dir,
+                           '--work-dir', os.path.join(config_dir, "work"),
+                           '--logs-dir', os.path.join(config_dir, "logs")],
+                          capture_output=True, text=True, timeout=300)
+
+def test_failed_final_reload_fails_run(tmp_path, monkeypatch):
+    scheduler = cert_renewal.CertRenewalScheduler(webroot=str(tmp_path / "acme"), vhost_dir=str(tmp_path))
+    scheduler.limiter = cert_renewal.RateLimiter(str(tmp_path / "state.json"))
+    scheduler.reload_flag = str(tmp_path / "reload-pending")
+    cert = {'domains': ["a.test"], 'cert': "a.pem", 'conf': "a.conf", 'tool': "manual", 'not_after': time.time()}
+    monkeypatch.setattr(scheduler, "collect_certificates", lambda: [cert])
+    monkeypatch.setattr(scheduler, "renew_one", lambda cert: {'status': "成功", 'domain': "a.test", 'ca': "-",
+                                                              'detail': ""})
+    monkeypatch.setattr(scheduler, "validate_and_reload", lambda: False)
+    open(scheduler.reload_flag, 'w').close()
+    assert not scheduler.run()
+    # 标记保留到下次运行再重载
+    assert os.path.exists(scheduler.reload_flag)
+
+    monkeypatch.setattr(scheduler, "validate_and_reload", lambda: True)
+    assert scheduler.run()
+    assert not os.path.exists(scheduler.reload_flag)
+
+@pytest.mark.skipif(not PEBBLE_DIRECTORY or not shutil.which("certbot"),
+                    reason="需要设置PEBBLE_DIRECTORY并安装certbot")
+def test_renewal_against_pebble(tmp_path, monkeypatch):
+    config_dir = str(tmp_path / "letsencrypt")
+    webroot = str(tmp_path / "acme")
+    vhost_dir = tmp_path / "vhost"
+    vhost_dir.mkdir()
+    os.makedirs(webroot)
+    monkeypatch.setattr(cert_renewal, "LETSENCRYPT_DIR", config_dir)
+
+    issued = certbot(config_dir, 'certonly', '--webroot', '-w', webroot, '-d', "renew.test",
+                     '--server', PEBBLE_DIRECTORY, '--no-verify-ssl', '--non-interactive',
+                     '--agree-tos', '--register-unsafely-without-email')
+    assert issued.returncode == 0, issued.stderr
+
+    live = os.path.join(config_dir, "live", "renew.test")
+    write_conf(vhost_dir, "renew.test", (
+        "server {\n"
+        "    listen 443 ssl;\n"
+        "    server_name renew.test;\n"
+        f"    ssl_certificate {live}/fullchain.pem;\n"
+        f"    ssl_certificate_key {live}/privkey.pem;\n"
+        "}\n"
+    ))
+    before = cert_info.decode_certificate(cert_info.pem_der(f"{live}/fullchain.pem", "CERTIFICATE"))
+
+    reloads = []
+    monkeypatch.setattr(cert_renewal.CertRenewalScheduler, "validate_and_reload",
+                        lambda self: reloads.append(True) or True)
+    scheduler = cert_renewal.CertRenewalScheduler(days=100000, server=PEBBLE_DIRECTORY, insecure=True,
+                                                  webroot=webroot, vhost_dir=str(vhost_dir))
+    scheduler.limiter = cert_renewal.RateLimiter(str(tmp_path / "state.json"))
+    scheduler.reload_flag = str(tmp_path / "reload-pending")
+    # 新证书的到期时间需要晚于旧证书
+    time.sleep(1)
+    assert scheduler.run()
+
+    after = cert_info.decode_certificate(cert_info.pem_der(f"{live}/fullchain.pem", "CERTIFICATE"))
+    assert after['not_after'] > before['not_after']
+    # 加入验证location后重载一次，续签完成后再重载一次
+    assert len(reloads) == 2
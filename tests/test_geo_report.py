@@ -0,0 +1,53 @@
+"""
+按国家/ASN统计测试：单次统计、按天汇总和查询
+"""
+
+from datetime import date
+
+import pytest
+
+from conftest import load_script
+from rollup_store import RollupStore
+
+geo_report = load_script("geo-report")
+
+def log_line(ip: str, body_bytes: int) -> str:
+    today = date.today().strftime("%d/%b/%Y")
+    return f'{ip} - - [{today}:10:00:00 +0800] "GET /a HTTP/1.1" 200 {body_bytes} "-" "curl/8.0" rt=0.010\n'
+
+@pytest.fixture
+def report(tmp_path, geo_databases):
+    store = RollupStore("geo", str(tmp_path / "rollup"))
+    return geo_report.GeoReport(*geo_databases, store=store, workers=1)
+
+def test_top_groups_by_country_and_asn(tmp_path, report):
+    log = tmp_path / "access_a.test.log"
+    log.write_text(log_line("1.2.3.4", 100) + log_line("1.2.3.5", 200) + log_line("1.2.3.4", 50)
+                   + log_line("9.9.9.200", 10) + log_line("8.8.8.8", 1))
+    groups = report.top([str(log)])
+    counters = {kind: {key: (requests, sent, len(ips)) for key, (requests, sent, ips) in groups[kind].items()}
+                for kind in ('country', 'asn')}
+    assert counters['country'] == {'US': (3, 350, 2), 'JP': (1, 10, 1), geo_report.UNKNOWN: (1, 1, 1)}
+    assert counters['asn'] == {'64500': (3, 350, 2), geo_report.UNKNOWN: (2, 11, 2)}
+    assert groups['names'] == {'64500': "Example Net"}
+
+def test_ingest_and_query(tmp_path, report, monkeypatch):
+    log_a = tmp_path / "access_a.test.log"
+    log_b = tmp_path / "access_b.test.log"
+    log_a.write_text(log_line("1.2.3.4", 100) + log_line("5.6.7.1", 20))
+    log_b.write_text(log_line("2001:db8:1:1::1", 30))
+    monkeypatch.setattr(geo_report, "site_access_logs", lambda: [("a.test", str(log_a)), ("b.test", str(log_b))])
+    assert report.ingest() == (3, 2)
+    # 再次运行只读取新增的行
+    with open(log_a, 'a') as f:
+        f.write(log_line("1.2.3.4", 100))
+    assert report.ingest() == (1, 2)
+
+    # IP数按批次相加，1.2.3.4在两次运行中各计一次
+    a = report.query(["a.test"], 1)
+    assert a['country'] == {'US': [2, 200, 2], 'DE': [1, 20, 1]}
+    assert a['asn'] == {'64500': [2, 200, 2], '64501': [1, 20, 1]}
+    assert a['names'] == {'64500': "Example Net", '64501': "Small Net"}
+    both = report.query(["a.test", "b.test"], 1)
+    assert both['country']['SE'] == [1, 30, 1]
+    assert both['asn'][geo_report.UNKNOWN] == [1, 30, 1]
@@ -0,0 +1,51 @@
+"""
+防盗链配置测试：共享map模式的写入顺序、失败恢复和模式切换，静态资源优化规则
+"""
+
+import pytest
+
+from conftest import load_script
+from hotlink_rules import referer_location, static_tuning_config
+
+hotlink_manager = load_script("hotlink-manager")
+
+VHOST = """server {
+    listen 443 ssl;
+    server_name example.com;
+    location / {
+        root /www;
+    }
+}
+"""
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(hotlink_manager, "snapshot_files", lambda paths, label: None)
+    conf = tmp_path / "example.com.conf"
+    conf.write_text(VHOST)
+    (tmp_path / "nginx.conf").write_text("http {\n    include vhost/*.conf;\n}\n")
+    manager = hotlink_manager.HotlinkManager(str(conf))
+    manager.nginx_main_conf = str(tmp_path / "nginx.conf")
+    manager.vhost_dir = str(tmp_path)
+    manager.referer_map_file = str(tmp_path / "hotlink-referers.conf")
+    return manager
+
+def test_failed_vhost_write_restores_map_and_include(manager, tmp_path, monkeypatch):
+    monkeypatch.setattr(manager, "write_config", lambda lines: False)
+    assert not manager.add_hotlink("none blocked", use_map=True)
+    assert not (tmp_path / "hotlink-referers.conf").exists()
+    assert "hotlink" not in (tmp_path / "nginx.conf").read_text()
+    assert (tmp_path / "example.com.conf").read_text() == VHOST
+
+def test_switch_back_to_plain_mode_removes_site_map(manager, tmp_path):
+    assert manager.add_hotlink("none blocked", use_map=True)
+    map_var = manager.site_map_var("example.com")
+    assert map_var in manager.read_referer_map()
+    assert manager.add_hotlink("none blocked")
+    assert map_var not in manager.read_referer_map()
+    assert "valid_referers none blocked;" in (tmp_path / "example.com.conf").read_text()
+
+def test_static_tuning_is_shared_with_insert_script(manager):
+    config = manager.generate_hotlink_config("none blocked", manager.generate_static_tuning())
+    assert config == referer_location("none blocked", static_tuning_config())
+    assert "max_ranges" not in config and "access_log" not in config
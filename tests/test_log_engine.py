@@ -0,0 +1,76 @@
+"""
+日志读取测试：gzip=写入的日志的增量读取，User-Agent分类
+"""
+
+import gzip
+
+from conftest import load_script
+from log_engine import (UNKNOWN_FAMILY, classify_user_agent, find_site_log, is_bot_family, iter_new_lines, iter_records,
+                        rotated_logs)
+
+access_log_manager = load_script("access-log-manager")
+
+def line(n: int) -> bytes:
+    return f'1.2.3.4 - - [19/Oct/2026:10:00:{n:02d} +0800] "GET /{n} HTTP/1.1" 200 10 "-" "curl/8.0"\n'.encode()
+
+def test_gzip_live_log_read_by_member(tmp_path):
+    log = tmp_path / "access_a.test.log.gz"
+    first = gzip.compress(line(1) + line(2))
+    second = gzip.compress(line(3))
+    # 第二个压缩块只写了一半
+    log.write_bytes(first + second[:10])
+
+    position = {}
+    assert [l.split('"')[1] for l in iter_new_lines(str(log), position)] == ["GET /1 HTTP/1.1", "GET /2 HTTP/1.1"]
+    assert position['offset'] == len(first)
+
+    with open(log, 'ab') as f:
+        f.write(second[10:])
+    assert [l.split('"')[1] for l in iter_new_lines(str(log), position)] == ["GET /3 HTTP/1.1"]
+    assert position['offset'] == len(first) + len(second)
+    assert list(iter_new_lines(str(log), position)) == []
+
+def test_gzip_live_log_full_read_ignores_unfinished_member(tmp_path):
+    log = tmp_path / "access_a.test.log.gz"
+    log.write_bytes(gzip.compress(line(1)) + gzip.compress(line(2))[:12])
+    assert [record.path for record in iter_records(str(log))] == ["/1"]
+    assert find_site_log("a.test", str(tmp_path)) == str(log)
+
+def test_rotated_gzip_log_is_read_back(tmp_path):
+    log = tmp_path / "access_a.test.log.gz"
+    log.write_bytes(gzip.compress(line(1)))
+    position = {}
+    assert len(list(iter_new_lines(str(log), position))) == 1
+
+    # 上次读取后又写入一块，随后被轮转
+    with open(log, 'ab') as f:
+        f.write(gzip.compress(line(2)))
+    assert access_log_manager.rotate_file(str(log))
+    log.write_bytes(gzip.compress(line(3)))
+    (tmp_path / "access_a.test.log.1.gz.bak").write_bytes(b"")
+    assert [l.split('"')[1] for l in iter_new_lines(str(log), position)] == ["GET /2 HTTP/1.1", "GET /3 HTTP/1.1"]
+
+    assert access_log_manager.rotate_file(str(log))
+    log.write_bytes(gzip.compress(line(4)))
+    files = rotated_logs(str(log))
+    assert files == [str(tmp_path / "access_a.test.log.2.gz"), str(tmp_path / "access_a.test.log.1.gz"), str(log)]
+    assert [record.path for path in files for record in iter_records(path)] == ["/1", "/2", "/3", "/4"]
+
+def test_rotated_plain_log_order(tmp_path):
+    log = tmp_path / "access_a.test.log"
+    for name in ("access_a.test.log.10.gz", "access_a.test.log.2.gz", "access_a.test.log.1", "access_a.test.log.bak"):
+        (tmp_path / name).write_bytes(b"")
+    assert rotated_logs(str(log)) == [str(tmp_path / name) for name in
+                                      ("access_a.test.log.10.gz", "access_a.test.log.2.gz", "access_a.test.log.1")] + [str(log)]
+
+def test_electron_apps_are_browsers():
+    ua = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+          "Slack/4.41.105 Chrome/130.0.6723.191 Electron/33.2.1 Safari/537.36")
+    assert classify_user_agent(ua) == "browser"
+    assert classify_user_agent("Mozilla/5.0 HeadlessChrome/120.0") == "headless"
+
+def test_unknown_is_not_counted_as_bot():
+    assert classify_user_agent("-") == UNKNOWN_FAMILY
+    assert not is_bot_family(UNKNOWN_FAMILY)
+    assert not is_bot_family("browser")
+    assert is_bot_family("library")
@@ -0,0 +1,78 @@
+"""
+MaxMind DB读取和归属地解析测试，数据库由mmdb_writer按需生成
+"""
+
+import pytest
+
+from conftest import COUNTRY_NETWORKS, country
+from mmdb import SPLIT, GeoResolver, MaxMindReader
+from mmdb_writer import encode_records, write_database
+
+@pytest.mark.parametrize("record_size", [24, 28, 32])
+def test_lookup_each_record_size(tmp_path, record_size):
+    path = str(tmp_path / f"country-{record_size}.mmdb")
+    write_database(path, COUNTRY_NETWORKS, record_size=record_size)
+    reader = MaxMindReader(path)
+    try:
+        assert reader.record_size == record_size and reader.database_type == "Test-Geo"
+        # IPv6数据库中的IPv4地址从::/96之下开始查找，前缀长度按IPv4计算
+        assert reader.lookup("1.2.3.4") == (country("US"), 24)
+        assert reader.lookup("9.9.9.200")[0] == country("JP")
+        assert reader.lookup("2001:db8:1:1::5") == (country("SE"), 64)
+        # /32被/64细分后，其余部分的前缀长度是与/64分开的位置
+        assert reader.lookup("2001:db8:8000::1") == (country("NL"), 33)
+        assert reader.lookup("8.8.8.8")[0] is None
+    finally:
+        reader.close()
+
+@pytest.mark.parametrize("record_size", [28, 32])
+def test_read_node_wide_records(tmp_path, record_size):
+    # 小数据库的节点号用不到高位，直接构造超过24位的记录检查拆分方式
+    path = str(tmp_path / "country.mmdb")
+    write_database(path, COUNTRY_NETWORKS, record_size=record_size)
+    reader = MaxMindReader(path)
+    reader.close()
+    left, right = 0x0ABCDEF1, 0x05123456
+    reader.buffer = encode_records(left, right, record_size)
+    assert (reader._read_node(0, 0), reader._read_node(0, 1)) == (left, right)
+
+def test_ipv6_lookup_in_ipv4_database(geo_databases):
+    _, asn_db = geo_databases
+    reader = MaxMindReader(asn_db)
+    try:
+        assert reader.lookup("1.2.3.4")[0]['autonomous_system_number'] == 64500
+        assert reader.lookup("2001:db8::1") == (None, 0)
+    finally:
+        reader.close()
+
+def test_resolver_caches_by_network(geo_databases):
+    resolver = GeoResolver(*geo_databases)
+    try:
+        assert resolver.resolve("1.2.3.4") == ("US", 64500, "Example Net")
+        assert resolver.resolve("1.2.3.200") == ("US", 64500, "Example Net")
+        # IPv4映射的IPv6地址与IPv4地址共用缓存
+        assert resolver.resolve("::ffff:1.2.3.9") == ("US", 64500, "Example Net")
+        assert (resolver.lookups, resolver.hits) == (1, 2)
+
+        assert resolver.resolve("2001:db8:5::1")[0] == "NL"
+        assert resolver.resolve("2001:db8:5:ffff::1")[0] == "NL"
+        assert (resolver.lookups, resolver.hits) == (2, 3)
+    finally:
+        resolver.close()
+
+def test_resolver_split_networks_are_looked_up_per_ip(geo_databases):
+    resolver = GeoResolver(*geo_databases)
+    try:
+        # 国家数据库把/24拆成两个/25
+        assert resolver.resolve("9.9.9.1")[0] == "FR"
+        assert resolver.resolve("9.9.9.200")[0] == "JP"
+        assert resolver.cache[(4, 0x090909)] is SPLIT
+        # ASN数据库中的/26比缓存粒度更细，国家仍来自/16
+        assert resolver.resolve("5.6.7.1") == ("DE", 64501, "Small Net")
+        assert resolver.resolve("5.6.7.100") == ("DE", None, "")
+        # /48内有更细的/64
+        assert resolver.resolve("2001:db8:1:1::1")[0] == "SE"
+        assert resolver.resolve("2001:db8:1:2::1")[0] == "NL"
+        assert resolver.hits == 0 and resolver.lookups == 6
+    finally:
+        resolver.close()
@@ -0,0 +1,43 @@
+"""
+静态预压缩测试：开启gzip_static时不重复server块中已有的gzip指令，nginx带brotli模块时开启brotli_static
+"""
+
+import pytest
+
+from conftest import load_script
+
+precompress = load_script("precompress")
+
+SITE = """server {
+    listen 80;
+    server_name a.test;
+    root /srv/a;
+    gzip on;
+    gzip_types text/css;
+}
+"""
+
+@pytest.fixture
+def conf(tmp_path, monkeypatch):
+    monkeypatch.setattr(precompress, "snapshot_files", lambda paths, label: None)
+    path = tmp_path / "a.test.conf"
+    path.write_text(SITE)
+    return path
+
+def added_directives(path) -> list:
+    return [line.split()[0] for line in path.read_text().splitlines()
+            if line.strip() and line not in SITE.splitlines() and not line.strip().startswith("#")]
+
+def test_existing_gzip_directives_are_not_duplicated(conf, monkeypatch):
+    monkeypatch.setattr(precompress, "brotli_module_available", lambda: False)
+    manager = precompress.StaticPrecompressor(str(conf))
+    assert manager.enable_gzip_static()
+    assert added_directives(conf) == ["gzip_static", "gzip_vary", "gzip_comp_level", "gzip_min_length"]
+
+def test_brotli_static_only_with_module(conf, monkeypatch):
+    monkeypatch.setattr(precompress, "brotli_module_available", lambda: True)
+    monkeypatch.setattr(precompress.shutil, "which", lambda name: "/usr/bin/brotli")
+    manager = precompress.StaticPrecompressor(str(conf))
+    assert manager.use_brotli
+    assert manager.enable_gzip_static()
+    assert "brotli_static" in added_directives(conf)
@@ -0,0 +1,29 @@
+"""
+Prometheus textfile导出测试
+"""
+
+from conftest import load_script
+
+prom_exporter = load_script("prom-exporter")
+
+LINE = '1.2.3.4 - - [19/Oct/2026:10:00:00 +0800] "GET /a HTTP/1.1" 200 100 "-" "curl/8.0" rt=0.010\n'
+
+def test_run_reloads_state_under_lock(tmp_path):
+    vhost_dir = tmp_path / "vhost"
+    vhost_dir.mkdir()
+    log = tmp_path / "access_a.test.log"
+    log.write_text(LINE)
+    (vhost_dir / "a.test.conf").write_text(f"server {{\n    server_name a.test;\n    access_log {log};\n}}\n")
+    state_file = str(tmp_path / "state.json")
+
+    def exporter():
+        return prom_exporter.PromExporter(str(vhost_dir), state_file, str(tmp_path / "out.prom"))
+
+    # 两个进程同时启动时都读到了空状态，后运行的一方不能覆盖先运行一方的计数或重复累加
+    first, second = exporter(), exporter()
+    first.run(from_start=True)
+    with open(log, 'a') as f:
+        f.write(LINE)
+    second.run(from_start=True)
+    assert second.state['sites']['a.test']['requests'] == 2
+    assert exporter().state['sites']['a.test']['requests'] == 2
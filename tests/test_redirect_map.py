@@ -0,0 +1,39 @@
+"""
+重定向规则表测试：源路径按$uri的方式规范化，删除时区分规则类型
+"""
+
+import pytest
+
+from conftest import load_script
+
+redirect_map = load_script("redirect-map")
+make_rule = redirect_map.make_rule
+
+def test_percent_encoded_sources_are_decoded():
+    assert make_rule("/caf%C3%A9/menu", "/menu").source == "/café/menu"
+    assert make_rule("/old%20page", "/new").source == "/old page"
+    assert make_rule("//a%2F%2Fb/*", "/b/*").source == "/a/b/"
+    # 编码的?是路径的一部分，未编码的?才是查询参数
+    assert make_rule("/what%3F", "/faq").source == "/what?"
+    with pytest.raises(ValueError):
+        make_rule("/search?q=1", "/find")
+
+@pytest.mark.parametrize("source", ["/bad%FF", "/a/%2E%2E/b", "~^/caf%C3%A9"])
+def test_invalid_encoded_sources_are_rejected(source):
+    with pytest.raises(ValueError):
+        make_rule(source, "/target")
+
+def test_remove_matches_rule_type(tmp_path):
+    conf = tmp_path / "a.test.conf"
+    conf.write_text("server {}\n")
+    table = redirect_map.RedirectMap(str(conf), str(tmp_path / "redirects"))
+    table.add(make_rule("/old/", "/new/"))
+    table.add(make_rule("/old/*", "/new/*"))
+    table.add(make_rule("~^/old/(\\d+)$", "/new/$1"))
+
+    assert table.remove("/old/*") == 1
+    assert [rule.type for rule in table.rules] == ["exact", "regex"]
+    assert table.remove("/ol%64/") == 1
+    assert [rule.type for rule in table.rules] == ["regex"]
+    assert table.remove("~^/old/(\\d+)$") == 1
+    assert not table.rules
@@ -0,0 +1,115 @@
+"""
+重载协调器测试：用一个假的master进程模拟HUP后是否派生新worker
+"""
+
+import sys
+import time
+import threading
+import subprocess
+
+import pytest
+
+import reload_coordinator
+from reload_coordinator import ReloadCoordinator, worker_pids
+
+FAKE_MASTER = """
+import os, sys, signal, time, subprocess
+children = [subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])]
+def on_hup(signum, frame):
+    if sys.argv[1] == 'spawn':
+        children.append(subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)']))
+signal.signal(signal.SIGHUP, on_hup)
+print('ready', flush=True)
+while True:
+    time.sleep(0.05)
+"""
+
+@pytest.fixture
+def paths(tmp_path, monkeypatch):
+    for name, filename in (("QUEUE_FILE", ".reload-queue"), ("LOCK_FILE", ".reload-queue.lock"),
+                           ("FLUSH_LOCK_FILE", ".reload-flush.lock"), ("HISTORY_FILE", "reload-history.jsonl"),
+                           ("HISTORY_LOCK_FILE", ".reload-history.lock"), ("RESULT_FILE", ".reload-results.json")):
+        monkeypatch.setattr(reload_coordinator, name, str(tmp_path / filename))
+    return tmp_path
+
+@pytest.fixture
+def fake_master(request, paths):
+    process = subprocess.Popen([sys.executable, '-c', FAKE_MASTER, request.param], stdout=subprocess.PIPE, text=True)
+    process.stdout.readline()
+    pid_file = paths / "nginx.pid"
+    pid_file.write_text(str(process.pid))
+    yield process, str(pid_file)
+    for pid in worker_pids(process.pid):
+        subprocess.run(['kill', str(pid)])
+    process.kill()
+    process.wait()
+
+@pytest.mark.parametrize("fake_master", ["ignore"], indirect=True)
+def test_no_new_workers_is_failure(fake_master, monkeypatch):
+    process, pid_file = fake_master
+    monkeypatch.setattr(reload_coordinator, "READY_TIMEOUT", 0.5)
+    coordinator = ReloadCoordinator(debounce=0, pid_file=pid_file)
+    coordinator.test_config = lambda: True
+    started = time.time()
+    assert not coordinator.reload_once([{'source': "test"}])
+    assert time.time() - started < 2
+    assert coordinator.history()[-1]['result'] == "not_ready"
+
+@pytest.mark.parametrize("fake_master", ["spawn"], indirect=True)
+def test_overlap_measured_in_background(fake_master, monkeypatch):
+    process, pid_file = fake_master
+    watched = []
+    coordinator = ReloadCoordinator(debounce=0, pid_file=pid_file)
+    coordinator.test_config = lambda: True
+    monkeypatch.setattr(coordinator, "spawn_overlap_watch", lambda *args: watched.append(args))
+    assert coordinator.reload_once([{'source': "test"}])
+    record = coordinator.history()[-1]
+    assert record['result'] == "reloaded" and record['new_workers'] == 1
+    assert 'overlap_ms' not in record
+    assert watched and watched[0][0] == record['id']
+
+    # 旧worker退出后由后台进程补记并存时间
+    record_id, master, old_workers, started = watched[0]
+    for pid in old_workers:
+        subprocess.run(['kill', str(pid)])
+    coordinator.watch_overlap(record_id, master, old_workers, started)
+    record = coordinator.history()[-1]
+    assert record['overlap_ms'] > 0 and record['old_workers_remaining'] == 0
+
+def test_merged_notification_waits_for_flusher_result(paths):
+    reloading = threading.Event()
+    release = threading.Event()
+
+    def failing_reload(entries):
+        reloading.set()
+        release.wait(5)
+        return False
+
+    first = ReloadCoordinator(debounce=0)
+    first.reload_once = failing_reload
+    results = {}
+    thread = threading.Thread(target=lambda: results.setdefault('first', first.notify("a", wait=False)))
+    thread.start()
+    assert reloading.wait(5)
+
+    # 第二条通知登记在执行者取走队列之后，由执行者在下一轮处理
+    second = ReloadCoordinator(debounce=0)
+    second.reload_once = failing_reload
+    merged = threading.Thread(target=lambda: results.setdefault('second', second.notify("b", wait=False)))
+    merged.start()
+    time.sleep(0.2)
+    assert 'second' not in results
+    release.set()
+    thread.join(5)
+    merged.join(5)
+    assert results == {'first': False, 'second': False}
+
+def test_token_result_comes_from_the_reload_that_handled_it(paths):
+    coordinator = ReloadCoordinator(debounce=0)
+    token = coordinator.enqueue("a")
+    coordinator.reload_once = lambda entries: True
+    assert coordinator.flush(wait=False)
+    other = ReloadCoordinator(debounce=0)
+    other.reload_once = lambda entries: False
+    # 通知已被处理，只查询结果
+    assert other.flush(wait=False, token=token)
@@ -0,0 +1,45 @@
+"""
+日汇总存储测试：汇总与偏移一起提交，中途崩溃后重跑不重复累加
+"""
+
+from datetime import date
+
+import pytest
+
+from conftest import load_script
+from rollup_store import RollupStore
+
+latency_report = load_script("latency-report")
+
+def log_line(second: int) -> str:
+    today = date.today().strftime("%d/%b/%Y")
+    return f'1.2.3.4 - - [{today}:10:00:{second:02d} +0800] "GET /a HTTP/1.1" 200 10 "-" "curl/8.0" rt=0.100\n'
+
+def test_crash_between_day_and_offset_is_not_double_counted(tmp_path, monkeypatch):
+    log = tmp_path / "access_a.test.log"
+    log.write_text(log_line(1) + log_line(2))
+    monkeypatch.setattr(latency_report, "site_access_logs", lambda: [("a.test", str(log))])
+    store = RollupStore("latency", str(tmp_path / "rollup"))
+    rollup = latency_report.LatencyRollup(store)
+
+    original = RollupStore.save_offsets
+    def crash(self, offsets):
+        raise KeyboardInterrupt
+    monkeypatch.setattr(RollupStore, "save_offsets", crash)
+    with pytest.raises(KeyboardInterrupt):
+        rollup.ingest()
+    monkeypatch.setattr(RollupStore, "save_offsets", original)
+
+    # 崩溃后日志又追加了新行，重跑时先重放journal，再只读取新行
+    with open(log, 'a') as f:
+        f.write(log_line(3))
+    rollup.ingest()
+    site_entry, _ = rollup.query("a.test", 1)
+    assert site_entry['total'].count == 3
+
+def test_truncated_journal_is_discarded(tmp_path):
+    store = RollupStore("geo", str(tmp_path))
+    store.save_offsets({"/log": {'inode': 1, 'offset': 10}})
+    with open(store.journal_file(), 'w') as f:
+        f.write('{"site": "a", "da')
+    assert store.load_offsets() == {"/log": {'inode': 1, 'offset': 10}}
@@ -0,0 +1,60 @@
+"""
+跨文件重复server_name处理测试
+"""
+
+import pytest
+
+import server_index
+from server_index import DUPLICATE_MARK, ServerIndex
+
+@pytest.fixture
+def vhosts(tmp_path, monkeypatch):
+    monkeypatch.setattr(server_index, "snapshot_files", lambda paths, label: None)
+    vhost_dir = tmp_path / "vhost"
+    vhost_dir.mkdir()
+    nginx_conf = tmp_path / "nginx.conf"
+    nginx_conf.write_text(f"http {{\n    include {vhost_dir}/*.conf;\n}}\n")
+    index = ServerIndex(str(nginx_conf), str(vhost_dir), str(tmp_path / "index.json"))
+    return vhost_dir, index
+
+def test_drop_names_rewrites_multiline_server_name(vhosts):
+    vhost_dir, index = vhosts
+    (vhost_dir / "a.conf").write_text(
+        "server {\n"
+        "    listen 80;\n"
+        "    server_name a.test;\n"
+        "}\n")
+    (vhost_dir / "b.conf").write_text(
+        "server {\n"
+        "    listen 80;\n"
+        "    server_name b.test\n"
+        "                a.test\n"
+        "                www.b.test;\n"
+        "    root /srv/b;\n"
+        "}\n")
+    index.refresh()
+    assert index.resolve_conflicts() == [str(vhost_dir / "b.conf")]
+    assert (vhost_dir / "b.conf").read_text() == (
+        "server {\n"
+        "    listen 80;\n"
+        "    server_name b.test www.b.test;\n"
+        "    root /srv/b;\n"
+        "}\n")
+    assert not index.conflicts()
+
+def test_fully_shadowed_server_is_commented(vhosts):
+    vhost_dir, index = vhosts
+    (vhost_dir / "a.conf").write_text("server {\n    listen 80;\n    server_name a.test;\n}\n")
+    (vhost_dir / "b.conf").write_text("server {\n    listen 80;\n    server_name a.test;\n}\n")
+    index.refresh()
+    index.resolve_conflicts()
+    assert all(line.startswith(DUPLICATE_MARK) for line in (vhost_dir / "b.conf").read_text().splitlines())
+
+def test_dry_run_does_not_change_files(vhosts):
+    vhost_dir, index = vhosts
+    (vhost_dir / "a.conf").write_text("server {\n    listen 80;\n    server_name a.test;\n}\n")
+    text = "server {\n    listen 80;\n    server_name a.test b.test;\n}\n"
+    (vhost_dir / "b.conf").write_text(text)
+    index.refresh()
+    assert index.resolve_conflicts(dry_run=True) == []
+    assert (vhost_dir / "b.conf").read_text() == text
@@ -0,0 +1,84 @@
+"""
+站点清单批量生成测试：更新由清单生成的配置时不能覆盖其他脚本添加的配置块
+"""
+
+import json
+
+import pytest
+
+from conftest import load_script
+
+site_provision = load_script("site-provision")
+
+@pytest.fixture
+def provisioner(tmp_path):
+    vhost_dir = tmp_path / "vhost"
+    vhost_dir.mkdir()
+    nginx_conf = tmp_path / "nginx.conf"
+    nginx_conf.write_text(f"http {{\n    include {vhost_dir}/*.conf;\n}}\n")
+    manifest = tmp_path / "sites.json"
+    manifest.write_text(json.dumps([{'domain': "a.test", 'backend': "http://127.0.0.1:8080"}]))
+    return site_provision.SiteProvisioner(str(vhost_dir), str(nginx_conf)), str(manifest), vhost_dir
+
+def plan(provisioner, manifest, force=False):
+    sites = site_provision.load_manifest(manifest)
+    rendered, errors = provisioner.render_all(sites)
+    assert not errors
+    return provisioner.plan(sites, rendered, force), rendered
+
+def test_foreign_blocks_are_reported_as_conflict(provisioner):
+    provisioner, manifest, vhost_dir = provisioner
+    _, rendered = plan(provisioner, manifest)
+    conf = vhost_dir / "a.test.conf"
+    content = rendered["a.test"].replace(
+        "    location / {\n",
+        "    # ACME验证\n    location ^~ /.well-known/acme-challenge/ {\n        root /var/www/acme;\n    }\n"
+        "    # 自动封禁\n    if ($blocked) {\n        return 403;\n    }\n    # 自动封禁结束\n"
+        "    location / {\n", 1)
+    conf.write_text(content)
+
+    (changes, conflicts), _ = plan(provisioner, manifest)
+    assert not changes['update']
+    assert len(conflicts) == 1
+    assert "cert-renewal.py" in conflicts[0] and "abuse-detector.py" in conflicts[0]
+
+    (changes, conflicts), _ = plan(provisioner, manifest, force=True)
+    assert changes['update'] == ["a.test"] and not conflicts
+
+def test_inline_tls_marker_and_plain_update(provisioner):
+    provisioner, manifest, vhost_dir = provisioner
+    _, rendered = plan(provisioner, manifest)
+    conf = vhost_dir / "a.test.conf"
+    # 没有其他脚本的配置块时照常更新
+    conf.write_text(rendered["a.test"].replace("127.0.0.1:8080", "127.0.0.1:9090"))
+    (changes, conflicts), _ = plan(provisioner, manifest)
+    assert changes['update'] == ["a.test"] and not conflicts
+
+    assert site_provision.foreign_tools("    listen 443 ssl http2;  # TLS握手优化\n") == ["tls-manager.py"]
+    assert site_provision.foreign_tools(rendered["a.test"]) == []
+
+def test_redirect_map_include_is_foreign(provisioner):
+    provisioner, manifest, vhost_dir = provisioner
+    _, rendered = plan(provisioner, manifest)
+    content = rendered["a.test"].replace(
+        "    location / {\n",
+        "    # 重定向规则表\n    include /usr/local/nginx/conf/redirects/a.test.server.conf;\n    # 重定向规则表结束\n"
+        "    location / {\n", 1)
+    (vhost_dir / "a.test.conf").write_text(content)
+    (changes, conflicts), _ = plan(provisioner, manifest)
+    assert not changes['update'] and "redirect-map.py" in conflicts[0]
+
+def test_each_rate_profile_gets_its_own_zone(provisioner, tmp_path):
+    provisioner, _, _ = provisioner
+    nginx_conf = tmp_path / "nginx.conf"
+    nginx_conf.write_text("http {\n    limit_req_zone $binary_remote_addr zone=site_req_strict:10m rate=9r/s;\n}\n")
+    text = "".join(provisioner.zone_lines(["medium", "strict", "medium"]))
+    assert "zone=site_req_medium:10m rate=5r/s;" in text
+    assert "zone=site_req_strict:10m rate=2r/s;" in text and "rate=9r/s" not in text
+    assert "zone=conn_limit_per_ip:10m;" in text
+    nginx_conf.write_text(text)
+    assert provisioner.zone_lines(["strict"]) is None
+
+    site = site_provision.normalize_site({'domain': "b.test", 'root': "/srv/b", 'rate_limit': "strict"})
+    _, content, _ = site_provision.render_site(site)
+    assert "limit_req zone=site_req_strict burst=3 nodelay;" in content
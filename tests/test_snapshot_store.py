@@ -0,0 +1,98 @@
+"""
+配置快照存储测试：按标签分别保留、完整备份单独保留、还原属主
+"""
+
+import os
+import json
+import threading
+
+import pytest
+
+from snapshot_store import SnapshotStore
+
+def make_snapshot(store: SnapshotStore, path, label: str, content: str, age_days: float = 0) -> str:
+    path.write_text(content)
+    manifest = store.create([str(path)], label)
+    if age_days:
+        manifest['time'] -= int(age_days * 86400)
+        store.write_json(os.path.join(store.manifests_dir, f"{manifest['id']}.json"), manifest)
+    return manifest['id']
+
+def test_gc_keeps_backups_separately(tmp_path):
+    store = SnapshotStore(str(tmp_path / "store"))
+    conf = tmp_path / "nginx.conf"
+    backup = make_snapshot(store, conf, "backup", "full", age_days=60)
+    edits = [make_snapshot(store, conf, "cache", f"edit {i}", age_days=40) for i in range(5)]
+
+    removed, _ = store.gc(keep=2, days=30)
+    remaining = store.list_snapshots()
+    # 频繁的配置修改不会挤掉完整备份
+    assert backup in remaining
+    assert [sid for sid in remaining if sid in edits] == edits[-2:]
+    assert removed == 3
+
+    store.gc(keep=2, days=30, backup_keep=0, backup_days=30)
+    assert backup not in store.list_snapshots()
+
+def test_gc_counts_each_label_on_its_own(tmp_path):
+    store = SnapshotStore(str(tmp_path / "store"))
+    conf = tmp_path / "nginx.conf"
+    tls = make_snapshot(store, conf, "tls", "tls", age_days=40)
+    for i in range(3):
+        make_snapshot(store, conf, "cache", f"cache {i}", age_days=40)
+    store.gc(keep=1, days=30)
+    assert tls in store.list_snapshots()
+    assert len(store.list_snapshots()) == 2
+
+@pytest.mark.skipif(os.geteuid() != 0, reason="修改属主需要root")
+def test_restore_owner(tmp_path):
+    store = SnapshotStore(str(tmp_path / "store"))
+    conf = tmp_path / "site.conf"
+    conf.write_text("server {}\n")
+    os.chown(conf, 1234, 2345)
+    snapshot_id = store.create([str(conf)], "manual")['id']
+
+    os.chown(conf, 0, 0)
+    # 只改属主不改内容也需要还原
+    assert store.restore(snapshot_id)
+    stat = os.stat(conf)
+    assert (stat.st_uid, stat.st_gid) == (1234, 2345)
+
+def test_restore_old_manifest_without_owner(tmp_path):
+    store = SnapshotStore(str(tmp_path / "store"))
+    conf = tmp_path / "site.conf"
+    conf.write_text("old\n")
+    manifest = store.create([str(conf)], "manual")
+    for entry in manifest['files'].values():
+        del entry['uid'], entry['gid']
+    with open(os.path.join(store.manifests_dir, f"{manifest['id']}.json"), 'w') as f:
+        json.dump(manifest, f)
+    conf.write_text("new\n")
+    assert store.restore(manifest['id'])
+    assert conf.read_text() == "old\n"
+
+def test_index_is_appended_and_compacted_by_gc(tmp_path):
+    store = SnapshotStore(str(tmp_path / "store"))
+    conf = tmp_path / "nginx.conf"
+    make_snapshot(store, conf, "cache", "one")
+    make_snapshot(store, conf, "cache", "two")
+    # 管理脚本的快照只追加变化的索引项
+    assert not os.path.exists(store.index_file)
+    with open(store.index_log) as f:
+        assert len(f.readlines()) == 2
+    assert SnapshotStore(store.store_dir).index[str(conf)][3] == store.index[str(conf)][3]
+
+    store.gc(keep=1, days=0)
+    assert not os.path.exists(store.index_log)
+    with open(store.index_file) as f:
+        assert list(json.load(f)) == [str(conf)]
+
+def test_gc_waits_for_snapshot_in_progress(tmp_path):
+    store = SnapshotStore(str(tmp_path / "store"))
+    finished = threading.Event()
+    with store.locked():
+        thread = threading.Thread(target=lambda: (SnapshotStore(store.store_dir).gc(), finished.set()))
+        thread.start()
+        assert not finished.wait(0.3)
+    thread.join(5)
+    assert finished.is_set()
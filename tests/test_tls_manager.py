@@ -0,0 +1,20 @@
+"""
+TLS握手优化测试：共享配置的会话缓存区域、会话票据和DNS服务器
+"""
+
+from conftest import load_script
+
+tls_manager = load_script("tls-manager")
+
+def test_tuning_config_uses_own_zone_without_tickets_or_resolver(tmp_path):
+    manager = tls_manager.TlsManager(str(tmp_path / "a.conf"))
+    config = manager.generate_tuning_config(manager.calculate_cache_size(40000))
+    assert f"ssl_session_cache shared:{tls_manager.SESSION_ZONE}:10m;" in config
+    assert "ssl_session_tickets off;" in config
+    assert "resolver" not in config
+
+def test_system_resolvers(tmp_path):
+    resolv = tmp_path / "resolv.conf"
+    resolv.write_text("# generated\nsearch example.com\nnameserver 10.0.0.2\nnameserver fe80::1%eth0\n")
+    assert tls_manager.system_resolvers(str(resolv)) == ["10.0.0.2", "[fe80::1]"]
+    assert tls_manager.system_resolvers(str(tmp_path / "missing")) == []
@@ -0,0 +1,49 @@
+"""
+worker调优测试：连接数与描述符上限的计算，按解析树修改nginx.conf
+"""
+
+import pytest
+
+from conftest import load_script
+
+worker_tuning = load_script("worker-tuning")
+
+@pytest.fixture
+def advisor(tmp_path, monkeypatch):
+    advisor = worker_tuning.WorkerTuningAdvisor()
+    advisor.nginx_main_conf = str(tmp_path / "nginx.conf")
+    advisor.vhost_dir = str(tmp_path / "vhost")
+    monkeypatch.setattr(advisor, "detect_hardware", lambda: {
+        'cpus': 2, 'cgroup_quota': None, 'file_max': 400000, 'nr_open': 1048576,
+        'ulimit_soft': 1024, 'ulimit_hard': 4096,
+    })
+    return advisor
+
+def build(advisor, tmp_path, conf: str):
+    (tmp_path / "nginx.conf").write_text(conf)
+    return "".join(advisor.build_main_config({
+        'worker_processes': "auto", 'worker_rlimit_nofile': 90000,
+        'worker_connections': 65535, 'multi_accept': "on",
+    }))
+
+def test_upstreams_raise_rlimit_not_halve_connections(advisor, monkeypatch):
+    monkeypatch.setattr(advisor, "count_listeners_and_upstreams", lambda: ([("*", 80), ("*", 443)], 0))
+    plain = advisor.recommend()
+    monkeypatch.setattr(advisor, "count_listeners_and_upstreams", lambda: ([("*", 80), ("*", 443)], 3))
+    proxied = advisor.recommend()
+    # 每个worker 400000 // 2 // 2 = 100000 个描述符
+    assert plain['worker_connections'] == proxied['worker_connections'] == 65535
+    assert plain['worker_rlimit_nofile'] == 65535 + worker_tuning.RESERVED_FDS + 2
+    assert proxied['worker_rlimit_nofile'] == 65535 + worker_tuning.RESERVED_FDS + 2 + 65535 // 2
+    assert proxied['clients'] == 65535 // 2
+
+def test_one_line_events_block(advisor, tmp_path):
+    conf = build(advisor, tmp_path, "worker_processes 1;\nevents { worker_connections 1024; }\nhttp {\n}\n")
+    assert conf == ("worker_processes auto;\nworker_rlimit_nofile 90000;\nevents {\n"
+                    "    worker_connections 65535;\n    multi_accept on;\n}\nhttp {\n}\n")
+
+def test_shared_line_and_multi_line_directives(advisor, tmp_path):
+    conf = build(advisor, tmp_path, "worker_processes 1; worker_rlimit_nofile\n    1024;\n"
+                                    "events {\n    use epoll; worker_connections 512;  # 旧值\n}\n")
+    assert conf == ("worker_processes auto; worker_rlimit_nofile 90000;\n"
+                    "events {\n    use epoll; worker_connections 65535;  # 旧值\n    multi_accept on;\n}\n")